@@ -0,0 +1,321 @@
+"""
+Anomaly Detection - Phát hiện bất thường trên luồng cảm biến, chấm điểm theo lô NumPy
+Ngoài ngưỡng cố định, tìm các lỗi mà ngưỡng không thấy:
+
+    zscore         lệch khỏi baseline trượt (EWMA mean/var) của chính garden đó
+    seasonal       lệch khỏi profile theo giờ trong ngày của garden (sau vài ngày học)
+    flatline       DHT đứng im: nhiệt độ VÀ độ ẩm không đổi suốt N phút (cảm biến treo)
+    drift          rain_analog lúc khô trôi dần so với mốc ban đầu (cảm biến mưa bị ăn mòn / bẩn)
+    rssi_collapse  RSSI ngắn hạn tụt sâu dưới baseline dài hạn (anten / nguồn / vật cản)
+
+Mẫu được gom vào bộ đệm và chấm điểm theo lô: mọi trạng thái (baseline, profile,
+mốc flatline...) là mảng NumPy đánh chỉ số theo garden, nên một lô nghìn mẫu là
+vài phép toán vector. Một garden xuất hiện nhiều lần trong lô được xử lý theo
+lượt (lần 1, lần 2, ...) để kết quả giống hệt chấm từng mẫu theo thứ tự.
+
+Luật "anomaly" trong rules.py đọc điểm lớn nhất trong lô gần nhất của mỗi
+garden (trễ tối đa một lô), nên cảnh báo đi qua cùng digest + dispatcher như
+các luật khác.
+
+Cần: pip install numpy
+"""
+
+import math
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+BATCH_SIZE = 1024           # Số mẫu mỗi lô chấm điểm
+MAX_DELAY = 5.0             # Giây (theo thời gian mẫu): chấm lô dở nếu mẫu đầu đã chờ quá lâu
+
+# Cột của ma trận mẫu; is_raining chỉ dùng để lọc mẫu khô cho drift
+FIELDS = ("temperature", "humidity", "rain_analog", "rssi", "is_raining")
+ZSCORE_FIELDS = ("temperature", "humidity", "rain_analog", "rssi")
+MIN_STD = (0.3, 1.0, 20.0, 2.0)     # Độ lệch chuẩn tối thiểu (tránh z khổng lồ khi rất ổn định)
+BASELINE_SECONDS = 3600             # Hằng số thời gian của baseline z-score
+WARMUP_SAMPLES = 30                 # Chưa đủ mẫu thì chưa chấm z-score
+CLIP_SIGMA = 3.0                    # Mẫu bất thường chỉ kéo baseline tối đa 3 sigma
+
+SEASONAL_FIELDS = ("temperature", "humidity")
+SEASONAL_DAYS = 3                   # Mỗi ngày đóng góp ~1/3 vào profile của giờ đó
+SEASONAL_WARMUP_DAYS = 2            # Profile dùng được sau 2 ngày
+TZ_OFFSET = 7 * 3600                # Giờ Việt Nam cho profile theo giờ
+
+RSSI_FAST_SECONDS = 120
+RSSI_SLOW_SECONDS = 3600
+DRIFT_SECONDS = 6 * 3600            # Baseline khô của rain_analog (chậm)
+DRIFT_WARMUP_SECONDS = 3600         # Mốc drift = baseline khô sau 1 giờ đầu
+
+# Kênh điểm: (loại, trường). Đơn vị: zscore/seasonal = sigma, flatline = phút,
+# drift = % so với mốc, rssi_collapse = dB dưới baseline
+CHANNELS = tuple(("zscore", f) for f in ZSCORE_FIELDS) + \
+    tuple(("seasonal", f) for f in SEASONAL_FIELDS) + \
+    (("flatline", "dht"), ("drift", "rain_analog"), ("rssi_collapse", "rssi"))
+CHANNEL_INDEX = {channel: i for i, channel in enumerate(CHANNELS)}
+
+_T, _H, _RAIN, _RSSI, _WET = range(len(FIELDS))
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("numpy is required for anomaly detection (pip install numpy)")
+
+# =============================================================================
+# DETECTOR
+# =============================================================================
+
+class AnomalyDetector:
+    """Trạng thái bất thường của mọi garden trong các mảng NumPy (một hàng mỗi garden).
+
+    add() đưa mẫu vào bộ đệm và chấm cả lô khi đủ BATCH_SIZE; score_batch()
+    chấm trực tiếp một lô đã ở dạng mảng (replay, benchmark). score() trả về
+    điểm mới nhất của một kênh cho một garden, None khi chưa đủ dữ liệu.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, max_delay=MAX_DELAY, capacity=1024):
+        _require_numpy()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._slots = {}            # garden -> hàng trong các mảng trạng thái
+        self._names = []
+        self._buffer = []           # [(hàng, t, [giá trị theo FIELDS])]
+        self._capacity = 0
+        self._grow(capacity)
+
+        # Counters
+        self.samples = 0
+        self.batches = 0
+
+    def _grow(self, capacity):
+        """Cấp phát (hoặc nới) các mảng trạng thái cho `capacity` garden"""
+        old = self._capacity
+        nz, ns = len(ZSCORE_FIELDS), len(SEASONAL_FIELDS)
+        specs = {
+            "mean": ((nz,), 0.0), "var": ((nz,), 0.0), "count": ((nz,), 0),
+            "last_t": ((), np.nan), "first_t": ((), np.nan),
+            "flat_val": ((2,), np.nan), "flat_since": ((), np.nan),
+            "dry_mean": ((), np.nan), "dry_ref": ((), np.nan), "dry_t": ((), np.nan),
+            "rssi_fast": ((), np.nan), "rssi_slow": ((), np.nan),
+            "prof_mean": ((24, ns), 0.0), "prof_var": ((24, ns), 0.0), "prof_count": ((24, ns), 0),
+            "latest": ((len(CHANNELS),), np.nan),
+        }
+        for name, (shape, fill) in specs.items():
+            dtype = np.int32 if isinstance(fill, int) else (np.float32 if name.startswith("prof") else np.float64)
+            array = np.full((capacity,) + shape, fill, dtype=dtype)
+            if old:
+                array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        self._capacity = capacity
+
+    def slot(self, device):
+        index = self._slots.get(device)
+        if index is None:
+            index = self._slots[device] = len(self._names)
+            self._names.append(device)
+            if index >= self._capacity:
+                self._grow(self._capacity * 2)
+        return index
+
+    # -------------------------------------------------------------------------
+    # Ingest
+    # -------------------------------------------------------------------------
+
+    def add(self, device, values, t):
+        """Đưa một mẫu (dict) vào bộ đệm; chấm cả lô khi đủ kích thước hoặc quá MAX_DELAY"""
+        get = values.get
+        row = [math.nan if v is None else float(v) for v in map(get, FIELDS)]
+        with self._lock:
+            self._buffer.append((self.slot(device), t, row))
+            if len(self._buffer) >= self.batch_size or t - self._buffer[0][1] >= self.max_delay:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, []
+        slots = np.fromiter((item[0] for item in buffer), dtype=np.int64, count=len(buffer))
+        times = np.fromiter((item[1] for item in buffer), dtype=np.float64, count=len(buffer))
+        X = np.array([item[2] for item in buffer], dtype=np.float64)
+        self._score(slots, times, X)
+
+    def score_batch(self, devices, times, X):
+        """Chấm một lô: devices = tên garden hoặc hàng (slot), times [n], X [n, len(FIELDS)].
+
+        Trả về ma trận điểm [n, len(CHANNELS)] (NaN = chưa đủ dữ liệu).
+        """
+        with self._lock:
+            self._flush_locked()
+            if len(devices) and not isinstance(devices[0], (int, np.integer)):
+                slots = np.fromiter((self.slot(d) for d in devices), dtype=np.int64, count=len(devices))
+            else:
+                slots = np.asarray(devices, dtype=np.int64)
+                if len(slots) and slots.max() >= self._capacity:
+                    raise ValueError("unknown slot: call slot(device) first")
+            return self._score(slots, np.asarray(times, dtype=np.float64), np.asarray(X, dtype=np.float64))
+
+    # -------------------------------------------------------------------------
+    # Scoring
+    # -------------------------------------------------------------------------
+
+    def _score(self, slots, times, X):
+        n = len(slots)
+        out = np.full((n, len(CHANNELS)), np.nan)
+        # Thứ tự xuất hiện của mỗi garden trong lô: lượt r chỉ chứa mỗi garden một lần
+        order = np.argsort(slots, kind="stable")
+        sorted_slots = slots[order]
+        starts = np.ones(n, dtype=bool)
+        starts[1:] = sorted_slots[1:] != sorted_slots[:-1]
+        first = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n) - first
+        rounds = int(rank.max()) + 1 if n else 0
+        for r in range(rounds):
+            sel = np.nonzero(rank == r)[0] if rounds > 1 else np.arange(n)
+            out[sel] = self._score_round(slots[sel], times[sel], X[sel], r > 0)
+        self.samples += n
+        self.batches += 1
+        return out
+
+    def _score_round(self, d, t, X, repeat=False):
+        """Chấm và cập nhật trạng thái cho các garden khác nhau `d` (mỗi garden một mẫu).
+
+        repeat = garden đã có mẫu trước trong cùng lô: điểm mới nhất giữ giá trị lớn nhất.
+        """
+        scores = np.full((len(d), len(CHANNELS)), np.nan)
+        first_seen = np.isnan(self.first_t[d])
+        self.first_t[d] = np.where(first_seen, t, self.first_t[d])
+        dt = np.where(first_seen, np.inf, t - self.last_t[d])
+        dt = np.maximum(dt, 0.0)
+        self.last_t[d] = t
+
+        # --- z-score so với baseline EWMA ---------------------------------
+        Z = X[:, :len(ZSCORE_FIELDS)]
+        valid = ~np.isnan(Z)
+        mean, var, count = self.mean[d], self.var[d], self.count[d]
+        std = np.maximum(np.sqrt(var), MIN_STD)
+        ready = valid & (count >= WARMUP_SAMPLES)
+        with np.errstate(invalid="ignore"):
+            z = np.abs(Z - mean) / std
+        scores[:, :len(ZSCORE_FIELDS)] = np.where(ready, z, np.nan)
+        alpha = (1 - np.exp(-dt / BASELINE_SECONDS))[:, None]
+        alpha = np.where(count == 0, 1.0, alpha)
+        delta = np.where(valid, Z - mean, 0.0)
+        # Sau warm-up, mẫu bất thường chỉ kéo baseline tối đa CLIP_SIGMA
+        delta = np.where(count >= WARMUP_SAMPLES, np.clip(delta, -CLIP_SIGMA * std, CLIP_SIGMA * std), delta)
+        self.mean[d] = mean + alpha * delta
+        self.var[d] = np.where(count == 0, 0.0, (1 - alpha) * (var + alpha * delta * delta))
+        self.count[d] = count + valid
+
+        # --- profile theo giờ trong ngày -----------------------------------
+        hour = (((t + TZ_OFFSET) // 3600) % 24).astype(np.int64)
+        S = X[:, [FIELDS.index(f) for f in SEASONAL_FIELDS]]
+        s_valid = ~np.isnan(S)
+        p_mean = self.prof_mean[d, hour].astype(np.float64)
+        p_var = self.prof_var[d, hour].astype(np.float64)
+        p_count = self.prof_count[d, hour]
+        p_std = np.maximum(np.sqrt(p_var), np.array([MIN_STD[ZSCORE_FIELDS.index(f)] for f in SEASONAL_FIELDS]))
+        learned = (t - self.first_t[d] >= SEASONAL_WARMUP_DAYS * 86400)[:, None] & (p_count > 0) & s_valid
+        with np.errstate(invalid="ignore"):
+            scores[:, len(ZSCORE_FIELDS):len(ZSCORE_FIELDS) + len(SEASONAL_FIELDS)] = \
+                np.where(learned, np.abs(S - p_mean) / p_std, np.nan)
+        # Mỗi ngày đóng góp ~1/SEASONAL_DAYS vào giờ tương ứng
+        p_alpha = np.where(p_count == 0, 1.0, (1 - np.exp(-np.minimum(dt, 3600) / (SEASONAL_DAYS * 3600)))[:, None])
+        p_delta = np.where(s_valid, S - p_mean, 0.0)
+        self.prof_mean[d, hour] = p_mean + p_alpha * p_delta
+        self.prof_var[d, hour] = np.where(p_count == 0, 0.0, (1 - p_alpha) * (p_var + p_alpha * p_delta * p_delta))
+        self.prof_count[d, hour] = p_count + s_valid
+
+        # --- flatline DHT: nhiệt độ và độ ẩm cùng không đổi ------------------
+        dht = X[:, [_T, _H]]
+        dht_ok = ~np.isnan(dht).any(axis=1)
+        same = dht_ok & (dht == self.flat_val[d]).all(axis=1)
+        since = np.where(same | ~dht_ok, self.flat_since[d], t)
+        since = np.where(np.isnan(since), t, since)
+        self.flat_since[d] = since
+        self.flat_val[d] = np.where(dht_ok[:, None], dht, self.flat_val[d])
+        scores[:, CHANNEL_INDEX[("flatline", "dht")]] = np.where(dht_ok, (t - since) / 60, np.nan)
+
+        # --- drift của rain_analog lúc khô ----------------------------------
+        rain = X[:, _RAIN]
+        dry = ~np.isnan(rain) & (X[:, _WET] == 0)
+        dry_mean = self.dry_mean[d]
+        no_dry = np.isnan(dry_mean)
+        d_alpha = np.where(no_dry, 1.0, 1 - np.exp(-np.minimum(dt, DRIFT_SECONDS) / DRIFT_SECONDS))
+        dry_mean = np.where(dry, np.where(no_dry, rain, dry_mean + d_alpha * (rain - dry_mean)), dry_mean)
+        self.dry_mean[d] = dry_mean
+        dry_t = np.where(dry & np.isnan(self.dry_t[d]), t, self.dry_t[d])
+        self.dry_t[d] = dry_t
+        ref = self.dry_ref[d]
+        set_ref = np.isnan(ref) & dry & (t - dry_t >= DRIFT_WARMUP_SECONDS)
+        ref = np.where(set_ref, dry_mean, ref)
+        self.dry_ref[d] = ref
+        with np.errstate(invalid="ignore", divide="ignore"):
+            drift = np.abs(dry_mean - ref) * 100 / np.maximum(ref, 1.0)
+        scores[:, CHANNEL_INDEX[("drift", "rain_analog")]] = np.where(dry & ~np.isnan(ref), drift, np.nan)
+
+        # --- RSSI: EWMA nhanh tụt dưới EWMA chậm ------------------------------
+        rssi = X[:, _RSSI]
+        r_ok = ~np.isnan(rssi)
+        fast, slow = self.rssi_fast[d], self.rssi_slow[d]
+        new = np.isnan(slow)
+        f_alpha = np.where(new, 1.0, 1 - np.exp(-dt / RSSI_FAST_SECONDS))
+        s_alpha = np.where(new, 1.0, 1 - np.exp(-dt / RSSI_SLOW_SECONDS))
+        fast = np.where(r_ok, np.where(new, rssi, fast + f_alpha * (rssi - fast)), fast)
+        slow = np.where(r_ok, np.where(new, rssi, slow + s_alpha * (rssi - slow)), slow)
+        self.rssi_fast[d], self.rssi_slow[d] = fast, slow
+        warm = (t - self.first_t[d]) >= RSSI_SLOW_SECONDS / 4
+        scores[:, CHANNEL_INDEX[("rssi_collapse", "rssi")]] = np.where(r_ok & warm, slow - fast, np.nan)
+
+        # Điểm cho luật "anomaly": lớn nhất trong lô gần nhất của garden (gai một mẫu
+        # không bị mẫu sau trong cùng lô che); kênh NaN giữ giá trị cũ
+        latest = self.latest[d]
+        self.latest[d] = np.fmax(latest, scores) if repeat else np.where(np.isnan(scores), latest, scores)
+        return scores
+
+    # -------------------------------------------------------------------------
+    # Query
+    # -------------------------------------------------------------------------
+
+    def score(self, device, kind, field):
+        """Điểm (lớn nhất trong lô gần nhất) của kênh (kind, field) cho garden; None nếu chưa có"""
+        index = self._slots.get(device)
+        if index is None:
+            return None
+        value = self.latest[index, CHANNEL_INDEX[(kind, field)]]
+        return None if math.isnan(value) else round(float(value), 2)
+
+    def scores(self, device):
+        """{"kind/field": điểm} của một garden (dashboard / debug)"""
+        index = self._slots.get(device)
+        if index is None:
+            return {}
+        row = self.latest[index]
+        return {f"{kind}/{field}": round(float(v), 2) for (kind, field), v in zip(CHANNELS, row)
+                if not math.isnan(v)}
+
+    def reset(self, device):
+        """Quên baseline của garden (sau khi thay / hiệu chỉnh cảm biến)"""
+        with self._lock:
+            index = self._slots.get(device)
+            if index is None:
+                return
+            for name in ("mean", "var", "count", "prof_mean", "prof_var", "prof_count"):
+                getattr(self, name)[index] = 0
+            for name in ("last_t", "first_t", "flat_val", "flat_since", "dry_mean", "dry_ref", "dry_t",
+                         "rssi_fast", "rssi_slow", "latest"):
+                getattr(self, name)[index] = np.nan
+
+    def stats(self):
+        return {"devices": len(self._names), "samples": self.samples, "batches": self.batches,
+                "buffered": len(self._buffer)}
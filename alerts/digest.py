@@ -0,0 +1,232 @@
+"""
+Alert Digest - Gom cảnh báo thành tin tóm tắt (digest) trước khi gửi webhook
+Khi nắng nóng, mọi garden vượt ngưỡng cùng lúc: thay vì một POST Discord cho
+mỗi garden, cảnh báo được gom theo nhóm (mặc định: mức độ + luật + loại) trong
+một cửa sổ thời gian và gửi một embed liệt kê N garden.
+
+    engine.evaluate() ─► Digester.add() ─► nhóm (severity, rule, kind) ─► hết cửa sổ ─► send(payload)
+
+Cảnh báo lặp lại của cùng (garden, luật, loại) trong cửa sổ chỉ được tính một
+lần (giữ giá trị mới nhất + số lần). Mỗi message mang tối đa MAX_EMBEDS embed,
+nên số request mỗi cửa sổ bị chặn bởi số nhóm, không phụ thuộc số garden.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from rules import CLEAR, REPEAT
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+# Cửa sổ gom (giây) theo mức độ: critical báo nhanh hơn, info gom lâu hơn
+WINDOWS = {"critical": 10, "warning": 60, "info": 300}
+DEFAULT_WINDOW = 60
+
+# Khóa nhóm: "severity", "rule", "kind", "site" (phần đầu topic), "garden"
+GROUP_BY = ("severity", "rule", "kind")
+
+MAX_DEVICES_LISTED = 25     # Số garden liệt kê trong một embed, còn lại ghi "+K"
+MAX_EMBEDS = 10             # Giới hạn embed mỗi message của Discord
+
+SEVERITY_COLORS = {"info": 3447003, "warning": 16753920, "critical": 16711680}
+NORMAL_COLOR = 65280        # Màu xanh lá
+USERNAME = "IoT Garden Bot"
+AVATAR_URL = "https://cdn-icons-png.flaticon.com/512/3093/3093173.png"
+
+# =============================================================================
+# EMBEDS
+# =============================================================================
+
+def group_key(alert, group_by=GROUP_BY):
+    parts = []
+    for name in group_by:
+        if name == "severity":
+            parts.append(alert.rule.severity)
+        elif name == "rule":
+            parts.append(alert.rule.id)
+        elif name == "kind":
+            # Nhắc lại (repeat) gộp chung nhóm với lần báo đầu
+            parts.append("clear" if alert.kind == CLEAR else "fire")
+        elif name == "site":
+            parts.append(alert.device.split("/", 1)[0])
+        elif name == "garden":
+            parts.append(alert.device)
+        else:
+            raise ValueError(f"Unknown digest group: {name}")
+    return tuple(parts)
+
+def digest_embed(group, max_devices=MAX_DEVICES_LISTED):
+    """Một embed tóm tắt mọi garden của nhóm"""
+    rule = group["rule"]
+    cleared = group["kind"] == CLEAR
+    devices = sorted(group["devices"].items(), key=lambda item: item[1][2])
+    values = [entry[0] for _, entry in devices if isinstance(entry[0], (int, float))]
+    repeats = sum(entry[1] for _, entry in devices) - len(devices)
+
+    lines = [f"• `{device}` — {value}" + (f" (×{count})" if count > 1 else "")
+             for device, (value, count, _, _) in devices[:max_devices]]
+    if len(devices) > max_devices:
+        lines.append(f"… và {len(devices) - max_devices} vườn khác")
+
+    fields = [
+        {"name": "🏡 Số vườn", "value": f"**{len(devices)}**", "inline": True},
+        {"name": "⚠️ Mức độ", "value": rule.severity, "inline": True},
+    ]
+    if values:
+        fields.append({"name": "📏 Giá trị", "value": f"{min(values)} → {max(values)}", "inline": True})
+    if repeats:
+        fields.append({"name": "🔁 Lặp lại đã gộp", "value": str(repeats), "inline": True})
+    fields.append({
+        "name": "⏰ Thời gian",
+        "value": f"{datetime.fromtimestamp(group['first_t']).strftime('%H:%M:%S')} → "
+                 f"{datetime.fromtimestamp(group['last_t']).strftime('%H:%M:%S')}",
+        "inline": False
+    })
+    if cleared:
+        title = f"✅ TRỞ VỀ BÌNH THƯỜNG: {rule.title}"
+    elif group["kind"] == REPEAT:
+        title = f"{rule.title} (vẫn tiếp diễn)"
+    else:
+        title = rule.title
+    return {
+        "title": f"{title} · {len(devices)} vườn",
+        "description": "\n".join(lines)[:4000],
+        "color": NORMAL_COLOR if cleared else SEVERITY_COLORS.get(rule.severity, 16711680),
+        "fields": fields,
+        "footer": {"text": "IoT Garden Alert System · digest"},
+        "timestamp": datetime.utcfromtimestamp(group["last_t"]).isoformat()
+    }
+
+# =============================================================================
+# DIGESTER
+# =============================================================================
+
+class Digester:
+    """Gom Alert theo nhóm trong cửa sổ thời gian rồi gửi một message cho nhiều nhóm.
+
+    send(payload, label) nhận payload webhook (vd Dispatcher.send). Nhóm chỉ có
+    một garden được gửi bằng single(alert, values) nếu có (embed chi tiết như
+    cảnh báo đơn lẻ), ngược lại bằng digest_embed().
+    """
+
+    def __init__(self, send, single=None, windows=None, group_by=GROUP_BY,
+                 max_devices=MAX_DEVICES_LISTED, max_embeds=MAX_EMBEDS):
+        self.send = send
+        self.single = single
+        self.windows = WINDOWS if windows is None else windows
+        self.group_by = group_by
+        self.max_devices = max_devices
+        self.max_embeds = max_embeds
+
+        self._cond = threading.Condition()
+        self._groups = {}       # khóa nhóm -> {"deadline", "rule", "kind", "devices", ...}
+        self._closing = False
+        self._thread = None
+
+        # Counters
+        self.alerts_in = 0
+        self.duplicates = 0
+        self.digests = 0
+        self.messages = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="alert_digest", daemon=True)
+        self._thread.start()
+
+    def add(self, alert, values=None, now=None):
+        """Đưa một Alert vào nhóm của nó; không gửi gì trên thread gọi"""
+        now = time.time() if now is None else now
+        key = group_key(alert, self.group_by)
+        with self._cond:
+            self.alerts_in += 1
+            group = self._groups.get(key)
+            if group is None:
+                window = self.windows.get(alert.rule.severity, DEFAULT_WINDOW)
+                group = self._groups[key] = {
+                    "deadline": now + window, "rule": alert.rule,
+                    "kind": alert.kind,
+                    "devices": {}, "first_t": alert.t, "last_t": alert.t,
+                }
+                self._cond.notify()
+            elif group["kind"] == REPEAT:
+                # Nhóm mở bằng lần nhắc lại: có garden mới vượt thì là cảnh báo mới
+                group["kind"] = alert.kind
+            entry = group["devices"].get(alert.device)
+            if entry is None:
+                group["devices"][alert.device] = [alert.value, 1, alert.t, (alert, values)]
+            else:
+                # Cùng garden, cùng nhóm trong cửa sổ: chỉ giữ bản mới nhất
+                self.duplicates += 1
+                entry[0], entry[2], entry[3] = alert.value, alert.t, (alert, values)
+                entry[1] += 1
+            group["last_t"] = max(group["last_t"], alert.t)
+
+    def flush(self, now=None, force=False):
+        """Gửi các nhóm đã hết cửa sổ (force = mọi nhóm); trả về số message đã gửi"""
+        now = time.time() if now is None else now
+        with self._cond:
+            due = [key for key, group in self._groups.items() if force or group["deadline"] <= now]
+            groups = [self._groups.pop(key) for key in due]
+        if not groups:
+            return 0
+        embeds = [self._embed(group) for group in groups]
+        sent = 0
+        for i in range(0, len(embeds), self.max_embeds):
+            chunk = embeds[i:i + self.max_embeds]
+            payload = {"username": USERNAME, "avatar_url": AVATAR_URL, "embeds": chunk}
+            devices = sum(len(group["devices"]) for group in groups[i:i + self.max_embeds])
+            try:
+                self.send(payload, f"digest {len(chunk)} groups / {devices} gardens")
+                sent += 1
+            except Exception as e:
+                print(f"❌ Digest send error: {e}")
+        self.digests += len(groups)
+        self.messages += sent
+        return sent
+
+    def close(self):
+        """Dừng thread và gửi nốt mọi nhóm còn lại"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush(force=True)
+
+    def stats(self):
+        with self._cond:
+            pending = sum(len(group["devices"]) for group in self._groups.values())
+        return {
+            "alerts_in": self.alerts_in,
+            "duplicates": self.duplicates,
+            "digests": self.digests,
+            "messages": self.messages,
+            "pending": pending,
+        }
+
+    # -------------------------------------------------------------------------
+
+    def _embed(self, group):
+        if len(group["devices"]) == 1 and self.single is not None:
+            (_, _, _, (alert, values)), = group["devices"].values()
+            return self.single(alert, values or {})
+        return digest_embed(group, self.max_devices)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closing:
+                    if self._groups:
+                        wait = min(group["deadline"] for group in self._groups.values()) - time.time()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._closing:
+                    return
+            self.flush()
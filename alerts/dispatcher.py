@@ -0,0 +1,331 @@
+"""
+Alert Dispatcher - Gửi thông báo webhook (Discord) không chặn luồng MQTT
+on_message chỉ ghi thông báo vào outbox rồi trả về ngay; một nhóm worker
+gửi đi qua requests.Session giữ kết nối (keep-alive), có timeout, thử lại
+với backoff và tôn trọng giới hạn tốc độ của webhook (429 + Retry-After).
+
+    on_message ─► send() ─► outbox (SQLite) ─► worker 1..N ─► Session.post()
+                                  ▲                  │
+                                  └── thử lại / 429 ─┘
+
+Outbox là file SQLite: thông báo chỉ bị xóa sau khi webhook trả 2xx, nên
+còn nguyên qua lần khởi động lại (giao ít nhất một lần). Lỗi 4xx khác 429
+là lỗi vĩnh viễn (webhook bị xóa, embed sai) và được đánh dấu dead.
+
+Cần: pip install requests
+"""
+
+import heapq
+import json
+import random
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+WORKERS = 2                     # Số request webhook chạy song song
+TIMEOUT = (3.05, 10)            # Giây (kết nối, đọc); webhook chậm không giữ worker mãi
+MAX_ATTEMPTS = 8                # Sau số lần lỗi này (5xx, mạng) thông báo bị đánh dấu dead
+BACKOFF_BASE = 1.0              # Giây chờ trước lần thử lại đầu, nhân đôi mỗi lần (+ jitter)
+BACKOFF_MAX = 300.0
+MAX_RETRY_AFTER = 600.0         # Giới hạn Retry-After để header lỗi không khóa worker cả ngày
+OUTBOX_FILE = "alerts_outbox.db"
+
+OUTBOX_SQL = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url TEXT NOT NULL,
+        body TEXT NOT NULL,
+        label TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL,
+        created REAL NOT NULL,
+        last_error TEXT,
+        dead INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+def _require_requests():
+    if requests is None:
+        raise RuntimeError("requests is required for the alert dispatcher (pip install requests)")
+
+# =============================================================================
+# OUTBOX
+# =============================================================================
+
+class Outbox:
+    """Thông báo chờ gửi trên SQLite (":memory:" = không bền vững)"""
+
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(OUTBOX_SQL)
+
+    def add(self, url, body, label, due):
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO outbox (url, body, label, next_attempt, created) VALUES (?, ?, ?, ?, ?)",
+                (url, body, label, due, time.time())).lastrowid
+
+    def pending(self):
+        """(id, url, body, label, attempts, next_attempt) chưa gửi, theo thứ tự tạo"""
+        with self._lock:
+            return self._conn.execute("""
+                SELECT id, url, body, label, attempts, next_attempt FROM outbox
+                WHERE dead = 0 ORDER BY id
+            """).fetchall()
+
+    def done(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (job_id,))
+
+    def retry(self, job_id, attempts, due, error):
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                               (attempts, due, error, job_id))
+
+    def dead(self, job_id, attempts, error):
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET dead = 1, attempts = ?, last_error = ? WHERE id = ?",
+                               (attempts, error, job_id))
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT dead, COUNT(*) FROM outbox GROUP BY dead").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# =============================================================================
+# DISPATCHER
+# =============================================================================
+
+def retry_after_seconds(response):
+    """Thời gian chờ của 429: header Retry-After (giây hoặc HTTP-date), hoặc retry_after trong JSON của Discord"""
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                pass
+    try:
+        return float(response.json().get("retry_after", 1.0))
+    except (ValueError, AttributeError):
+        return 1.0
+
+class Dispatcher:
+    """Nhóm worker gửi thông báo webhook từ outbox.
+
+    send() chỉ ghi outbox và đánh thức worker (vài chục µs), nên an toàn khi
+    gọi trong on_message. Mỗi worker có một requests.Session riêng giữ kết nối
+    tới webhook. Khi webhook trả 429, mọi worker cùng tạm dừng tới hết
+    Retry-After (giới hạn tốc độ tính theo webhook, không theo kết nối).
+    """
+
+    def __init__(self, url, workers=WORKERS, outbox_file=OUTBOX_FILE, timeout=TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        _require_requests()
+        self.url = url
+        self.workers = workers
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.outbox = Outbox(outbox_file)
+
+        self._cond = threading.Condition()
+        self._heap = []                 # (thời điểm gửi, id, url, body, label, attempts)
+        self._paused_until = 0.0
+        self._closing = False
+        self._drain = False
+        self._in_flight = 0
+        self._threads = []
+
+        # Counters (cập nhật từ nhiều worker: giữ self._cond)
+        self.sent = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.dead = 0
+        self.restored = 0
+
+    def start(self):
+        """Nạp thông báo còn trong outbox (lần chạy trước) rồi chạy các worker"""
+        now = time.time()
+        with self._cond:
+            for job_id, url, body, label, attempts, due in self.outbox.pending():
+                heapq.heappush(self._heap, (min(due, now), job_id, url, body, label, attempts))
+                self.restored += 1
+        if self.restored:
+            print(f"📮 Restored {self.restored} pending notifications from {self.outbox.path}")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"alert_dispatch_{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def send(self, payload, label="", url=None):
+        """Đưa một thông báo (dict JSON) vào outbox; trả về id, không chờ gửi"""
+        url = url or self.url
+        body = json.dumps(payload)
+        now = time.time()
+        job_id = self.outbox.add(url, body, label, now)
+        with self._cond:
+            heapq.heappush(self._heap, (now, job_id, url, body, label, 0))
+            self._cond.notify()
+        return job_id
+
+    def close(self, drain=False, timeout=None):
+        """Dừng worker; drain=True chờ gửi hết (tối đa `timeout` giây).
+
+        Thông báo chưa gửi vẫn nằm trong outbox và được gửi ở lần start() sau.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            self._closing = True
+            self._drain = drain
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if drain and any(thread.is_alive() for thread in self._threads):
+            # Hết thời gian chờ: dừng hẳn, phần còn lại để lần sau
+            with self._cond:
+                self._drain = False
+                self._cond.notify_all()
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+        self.outbox.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._heap),
+                "in_flight": self._in_flight,
+                "sent": self.sent,
+                "retried": self.retried,
+                "rate_limited": self.rate_limited,
+                "dead": self.dead,
+                "paused_s": max(self._paused_until - time.time(), 0.0),
+            }
+
+    # -------------------------------------------------------------------------
+    # Workers
+    # -------------------------------------------------------------------------
+
+    def _session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _next_job(self):
+        """Chờ tới khi có thông báo tới hạn (và không bị 429 tạm dừng); None = dừng worker"""
+        with self._cond:
+            while True:
+                if self._closing and not (self._drain and (self._heap or self._in_flight)):
+                    return None
+                if self._heap:
+                    wait = max(self._heap[0][0], self._paused_until) - time.time()
+                    if wait <= 0:
+                        self._in_flight += 1
+                        return heapq.heappop(self._heap)
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _schedule(self, job, due, attempts):
+        with self._cond:
+            heapq.heappush(self._heap, (due, job[1], job[2], job[3], job[4], attempts))
+            self._cond.notify()
+
+    def _run(self):
+        session = self._session()
+        try:
+            while True:
+                job = self._next_job()
+                if job is None:
+                    break
+                try:
+                    self._deliver(session, job)
+                except Exception as e:
+                    # Lỗi ngoài dự kiến (vd outbox): không làm chết worker
+                    print(f"❌ Alert dispatcher error: {e}")
+                finally:
+                    with self._cond:
+                        self._in_flight -= 1
+                        self._cond.notify_all()
+        finally:
+            session.close()
+
+    def _deliver(self, session, job):
+        _, job_id, url, body, label, attempts = job
+        try:
+            response = session.post(url, data=body, headers={"Content-Type": "application/json"},
+                                    timeout=self.timeout)
+        except requests.RequestException as e:
+            self._retry(job, attempts + 1, f"{type(e).__name__}: {e}")
+            return
+
+        status = response.status_code
+        if status == 429:
+            # Không tính là một lần thử: chỉ chờ và gửi lại
+            wait = min(max(retry_after_seconds(response), 0.0), MAX_RETRY_AFTER)
+            until = time.time() + wait
+            with self._cond:
+                self._paused_until = max(self._paused_until, until)
+                self.rate_limited += 1
+            print(f"⏳ Webhook rate limited, pausing {wait:.1f}s")
+            self.outbox.retry(job_id, attempts, until, "429")
+            self._schedule(job, until, attempts)
+        elif 200 <= status < 300:
+            self.outbox.done(job_id)
+            with self._cond:
+                self.sent += 1
+            print(f"✅ Notification sent: {label or job_id}")
+            # Discord báo trước khi hết lượt: dừng chủ động thay vì chờ 429
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                reset = response.headers.get("X-RateLimit-Reset-After")
+                if reset:
+                    with self._cond:
+                        self._paused_until = max(self._paused_until, time.time() + float(reset))
+        elif status >= 500 or status == 408:
+            self._retry(job, attempts + 1, f"HTTP {status}")
+        else:
+            self.outbox.dead(job_id, attempts + 1, f"HTTP {status}: {response.text[:200]}")
+            with self._cond:
+                self.dead += 1
+            print(f"❌ Notification rejected ({label or job_id}): HTTP {status}")
+
+    def _retry(self, job, attempts, error):
+        _, job_id, _, _, label, _ = job
+        if attempts >= self.max_attempts:
+            self.outbox.dead(job_id, attempts, error)
+            with self._cond:
+                self.dead += 1
+            print(f"❌ Notification failed after {attempts} attempts ({label or job_id}): {error}")
+            return
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        due = time.time() + delay * random.uniform(0.5, 1.0)
+        self.outbox.retry(job_id, attempts, due, error)
+        with self._cond:
+            self.retried += 1
+        print(f"🔁 Notification retry {attempts}/{self.max_attempts} in {due - time.time():.1f}s "
+              f"({label or job_id}): {error}")
+        self._schedule(job, due, attempts)
@@ -0,0 +1,403 @@
+"""
+Alert Rules - Bộ luật cảnh báo theo từng thiết bị (garden)
+Thay cho một biến alert_active / last_alert_time toàn cục: mỗi (garden, luật)
+có trạng thái riêng, nên garden này vượt ngưỡng không chặn hay xóa cảnh báo
+của garden khác.
+
+Các loại luật (khai báo bằng dict, xem RULES):
+    threshold  field vượt "above" / dưới "below", hết khi lùi lại quá "hysteresis"
+    rate       field tăng (hoặc giảm) nhanh hơn "per_minute" trong "window" giây
+    combo      mọi điều kiện [(field, op, giá trị), ...] cùng đúng (vd nóng + không mưa)
+    window     như threshold nhưng trên thống kê cửa sổ trượt của streaming.py
+               ("stat": mean/min/max/ewma/p90/..., "window" giây, "min_count" mẫu)
+    anomaly    như threshold nhưng trên điểm bất thường của anomaly.py
+               ("kind": zscore/seasonal/flatline/drift/rssi_collapse, "field"); cần numpy
+Mọi luật có thêm:
+    minutes    điều kiện phải đúng liên tục N phút mới báo (sustained)
+    repeat     giây giữa hai lần nhắc lại khi vẫn còn vượt (0 = không nhắc)
+    devices    glob garden áp dụng ("*" = mọi garden, "demo/*", "site/g12")
+
+Mỗi garden được ánh xạ một lần (lần đầu gửi mẫu) tới bộ luật của nó, nên một
+mẫu chỉ chạy các luật áp dụng cho garden đó: O(số luật của garden), không phụ
+thuộc tổng số luật hay số garden.
+"""
+
+import operator
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from fnmatch import fnmatchcase
+
+import anomaly
+from streaming import StreamAggregates
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+TEMP_THRESHOLD = 30.0       # °C, giống ngưỡng cũ của temperature_alert.py
+REPEAT_SECONDS = 300        # Nhắc lại cảnh báo còn hiệu lực sau 5 phút (ALERT_COOLDOWN cũ)
+
+RULES = [
+    {"id": "temp_high", "type": "threshold", "field": "temperature", "above": TEMP_THRESHOLD,
+     "hysteresis": 0.5, "severity": "warning", "repeat": REPEAT_SECONDS,
+     "title": "🚨 CẢNH BÁO NHIỆT ĐỘ CAO"},
+    {"id": "temp_heatwave", "type": "threshold", "field": "temperature", "above": 35.0,
+     "hysteresis": 1.0, "minutes": 10, "severity": "critical",
+     "title": "🔥 NẮNG NÓNG KÉO DÀI (≥ 10 phút)"},
+    {"id": "temp_rising", "type": "rate", "field": "temperature", "per_minute": 0.5, "window": 600,
+     "severity": "info", "title": "📈 NHIỆT ĐỘ TĂNG NHANH"},
+    {"id": "temp_avg_high", "type": "window", "field": "temperature", "stat": "mean", "window": 600,
+     "above": TEMP_THRESHOLD, "hysteresis": 0.5, "min_count": 20, "severity": "warning",
+     "title": "🌡️ NHIỆT ĐỘ TRUNG BÌNH 10 PHÚT VƯỢT NGƯỠNG"},
+    {"id": "hot_dry", "type": "combo", "minutes": 15, "severity": "warning",
+     "when": [("temperature", ">", 32.0), ("is_raining", "==", False)],
+     "title": "🌵 NÓNG VÀ KHÔ - NÊN TƯỚI CÂY"},
+]
+
+# Luật bất thường (anomaly.py), chỉ bật khi có numpy
+ANOMALY_RULES = [
+    {"id": "temp_spike", "type": "anomaly", "kind": "zscore", "field": "temperature", "above": 5.0,
+     "hysteresis": 2.0, "severity": "warning", "title": "⚡ NHIỆT ĐỘ BẤT THƯỜNG (lệch > 5σ so với baseline)"},
+    {"id": "dht_stuck", "type": "anomaly", "kind": "flatline", "field": "dht", "above": 30,
+     "severity": "warning", "title": "🧊 CẢM BIẾN DHT ĐỨNG IM ≥ 30 PHÚT"},
+    {"id": "rain_drift", "type": "anomaly", "kind": "drift", "field": "rain_analog", "above": 25,
+     "hysteresis": 5, "minutes": 30, "severity": "info", "title": "🌧️ CẢM BIẾN MƯA TRÔI > 25% (cần vệ sinh)"},
+    {"id": "rssi_collapse", "type": "anomaly", "kind": "rssi_collapse", "field": "rssi", "above": 15,
+     "hysteresis": 5, "minutes": 2, "severity": "warning", "title": "📶 TÍN HIỆU WIFI SỤT MẠNH"},
+    {"id": "temp_off_profile", "type": "anomaly", "kind": "seasonal", "field": "temperature", "above": 4.0,
+     "hysteresis": 1.0, "minutes": 20, "severity": "info", "title": "🕒 NHIỆT ĐỘ KHÁC HẲN MỌI NGÀY CÙNG GIỜ"},
+]
+if anomaly.np is not None:
+    RULES += ANOMALY_RULES
+
+FIRE = "fire"           # Bắt đầu vượt
+REPEAT = "repeat"       # Vẫn vượt sau `repeat` giây
+CLEAR = "clear"         # Trở lại bình thường
+
+Alert = namedtuple("Alert", "device rule kind value t")
+
+NO_ALERTS = ()
+
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+             "==": operator.eq, "!=": operator.ne}
+
+# =============================================================================
+# RULES
+# =============================================================================
+
+class Rule(ABC):
+    """Luật cơ sở: giữ trạng thái bật/tắt, thời gian giữ (minutes) và nhắc lại.
+
+    Trạng thái của một (garden, luật) là một list ngắn:
+        [active, since, last_fire, ...phần riêng của loại luật]
+    condition() trả về (True | False | None, giá trị); None = chưa đủ dữ liệu
+    hoặc nằm trong vùng trễ (hysteresis), giữ nguyên trạng thái.
+    """
+
+    __slots__ = ("id", "severity", "title", "devices", "hold", "repeat", "spec")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.id = spec["id"]
+        self.severity = spec.get("severity", "warning")
+        self.title = spec.get("title", self.id)
+        self.devices = spec.get("devices", "*")
+        self.hold = spec.get("minutes", 0) * 60
+        self.repeat = spec.get("repeat", 0)
+
+    def new_state(self):
+        return [False, None, 0.0]
+
+    def bind(self, engine):
+        """Gọi khi luật được thêm vào engine (luật cần tài nguyên chung của engine)"""
+
+    @abstractmethod
+    def condition(self, state, device, values, t):
+        """(True | False | None, giá trị) cho một mẫu; mỗi loại luật phải định nghĩa"""
+
+    def evaluate(self, state, device, values, t):
+        """Cập nhật trạng thái với một mẫu; trả về Alert hoặc None"""
+        hit, value = self.condition(state, device, values, t)
+        if hit is None:
+            return None
+        if hit:
+            if state[1] is None:
+                state[1] = t
+            if t - state[1] < self.hold:
+                return None
+            if not state[0]:
+                state[0] = True
+                state[2] = t
+                return Alert(device, self, FIRE, value, t)
+            if self.repeat and t - state[2] >= self.repeat:
+                state[2] = t
+                return Alert(device, self, REPEAT, value, t)
+            return None
+        state[1] = None
+        if state[0]:
+            state[0] = False
+            return Alert(device, self, CLEAR, value, t)
+        return None
+
+class ThresholdRule(Rule):
+    """field > above (hoặc < below); hết khi về dưới above - hysteresis"""
+
+    __slots__ = ("field", "limit", "sign", "hysteresis")
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.field = spec["field"]
+        self.hysteresis = spec.get("hysteresis", 0.0)
+        if "above" in spec:
+            self.limit, self.sign = spec["above"], 1
+        else:
+            self.limit, self.sign = spec["below"], -1
+
+    def read(self, state, device, values):
+        return values.get(self.field)
+
+    def condition(self, state, device, values, t):
+        value = self.read(state, device, values)
+        if value is None:
+            return None, None
+        # Đưa "below" về "above" bằng cách đổi dấu
+        excess = (value - self.limit) * self.sign
+        if excess > 0:
+            return True, value
+        if excess <= -self.hysteresis or not state[0]:
+            return False, value
+        return None, value
+
+class RateRule(Rule):
+    """Độ dốc của field (đơn vị/phút) so với một mốc cũ trong `window` giây.
+
+    Chỉ giữ một mốc (t, giá trị) thay vì cả cửa sổ: độ dốc tính khi mốc đã cũ
+    hơn `min_span`, mốc được dời tới mẫu hiện tại khi cũ hơn `window`.
+    "per_minute" âm = cảnh báo khi giảm nhanh.
+    """
+
+    __slots__ = ("field", "per_minute", "window", "min_span")
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.field = spec["field"]
+        self.per_minute = spec["per_minute"]
+        self.window = spec.get("window", 600)
+        self.min_span = spec.get("min_span", min(60, self.window))
+
+    def new_state(self):
+        return [False, None, 0.0, None, None]
+
+    def condition(self, state, device, values, t):
+        value = values.get(self.field)
+        if value is None:
+            return None, None
+        ref_t = state[3]
+        if ref_t is None or t < ref_t:
+            state[3], state[4] = t, value
+            return None, None
+        span = t - ref_t
+        if span < self.min_span:
+            return None, None
+        slope = (value - state[4]) * 60 / span
+        if span >= self.window:
+            state[3], state[4] = t, value
+        # Chuẩn hóa về "tăng nhanh hơn per_minute"; hết khi dưới một nửa
+        ratio = slope / self.per_minute
+        if ratio >= 1:
+            return True, round(slope, 3)
+        if ratio < 0.5 or not state[0]:
+            return False, round(slope, 3)
+        return None, round(slope, 3)
+
+class ComboRule(Rule):
+    """Mọi điều kiện (field, op, giá trị) cùng đúng, vd nhiệt độ > 32 và không mưa"""
+
+    __slots__ = ("conditions", "field")
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.conditions = tuple((field, OPERATORS[op], limit) for field, op, limit in spec["when"])
+        self.field = self.conditions[0][0]
+
+    def condition(self, state, device, values, t):
+        for field, op, limit in self.conditions:
+            value = values.get(field)
+            if value is None:
+                return None, None
+            if not op(value, limit):
+                return False, values.get(self.field)
+        return True, values.get(self.field)
+
+class WindowRule(ThresholdRule):
+    """Ngưỡng (có hysteresis) trên thống kê cửa sổ trượt, vd trung bình 10 phút > 30°C.
+
+    Chuỗi của garden nằm trong StreamAggregates chung của engine (cũng phục vụ
+    dashboard); trạng thái luật giữ tham chiếu tới chuỗi để khỏi tra lại.
+    """
+
+    __slots__ = ("stat", "window", "min_count", "aggregates")
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.stat = spec.get("stat", "mean")
+        self.window = spec.get("window")
+        self.min_count = spec.get("min_count", 1)
+        self.aggregates = None
+
+    def new_state(self):
+        return [False, None, 0.0, None]
+
+    def bind(self, engine):
+        if engine.aggregates is None:
+            engine.aggregates = StreamAggregates()
+        self.aggregates = engine.aggregates
+        self.window = self.aggregates.track(self.field, self.window)[1]
+
+    def read(self, state, device, values):
+        series = state[3]
+        if series is None:
+            series = state[3] = self.aggregates.get(device, self.field, self.window)
+            if series is None:
+                return None
+        if series.size < self.min_count:
+            return None
+        value = series.stat(self.stat)
+        return round(value, 2) if isinstance(value, float) else value
+
+class AnomalyRule(ThresholdRule):
+    """Ngưỡng (có hysteresis) trên điểm bất thường mới nhất của garden.
+
+    Điểm do AnomalyDetector chung của engine chấm theo lô, nên luật thấy
+    điểm trễ tối đa một lô (anomaly.BATCH_SIZE mẫu / MAX_DELAY giây).
+    """
+
+    __slots__ = ("kind", "detector")
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.kind = spec["kind"]
+        if (self.kind, self.field) not in anomaly.CHANNEL_INDEX:
+            raise ValueError(f"Unknown anomaly channel: {self.kind}/{self.field} (rule {self.id!r})")
+        self.detector = None
+
+    def bind(self, engine):
+        if engine.anomaly is None:
+            engine.anomaly = anomaly.AnomalyDetector()
+        self.detector = engine.anomaly
+
+    def read(self, state, device, values):
+        return self.detector.score(device, self.kind, self.field)
+
+RULE_TYPES = {"threshold": ThresholdRule, "rate": RateRule, "combo": ComboRule, "window": WindowRule,
+              "anomaly": AnomalyRule}
+
+def make_rule(spec):
+    try:
+        rule_type = RULE_TYPES[spec["type"]]
+    except KeyError:
+        raise ValueError(f"Unknown rule type: {spec.get('type')!r} (rule {spec.get('id')!r})") from None
+    return rule_type(spec)
+
+# =============================================================================
+# ENGINE
+# =============================================================================
+
+class RuleEngine:
+    """Chạy các luật cho từng garden với trạng thái riêng mỗi (garden, luật).
+
+    Lần đầu gặp một garden, engine lọc các luật có `devices` khớp và lưu
+    (luật, trạng thái) cho garden đó; các garden cùng bộ luật dùng chung một
+    tuple luật. evaluate() sau đó chỉ duyệt đúng các luật này.
+    """
+
+    def __init__(self, rules=None, aggregates=None):
+        self.aggregates = aggregates    # StreamAggregates; tạo khi có luật "window"
+        self.anomaly = None             # AnomalyDetector; tạo khi có luật "anomaly"
+        self.rules = []
+        self._order = {}            # Luật -> vị trí khai báo
+        self._exact = {}            # garden -> [luật chỉ định đúng garden đó]
+        self._patterns = []         # Luật có glob ("*", "demo/*")
+        self._rule_sets = {}        # Tuple luật dùng chung giữa các garden
+        self._devices = {}          # garden -> (tuple luật, [trạng thái])
+        for spec in RULES if rules is None else rules:
+            self.add_rule(spec)
+
+    def add_rule(self, spec):
+        rule = spec if isinstance(spec, Rule) else make_rule(spec)
+        if any(r.id == rule.id for r in self.rules):
+            raise ValueError(f"Duplicate rule id: {rule.id}")
+        rule.bind(self)
+        self._order[rule] = len(self.rules)
+        self.rules.append(rule)
+        if any(c in rule.devices for c in "*?["):
+            self._patterns.append(rule)
+        else:
+            self._exact.setdefault(rule.devices, []).append(rule)
+        # Garden đã có trạng thái: xây lại để nhận luật mới (giữ trạng thái luật cũ)
+        for device in list(self._devices):
+            self._index(device)
+        return rule
+
+    def rules_for(self, device):
+        entry = self._devices.get(device) or self._index(device)
+        return entry[0]
+
+    def evaluate(self, device, values, t):
+        """Chạy các luật của `device` với một mẫu (dict); trả về tuple/list Alert"""
+        entry = self._devices.get(device)
+        if entry is None:
+            entry = self._index(device)
+        if self.aggregates is not None:
+            # Cập nhật cửa sổ trượt trước để luật "window" thấy cả mẫu này
+            self.aggregates.update(device, values, t)
+        if self.anomaly is not None:
+            self.anomaly.add(device, values, t)
+        alerts = None
+        for rule, state in zip(*entry):
+            alert = rule.evaluate(state, device, values, t)
+            if alert is not None:
+                if alerts is None:
+                    alerts = [alert]
+                else:
+                    alerts.append(alert)
+        return alerts or NO_ALERTS
+
+    def active(self):
+        """[(garden, rule_id, đang vượt từ)] cho dashboard / trạng thái"""
+        result = []
+        for device, (rules, states) in self._devices.items():
+            for rule, state in zip(rules, states):
+                if state[0]:
+                    result.append((device, rule.id, state[2]))
+        return result
+
+    def forget(self, device):
+        """Bỏ trạng thái của garden (thiết bị đã gỡ), kể cả cửa sổ trượt và điểm bất thường"""
+        self._devices.pop(device, None)
+        if self.aggregates is not None:
+            self.aggregates.forget(device)
+        if self.anomaly is not None:
+            self.anomaly.reset(device)
+
+    def stats(self):
+        stats = {
+            "rules": len(self.rules),
+            "devices": len(self._devices),
+            "rule_sets": len(self._rule_sets),
+            "active": sum(1 for _, states in self._devices.values() for s in states if s[0]),
+        }
+        if self.anomaly is not None:
+            stats["anomaly"] = self.anomaly.stats()
+        return stats
+
+    def _index(self, device):
+        chosen = set(self._exact.get(device, ()))
+        chosen.update(r for r in self._patterns if fnmatchcase(device, r.devices))
+        rules = tuple(sorted(chosen, key=self._order.__getitem__))     # Giữ thứ tự khai báo
+        rules = self._rule_sets.setdefault(rules, rules)
+        old = self._devices.get(device)
+        previous = dict(zip(old[0], old[1])) if old else {}
+        entry = (rules, [previous.get(r) or r.new_state() for r in rules])
+        self._devices[device] = entry
+        return entry
@@ -0,0 +1,304 @@
+"""
+Streaming Aggregates - Thống kê cửa sổ trượt theo từng garden, giữ trong RAM
+Luật cảnh báo chỉ thấy giá trị tức thời của mỗi message; để hỏi "trung bình
+10 phút qua > 30°C" mà không query SQLite, mỗi (garden, trường) giữ một cửa
+sổ trượt cố định bộ nhớ:
+
+    ring buffer (t, giá trị)  ─► mean (tổng chạy), min/max (deque đơn điệu)
+                              ─► percentile (sketch histogram bin cố định)
+    EWMA theo thời gian       ─► không cần lưu mẫu
+
+Thêm một mẫu là O(1) (khấu hao); mẫu cũ hơn cửa sổ bị loại khi có mẫu mới
+hoặc khi đọc. Ring đầy (gửi dày hơn dự kiến) thì mẫu cũ nhất bị đè, nên bộ
+nhớ mỗi chuỗi không đổi (~5 KB với cửa sổ 10 phút, mẫu 3 s).
+
+Dùng chung bởi rules.py (luật "window") và history_api.py (/api/window).
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+WINDOW_SECONDS = 600        # Cửa sổ mặc định: 10 phút
+SAMPLE_INTERVAL = 3         # Giây giữa hai mẫu của firmware: dung lượng ring = cửa sổ / chu kỳ
+EWMA_SECONDS = 300          # Hằng số thời gian của EWMA
+FIELDS = ("temperature", "humidity")    # Trường luôn được theo dõi (dashboard)
+PERCENTILES = (50, 90, 99)
+
+# Bin của sketch percentile theo trường: (thấp, cao, bước); sai số <= một bước
+SKETCH_BINS = {
+    "temperature": (-20.0, 60.0, 0.5),
+    "humidity": (0.0, 100.0, 0.5),
+    "rssi": (-120.0, 0.0, 1.0),
+    "rain_analog": (0.0, 4096.0, 16.0),
+}
+DEFAULT_BINS = (0.0, 100.0, 1.0)
+
+STATS = ("count", "mean", "min", "max", "ewma", "last") + tuple(f"p{p}" for p in PERCENTILES)
+
+# =============================================================================
+# SERIES
+# =============================================================================
+
+class SeriesWindow:
+    """Cửa sổ trượt của một chuỗi số (một garden, một trường)"""
+
+    __slots__ = ("window", "capacity", "times", "values", "head", "size", "seq", "total",
+                 "min_q", "max_q", "tau", "ewma", "ewma_t", "lo", "step", "counts", "last", "last_t")
+
+    def __init__(self, window=WINDOW_SECONDS, capacity=None, bins=DEFAULT_BINS, ewma_seconds=EWMA_SECONDS):
+        self.window = window
+        self.capacity = capacity or max(int(window / SAMPLE_INTERVAL), 1)
+        self.times = array("d", bytes(8 * self.capacity))
+        self.values = array("f", bytes(4 * self.capacity))
+        self.head = 0               # Vị trí mẫu cũ nhất
+        self.size = 0
+        self.seq = 0                # Số thứ tự của mẫu kế tiếp (cho deque min/max)
+        self.total = 0.0
+        self.min_q = deque()        # (seq, giá trị) tăng dần: phần tử đầu là min
+        self.max_q = deque()        # (seq, giá trị) giảm dần: phần tử đầu là max
+        self.tau = ewma_seconds
+        self.ewma = None
+        self.ewma_t = None
+        lo, hi, step = bins
+        self.lo = lo
+        self.step = step
+        self.counts = array("H", bytes(2 * (int(math.ceil((hi - lo) / step)) + 1)))
+        self.last = None
+        self.last_t = None
+
+    def add(self, t, value):
+        if self.last_t is not None and t < self.last_t:
+            t = self.last_t         # Giữ ring theo thứ tự thời gian
+        times = self.times
+        cutoff = t - self.window
+        while self.size and times[self.head] <= cutoff:
+            self._pop()
+        if self.size == self.capacity:
+            self._pop()
+        i = self.head + self.size
+        if i >= self.capacity:
+            i -= self.capacity
+        times[i] = t
+        self.values[i] = value
+        value = self.values[i]      # Giá trị float32 đã lưu: cùng bin khi loại ra
+        self.size += 1
+        self.total += value
+        b = int((value - self.lo) / self.step)
+        counts = self.counts
+        counts[0 if b < 0 else b if b < len(counts) else len(counts) - 1] += 1
+        seq = self.seq
+        self.seq = seq + 1
+        min_q = self.min_q
+        while min_q and min_q[-1][1] >= value:
+            min_q.pop()
+        min_q.append((seq, value))
+        max_q = self.max_q
+        while max_q and max_q[-1][1] <= value:
+            max_q.pop()
+        max_q.append((seq, value))
+        if self.ewma is None:
+            self.ewma = value
+        elif t > self.ewma_t:
+            self.ewma += (1 - math.exp((self.ewma_t - t) / self.tau)) * (value - self.ewma)
+        self.ewma_t = t
+        self.last = value
+        self.last_t = t
+
+    def expire(self, now):
+        """Loại các mẫu cũ hơn cửa sổ tính tới `now`"""
+        cutoff = now - self.window
+        times = self.times
+        while self.size and times[self.head] <= cutoff:
+            self._pop()
+
+    def _pop(self):
+        i = self.head
+        value = self.values[i]
+        oldest = self.seq - self.size
+        self.head = (i + 1) % self.capacity
+        self.size -= 1
+        self.counts[self._bin(value)] -= 1
+        if self.size:
+            self.total -= value
+        else:
+            self.total = 0.0        # Cửa sổ rỗng: xóa sai số cộng dồn
+        if self.min_q and self.min_q[0][0] == oldest:
+            self.min_q.popleft()
+        if self.max_q and self.max_q[0][0] == oldest:
+            self.max_q.popleft()
+
+    def _bin(self, value):
+        b = int((value - self.lo) / self.step)
+        return 0 if b < 0 else min(b, len(self.counts) - 1)
+
+    # -------------------------------------------------------------------------
+
+    def mean(self):
+        return self.total / self.size if self.size else None
+
+    def min(self):
+        return self.min_q[0][1] if self.min_q else None
+
+    def max(self):
+        return self.max_q[0][1] if self.max_q else None
+
+    def percentile(self, q):
+        """Percentile q (0-100) từ sketch: nội suy tuyến tính trong bin"""
+        return self.percentiles((q,))[0]
+
+    def percentiles(self, qs):
+        """Nhiều percentile (qs tăng dần) trong một lần duyệt sketch"""
+        if not self.size:
+            return [None] * len(qs)
+        low, high = self.min_q[0][1], self.max_q[0][1]
+        # Chỉ duyệt các bin giữa min và max thật
+        first = max(int((low - self.lo) / self.step), 0)
+        result = []
+        pending = iter(qs)
+        q = next(pending)
+        seen = 0
+        for b in range(first, len(self.counts)):
+            count = self.counts[b]
+            if not count:
+                continue
+            while q is not None and seen + count >= q / 100 * self.size:
+                value = self.lo + (b + (q / 100 * self.size - seen) / count) * self.step
+                # Không vượt ra ngoài giá trị thật đã thấy
+                result.append(min(max(value, low), high))
+                q = next(pending, None)
+            if q is None:
+                return result
+            seen += count
+        return result + [high] * (len(qs) - len(result))
+
+    def stat(self, name):
+        if name == "mean":
+            return self.mean()
+        if name == "min":
+            return self.min()
+        if name == "max":
+            return self.max()
+        if name == "ewma":
+            return self.ewma
+        if name == "count":
+            return self.size
+        if name == "last":
+            return self.last
+        if name == "spread":
+            return self.max() - self.min() if self.size else None
+        if name[0] == "p":
+            return self.percentile(float(name[1:]))
+        raise ValueError(f"Unknown stat: {name}")
+
+    def snapshot(self, now=None):
+        if now is not None:
+            self.expire(now)
+        data = {name: self.stat(name) for name in STATS if name[0] != "p"}
+        data.update(zip((f"p{p}" for p in PERCENTILES), self.percentiles(PERCENTILES)))
+        for name, value in data.items():
+            if isinstance(value, float):
+                data[name] = round(value, 2)
+        data["last_t"] = self.last_t
+        return data
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+class StreamAggregates:
+    """garden -> các SeriesWindow của trường được theo dõi.
+
+    track(field, window) đăng ký một chuỗi (luật cần cửa sổ khác mặc định thì
+    có chuỗi riêng); update() đưa một mẫu vào mọi chuỗi của garden. Một thread
+    ghi (luồng cảnh báo), nhiều thread đọc (API) qua lock.
+    """
+
+    def __init__(self, fields=FIELDS, window=WINDOW_SECONDS, ewma_seconds=EWMA_SECONDS):
+        self.window = window
+        self.ewma_seconds = ewma_seconds
+        self._lock = threading.Lock()
+        self._tracked = []          # [(field, window)]
+        self._devices = {}          # garden -> [(field, key, SeriesWindow)]
+        for field in fields:
+            self.track(field)
+
+    def track(self, field, window=None):
+        """Theo dõi `field` với cửa sổ `window` giây; trả về khóa dùng cho get()"""
+        key = (field, window or self.window)
+        with self._lock:
+            if key not in self._tracked:
+                self._tracked.append(key)
+                # Garden đã có: thêm chuỗi mới (bắt đầu rỗng)
+                for series in self._devices.values():
+                    series.append((field, key, self._new_series(key)))
+        return key
+
+    def update(self, device, values, t):
+        """Đưa một mẫu (dict) vào mọi chuỗi của garden"""
+        with self._lock:
+            series = self._devices.get(device)
+            if series is None:
+                series = self._devices[device] = [(key[0], key, self._new_series(key)) for key in self._tracked]
+            for field, _, window in series:
+                value = values.get(field)
+                if value is not None and not isinstance(value, bool):
+                    window.add(t, value)
+
+    def get(self, device, field, window=None):
+        key = (field, window or self.window)
+        for _, series_key, series in self._devices.get(device, ()):
+            if series_key == key:
+                return series
+        return None
+
+    def snapshot(self, device, now=None):
+        """{trường: thống kê} cho dashboard; cửa sổ khác mặc định có tên 'trường@Ns'"""
+        now = time.time() if now is None else now
+        with self._lock:
+            result = {}
+            for field, (_, window), series in self._devices.get(device, ()):
+                name = field if window == self.window else f"{field}@{window:g}s"
+                result[name] = series.snapshot(now)
+            return result
+
+    def fleet(self, field="temperature", stat="mean", window=None, now=None):
+        """{garden: giá trị} của một thống kê trên mọi garden (bản đồ nhiệt dashboard)"""
+        now = time.time() if now is None else now
+        key = (field, window or self.window)
+        with self._lock:
+            result = {}
+            for device, series_list in self._devices.items():
+                for _, series_key, series in series_list:
+                    if series_key == key:
+                        series.expire(now)
+                        value = series.stat(stat)
+                        if value is not None:
+                            result[device] = round(value, 2) if isinstance(value, float) else value
+            return result
+
+    def devices(self):
+        with self._lock:
+            return list(self._devices)
+
+    def forget(self, device):
+        with self._lock:
+            self._devices.pop(device, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "devices": len(self._devices),
+                "series": sum(len(s) for s in self._devices.values()),
+                "tracked": [f"{field}@{window:g}s" for field, window in self._tracked],
+            }
+
+    def _new_series(self, key):
+        field, window = key
+        return SeriesWindow(window, bins=SKETCH_BINS.get(field, DEFAULT_BINS), ewma_seconds=self.ewma_seconds)
@@ -2,14 +2,30 @@
 Temperature Alert System - Discord Notifications
 Theo dõi nhiệt độ TỪ MQTT và gửi cảnh báo qua Discord khi vượt ngưỡng
 (Phiên bản cập nhật, có thêm trạng thái MƯA)
+Các luật cảnh báo (ngưỡng, tốc độ tăng, kéo dài N phút, nóng + khô) nằm trong
+rules.py, trạng thái tách riêng cho từng garden.
+Payload decode bằng database/decoders.py (JSON / MessagePack / CBOR, cùng
+schema với logger); message sensor/batch được chấm từng mẫu theo thời gian
+của mẫu đó.
 """
 
-import json
+import os
+import sys
 import time
 from datetime import datetime
 import paho.mqtt.client as mqtt
 import requests
 
+from digest import Digester, SEVERITY_COLORS, NORMAL_COLOR, USERNAME, AVATAR_URL
+from dispatcher import Dispatcher, TIMEOUT
+from rules import RuleEngine, TEMP_THRESHOLD, CLEAR, REPEAT
+
+# Dùng chung decoder với database/ (schema, payload nhị phân, sensor/batch)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from decoders import decode, sensor_samples, PayloadError
+from schema import garden_from_topic
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
@@ -19,56 +35,84 @@ MQTT_BROKER = "192.168.1.9"
 MQTT_PORT = 1883
 MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
-TOPIC_SENSOR = "demo/garden/sensor/state"
+TOPIC_SENSOR = "+/+/sensor/state"     # Mọi garden: <prefix>/<garden>/sensor/state
+TOPIC_BATCH = "+/+/sensor/batch"      # Thiết bị gom nhiều mẫu vào một message
 
 # Discord Webhook Configuration
 DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1424942108313129005/24l_Jies7HOFm0e283fWE47QJYvNm9uWC5-g3-gKmyub7KuZmcT4rd62km-G2Klkykco"
 
-# Alert Configuration
-TEMP_THRESHOLD = 30.0  # Ngưỡng nhiệt độ (°C)
-ALERT_COOLDOWN = 300   # Thời gian chờ giữa các cảnh báo (5 phút = 300 giây)
+# Alert Configuration: ngưỡng và luật ở rules.py (TEMP_THRESHOLD, RULES),
+# cửa sổ gom cảnh báo ở digest.py (WINDOWS, GROUP_BY)
+
+# Dispatcher: on_message chỉ xếp hàng, worker gửi webhook (xem dispatcher.py)
+ALERT_WORKERS = 2
+ALERT_OUTBOX_FILE = "alerts_outbox.db"   # Thông báo chưa gửi được giữ qua lần khởi động lại
 
 # =============================================================================
 # GLOBAL VARIABLES
 # =============================================================================
 
-last_alert_time = 0
-alert_active = False
+engine = RuleEngine()
+dispatcher = None
+digester = None
 
 # =============================================================================
 # DISCORD FUNCTIONS
 # =============================================================================
 
-# <<< SỬA: Thêm 'is_raining' vào hàm
-def send_discord_alert(temperature, humidity, rssi, is_raining):
-    """Gửi cảnh báo lên Discord"""
-    global last_alert_time
-    
-    current_time = time.time()
-    
-    if current_time - last_alert_time < ALERT_COOLDOWN:
-        print(f"⏳ Cooldown active, skipping alert (wait {ALERT_COOLDOWN - (current_time - last_alert_time):.0f}s)")
-        return
-    
-    # <<< SỬA: Thêm logic cho trạng thái mưa
-    rain_status_str = "🌧️ Đang mưa" if is_raining else "☀️ Khô ráo"
+def start_dispatcher():
+    """Chạy dispatcher gửi webhook (và gửi lại thông báo còn trong outbox)"""
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = Dispatcher(DISCORD_WEBHOOK_URL, workers=ALERT_WORKERS, outbox_file=ALERT_OUTBOX_FILE)
+        dispatcher.start()
+    return dispatcher
+
+def start_digester():
+    """Chạy digester: gom cảnh báo theo cửa sổ rồi xếp hàng vào dispatcher"""
+    global digester
+    if digester is None:
+        digester = Digester(lambda payload, label: start_dispatcher().send(payload, label), single=rule_embed)
+        digester.start()
+    return digester
+
+def stop_dispatcher(timeout=10):
+    """Gửi nốt digest, chờ gửi tối đa `timeout` giây; phần còn lại nằm trong outbox"""
+    global dispatcher, digester
+    if digester is not None:
+        digester.close()
+        digester = None
+    if dispatcher is not None:
+        dispatcher.close(drain=True, timeout=timeout)
+        dispatcher = None
+
+def rule_embed(alert, data):
+    """Embed chi tiết cho một cảnh báo (hoặc thông báo hết cảnh báo) của một garden"""
+    rule = alert.rule
+    cleared = alert.kind == CLEAR
+    rain_status_str = "🌧️ Đang mưa" if data.get("is_raining") else "☀️ Khô ráo"
+    if cleared:
+        title = f"✅ TRỞ VỀ BÌNH THƯỜNG: {rule.title}"
+    elif alert.kind == REPEAT:
+        title = f"{rule.title} (vẫn tiếp diễn)"
+    else:
+        title = rule.title
     
     embed = {
-        "title": "🚨 CẢNH BÁO NHIỆT ĐỘ CAO (VƯỜN)",
-        "description": f"⚠️ Nhiệt độ vượt ngưỡng **{TEMP_THRESHOLD}°C**",
-        "color": 16711680,  # Màu đỏ
+        "title": title,
+        "description": f"🏡 Vườn **{alert.device}** · luật `{rule.id}` ({rule.severity})",
+        "color": NORMAL_COLOR if cleared else SEVERITY_COLORS.get(rule.severity, 16711680),
         "fields": [
             {
                 "name": "🌡️ Nhiệt độ hiện tại",
-                "value": f"**{temperature}°C**",
+                "value": f"**{data.get('temperature')}°C**",
                 "inline": True
             },
             {
                 "name": "💧 Độ ẩm",
-                "value": f"{humidity}%",
+                "value": f"{data.get('humidity')}%",
                 "inline": True
             },
-            # <<< SỬA: Thêm trường Tình trạng mưa
             {
                 "name": "🌧️ Tình trạng mưa",
                 "value": f"**{rain_status_str}**",
@@ -76,92 +120,29 @@ def send_discord_alert(temperature, humidity, rssi, is_raining):
             },
             {
                 "name": "📶 Tín hiệu",
-                "value": f"{rssi} dBm",
-                "inline": True # Sẽ tự động xuống dòng mới
-            },
-            {
-                "name": "⏰ Thời gian",
-                "value": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "inline": False
-            }
-        ],
-        "footer": { "text": "IoT Garden Alert System" },
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    
-    payload = {
-        "username": "IoT Garden Bot",
-        "avatar_url": "https://cdn-icons-png.flaticon.com/512/3093/3093173.png",
-        "embeds": [embed]
-    }
-    
-    try:
-        response = requests.post(DISCORD_WEBHOOK_URL, json=payload)
-        
-        if response.status_code == 204:
-            print(f"✅ Discord alert sent: {temperature}°C")
-            last_alert_time = current_time
-        else:
-            print(f"❌ Failed to send Discord alert: {response.status_code}")
-            print(f"   Response: {response.text}")
-    
-    except Exception as e:
-        print(f"❌ Error sending Discord alert: {e}")
-
-# <<< SỬA: Thêm 'is_raining' vào hàm
-def send_discord_normal(temperature, humidity, is_raining):
-    """Gửi thông báo nhiệt độ đã trở về bình thường"""
-    
-    # <<< SỬA: Thêm logic cho trạng thái mưa
-    rain_status_str = "🌧️ Đang mưa" if is_raining else "☀️ Khô ráo"
-
-    embed = {
-        "title": "✅ NHIỆT ĐỘ TRỞ VỀ BÌNH THƯỜNG (VƯỜN)",
-        "description": f"Nhiệt độ hiện tại dưới ngưỡng {TEMP_THRESHOLD}°C",
-        "color": 65280,  # Màu xanh lá
-        "fields": [
-            {
-                "name": "🌡️ Nhiệt độ hiện tại",
-                "value": f"**{temperature}°C**",
+                "value": f"{data.get('rssi')} dBm",
                 "inline": True
             },
             {
-                "name": "💧 Độ ẩm",
-                "value": f"{humidity}%",
-                "inline": True
-            },
-            # <<< SỬA: Thêm trường Tình trạng mưa
-            {
-                "name": "🌧️ Tình trạng mưa",
-                "value": f"{rain_status_str}",
+                "name": "📏 Giá trị luật",
+                "value": f"{alert.value}",
                 "inline": True
             },
             {
                 "name": "⏰ Thời gian",
-                "value": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "value": datetime.fromtimestamp(alert.t).strftime("%Y-%m-%d %H:%M:%S"),
                 "inline": False
             }
         ],
         "footer": { "text": "IoT Garden Alert System" },
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcfromtimestamp(alert.t).isoformat()
     }
     
-    payload = {
-        "username": "IoT Garden Bot",
-        "avatar_url": "https://cdn-icons-png.flaticon.com/512/3093/3093173.png",
-        "embeds": [embed]
-    }
-    
-    try:
-        response = requests.post(DISCORD_WEBHOOK_URL, json=payload)
-        
-        if response.status_code == 204:
-            print(f"✅ Discord normal notification sent: {temperature}°C")
-        else:
-            print(f"❌ Failed to send Discord notification: {response.status_code}")
-    
-    except Exception as e:
-        print(f"❌ Error sending Discord notification: {e}")
+    return embed
+
+def notify(alert, data):
+    """Đưa cảnh báo vào digester; không chờ webhook (digest + dispatcher gửi sau)"""
+    start_digester().add(alert, data)
 
 # =============================================================================
 # MQTT CALLBACKS
@@ -171,53 +152,50 @@ def on_connect(client, userdata, flags, rc):
     """Callback khi kết nối MQTT thành công"""
     if rc == 0:
         print("✅ Connected to MQTT broker: " + MQTT_BROKER)
-        client.subscribe(TOPIC_SENSOR)
-        print(f"📡 Subscribed to: {TOPIC_SENSOR}")
-        print(f"🌡️  Monitoring temperature threshold: {TEMP_THRESHOLD}°C")
-        print(f"⏱️  Alert cooldown: {ALERT_COOLDOWN} seconds")
+        for topic in (TOPIC_SENSOR, TOPIC_BATCH):
+            client.subscribe(topic)
+            client.subscribe(topic + "/+")     # Hậu tố /msgpack, /cbor
+        print(f"📡 Subscribed to: {TOPIC_SENSOR}, {TOPIC_BATCH} (json, msgpack, cbor)")
+        print(f"🌡️  Monitoring {len(engine.rules)} rules per garden (threshold {TEMP_THRESHOLD}°C)")
     else:
         print(f"❌ Connection failed with code: {rc}")
 
 def on_message(client, userdata, msg):
     """Callback khi nhận được message từ MQTT"""
-    global alert_active
-    
     try:
-        data = json.loads(msg.payload.decode())
-        
-        temperature = data.get('temperature')
-        humidity = data.get('humidity')
-        rssi = data.get('rssi')
-        is_raining = data.get('is_raining') # <<< SỬA: Đọc thêm trạng thái mưa
-        
-        # <<< SỬA: Kiểm tra cả 2 giá trị
-        if temperature is None or is_raining is None:
-            print(" → ⚠️ Missing temp or rain data, skipping")
+        decoded = decode(msg.topic, msg.payload)
+        if decoded is None:
             return
+        garden = garden_from_topic(msg.topic)
+        samples = sensor_samples(*decoded, int(time.time() * 1000))
+        if len(samples) > 1:
+            print(f"📦 [{garden}] batch of {len(samples)} samples")
         
-        rain_status_str = "Raining" if is_raining else "Dry"
-        print(f"🌡️  Current: {temperature}°C, {humidity}%, {rssi}dBm, Rain: {rain_status_str}", end="")
-        
-        if temperature > TEMP_THRESHOLD:
-            print(f" → 🚨 HIGH TEMPERATURE!")
-            if not alert_active:
-                # <<< SỬA: Truyền 'is_raining'
-                send_discord_alert(temperature, humidity, rssi, is_raining)
-                alert_active = True
-            else:
-                # Vẫn kiểm tra cooldown
-                send_discord_alert(temperature, humidity, rssi, is_raining)
-        else:
-            print(f" → ✅ Normal")
-            if alert_active:
-                # <<< SỬA: Truyền 'is_raining'
-                send_discord_normal(temperature, humidity, is_raining)
-                alert_active = False
-                global last_alert_time
-                last_alert_time = 0 
+        for record, recv_ms in samples:
+            data = record._asdict()
+            temperature = data['temperature']
+            humidity = data['humidity']
+            rssi = data['rssi']
+            is_raining = data['is_raining'] # <<< SỬA: Đọc thêm trạng thái mưa
+            
+            # <<< SỬA: Kiểm tra cả 2 giá trị
+            if temperature is None or is_raining is None:
+                print(" → ⚠️ Missing temp or rain data, skipping")
+                continue
+            
+            rain_status_str = "Raining" if is_raining else "Dry"
+            print(f"🌡️  [{garden}] {temperature}°C, {humidity}%, {rssi}dBm, Rain: {rain_status_str}", end="")
+            
+            alerts = engine.evaluate(garden, data, recv_ms / 1000)
+            if not alerts:
+                print(" → ✅ OK")
+                continue
+            print(" → " + ", ".join(f"{'✅' if a.kind == CLEAR else '🚨'} {a.rule.id}" for a in alerts))
+            for alert in alerts:
+                notify(alert, data)
     
-    except json.JSONDecodeError:
-        print(f"⚠️  Invalid JSON: {msg.payload.decode()}")
+    except PayloadError as e:
+        print(f"⚠️  Invalid payload on {msg.topic}: {e}")
     except Exception as e:
         print(f"❌ Error processing message: {e}")
 
@@ -233,7 +211,7 @@ def main():
     print(f"📡 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
     print(f"🔔 Discord Webhook: Configured")
     print(f"🌡️  Temperature Threshold: {TEMP_THRESHOLD}°C")
-    print(f"⏱️  Alert Cooldown: {ALERT_COOLDOWN} seconds")
+    print(f"📏 Rules: {', '.join(rule.id for rule in engine.rules)}")
     print("────────────────────────────────────────────")
     
     # Test Discord webhook
@@ -251,13 +229,13 @@ def main():
     }
     
     test_payload = {
-        "username": "IoT Garden Bot",
-        "avatar_url": "https://cdn-icons-png.flaticon.com/512/3093/3093173.png",
+        "username": USERNAME,
+        "avatar_url": AVATAR_URL,
         "embeds": [test_embed]
     }
     
     try:
-        response = requests.post(DISCORD_WEBHOOK_URL, json=test_payload)
+        response = requests.post(DISCORD_WEBHOOK_URL, json=test_payload, timeout=TIMEOUT)
         if response.status_code == 204:
             print("✅ Discord webhook test successful!")
         else:
@@ -267,6 +245,8 @@ def main():
     
     print("\n────────────────────────────────────────────")
     
+    start_dispatcher()
+    start_digester()
     client = mqtt.Client(client_id="temp_alert_" + str(int(time.time())), protocol=mqtt.MQTTv311)
     client.on_connect = on_connect
     client.on_message = on_message
@@ -287,6 +267,8 @@ def main():
         client.disconnect()
     except Exception as e:
         print(f"❌ Error: {e}")
+    finally:
+        stop_dispatcher()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
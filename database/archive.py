@@ -0,0 +1,342 @@
+"""
+Columnar Archive - Chuyển sensor_data cũ ra file Parquet / Arrow IPC
+Mỗi (garden, ngày UTC) được đọc theo từng chunk bằng fetchmany, ghi thành một
+file cột nén (archive/sensor_data/<garden>/<YYYY-MM-DD>.<part>.parquet), ghi
+vào bảng archive_catalog rồi xóa khỏi SQLite trong cùng một transaction.
+File SQLite "nóng" luôn nhỏ; rollup vẫn giữ nguyên nên biểu đồ dài hạn không
+cần đọc archive.
+
+Cần pyarrow (pip install pyarrow). Chạy trực tiếp:
+    python archive.py [iot_garden_data.db] [--days 7] [--format parquet|arrow]
+"""
+
+import itertools
+import os
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from schema import open_database, migrate, shard_files
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+ARCHIVE_DIR = "archive"         # Tương đối so với thư mục chứa file database
+ARCHIVE_AFTER_DAYS = 7          # Phải nhỏ hơn RETENTION_DAYS["sensor_data"]
+ARCHIVE_FORMAT = "parquet"      # parquet | arrow
+COMPRESSION = "zstd"
+CHUNK_ROWS = 50000              # Số dòng mỗi fetchmany / record batch
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+# Cột được lưu (bỏ id); is_raining ghi dạng bool
+COLUMNS = ("garden", "recv_ms", "timestamp", "device_timestamp", "temperature", "humidity",
+           "rain_analog", "rain_digital", "is_raining", "rssi")
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for the archive (pip install pyarrow)")
+
+def arrow_schema():
+    _require_pyarrow()
+    return pa.schema([
+        ("garden", pa.string()),
+        ("recv_ms", pa.int64()),
+        ("timestamp", pa.string()),
+        ("device_timestamp", pa.int64()),
+        ("temperature", pa.float64()),
+        ("humidity", pa.float64()),
+        ("rain_analog", pa.int32()),
+        ("rain_digital", pa.int8()),
+        ("is_raining", pa.bool_()),
+        ("rssi", pa.int16()),
+    ])
+
+# =============================================================================
+# WRITING
+# =============================================================================
+
+def _record_batch(rows, schema):
+    """Chuyển một chunk tuple SQLite thành RecordBatch theo cột"""
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if field.type == pa.bool_():
+            # SQLite lưu BOOLEAN là 0/1
+            arrays.append(pa.array(values, pa.int8()).cast(pa.bool_()))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class _Writer:
+    """Ghi record batch ra Parquet hoặc Arrow IPC (file tạm, đổi tên khi xong)"""
+
+    def __init__(self, path, fmt, schema):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self._sink = None
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(self.tmp_path, schema, compression=COMPRESSION)
+        else:
+            self._sink = pa.OSFile(self.tmp_path, "wb")
+            self._writer = ipc.new_file(self._sink, schema,
+                                        options=ipc.IpcWriteOptions(compression=COMPRESSION))
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            self._writer.close()
+            if self._sink is not None:
+                self._sink.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+def archive_root(db_file):
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), ARCHIVE_DIR)
+
+def _path_segment(segment):
+    """Một cấp topic -> tên thư mục an toàn: percent-encode ('/', '%', ký tự lạ),
+    kể cả '.', '..' và cấp rỗng (không được trỏ ra ngoài archive/)"""
+    quoted = quote(segment, safe="")
+    if not quoted.strip("."):
+        quoted = "%2E" * len(segment) or "%"
+    return quoted
+
+def _partition_path(garden, day_ms, part, fmt):
+    """Đường dẫn tương đối của một part; garden lấy từ topic MQTT nên mọi cấp đều được encode"""
+    day = datetime.fromtimestamp(day_ms / 1000, timezone.utc).strftime("%Y-%m-%d")
+    return os.path.join("sensor_data", *map(_path_segment, garden.split("/")),
+                        f"{day}.{part}.{EXTENSIONS[fmt]}")
+
+def _archive_path(root, rel_path):
+    """root + rel_path, kiểm tra đường dẫn thật vẫn nằm trong root"""
+    path = os.path.join(root, rel_path)
+    real_root = os.path.realpath(root)
+    if os.path.commonpath([real_root, os.path.realpath(path)]) != real_root:
+        raise ValueError(f"Archive path escapes {root}: {rel_path}")
+    return path
+
+def archive_partition(conn, db_file, garden, day_ms, fmt=ARCHIVE_FORMAT, chunk_rows=CHUNK_ROWS):
+    """Archive sensor_data của một garden trong một ngày; trả về số dòng đã chuyển"""
+    schema = arrow_schema()
+    end_ms = day_ms + DAY_MS
+    # Dữ liệu đến trễ cho ngày đã archive được ghi thành part tiếp theo
+    part = conn.execute("""
+        SELECT COALESCE(MAX(part) + 1, 0) FROM archive_catalog
+        WHERE table_name = 'sensor_data' AND garden = ? AND day_ms = ?
+    """, (garden, day_ms)).fetchone()[0]
+    rel_path = _partition_path(garden, day_ms, part, fmt)
+    path = _archive_path(archive_root(db_file), rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Replay / sensor/batch vẫn có thể ghi dòng lùi ngày vào ngày này trong lúc file
+    # đang được ghi: chỉ xóa đúng các id đã ra file, dòng đến sau thành part kế tiếp
+    cursor = conn.execute(f"""
+        SELECT id, {', '.join(COLUMNS)} FROM sensor_data
+        WHERE garden = ? AND recv_ms >= ? AND recv_ms < ?
+        ORDER BY recv_ms
+    """, (garden, day_ms, end_ms))
+    writer = _Writer(path, fmt, schema)
+    rows = 0
+    ids = array("q")
+    min_recv = max_recv = None
+    try:
+        while True:
+            chunk = cursor.fetchmany(chunk_rows)
+            if not chunk:
+                break
+            ids.extend(row[0] for row in chunk)
+            chunk = [row[1:] for row in chunk]
+            writer.write(_record_batch(chunk, schema))
+            rows += len(chunk)
+            if min_recv is None:
+                min_recv = chunk[0][1]
+            max_recv = chunk[-1][1]
+        if not rows:
+            writer.abort()
+            return 0
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO archive_catalog (table_name, garden, day_ms, part, path, format,
+                                             rows, min_recv_ms, max_recv_ms, bytes)
+                VALUES ('sensor_data', ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (garden, day_ms, part, rel_path, fmt, rows, min_recv, max_recv, os.path.getsize(path)))
+            conn.executemany("DELETE FROM sensor_data WHERE id = ?", ((i,) for i in ids))
+    except Exception:
+        os.remove(path)
+        raise
+    return rows
+
+def pending_partitions(conn, before_ms):
+    """Các (garden, day_ms) còn dữ liệu thô cũ hơn before_ms"""
+    return conn.execute(f"""
+        SELECT garden, recv_ms / {DAY_MS} * {DAY_MS} AS day_ms
+        FROM sensor_data
+        WHERE recv_ms < ? AND garden IS NOT NULL
+        GROUP BY garden, day_ms
+        ORDER BY day_ms
+    """, (before_ms,)).fetchall()
+
+class Archiver:
+    """Archive các ngày đã trọn vẹn cũ hơn `after_days` trên mọi shard"""
+
+    def __init__(self, db_file, after_days=ARCHIVE_AFTER_DAYS, fmt=ARCHIVE_FORMAT,
+                 shards=1, pragmas=None, shard_ids=None):
+        _require_pyarrow()
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unknown archive format: {fmt}")
+        self.db_file = db_file
+        self.after_days = after_days
+        self.fmt = fmt
+        self.shards = shards
+        self.shard_ids = shard_ids      # None = mọi shard
+        self.pragmas = pragmas or {}
+        self.rows_archived = 0
+
+    def run_once(self, now_ms=None):
+        """Archive mọi shard một lần; trả về tổng số dòng đã chuyển"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        # Chỉ archive ngày đã kết thúc hẳn
+        before_ms = (now_ms - int(self.after_days * DAY_MS)) // DAY_MS * DAY_MS
+        total = 0
+        for db_file in shard_files(self.db_file, self.shards, self.shard_ids):
+            conn = open_database(db_file, **self.pragmas)
+            try:
+                for garden, day_ms in pending_partitions(conn, before_ms):
+                    start = time.perf_counter()
+                    rows = archive_partition(conn, db_file, garden, day_ms, self.fmt)
+                    elapsed = time.perf_counter() - start
+                    day = datetime.fromtimestamp(day_ms / 1000, timezone.utc).strftime("%Y-%m-%d")
+                    print(f"📦 Archived {rows} rows of [{garden}] {day} ({elapsed * 1000:.0f} ms)")
+                    total += rows
+            finally:
+                conn.close()
+        self.rows_archived += total
+        return total
+
+# =============================================================================
+# READING
+# =============================================================================
+
+def catalog_entries(conn, garden, from_ms, to_ms):
+    """Các file archive giao với [from_ms, to_ms) của garden (None = mọi garden)"""
+    sql = """
+        SELECT day_ms, path, format, min_recv_ms, max_recv_ms FROM archive_catalog
+        WHERE table_name = 'sensor_data' AND max_recv_ms >= ? AND min_recv_ms < ?
+    """
+    params = (from_ms, to_ms)
+    if garden:
+        sql += " AND garden = ?"
+        params += (garden,)
+    return conn.execute(sql + " ORDER BY day_ms, min_recv_ms", params).fetchall()
+
+def read_file(path, fmt, columns=None):
+    _require_pyarrow()
+    if fmt == "parquet":
+        return pq.read_table(path, columns=columns)
+    with pa.memory_map(path) as source:
+        table = ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+def _read_entries(root, entries, from_ms, to_ms, columns):
+    """Đọc các file trong `entries`, cắt theo [from_ms, to_ms), sắp theo recv_ms"""
+    read_columns = list(columns)
+    if "recv_ms" not in read_columns:
+        read_columns.append("recv_ms")
+    tables = []
+    for _, path, fmt, min_recv, max_recv in entries:
+        table = read_file(os.path.join(root, path), fmt, read_columns)
+        if min_recv < from_ms or max_recv >= to_ms:
+            table = table.filter((pc.field("recv_ms") >= from_ms) & (pc.field("recv_ms") < to_ms))
+        tables.append(table)
+    if not tables:
+        return arrow_schema().empty_table().select(list(columns))
+    return pa.concat_tables(tables).sort_by("recv_ms").select(list(columns))
+
+def scan(conn, db_file, garden, from_ms, to_ms, columns=COLUMNS):
+    """pyarrow.Table các dòng archive trong [from_ms, to_ms), đã sắp theo recv_ms.
+
+    Dùng cho phân tích theo cột (pyarrow.compute) thay vì lặp từng dòng.
+    """
+    _require_pyarrow()
+    entries = catalog_entries(conn, garden, from_ms, to_ms)
+    return _read_entries(archive_root(db_file), entries, from_ms, to_ms, columns)
+
+def iter_rows(conn, db_file, garden, from_ms, to_ms, columns=COLUMNS, chunk_rows=CHUNK_ROWS):
+    """Các dòng archive dạng tuple (cùng thứ tự với `columns`), theo recv_ms.
+
+    Đọc từng ngày một (mọi garden/part của ngày đó) nên bộ nhớ chỉ cỡ một ngày
+    dữ liệu dù khoảng thời gian dài bao nhiêu.
+    """
+    if pa is None:
+        # Không có pyarrow: bỏ qua archive nhưng không làm hỏng truy vấn dữ liệu nóng
+        return
+    root = archive_root(db_file)
+    entries = catalog_entries(conn, garden, from_ms, to_ms)
+    for _, day_entries in itertools.groupby(entries, key=lambda entry: entry[0]):
+        table = _read_entries(root, list(day_entries), from_ms, to_ms, columns)
+        for batch in table.to_batches(chunk_rows):
+            # bool -> 0/1 cho giống giá trị SQLite trả về
+            arrays = [column.cast(pa.int8()) if column.type == pa.bool_() else column
+                      for column in batch.columns]
+            yield from zip(*(array.to_pylist() for array in arrays))
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    args = sys.argv[1:]
+    days = ARCHIVE_AFTER_DAYS
+    fmt = ARCHIVE_FORMAT
+    if "--days" in args:
+        i = args.index("--days")
+        days = float(args[i + 1])
+        del args[i:i + 2]
+    if "--format" in args:
+        i = args.index("--format")
+        fmt = args[i + 1]
+        del args[i:i + 2]
+    db_file = args[0] if args else "iot_garden_data.db"
+
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.close()
+
+    try:
+        archiver = Archiver(db_file, days, fmt)
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        return
+    total = archiver.run_once()
+    print(f"✅ Archive finished: {total} rows moved to {archive_root(db_file)} ({fmt})")
+
+if __name__ == "__main__":
+    main()
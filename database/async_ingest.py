@@ -0,0 +1,315 @@
+"""
+Async Ingest Service - Logger + cảnh báo trên asyncio (thay cho paho loop_forever)
+Một client MQTT bất đồng bộ (aiomqtt) đọc mọi topic; các task chạy song song:
+
+    mqtt_reader  ──► db_queue ────► db_worker    (parse + BatchWriter, theo lô trên thread)
+                 └─► alert_queue ─► alert_worker (alerts/rules.py, trạng thái theo từng garden)
+
+Hàng đợi có giới hạn: khi DB chậm, reader dừng đọc socket và broker giữ lại
+message (back-pressure) thay vì tràn bộ nhớ. Nhiều instance chia nhau theo
+garden (--instance k/N), không dùng $share: dedup heartbeat và luật cảnh báo
+giữ trạng thái theo garden nên mọi message của một garden phải về cùng một
+tiến trình.
+
+Cần: pip install aiomqtt
+Chạy:
+    python async_ingest.py                # kết nối broker, ghi DB + cảnh báo
+    python async_ingest.py --instance 0/2 # instance 0 trong 2 (chỉ các garden thuộc shard của nó)
+    python async_ingest.py --bench 200000 # đo messages/s của pipeline (không cần broker)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+try:
+    import aiomqtt
+except ImportError:
+    aiomqtt = None
+
+import history_api
+import mqtt_logger
+from batch_writer import BatchWriter
+from decoders import decode, PayloadError, sensor_samples
+from schema import garden_from_topic, shard_index, split_encoding, worker_shards
+
+# Dùng lại rule engine và hàm gửi Discord của alerts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+MQTT_BROKER = mqtt_logger.MQTT_BROKER
+MQTT_PORT = mqtt_logger.MQTT_PORT
+MQTT_USERNAME = mqtt_logger.MQTT_USERNAME
+MQTT_PASSWORD = mqtt_logger.MQTT_PASSWORD
+TOPIC_PREFIX = mqtt_logger.TOPIC_PREFIX
+TOPIC_KINDS = mqtt_logger.TOPIC_KINDS
+
+# Nhiều instance (--instance k/N): garden thuộc instance k khi shard của nó
+# (mqtt_logger.DB_SHARDS) % N == k, giống mqtt_logger --workers. Không dùng
+# $share/<group>/...: broker chia message theo lượt chứ không theo garden, nên
+# last_rows (dedup heartbeat) và trạng thái RuleEngine (hysteresis, minutes,
+# rate, window, anomaly) của một garden sẽ bị tách ra nhiều tiến trình.
+# Giới hạn: mọi instance vẫn nhận toàn bộ message rồi bỏ garden không thuộc
+# mình; đổi N thì garden đổi instance và trạng thái luật bắt đầu lại.
+# DB_SHARDS phải là bội số của N.
+INSTANCES = 1
+INSTANCE_INDEX = 0
+
+DB_QUEUE_SIZE = 20000       # Message chờ ghi; đầy thì reader tạm dừng đọc
+DB_CHUNK = 1000             # Số message mỗi lần chuyển sang thread ghi
+ALERT_QUEUE_SIZE = 1000     # Đầy thì bỏ bản cũ nhất (cảnh báo chỉ cần giá trị mới)
+ALERTS_ENABLED = True
+RECONNECT_DELAY = 5         # Giây chờ trước khi kết nối lại
+STATS_INTERVAL = 60
+ALERT_TOPICS = ("/sensor/state", "/sensor/batch")    # Topic đưa sang nhánh cảnh báo
+
+# =============================================================================
+# STATS
+# =============================================================================
+
+class Stats:
+    def __init__(self):
+        self.received = 0
+        self.processed = 0
+        self.alert_dropped = 0
+        self.foreign_skipped = 0
+        self.alerts_sent = 0
+        self.started = time.monotonic()
+
+    def line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"📈 Async ingest: {self.received} received, {self.processed} processed "
+                f"({self.processed / elapsed:,.0f} msg/s), alerts sent={self.alerts_sent}, "
+                f"alert drops={self.alert_dropped}, other instances' gardens={self.foreign_skipped}")
+
+stats = Stats()
+
+# =============================================================================
+# TASKS
+# =============================================================================
+
+def subscriptions():
+    # Mỗi loại topic: JSON và hậu tố encoding nhị phân (.../msgpack, .../cbor)
+    return [f"{TOPIC_PREFIX}/{kind}{suffix}" for kind in TOPIC_KINDS for suffix in ("", "/+")]
+
+async def enqueue(db_queue, alert_queue, topic, payload, recv_time, content_type=None):
+    """Đưa một message vào hai nhánh xử lý (bỏ qua garden của instance khác)"""
+    stats.received += 1
+    owned = mqtt_logger.owned_shards
+    if owned is not None and shard_index(garden_from_topic(topic), mqtt_logger.DB_SHARDS) not in owned:
+        stats.foreign_skipped += 1
+        return
+    await db_queue.put((topic, payload, recv_time, content_type))
+    if alert_queue is not None and split_encoding(topic)[0].endswith(ALERT_TOPICS):
+        if alert_queue.full():
+            alert_queue.get_nowait()
+            stats.alert_dropped += 1
+        alert_queue.put_nowait((topic, payload, recv_time, content_type))
+
+async def mqtt_reader(db_queue, alert_queue):
+    """Kết nối (và kết nối lại) broker, đọc message vào hàng đợi"""
+    identifier = f"async_logger_{os.getpid()}_{int(time.time())}"
+    while True:
+        try:
+            async with aiomqtt.Client(MQTT_BROKER, MQTT_PORT, identifier=identifier,
+                                      username=MQTT_USERNAME or None,
+                                      password=MQTT_PASSWORD or None,
+                                      protocol=aiomqtt.ProtocolVersion.V5) as client:
+                await client.subscribe([(topic, 0) for topic in subscriptions()])
+                print(f"✅ Connected to MQTT broker: {MQTT_BROKER} ({', '.join(subscriptions())})")
+                async for message in client.messages:
+                    # MQTT 5: thiết bị có thể khai báo encoding bằng Content-Type
+                    content_type = getattr(message.properties, "ContentType", None)
+                    await enqueue(db_queue, alert_queue, str(message.topic),
+                                  message.payload, time.time(), content_type)
+        except aiomqtt.MqttError as e:
+            print(f"❌ MQTT connection lost: {e}; reconnecting in {RECONNECT_DELAY}s")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+def process_batch(batch):
+    """Chạy trên thread: parse + đưa vào BatchWriter (có thể block khi writer đầy)"""
+    for topic, payload, recv_time, content_type in batch:
+        mqtt_logger.process_message(topic, payload, recv_time, content_type)
+
+async def db_worker(db_queue):
+    """Gom message đang chờ thành lô và xử lý trên thread, không chặn event loop"""
+    while True:
+        item = await db_queue.get()
+        batch = []
+        stop = False
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= DB_CHUNK or db_queue.empty():
+                break
+            item = db_queue.get_nowait()
+        if item is None:
+            stop = True
+        if batch:
+            await asyncio.to_thread(process_batch, batch)
+            stats.processed += len(batch)
+        if stop:
+            return
+
+async def alert_worker(alert_queue, engine, notify):
+    """Chạy rule engine cho từng mẫu (batch: từng mẫu theo thời gian của nó); notify chỉ gom, không gửi"""
+    while True:
+        item = await alert_queue.get()
+        if item is None:
+            return
+        topic, payload, recv_time, content_type = item
+        try:
+            table, record = decode(topic, payload, content_type)
+        except PayloadError:
+            continue
+        garden = garden_from_topic(topic)
+        for sample, recv_ms in sensor_samples(table, record, int(recv_time * 1000)):
+            values = sample._asdict()
+            for alert in engine.evaluate(garden, values, recv_ms / 1000):
+                stats.alerts_sent += 1
+                print(f"{'✅' if alert.kind == 'clear' else '🚨'} [{garden}] {alert.rule.id} "
+                      f"{alert.kind}: {alert.value}")
+                notify(alert, values)
+
+async def stats_reporter():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        print(stats.line())
+
+# =============================================================================
+# SERVICE
+# =============================================================================
+
+async def run_service():
+    from temperature_alert import engine, notify, start_dispatcher, start_digester, stop_dispatcher
+
+    db_queue = asyncio.Queue(DB_QUEUE_SIZE)
+    alert_queue = asyncio.Queue(ALERT_QUEUE_SIZE) if ALERTS_ENABLED else None
+    tasks = [asyncio.create_task(db_worker(db_queue), name="db_worker"),
+             asyncio.create_task(stats_reporter(), name="stats")]
+    if alert_queue is not None:
+        # Cảnh báo được gom (digest) rồi gửi trên worker của dispatcher, không chặn event loop
+        start_dispatcher()
+        start_digester()
+        # Dashboard đọc cửa sổ trượt của rule engine qua /api/window
+        history_api.window_store = engine.aggregates
+        tasks.append(asyncio.create_task(
+            alert_worker(alert_queue, engine, notify),
+            name="alerts"))
+    reader = asyncio.create_task(mqtt_reader(db_queue, alert_queue), name="mqtt_reader")
+    try:
+        # Task nào dừng (thường là do lỗi) thì dừng cả service, không treo reader
+        done, _ = await asyncio.wait([reader, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        reader.cancel()
+        # Xử lý nốt message đã nhận trước khi thoát
+        if not tasks[0].done():
+            await db_queue.put(None)
+            await tasks[0]
+        for task in tasks[1:]:
+            task.cancel()
+        if alert_queue is not None:
+            await asyncio.to_thread(stop_dispatcher)
+
+async def run_benchmark(count, gardens=100):
+    """Đẩy `count` message tổng hợp qua cùng pipeline, không cần broker"""
+    # Một payload trên 64 vượt ngưỡng để nhánh cảnh báo cũng có việc
+    payloads = [json.dumps({"temperature": 35 if i == 0 else 25 + i % 5, "humidity": 60.0, "rain_analog": 3000,
+                            "rain_digital": 1, "is_raining": False, "rssi": -60,
+                            "timestamp": i}).encode() for i in range(64)]
+    from rules import RuleEngine
+
+    sent = []
+
+    def record_alert(*args):
+        sent.append(args)
+
+    db_queue = asyncio.Queue(DB_QUEUE_SIZE)
+    alert_queue = asyncio.Queue(ALERT_QUEUE_SIZE)
+    workers = [asyncio.create_task(db_worker(db_queue)),
+               asyncio.create_task(alert_worker(alert_queue, RuleEngine(), record_alert))]
+    start = time.perf_counter()
+    # Mỗi message một ms riêng: trùng (garden, recv_ms) sẽ bị INSERT OR IGNORE bỏ qua như replay
+    base_time = time.time()
+    for i in range(count):
+        await enqueue(db_queue, alert_queue, f"bench/g{i % gardens}/sensor/state",
+                      payloads[i % len(payloads)], base_time + i / 1000)
+    await db_queue.put(None)
+    await alert_queue.put(None)
+    await asyncio.gather(*workers)
+    return time.perf_counter() - start, len(sent)
+
+def main():
+    global INSTANCES, INSTANCE_INDEX
+    args = sys.argv[1:]
+    if args[:1] == ["--instance"]:
+        INSTANCE_INDEX, INSTANCES = (int(n) for n in args[1].split("/"))
+        args = args[2:]
+    if INSTANCES > 1:
+        if mqtt_logger.DB_SHARDS % INSTANCES:
+            print(f"❌ DB_SHARDS ({mqtt_logger.DB_SHARDS}) must be a multiple of the instance count ({INSTANCES})")
+            return
+        # Cùng cơ chế sở hữu shard với mqtt_logger --workers
+        mqtt_logger.WORKERS, mqtt_logger.WORKER_INDEX = INSTANCES, INSTANCE_INDEX
+        mqtt_logger.owned_shards = worker_shards(mqtt_logger.DB_SHARDS, INSTANCES, INSTANCE_INDEX)
+        mqtt_logger.latest.snapshot_file = mqtt_logger.worker_file(mqtt_logger.LATEST_SNAPSHOT_FILE)
+    mqtt_logger.init_database()
+    mqtt_logger.writer = BatchWriter(mqtt_logger.DB_FILE, max_rows=mqtt_logger.BATCH_MAX_ROWS,
+                                     max_delay=mqtt_logger.BATCH_MAX_DELAY,
+                                     report_interval=mqtt_logger.STATS_INTERVAL,
+                                     pragmas=mqtt_logger.SQLITE_PRAGMAS, shards=mqtt_logger.DB_SHARDS)
+    mqtt_logger.writer.start()
+
+    if args and args[0] == "--bench":
+        count = int(args[1]) if len(args) > 1 else 100000
+        mqtt_logger.LOG_MESSAGES = False
+        try:
+            elapsed, alerts = asyncio.run(run_benchmark(count))
+        finally:
+            mqtt_logger.writer.close()
+        print(f"⚡ {count} messages in {elapsed:.2f}s = {count / elapsed:,.0f} msg/s "
+              f"(queue → parse → BatchWriter, {alerts} alert transitions)")
+        return
+
+    if aiomqtt is None:
+        print("❌ aiomqtt is required: pip install aiomqtt")
+        mqtt_logger.writer.close()
+        return
+
+    print("╔════════════════════════════════════════════╗")
+    print("║   Async MQTT Ingest (Logger + Alerts)      ║")
+    print("╚════════════════════════════════════════════╝")
+    print(f"📡 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT} (MQTT 5)")
+    if INSTANCES > 1:
+        print(f"🤝 Instance {INSTANCE_INDEX}/{INSTANCES}: shards {mqtt_logger.owned_shards}")
+    print(f"📬 DB queue: {DB_QUEUE_SIZE} messages, chunk {DB_CHUNK}")
+    mqtt_logger.LOG_MESSAGES = False
+    mqtt_logger.latest.load()
+    mqtt_logger.latest.start_snapshots(mqtt_logger.LATEST_SNAPSHOT_INTERVAL)
+    api_server = None
+    if mqtt_logger.HISTORY_API_PORT:
+        mqtt_logger.writer.add_flush_listener(history_api.cache.invalidate_changes)
+        history_api.latest_store = mqtt_logger.latest
+        api_server = history_api.start_server(mqtt_logger.HISTORY_API_PORT, mqtt_logger.DB_FILE,
+                                              mqtt_logger.DB_SHARDS)
+        print(f"🌐 History API: http://{history_api.HOST}:{mqtt_logger.HISTORY_API_PORT}/api/history "
+              f"(+ /api/window)")
+    try:
+        asyncio.run(run_service())
+    except KeyboardInterrupt:
+        print("\n🛑 Async ingest stopped by user")
+    finally:
+        if api_server is not None:
+            api_server.shutdown()
+        mqtt_logger.latest.stop()
+        mqtt_logger.writer.close()
+        print(stats.line())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Batch Writer - Ghi dữ liệu vào SQLite theo lô
+Giữ một kết nối lâu dài, gom các dòng từ on_message và ghi bằng executemany
+trong một transaction cho mỗi cửa sổ kích thước / thời gian.
+"""
+
+import sqlite3
+import threading
+import time
+
+import rollups
+import tscompress
+from schema import open_database, shard_file
+
+# =============================================================================
+# SQL STATEMENTS
+# =============================================================================
+
+# timestamp (TEXT, UTC) lấy từ recv_ms (?2) chứ không phải CURRENT_TIMESTAMP: dòng
+# replay / mẫu sensor/batch lùi thời gian vẫn hiện đúng giờ trong view_database.
+# OR IGNORE: (garden, recv_ms) là UNIQUE (migration 8), ghi lại cùng message
+# (replay chạy lại, capture trùng với dữ liệu đã ghi) không tạo dòng trùng
+INSERT_SQL = {
+    "sensor_data": """
+        INSERT OR IGNORE INTO sensor_data (garden, recv_ms, timestamp, device_timestamp, temperature, humidity, rain_analog, rain_digital, is_raining, rssi)
+        VALUES (?, ?, datetime(?2 / 1000, 'unixepoch'), ?, ?, ?, ?, ?, ?, ?)
+    """,
+    "device_state": """
+        INSERT OR IGNORE INTO device_state (garden, recv_ms, timestamp, device_timestamp, light, pump, pumpSpeed, rssi, last_seen_ms)
+        VALUES (?, ?, datetime(?2 / 1000, 'unixepoch'), ?, ?, ?, ?, ?, ?)
+    """,
+    "device_online": """
+        INSERT OR IGNORE INTO device_online (garden, recv_ms, timestamp, device_timestamp, online, device_id, firmware, rssi, last_seen_ms)
+        VALUES (?, ?, datetime(?2 / 1000, 'unixepoch'), ?, ?, ?, ?, ?, ?)
+    """,
+    "commands": """
+        INSERT INTO commands (garden, recv_ms, timestamp, command_type, command_value, source)
+        VALUES (?, ?, datetime(?2 / 1000, 'unixepoch'), ?, ?, ?)
+    """,
+}
+
+# Heartbeat không đổi trạng thái: chỉ kéo dài last_seen_ms của dòng đã ghi
+TOUCH_SQL = {
+    "device_state": "UPDATE device_state SET last_seen_ms = ? WHERE garden = ? AND recv_ms = ?",
+    "device_online": "UPDATE device_online SET last_seen_ms = ? WHERE garden = ? AND recv_ms = ?",
+}
+
+# =============================================================================
+# INSERT
+# =============================================================================
+
+# Lỗi chỉ do nội dung một dòng (giá trị không bind được, số quá lớn, NOT NULL...);
+# lỗi khác (khóa, đĩa) vẫn làm hỏng cả transaction của shard
+ROW_ERRORS = (sqlite3.InterfaceError, sqlite3.ProgrammingError, sqlite3.IntegrityError,
+              sqlite3.DataError, OverflowError)
+
+def _insert(conn, table, rows, failed=None):
+    """INSERT OR IGNORE các dòng; trả về các dòng thực sự được ghi.
+
+    Thường không có dòng trùng nên executemany một lần; nếu số dòng ghi được
+    ít hơn, hoặc có dòng lỗi (kiểu không bind được, vi phạm ràng buộc), thì
+    làm lại từng dòng trong savepoint: dòng đã có bị bỏ qua, dòng lỗi được
+    thêm vào `failed` thay vì làm hỏng cả lô.
+    """
+    if not rows:
+        return rows
+    sql = INSERT_SQL[table]
+    if not conn.in_transaction:
+        conn.execute("BEGIN")      # Savepoint ngoài cùng sẽ tự commit khi RELEASE
+    conn.execute("SAVEPOINT batch_insert")
+    before = conn.total_changes
+    try:
+        conn.executemany(sql, rows)
+        if conn.total_changes - before == len(rows):
+            conn.execute("RELEASE batch_insert")
+            return rows
+    except ROW_ERRORS:
+        pass
+    conn.execute("ROLLBACK TO batch_insert")
+    cursor = conn.cursor()
+    inserted = []
+    for row in rows:
+        try:
+            cursor.execute(sql, row)
+        except ROW_ERRORS as e:
+            if failed is not None:
+                failed.append((table, row, e))
+            continue
+        if cursor.rowcount > 0:
+            inserted.append(row)
+    conn.execute("RELEASE batch_insert")
+    return inserted
+
+def _uncompressed(conn, rows):
+    """Bỏ các mẫu sensor_data đã nằm trong sensor_blocks (replay lại dữ liệu đã nén)"""
+    spans = {}
+    for row in rows:
+        span = spans.get(row[0])
+        spans[row[0]] = (min(span[0], row[1]), max(span[1], row[1])) if span else (row[1], row[1])
+    compressed = set()
+    for garden, (lo, hi) in spans.items():
+        compressed.update((garden, recv[0]) for recv in
+                          tscompress.iter_rows(conn, garden, lo, hi + 1, columns=("recv_ms",)))
+    if not compressed:
+        return rows
+    return [row for row in rows if (row[0], row[1]) not in compressed]
+
+# =============================================================================
+# BATCH WRITER
+# =============================================================================
+
+class BatchWriter:
+    """Gom các dòng theo bảng và flush trong một transaction.
+
+    Một batch được ghi khi đủ `max_rows` dòng hoặc khi dòng cũ nhất đã chờ
+    quá `max_delay` giây. Kết nối SQLite chỉ được dùng trên thread flush.
+    Với `shards` > 1, mỗi shard là một file riêng và được commit riêng.
+    """
+
+    def __init__(self, db_file, max_rows=500, max_delay=0.25, max_pending=None,
+                 report_interval=60, pragmas=None, shards=1, maintain_rollups=True):
+        self.db_file = db_file
+        self.pragmas = pragmas or {}
+        self.shards = shards
+        self.maintain_rollups = maintain_rollups
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending or max_rows * 4
+        self.report_interval = report_interval
+
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._pending_count = 0
+        self._touches = {}
+        self._oldest = None
+        self._closing = False
+        self._thread = None
+        self._listeners = []
+        self._direct_conns = {}     # Kết nối của write_batch() (thread gọi)
+
+        # Counters
+        self.rows_written = 0
+        self.rows_touched = 0
+        self.rows_failed = 0
+        self.rows_duplicate = 0     # Dòng đã có (garden, recv_ms) nên bị bỏ qua
+        self.flushes = 0
+        self.total_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.last_flush_ms = 0.0
+        self._started_at = None
+        self._report_rows = 0
+        self._report_at = None
+
+    def start(self):
+        """Mở kết nối và chạy thread flush nền"""
+        self._started_at = time.monotonic()
+        self._report_at = self._started_at
+        self._thread = threading.Thread(target=self._run, name="batch_writer", daemon=True)
+        self._thread.start()
+
+    def add(self, table, row, shard=0):
+        """Đưa một dòng vào hàng đợi; chặn lại nếu hàng đợi đang đầy"""
+        if table not in INSERT_SQL:
+            raise ValueError(f"Unknown table: {table}")
+        with self._cond:
+            while self._pending_count >= self.max_pending and not self._closing:
+                self._cond.wait()
+            if self._closing:
+                raise RuntimeError("BatchWriter is closed")
+            self._pending.setdefault((shard, table), []).append(row)
+            self._pending_count += 1
+            if self._oldest is None:
+                # Dòng đầu tiên của batch: đánh thức thread để đặt hạn flush
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            elif self._pending_count >= self.max_rows:
+                self._cond.notify_all()
+
+    def add_many(self, table, rows, shard=0):
+        """Đưa nhiều dòng cùng bảng vào hàng đợi với một lần lấy lock (sensor/batch)"""
+        if table not in INSERT_SQL:
+            raise ValueError(f"Unknown table: {table}")
+        if not rows:
+            return
+        with self._cond:
+            while self._pending_count >= self.max_pending and not self._closing:
+                self._cond.wait()
+            if self._closing:
+                raise RuntimeError("BatchWriter is closed")
+            self._pending.setdefault((shard, table), []).extend(rows)
+            self._pending_count += len(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            elif self._pending_count >= self.max_rows:
+                self._cond.notify_all()
+
+    def add_flush_listener(self, listener):
+        """Gọi listener(changes) sau mỗi commit thành công, trên thread flush.
+
+        changes = {(table, garden): (min_recv_ms, max_recv_ms)} của các dòng vừa
+        ghi hoặc vừa được heartbeat (dùng để invalidate cache).
+        """
+        self._listeners.append(listener)
+
+    def touch(self, table, garden, row_recv_ms, seen_ms, shard=0):
+        """Cập nhật last_seen_ms của dòng (garden, row_recv_ms); gộp các lần gọi trong batch"""
+        if table not in TOUCH_SQL:
+            raise ValueError(f"Table has no last_seen_ms: {table}")
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("BatchWriter is closed")
+            key = (shard, table, garden, row_recv_ms)
+            if seen_ms > self._touches.get(key, 0):
+                self._touches[key] = seen_ms
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+
+    def write_batch(self, batch, touches=None, rollup_params=None):
+        """Ghi ngay một lô trên thread gọi, không qua hàng đợi (replay / backfill).
+
+        batch = {(shard, table): [row, ...]},
+        touches = {(shard, table, garden, row_recv_ms): seen_ms}.
+        Mỗi shard một transaction, rollup được cập nhật như khi flush; nếu người
+        gọi đã tự gộp (rollup_params = {shard: rollups.aggregate(...)}) thì dùng luôn
+        khi mọi dòng đều được ghi. Ghi lại cùng dữ liệu là idempotent: dòng trùng
+        (garden, recv_ms) trong sensor_data / bảng heartbeat, kể cả mẫu đã nén vào
+        sensor_blocks, bị bỏ qua và không được cộng vào rollup.
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+            self._report_at = self._started_at
+        self._write(self._direct_conns, batch, touches or {}, rollup_params, skip_compressed=True)
+
+    def close(self):
+        """Flush toàn bộ dữ liệu còn lại rồi đóng kết nối"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for conn in self._direct_conns.values():
+            conn.close()
+        self._direct_conns.clear()
+
+    def stats(self):
+        """Trả về bộ đếm hiện tại (rows/s tính từ lúc start)"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            "rows_written": self.rows_written,
+            "rows_touched": self.rows_touched,
+            "rows_failed": self.rows_failed,
+            "rows_duplicate": self.rows_duplicate,
+            "flushes": self.flushes,
+            "rows_per_sec": self.rows_written / elapsed if elapsed > 0 else 0.0,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+            "max_flush_ms": self.max_flush_ms,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    # -------------------------------------------------------------------------
+    # Flush thread
+    # -------------------------------------------------------------------------
+
+    def _take_batch(self):
+        """Chờ tới khi batch sẵn sàng, rồi lấy nó ra khỏi hàng đợi"""
+        with self._cond:
+            while True:
+                if self._pending_count >= self.max_rows or self._closing:
+                    break
+                if self._oldest is not None:
+                    remaining = self._oldest + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait(self.report_interval)
+                    if self._oldest is None and not self._closing:
+                        return {}, {}
+            batch, touches = self._pending, self._touches
+            self._pending = {}
+            self._pending_count = 0
+            self._touches = {}
+            self._oldest = None
+            self._cond.notify_all()
+            return batch, touches
+
+    def _connection(self, conns, shard):
+        conn = conns.get(shard)
+        if conn is None:
+            conn = open_database(shard_file(self.db_file, shard, self.shards), **self.pragmas)
+            conns[shard] = conn
+        return conn
+
+    def _run(self):
+        conns = {}
+        try:
+            while True:
+                batch, touches = self._take_batch()
+                if batch or touches:
+                    self._write(conns, batch, touches)
+                self._maybe_report()
+                with self._cond:
+                    if self._closing and self._oldest is None:
+                        break
+        finally:
+            for conn in conns.values():
+                conn.close()
+
+    def _write(self, conns, batch, touches, rollup_params=None, skip_compressed=False):
+        by_shard = {}
+        for (shard, table), rows in batch.items():
+            by_shard.setdefault(shard, ([], {}))[0].append((table, rows))
+        for (shard, table, garden, row_recv_ms), seen_ms in touches.items():
+            by_shard.setdefault(shard, ([], {}))[1].setdefault(table, []).append((seen_ms, garden, row_recv_ms))
+
+        count = 0
+        duplicates = 0
+        touched = 0
+        start = time.perf_counter()
+        for shard, (tables, shard_touches) in by_shard.items():
+            shard_rows = sum(len(rows) for _, rows in tables)
+            written = []
+            failed = []
+            try:
+                with self._connection(conns, shard) as conn:
+                    if skip_compressed:
+                        # Kiểm tra sensor_blocks và ghi trong cùng một transaction ghi
+                        # (Compactor không chen vào giữa)
+                        conn.execute("BEGIN IMMEDIATE")
+                    for table, rows in tables:
+                        inserted = _insert(conn, table, _uncompressed(conn, rows)
+                                           if skip_compressed and table == "sensor_data" else rows, failed)
+                        written.append((table, inserted))
+                        if table == "sensor_data" and self.maintain_rollups and inserted:
+                            # Cập nhật rollup cùng transaction với dữ liệu thô, chỉ từ dòng đã ghi
+                            if rollup_params is None or len(inserted) < len(rows):
+                                params = rollups.aggregate(inserted)
+                            else:
+                                params = rollup_params.get(shard, ())
+                            conn.executemany(rollups.UPSERT_SQL, params)
+                    # Sau INSERT: heartbeat có thể trỏ tới dòng vừa ghi trong batch này
+                    for table, params in shard_touches.items():
+                        conn.executemany(TOUCH_SQL[table], params)
+            except sqlite3.Error as e:
+                self.rows_failed += shard_rows
+                print(f"❌ Batch write failed (shard {shard}, {shard_rows} rows): {e}")
+                continue
+            if failed:
+                self.rows_failed += len(failed)
+                table, row, e = failed[0]
+                print(f"❌ {len(failed)} bad row(s) skipped (shard {shard}), first: {table} {row!r}: {e}")
+            shard_written = sum(len(rows) for _, rows in written)
+            count += shard_written
+            duplicates += shard_rows - shard_written - len(failed)
+            touched += sum(len(params) for params in shard_touches.values())
+            if self._listeners:
+                self._notify(written, shard_touches)
+        self.rows_duplicate += duplicates
+        if not count and not touched:
+            return
+
+        flush_ms = (time.perf_counter() - start) * 1000
+        self.rows_written += count
+        self.rows_touched += touched
+        self._report_rows += count
+        self.flushes += 1
+        self.total_flush_ms += flush_ms
+        self.last_flush_ms = flush_ms
+        self.max_flush_ms = max(self.max_flush_ms, flush_ms)
+
+    def _notify(self, tables, shard_touches):
+        changes = {}
+        for table, rows in tables:
+            for row in rows:
+                # Mọi bảng đều bắt đầu bằng (garden, recv_ms, ...)
+                key = (table, row[0])
+                span = changes.get(key)
+                recv_ms = row[1]
+                changes[key] = (min(span[0], recv_ms), max(span[1], recv_ms)) if span else (recv_ms, recv_ms)
+        for table, params in shard_touches.items():
+            for seen_ms, garden, row_recv_ms in params:
+                key = (table, garden)
+                span = changes.get(key)
+                changes[key] = (min(span[0], row_recv_ms), max(span[1], seen_ms)) if span else (row_recv_ms, seen_ms)
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                print(f"❌ Flush listener error: {e}")
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        elapsed = now - self._report_at
+        if elapsed < self.report_interval:
+            return
+        s = self.stats()
+        print(f"💾 Writer: {self._report_rows / elapsed:.1f} rows/s, "
+              f"flush avg {s['avg_flush_ms']:.1f} ms (max {s['max_flush_ms']:.1f} ms), "
+              f"{s['rows_written']} rows total, {s['rows_touched']} heartbeat updates, "
+              f"{s['rows_duplicate']} duplicates skipped")
+        self._report_rows = 0
+        self._report_at = now
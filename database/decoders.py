@@ -0,0 +1,339 @@
+"""
+Payload Decoders - Parse payload MQTT thành record có kiểu, theo từng topic
+Dùng orjson nếu đã cài (nhanh hơn json chuẩn vài lần), nếu không thì json.
+Decode thẳng từ bytes (không payload.decode() trung gian), kiểm tra kiểu
+từng trường theo schema của topic và trả về namedtuple gọn có thứ tự trường
+trùng với cột INSERT của batch_writer, nên dòng ghi DB chỉ là
+(recv_ms,) + record.
+
+Payload hỏng bị loại sớm và rẻ: quá dài, không bắt đầu bằng '{', JSON lỗi,
+hoặc trường sai kiểu đều ném PayloadError.
+
+Ngoài JSON, thiết bị có thể gửi MessagePack hoặc CBOR: publish lên topic
+JSON + "/msgpack" hoặc "/cbor" (MQTT 3.1.1), hoặc đặt Content-Type (MQTT 5).
+Payload nhị phân là map với cùng tên khóa, hoặc gọn nhất là mảng theo thứ tự
+trường của schema, vd [timestamp, temperature, humidity, rain_analog,
+rain_digital, is_raining, rssi] cho sensor/state.
+
+Thiết bị có thể gom nhiều mẫu cảm biến vào một message trên sensor/batch:
+danh sách mẫu ([{...}, ...] hoặc {"samples": [...]}, mỗi mẫu giống
+sensor/state), hoặc khối delta theo cột:
+
+    {"t0": 123456, "dt": 3000, "scale": {"temperature": 10, "humidity": 10},
+     "delta": {"temperature": [315, 1, -2], "humidity": [802, 0, 5], ...}}
+
+mỗi cột là giá trị đầu rồi các chênh lệch (số nguyên sau khi nhân scale);
+timestamp của mẫu i là t0 + i * dt nếu không có cột "timestamp".
+"""
+
+import json
+import operator
+from itertools import accumulate
+from collections import namedtuple
+
+from schema import split_encoding
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+MAX_PAYLOAD_BYTES = 4096    # Payload của firmware < 300 byte; lớn hơn coi như rác
+TOPIC_CACHE_SIZE = 50000    # Số topic nhớ sẵn bảng/decoder (≈ 4 topic mỗi thiết bị)
+MAX_BATCH_PAYLOAD_BYTES = 65536
+MAX_BATCH_SAMPLES = 500
+BATCH_INTERVAL_MS = 3000    # Khoảng cách mẫu khi batch không có timestamp (SENSOR_PUBLISH_INTERVAL)
+
+NUMBER = (int, float)
+TEXT = (str,)
+FLAG = (bool, int)          # Firmware cũ gửi 0/1 thay cho true/false
+COMMAND_VALUE = (str, int, float)
+
+# Content-Type (MQTT 5) -> encoding
+CONTENT_TYPES = {
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/cbor": "cbor",
+}
+
+# =============================================================================
+# RECORDS
+# =============================================================================
+
+SensorRecord = namedtuple("SensorRecord", "device_timestamp temperature humidity rain_analog rain_digital is_raining rssi")
+StateRecord = namedtuple("StateRecord", "device_timestamp light pump pump_speed rssi")
+OnlineRecord = namedtuple("OnlineRecord", "device_timestamp online device_id firmware rssi")
+CommandRecord = namedtuple("CommandRecord", "command_type command_value")
+
+# Schema theo hậu tố topic: (bảng, record, [(khóa JSON, kiểu cho phép), ...])
+SCHEMAS = {
+    "sensor/state": ("sensor_data", SensorRecord, [
+        ("timestamp", NUMBER), ("temperature", NUMBER), ("humidity", NUMBER),
+        ("rain_analog", NUMBER), ("rain_digital", NUMBER), ("is_raining", FLAG), ("rssi", NUMBER)]),
+    "device/state": ("device_state", StateRecord, [
+        ("timestamp", NUMBER), ("light", TEXT), ("pump", TEXT), ("pumpSpeed", NUMBER), ("rssi", NUMBER)]),
+    "sys/online": ("device_online", OnlineRecord, [
+        ("timestamp", NUMBER), ("online", FLAG), ("deviceId", TEXT), ("firmware", TEXT), ("rssi", NUMBER)]),
+}
+COMMAND_TOPIC = "device/cmd"
+BATCH_TOPIC = "sensor/batch"
+BATCH_TABLE = "sensor_batch"    # Bung ra nhiều dòng sensor_data
+
+class PayloadError(ValueError):
+    """Payload không hợp lệ với schema của topic"""
+
+# =============================================================================
+# JSON / BINARY
+# =============================================================================
+
+def loads_json(payload):
+    # Tự decode UTF-8 rẻ hơn để json.loads đoán encoding của bytes
+    return json.loads(payload.decode() if isinstance(payload, (bytes, bytearray)) else payload)
+
+if orjson is not None:
+    JSON_LIBRARY = "orjson"
+    loads = orjson.loads
+else:
+    JSON_LIBRARY = "json"
+    loads = loads_json
+
+def _loads_msgpack(payload):
+    if msgpack is None:
+        raise PayloadError("msgpack payload but msgpack is not installed (pip install msgpack)")
+    try:
+        return msgpack.unpackb(payload)
+    except Exception as e:  # ExtraData, FormatError, StackError... không cùng gốc
+        raise PayloadError(f"invalid msgpack: {e}") from None
+
+def _loads_cbor(payload):
+    if cbor2 is None:
+        raise PayloadError("cbor payload but cbor2 is not installed (pip install cbor2)")
+    try:
+        return cbor2.loads(payload)
+    except Exception as e:
+        raise PayloadError(f"invalid cbor: {e}") from None
+
+_BINARY_LOADS = {"msgpack": _loads_msgpack, "cbor": _loads_cbor}
+
+# =============================================================================
+# DECODING
+# =============================================================================
+
+def topic_kind(topic):
+    """'demo/garden/sensor/state' -> 'sensor/state'"""
+    return topic[topic.rfind("/", 0, topic.rfind("/")) + 1:]
+
+def parse_object(payload, encoding="json", max_bytes=MAX_PAYLOAD_BYTES, arrays=False):
+    """bytes -> dict (hoặc list với payload nhị phân dạng mảng), loại payload rác trước khi tốn công parse.
+
+    `arrays`: chấp nhận cả JSON array ở gốc (sensor/batch).
+    """
+    if len(payload) > max_bytes:
+        raise PayloadError(f"payload too large ({len(payload)} bytes)")
+    if encoding != "json":
+        data = _BINARY_LOADS[encoding](payload)
+        if not isinstance(data, (dict, list)):
+            raise PayloadError(f"{encoding} payload is not a map or array")
+        return data
+    if payload[:1] not in (b"{", "{") and payload.lstrip()[:1] not in (b"{", "{"):
+        if not arrays or payload.lstrip()[:1] not in (b"[", "["):
+            raise PayloadError("payload is not a JSON object")
+    try:
+        data = loads(payload)
+    except ValueError as e:     # gồm cả orjson.JSONDecodeError
+        raise PayloadError(f"invalid JSON: {e}") from None
+    if not isinstance(data, dict) and not (arrays and isinstance(data, list)):
+        raise PayloadError("payload is not a JSON object")
+    return data
+
+def _check_types(keys, values, types):
+    for key, value, allowed in zip(keys, values, types):
+        if value is not None and not isinstance(value, allowed):
+            raise PayloadError(f"{key} must be {'/'.join(t.__name__ for t in allowed)}, "
+                               f"got {type(value).__name__}")
+
+def _make_decoder(record, fields):
+    keys = tuple(key for key, _ in fields)
+    types = tuple(allowed for _, allowed in fields)
+    width = len(keys)
+    get_all = operator.itemgetter(*keys)
+    new = tuple.__new__
+    # Chữ ký kiểu (type của từng trường) đã kiểm tra: một thiết bị gần như luôn
+    # gửi cùng một chữ ký, nên mỗi message chỉ tốn một lần tra set
+    valid = set()
+
+    def decode(data):
+        if data.__class__ is list:
+            # Dạng mảng gọn: trường theo thứ tự schema, thiếu ở cuối = None
+            if len(data) > width:
+                raise PayloadError(f"array has {len(data)} fields, schema has {width}")
+            values = tuple(data) + (None,) * (width - len(data))
+        else:
+            try:
+                values = get_all(data)
+            except KeyError:
+                values = tuple(map(data.get, keys))    # Thiếu trường -> None
+        signature = tuple(map(type, values))
+        if signature not in valid:
+            _check_types(keys, values, types)
+            valid.add(signature)
+        return new(record, values)
+    return decode
+
+_DECODERS = {kind: (table, _make_decoder(record, fields))
+             for kind, (table, record, fields) in SCHEMAS.items()}
+
+_SENSOR_KEYS = tuple(key for key, _ in SCHEMAS["sensor/state"][2])
+_decode_sample = _DECODERS["sensor/state"][1]
+
+def _delta_samples(data):
+    """Khối delta theo cột -> danh sách mẫu dạng mảng (thứ tự trường của sensor/state)"""
+    columns = data["delta"]
+    scales = data.get("scale") or {}
+    if not isinstance(columns, dict) or not isinstance(scales, dict):
+        raise PayloadError("delta and scale must be maps")
+    count = None
+    values = []
+    for key in _SENSOR_KEYS:
+        column = columns.get(key)
+        if column is None:
+            values.append(None)
+            continue
+        if not isinstance(column, list) or not all(isinstance(v, NUMBER) for v in column):
+            raise PayloadError(f"delta column {key} must be a list of numbers")
+        if count is None:
+            count = len(column)
+        elif len(column) != count:
+            raise PayloadError(f"delta column {key} has {len(column)} values, expected {count}")
+        scale = scales.get(key, 1)
+        if not isinstance(scale, NUMBER) or not scale:
+            raise PayloadError(f"scale of {key} must be a non-zero number")
+        total = accumulate(column)
+        values.append(list(total) if scale == 1 else [v / scale for v in total])
+    if count is None:
+        raise PayloadError("delta block has no sensor columns")
+    if values[0] is None:
+        t0 = data.get("t0")
+        dt = data.get("dt", BATCH_INTERVAL_MS)
+        if not isinstance(t0, NUMBER) or not isinstance(dt, NUMBER):
+            raise PayloadError("delta block needs t0/dt or a timestamp column")
+        values[0] = [t0 + i * dt for i in range(count)]
+    none = [None] * count
+    return list(zip(*(column if column is not None else none for column in values)))
+
+def decode_sensor_batch(data):
+    """sensor/batch -> tuple các SensorRecord theo thứ tự thời gian"""
+    if isinstance(data, dict):
+        if "delta" in data:
+            samples = _delta_samples(data)
+        else:
+            samples = data.get("samples")
+    else:
+        samples = data
+    if not isinstance(samples, list) or not samples:
+        raise PayloadError("batch must contain a non-empty list of samples")
+    if len(samples) > MAX_BATCH_SAMPLES:
+        raise PayloadError(f"batch has {len(samples)} samples (max {MAX_BATCH_SAMPLES})")
+    decoded = []
+    for sample in samples:
+        if not isinstance(sample, (dict, list, tuple)):
+            raise PayloadError("batch sample must be a map or array")
+        decoded.append(_decode_sample(list(sample) if sample.__class__ is tuple else sample))
+    return tuple(decoded)
+
+def sample_recv_ms(records, recv_ms, interval_ms=BATCH_INTERVAL_MS):
+    """recv_ms lùi lại cho từng mẫu của batch: mẫu cuối = recv_ms, mẫu trước cách
+    theo chênh lệch device_timestamp (hoặc interval_ms nếu thiếu timestamp).
+
+    Kết quả tăng ngặt: mẫu trùng timestamp hoặc sai thứ tự được lùi thêm 1 ms
+    so với mẫu sau nó, vì (garden, recv_ms) là UNIQUE và dòng trùng bị bỏ qua.
+    """
+    last = records[-1].device_timestamp
+    count = len(records)
+    times = [0] * count
+    following = recv_ms + 1
+    for i in range(count - 1, -1, -1):
+        ts = records[i].device_timestamp
+        if ts is None or last is None or ts > last:
+            candidate = recv_ms - (count - 1 - i) * interval_ms
+        else:
+            candidate = recv_ms - int(last - ts)
+        following = times[i] = min(candidate, following - 1)
+    return times
+
+def sensor_samples(table, record, recv_ms):
+    """(SensorRecord, recv_ms) của từng mẫu cảm biến trong message đã decode:
+    sensor/state -> một mẫu, sensor/batch -> mọi mẫu theo thời gian của nó,
+    bảng khác -> không có"""
+    if table == BATCH_TABLE:
+        return list(zip(record, sample_recv_ms(record, recv_ms)))
+    if table == "sensor_data":
+        return [(record, recv_ms)]
+    return []
+
+def decode_command(data):
+    """Lệnh điều khiển: một trong light / pump / pumpSpeed; giá trị phải là chuỗi hoặc số"""
+    if not isinstance(data, dict):
+        raise PayloadError("command payload must be a map")
+    for key in ('light', 'pump', 'pumpSpeed'):
+        if key in data:
+            value = data[key]
+            if not isinstance(value, COMMAND_VALUE):
+                raise PayloadError(f"{key} must be str/int/float, got {type(value).__name__}")
+            return CommandRecord(key, str(value) if key == 'pumpSpeed' else value)
+    try:
+        return CommandRecord('unknown', json.dumps(data))
+    except (TypeError, ValueError) as e:    # bytes / khóa lạ từ msgpack, cbor
+        raise PayloadError(f"command payload is not JSON-serializable: {e}") from None
+
+_topic_decoders = {}
+
+def _topic_decoder(topic):
+    """(bảng, hàm decode, encoding) theo topic, False nếu topic không được lưu (có cache)"""
+    entry = _topic_decoders.get(topic)
+    if entry is None:
+        base, encoding = split_encoding(topic)
+        kind = topic_kind(base)
+        table_decoder = (_DECODERS.get(kind) or (kind == COMMAND_TOPIC and ("commands", decode_command))
+                         or (kind == BATCH_TOPIC and (BATCH_TABLE, decode_sensor_batch)))
+        entry = table_decoder and table_decoder + (encoding,)
+        if len(_topic_decoders) >= TOPIC_CACHE_SIZE:
+            _topic_decoders.clear()
+        _topic_decoders[topic] = entry
+    return entry
+
+def decode(topic, payload, content_type=None):
+    """(bảng, record) của message, hoặc None nếu topic không được lưu.
+
+    Với sensor/batch, bảng là BATCH_TABLE và record là tuple các SensorRecord.
+
+    Encoding lấy từ `content_type` (MQTT 5) nếu có, nếu không thì từ hậu tố
+    topic. Ném PayloadError nếu payload hỏng hoặc sai kiểu.
+    """
+    entry = _topic_decoder(topic)
+    if not entry:
+        return None
+    table, decoder, encoding = entry
+    if content_type:
+        encoding = CONTENT_TYPES.get(content_type.split(";", 1)[0].strip().lower())
+        if encoding is None:
+            raise PayloadError(f"unsupported content type: {content_type}")
+    if table == BATCH_TABLE:
+        return table, decoder(parse_object(payload, encoding, MAX_BATCH_PAYLOAD_BYTES, arrays=True))
+    return table, decoder(parse_object(payload, encoding))
@@ -0,0 +1,472 @@
+"""
+History API - HTTP đọc lịch sử cảm biến cho Web Dashboard / App Flutter
+Client kết nối lại có thể tải biểu đồ ngay thay vì chờ message MQTT mới.
+
+    GET /api/gardens
+    GET /api/latest?garden=demo/garden           # dòng mới nhất của sensor/state/online
+    GET /api/stats?garden=demo/garden&hours=24   # thống kê cửa sổ từ rollup 1m
+    GET /api/cache                               # hit/miss của query cache
+    GET /api/fleet?since=<version>               # trạng thái mới nhất mọi thiết bị (từ RAM)
+    GET /api/window?garden=demo/garden           # mean/min/max/EWMA/percentile cửa sổ trượt (từ RAM)
+    GET /api/window?field=temperature&stat=p90   # một thống kê cửa sổ của mọi garden
+    GET /api/history?garden=demo/garden&metric=temperature,humidity
+                    &from=<ms|ISO|24h|7d>&to=<ms|ISO>&resolution=auto|raw|1m|1h|1d
+                    &format=json|bin
+
+resolution=auto chọn độ phân giải mịn nhất mà không vượt MAX_POINTS điểm:
+dữ liệu thô cho khoảng ngắn, bảng rollup cho khoảng dài (7 ngày -> 168
+bucket 1h). Có ETag/If-None-Match (304) và gzip khi client hỗ trợ.
+
+Kết quả được giữ trong QueryCache. Chạy riêng thì cache chỉ hết hạn theo
+CACHE_TTL; chạy bên trong mqtt_logger (HISTORY_API_PORT) thì BatchWriter
+invalidate đúng các entry bị ảnh hưởng ngay sau mỗi commit.
+
+Chạy: python history_api.py [port]
+"""
+
+import array
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import archive
+import rollups
+import tscompress
+from latest_state import FLEET_COLUMNS
+from query_cache import QueryCache
+from schema import open_database, shard_index, shard_file, shard_files
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+HOST = "0.0.0.0"
+PORT = 8090
+DB_FILE = "iot_garden_data.db"
+DB_SHARDS = 1                   # Phải khớp với DB_SHARDS trong mqtt_logger.py
+
+SAMPLE_INTERVAL_MS = 3000       # Chu kỳ gửi cảm biến của firmware, để ước lượng số điểm thô
+MAX_POINTS = 2000               # resolution=auto: không trả quá số điểm này
+RAW_LIMIT = 20000               # resolution=raw: cắt bớt nếu khoảng quá dài
+GZIP_MIN_BYTES = 1024           # Không nén body nhỏ hơn
+ALLOW_ORIGIN = "*"              # CORS cho web dashboard chạy ở cổng khác
+CACHE_ENTRIES = 2048            # Số kết quả tối đa trong query cache
+CACHE_TTL = 30                  # Giây; giới hạn độ cũ khi không có invalidation
+
+cache = QueryCache(CACHE_ENTRIES, CACHE_TTL)
+
+# latest_state.LatestState do mqtt_logger gắn vào; None khi chạy riêng
+latest_store = None
+# alerts/streaming.StreamAggregates của rule engine, do async_ingest gắn vào
+window_store = None
+
+# metric -> (cột thô trong sensor_data, tiền tố cột trong sensor_rollup)
+METRICS = {
+    "temperature": ("temperature", "temp"),
+    "humidity": ("humidity", "hum"),
+    "rssi": ("rssi", "rssi"),
+    "rain": ("is_raining", None),
+}
+
+# =============================================================================
+# QUERIES
+# =============================================================================
+
+_local = threading.local()
+
+def connection_for_file(db_file):
+    """Kết nối (mỗi thread một kết nối cho mỗi shard), không đổi journal_mode"""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_file)
+    if conn is None:
+        conn = conns[db_file] = open_database(db_file, journal_mode=None)
+    return conn
+
+def connection(garden):
+    """Kết nối tới shard chứa garden, kèm tên file của shard"""
+    db_file = shard_file(DB_FILE, shard_index(garden, DB_SHARDS), DB_SHARDS)
+    return connection_for_file(db_file), db_file
+
+def pick_resolution(from_ms, to_ms):
+    """Độ phân giải mịn nhất cho tối đa MAX_POINTS điểm"""
+    span = max(to_ms - from_ms, 1)
+    if span / SAMPLE_INTERVAL_MS <= MAX_POINTS:
+        return "raw"
+    for name, bucket in sorted(rollups.RESOLUTIONS.items(), key=lambda item: item[1]):
+        if span / bucket <= MAX_POINTS:
+            return name
+    return "1d"
+
+def query_raw(garden, metrics, from_ms, to_ms):
+    """Các cột: t, rồi một cột cho mỗi metric; kèm cờ bị cắt do RAW_LIMIT"""
+    conn, db_file = connection(garden)
+    columns = ["recv_ms"] + [METRICS[m][0] for m in metrics]
+    # Ngày đã archive (Parquet/Arrow) đứng trước dữ liệu còn trong SQLite
+    # rồi tới block nén (tscompress), cuối cùng là dòng thô
+    rows = list(itertools.islice(itertools.chain(archive.iter_rows(conn, db_file, garden, from_ms, to_ms, columns),
+                                                 tscompress.iter_rows(conn, garden, from_ms, to_ms, columns)),
+                                 RAW_LIMIT + 1))
+    rows += conn.execute(f"""
+        SELECT {', '.join(columns)} FROM sensor_data
+        WHERE garden = ? AND recv_ms >= ? AND recv_ms < ?
+        ORDER BY recv_ms
+        LIMIT ?
+    """, (garden, from_ms, to_ms, max(RAW_LIMIT - len(rows) + 1, 0))).fetchall()
+    truncated = len(rows) > RAW_LIMIT
+    rows = rows[:RAW_LIMIT]
+    names = ["t"] + metrics
+    return names, [list(column) for column in zip(*rows)] or [[] for _ in names], truncated
+
+def query_rollup(garden, metrics, from_ms, to_ms, resolution):
+    """Các cột: t, rồi <metric>.avg/.min/.max (rain: tỉ lệ mẫu có mưa)"""
+    conn, _ = connection(garden)
+    bucket = rollups.RESOLUTIONS[resolution]
+    names = ["t"]
+    select = ["bucket_ms"]
+    for metric in metrics:
+        prefix = METRICS[metric][1]
+        if prefix is None:
+            names.append(f"{metric}.ratio")
+            select.append("rain_count * 1.0 / samples")
+        else:
+            names += [f"{metric}.avg", f"{metric}.min", f"{metric}.max"]
+            select += [f"{prefix}_sum / NULLIF({prefix}_count, 0)", f"{prefix}_min", f"{prefix}_max"]
+    rows = conn.execute(f"""
+        SELECT {', '.join(select)} FROM sensor_rollup
+        WHERE resolution = ? AND garden = ? AND bucket_ms >= ? AND bucket_ms < ?
+        ORDER BY bucket_ms
+    """, (bucket, garden, from_ms - from_ms % bucket, to_ms)).fetchall()
+    return names, [list(column) for column in zip(*rows)] or [[] for _ in names], False
+
+LATEST_COLUMNS = {
+    "sensor_data": ("recv_ms", "temperature", "humidity", "rain_analog", "is_raining", "rssi"),
+    "device_state": ("recv_ms", "light", "pump", "pumpSpeed", "rssi", "last_seen_ms"),
+    "device_online": ("recv_ms", "online", "device_id", "firmware", "rssi", "last_seen_ms"),
+}
+
+def query_latest(garden):
+    """Dòng mới nhất của mỗi bảng trạng thái cho garden (dùng index (garden, recv_ms))"""
+    conn, _ = connection(garden)
+    latest = {"garden": garden}
+    for table, columns in LATEST_COLUMNS.items():
+        row = conn.execute(f"""
+            SELECT {', '.join(columns)} FROM {table}
+            WHERE garden = ?
+            ORDER BY recv_ms DESC
+            LIMIT 1
+        """, (garden,)).fetchone()
+        latest[table] = dict(zip(columns, row)) if row else None
+    return latest
+
+def query_stats(garden, from_ms):
+    """Thống kê từ from_ms tới nay trên rollup 1m; garden=None gộp mọi shard"""
+    minute = rollups.RESOLUTIONS["1m"]
+    sql = """
+        SELECT SUM(samples), SUM(temp_sum), SUM(temp_count), MIN(temp_min), MAX(temp_max),
+               SUM(hum_sum), SUM(hum_count), SUM(rain_count)
+        FROM sensor_rollup
+        WHERE resolution = ? AND bucket_ms >= ?
+    """
+    params = (minute, from_ms - from_ms % minute)
+    if garden:
+        conn, _ = connection(garden)
+        parts = [conn.execute(sql + " AND garden = ?", params + (garden,)).fetchone()]
+    else:
+        parts = [connection_for_file(db_file).execute(sql, params).fetchone()
+                 for db_file in shard_files(DB_FILE, DB_SHARDS)]
+    parts = [part for part in parts if part[0]]
+    samples = sum(part[0] for part in parts)
+    temp_count = sum(part[2] for part in parts)
+    hum_count = sum(part[6] for part in parts)
+    return {
+        "garden": garden,
+        "samples": samples,
+        "avg_temperature": sum(part[1] for part in parts) / temp_count if temp_count else None,
+        "min_temperature": min((part[3] for part in parts if part[3] is not None), default=None),
+        "max_temperature": max((part[4] for part in parts if part[4] is not None), default=None),
+        "avg_humidity": sum(part[5] for part in parts) / hum_count if hum_count else None,
+        "rain_samples": sum(part[7] for part in parts),
+    }
+
+def list_gardens():
+    gardens = []
+    for db_file in shard_files(DB_FILE, DB_SHARDS):
+        conn = open_database(db_file, journal_mode=None)
+        try:
+            gardens += conn.execute("""
+                SELECT garden, MAX(recv_ms) FROM sensor_data
+                WHERE garden IS NOT NULL GROUP BY garden
+            """).fetchall()
+        finally:
+            conn.close()
+    return [{"garden": garden, "last_ms": last_ms} for garden, last_ms in sorted(gardens)]
+
+# =============================================================================
+# ENCODING
+# =============================================================================
+
+def parse_ms(value, now_ms):
+    """epoch ms, '24h' / '7d' / '30m' (tính lùi từ now) hoặc ISO (UTC)"""
+    if value.isdigit():
+        return int(value)
+    units = {"m": 60000, "h": 3600000, "d": 86400000}
+    if value[-1:] in units and value[:-1].replace(".", "", 1).isdigit():
+        return now_ms - int(float(value[:-1]) * units[value[-1]])
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def json_response(value):
+    return json.dumps(value, separators=(",", ":")).encode(), "application/json", {}
+
+def encode_json(meta, names, columns):
+    """JSON gọn: mảng theo cột, float làm tròn 2 chữ số"""
+    body = dict(meta)
+    body["columns"] = {
+        name: [round(v, 2) if isinstance(v, float) else v for v in column]
+        for name, column in zip(names, columns)
+    }
+    return json.dumps(body, separators=(",", ":")).encode(), "application/json"
+
+def encode_binary(names, columns):
+    """uint32 số điểm, int64[] t, rồi float32[] mỗi cột còn lại (NaN = thiếu), little-endian.
+
+    Thứ tự cột nằm trong header X-Columns; đọc trực tiếp bằng DataView /
+    Float32Array hoặc ByteData trên Flutter.
+    """
+    count = len(columns[0]) if columns else 0
+    parts = [array.array("I", [count]), array.array("q", columns[0])]
+    for column in columns[1:]:
+        parts.append(array.array("f", [math.nan if v is None else v for v in column]))
+    if sys.byteorder == "big":
+        for part in parts:
+            part.byteswap()
+    return b"".join(part.tobytes() for part in parts), "application/octet-stream"
+
+# =============================================================================
+# HTTP
+# =============================================================================
+
+class HistoryHandler(BaseHTTPRequestHandler):
+    server_version = "GardenHistory/1.0"
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == "/api/history":
+                body, content_type, headers = self.history(params)
+            elif url.path == "/api/latest":
+                body, content_type, headers = self.latest(params)
+            elif url.path == "/api/stats":
+                body, content_type, headers = self.stats(params)
+            elif url.path == "/api/fleet":
+                body, content_type, headers = self.fleet(params)
+            elif url.path == "/api/window":
+                body, content_type, headers = self.window(params)
+            elif url.path == "/api/gardens":
+                body, content_type, headers = json_response(list_gardens())
+            elif url.path == "/api/cache":
+                body, content_type, headers = json_response(cache.stats())
+            else:
+                return self.send_error_json(404, "not found")
+        except (KeyError, ValueError) as e:
+            return self.send_error_json(400, str(e))
+        except LookupError as e:
+            return self.send_error_json(503, str(e))
+        except Exception as e:
+            print(f"❌ {self.path}: {e}")
+            return self.send_error_json(500, "internal error")
+        headers["Server-Timing"] = f"app;dur={(time.perf_counter() - start) * 1000:.1f}"
+        self.send_body(body, content_type, headers)
+
+    def latest(self, params):
+        garden = params.get("garden") or params.get("device")
+        if not garden:
+            raise ValueError("garden is required")
+        if latest_store is not None:
+            device = latest_store.get(garden)
+            if device is not None:
+                body, content_type, headers = json_response(device)
+                return body, content_type, {"Cache-Control": "no-cache"}
+        body, content_type, headers = cache.cached(
+            ("latest", garden), lambda: json_response(query_latest(garden)),
+            tables=LATEST_COLUMNS, garden=garden)
+        return body, content_type, dict(headers, **{"Cache-Control": "no-cache"})
+
+    def fleet(self, params):
+        """Toàn bộ thiết bị, hoặc chỉ các thiết bị đổi sau version `since`"""
+        if latest_store is None:
+            raise LookupError("latest-state store runs inside mqtt_logger (set HISTORY_API_PORT)")
+        version, rows = latest_store.fleet(int(params.get("since", "0")))
+        body, content_type, headers = json_response(
+            {"version": version, "summary": latest_store.summary(),
+             "columns": FLEET_COLUMNS, "devices": rows})
+        return body, content_type, {"Cache-Control": "no-cache"}
+
+    def window(self, params):
+        """Thống kê cửa sổ trượt của luồng cảnh báo: một garden, hoặc một thống kê của mọi garden"""
+        if window_store is None:
+            raise LookupError("window aggregates run inside async_ingest (set HISTORY_API_PORT)")
+        garden = params.get("garden") or params.get("device")
+        if garden:
+            value = {"garden": garden, "window_s": window_store.window, "fields": window_store.snapshot(garden)}
+        else:
+            field = params.get("field", "temperature")
+            stat = params.get("stat", "mean")
+            value = {"field": field, "stat": stat, "window_s": window_store.window,
+                     "devices": window_store.fleet(field, stat)}
+        body, content_type, headers = json_response(value)
+        return body, content_type, {"Cache-Control": "no-cache"}
+
+    def stats(self, params):
+        now_ms = int(time.time() * 1000)
+        garden = params.get("garden") or params.get("device")
+        hours = float(params.get("hours", "24"))
+        from_ms = now_ms - int(hours * 3600 * 1000)
+        # Khóa theo số giờ (không theo from_ms) để các lần gọi liên tiếp dùng chung entry
+        body, content_type, headers = cache.cached(
+            ("stats", garden, hours), lambda: json_response(query_stats(garden, from_ms)),
+            tables=("sensor_data",), garden=garden,
+            from_ms=from_ms - from_ms % rollups.RESOLUTIONS["1m"])
+        return body, content_type, dict(headers, **{"Cache-Control": "no-cache"})
+
+    def history(self, params):
+        now_ms = int(time.time() * 1000)
+        garden = params.get("garden") or params.get("device")
+        if not garden:
+            raise ValueError("garden is required")
+        metrics = params.get("metric", "temperature").split(",")
+        for metric in metrics:
+            if metric not in METRICS:
+                raise ValueError(f"unknown metric: {metric}")
+        to_ms = parse_ms(params["to"], now_ms) if "to" in params else now_ms
+        from_ms = parse_ms(params.get("from", "24h"), now_ms)
+        if from_ms >= to_ms:
+            raise ValueError("from must be before to")
+
+        key = ("history", garden, tuple(metrics), params.get("from", "24h"), params.get("to"),
+               params.get("resolution", "auto"), params.get("format"))
+        body, content_type, headers = cache.cached(
+            key, lambda: self.load_history(params, garden, metrics, from_ms, to_ms),
+            # Bucket rollup đầu tiên có thể bắt đầu trước from_ms (tối đa một ngày)
+            tables=("sensor_data",), garden=garden,
+            from_ms=from_ms - from_ms % rollups.RESOLUTIONS["1d"],
+            to_ms=to_ms if "to" in params else None)
+        headers = dict(headers)
+        # Khoảng đã kết thúc hơn một ngày trước không còn thay đổi
+        if to_ms < now_ms - rollups.RESOLUTIONS["1d"]:
+            headers["Cache-Control"] = "public, max-age=86400"
+        else:
+            headers["Cache-Control"] = "no-cache"
+        return body, content_type, headers
+
+    def load_history(self, params, garden, metrics, from_ms, to_ms):
+        resolution = params.get("resolution", "auto")
+        if resolution == "auto":
+            resolution = pick_resolution(from_ms, to_ms)
+        if resolution == "raw":
+            names, columns, truncated = query_raw(garden, metrics, from_ms, to_ms)
+        elif resolution in rollups.RESOLUTIONS:
+            names, columns, truncated = query_rollup(garden, metrics, from_ms, to_ms, resolution)
+        else:
+            raise ValueError(f"unknown resolution: {resolution}")
+
+        headers = {"X-Resolution": resolution, "X-Columns": ",".join(names)}
+        if truncated:
+            headers["X-Truncated"] = "1"
+        if params.get("format") == "bin":
+            body, content_type = encode_binary(names, columns)
+        else:
+            # Không kèm from/to: "from=24h" đổi mỗi lần gọi nhưng dữ liệu thì không,
+            # body giống nhau -> ETag giống nhau -> 304
+            meta = {"garden": garden, "resolution": resolution, "truncated": truncated}
+            body, content_type = encode_json(meta, names, columns)
+        return body, content_type, headers
+
+    def send_body(self, body, content_type, headers):
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_common_headers(headers)
+            self.end_headers()
+            return
+        encoding = None
+        if len(body) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            encoding = "gzip"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_common_headers(headers)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_common_headers(self, headers):
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
+        self.send_header("Access-Control-Expose-Headers", "ETag, X-Resolution, X-Columns, X-Truncated")
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+    def send_error_json(self, status, message):
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", ALLOW_ORIGIN)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Gọn hơn log mặc định của http.server
+        print(f"🌐 {self.address_string()} {format % args}")
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def start_server(port=PORT, db_file=None, shards=None):
+    """Chạy API trên thread nền (dùng bên trong mqtt_logger); trả về server"""
+    global DB_FILE, DB_SHARDS
+    DB_FILE = db_file or DB_FILE
+    DB_SHARDS = shards or DB_SHARDS
+    server = ThreadingHTTPServer((HOST, port), HistoryHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="history_api", daemon=True).start()
+    return server
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    server = ThreadingHTTPServer((HOST, port), HistoryHandler)
+    server.daemon_threads = True
+    print("╔════════════════════════════════════════════╗")
+    print("║        Garden History API (HTTP)           ║")
+    print("╚════════════════════════════════════════════╝")
+    print(f"💾 Database: {DB_FILE} ({DB_SHARDS} shard{'s' if DB_SHARDS > 1 else ''})")
+    print(f"🌐 Listening on http://{HOST}:{port}/api/history")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 History API stopped by user")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
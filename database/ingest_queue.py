@@ -0,0 +1,259 @@
+"""
+Ingest Queue - Hàng đợi giới hạn giữa MQTT và database
+on_message chỉ đưa (topic, payload, recv_time) vào hàng đợi; một thread riêng
+lấy ra để parse và ghi. Khi hàng đợi đầy, áp dụng chính sách backpressure:
+  block        - chặn thread mạng của paho cho tới khi có chỗ trống
+  drop_oldest  - bỏ message cũ nhất để nhận message mới
+  spill        - ghi tạm message ra file, đọc lại khi hàng đợi rảnh
+
+Với spill, vị trí đã đọc lại trong file được lưu ở <spill_file>.offset sau mỗi
+lần đọc, nên khởi động lại chỉ nhận các message chưa được đọc ra (message đã
+nằm trong bộ nhớ lúc dừng đột ngột thì mất, như hàng đợi thường) thay vì
+ghi lại cả file (bảng commands không có khóa UNIQUE nên sẽ bị trùng).
+"""
+
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+POLICIES = ("block", "drop_oldest", "spill")
+
+# Spill record: recv_time (double), topic length, payload length, rồi dữ liệu.
+# Cùng định dạng với file capture của mqtt_logger (CAPTURE_FILE) mà replay.py đọc
+_SPILL_HEADER = struct.Struct("<dII")
+
+def write_record(f, topic, payload, recv_time):
+    """Ghi một message ở định dạng spill/capture"""
+    topic_bytes = topic.encode()
+    f.write(_SPILL_HEADER.pack(recv_time, len(topic_bytes), len(payload)))
+    f.write(topic_bytes)
+    f.write(payload)
+
+def read_records(f):
+    """Generator (topic, payload, recv_time); dừng ở bản ghi dở dang cuối file"""
+    while True:
+        header = f.read(_SPILL_HEADER.size)
+        if len(header) < _SPILL_HEADER.size:
+            return
+        recv_time, topic_len, payload_len = _SPILL_HEADER.unpack(header)
+        body = f.read(topic_len + payload_len)
+        if len(body) < topic_len + payload_len:
+            return
+        yield body[:topic_len].decode(), body[topic_len:], recv_time
+
+# =============================================================================
+# INGEST QUEUE
+# =============================================================================
+
+class IngestQueue:
+    """Hàng đợi FIFO giới hạn, an toàn giữa nhiều thread"""
+
+    def __init__(self, maxsize=10000, policy="block", spill_file="ingest_spill.bin"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy} (use one of {POLICIES})")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_file = spill_file
+        self.offset_file = spill_file + ".offset"
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Spill state: file được đọc lại tuần tự để giữ thứ tự FIFO
+        self._spill_out = None
+        self._spill_in = None
+        self._spill_pending = 0
+        self._spill_offset = 0          # Đầu bản ghi chưa đọc đầu tiên trong file spill
+
+        # Counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked = 0
+        self.max_depth = 0
+
+        if policy == "spill":
+            self._recover_spill()
+
+    def put(self, topic, payload, recv_time=None):
+        """Đưa một message vào hàng đợi. Trả về False nếu message bị bỏ."""
+        item = (topic, payload, recv_time if recv_time is not None else time.time())
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return False
+
+            # Khi đã có dữ liệu trên đĩa, message mới phải xếp sau nó
+            if self._spill_pending or (self.policy == "spill" and len(self._items) >= self.maxsize):
+                self._spill(item)
+                self._cond.notify()
+                return True
+
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    self.blocked += 1
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        self.dropped += 1
+                        return False
+
+            self._items.append(item)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Lấy message cũ nhất; trả về None khi hết thời gian chờ hoặc đã đóng và rỗng"""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                if self._spill_pending:
+                    self._refill()
+                    continue
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            item = self._items.popleft()
+            self._cond.notify()
+            return item
+
+    def close(self):
+        """Ngừng nhận message mới; các message còn lại vẫn được get() trả về"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def depth(self):
+        return len(self._items) + self._spill_pending
+
+    def stats(self):
+        """Bộ đếm để theo dõi backpressure"""
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "depth": len(self._items),
+                "spill_depth": self._spill_pending,
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "blocked": self.blocked,
+            }
+
+    # -------------------------------------------------------------------------
+    # Spill to disk
+    # -------------------------------------------------------------------------
+
+    def _recover_spill(self):
+        """Nhận lại các message đã spill mà lần chạy trước chưa đọc ra"""
+        if not os.path.exists(self.spill_file):
+            self._remove_offset()
+            return
+        consumed = self._read_offset()
+        count = 0
+        offset = 0
+        boundaries = {0}
+        with open(self.spill_file, "rb") as f:
+            while True:
+                header = f.read(_SPILL_HEADER.size)
+                if len(header) < _SPILL_HEADER.size:
+                    break
+                _, topic_len, payload_len = _SPILL_HEADER.unpack(header)
+                body = f.read(topic_len + payload_len)
+                if len(body) < topic_len + payload_len:
+                    break
+                if offset >= consumed:
+                    count += 1
+                offset = f.tell()
+                boundaries.add(offset)
+        if consumed not in boundaries:
+            # Offset hỏng (không trùng ranh giới bản ghi): đọc lại cả file, thà trùng còn hơn mất
+            print(f"⚠️  Ignoring invalid spill offset {consumed} in {self.offset_file}")
+            consumed = 0
+            count = len(boundaries) - 1
+        # Cắt bỏ bản ghi dở dang (nếu tiến trình bị dừng giữa chừng)
+        os.truncate(self.spill_file, offset)
+        if count:
+            self._spill_pending = count
+            self._spill_offset = consumed
+            self.enqueued += count
+            print(f"♻️  Recovered {count} spilled messages from {self.spill_file}")
+        else:
+            os.remove(self.spill_file)
+            self._remove_offset()
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_file) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            return -1
+
+    def _write_offset(self):
+        tmp = self.offset_file + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(self._spill_offset))
+        os.replace(tmp, self.offset_file)
+
+    def _remove_offset(self):
+        if os.path.exists(self.offset_file):
+            os.remove(self.offset_file)
+
+    def _spill(self, item):
+        topic, payload, recv_time = item
+        if self._spill_out is None:
+            self._spill_out = open(self.spill_file, "ab")
+        write_record(self._spill_out, topic, payload, recv_time)
+        self._spill_out.flush()
+        self._spill_pending += 1
+        self.spilled += 1
+        self.enqueued += 1
+
+    def _refill(self):
+        """Đọc lại một phần file spill vào bộ nhớ (gọi khi đang giữ lock)"""
+        if self._spill_out is not None:
+            self._spill_out.flush()
+        if self._spill_in is None:
+            self._spill_in = open(self.spill_file, "rb")
+            self._spill_in.seek(self._spill_offset)
+
+        while self._spill_pending and len(self._items) < self.maxsize:
+            header = self._spill_in.read(_SPILL_HEADER.size)
+            recv_time, topic_len, payload_len = _SPILL_HEADER.unpack(header)
+            topic = self._spill_in.read(topic_len).decode()
+            payload = self._spill_in.read(payload_len)
+            self._items.append((topic, payload, recv_time))
+            self._spill_pending -= 1
+
+        if not self._spill_pending:
+            # Đã đọc hết: xóa file để lần spill sau bắt đầu từ đầu
+            self._spill_in.close()
+            if self._spill_out is not None:
+                self._spill_out.close()
+            self._spill_in = None
+            self._spill_out = None
+            self._spill_offset = 0
+            os.remove(self.spill_file)
+            self._remove_offset()
+        else:
+            # Lưu vị trí đã đọc: khởi động lại không nhận lại các message này
+            self._spill_offset = self._spill_in.tell()
+            self._write_offset()
@@ -0,0 +1,205 @@
+"""
+Latest State - Trạng thái mới nhất của mọi thiết bị, giữ trong bộ nhớ
+mqtt_logger cập nhật mỗi message (cảm biến, device/state, sys/online), nên
+trang tổng quan hàng nghìn thiết bị đọc thẳng từ RAM thay vì
+SELECT ... ORDER BY ... LIMIT 1 trên SQLite. Định kỳ ghi snapshot JSON ra đĩa
+để khởi động lại là có ngay trạng thái cũ.
+"""
+
+import json
+import operator
+import os
+import threading
+import time
+
+# Coi là mất kết nối nếu quá lâu không nhận message nào (3 heartbeat 15 s)
+STALE_MS = 45 * 1000
+
+class DeviceState:
+    """Một dòng trạng thái gọn (__slots__) cho mỗi garden"""
+
+    __slots__ = ("garden", "version", "last_seen_ms",
+                 "temperature", "humidity", "is_raining", "rain_analog", "sensor_ms",
+                 "light", "pump", "pump_speed", "state_ms",
+                 "online", "device_id", "firmware", "online_ms", "rssi")
+
+    def __init__(self, garden):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.garden = garden
+        self.version = 0
+
+    def to_dict(self, now_ms=None):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        if now_ms is not None:
+            # online = thiết bị tự báo; alive = còn gửi message gần đây
+            data["alive"] = bool(self.online) and self.last_seen_ms is not None \
+                and now_ms - self.last_seen_ms <= STALE_MS
+        return data
+
+    def row(self, now_ms):
+        """Tuple theo FLEET_COLUMNS (không lặp lại tên trường, JSON nhỏ hơn ~2.5 lần)"""
+        alive = bool(self.online) and self.last_seen_ms is not None \
+            and now_ms - self.last_seen_ms <= STALE_MS
+        return _fields(self) + (alive,)
+
+    @classmethod
+    def from_dict(cls, data):
+        device = cls(data["garden"])
+        for name in cls.__slots__:
+            if name in data:
+                setattr(device, name, data[name])
+        return device
+
+_fields = operator.attrgetter(*DeviceState.__slots__)
+FLEET_COLUMNS = DeviceState.__slots__ + ("alive",)
+
+class LatestState:
+    """Map garden -> DeviceState, an toàn khi một thread ghi và nhiều thread đọc"""
+
+    def __init__(self, snapshot_file=None):
+        self.snapshot_file = snapshot_file
+        self.version = 0
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -------------------------------------------------------------------------
+    # Cập nhật (gọi từ ingest thread của logger)
+    # -------------------------------------------------------------------------
+
+    def _device(self, garden, recv_ms, rssi):
+        device = self._devices.get(garden)
+        if device is None:
+            device = self._devices[garden] = DeviceState(garden)
+        self.version += 1
+        device.version = self.version
+        device.last_seen_ms = recv_ms
+        if rssi is not None:
+            device.rssi = rssi
+        return device
+
+    def update_sensor(self, garden, record, recv_ms):
+        """record: decoders.SensorRecord"""
+        with self._lock:
+            device = self._device(garden, recv_ms, record.rssi)
+            device.temperature = record.temperature
+            device.humidity = record.humidity
+            device.is_raining = record.is_raining
+            device.rain_analog = record.rain_analog
+            device.sensor_ms = recv_ms
+
+    def update_state(self, garden, record, recv_ms):
+        """record: decoders.StateRecord"""
+        with self._lock:
+            device = self._device(garden, recv_ms, record.rssi)
+            device.light = record.light
+            device.pump = record.pump
+            device.pump_speed = record.pump_speed
+            device.state_ms = recv_ms
+
+    def update_online(self, garden, record, recv_ms):
+        """record: decoders.OnlineRecord"""
+        with self._lock:
+            device = self._device(garden, recv_ms, record.rssi)
+            device.online = record.online
+            device.device_id = record.device_id or device.device_id
+            device.firmware = record.firmware or device.firmware
+            device.online_ms = recv_ms
+
+    # -------------------------------------------------------------------------
+    # Đọc
+    # -------------------------------------------------------------------------
+
+    def get(self, garden, now_ms=None):
+        """dict trạng thái của một garden hoặc None"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        with self._lock:
+            device = self._devices.get(garden)
+            return device.to_dict(now_ms) if device else None
+
+    def fleet(self, since=0, now_ms=None):
+        """(version hiện tại, các dòng theo FLEET_COLUMNS của thiết bị đổi sau `since`).
+
+        since=0 trả về toàn bộ; client gửi lại version nhận được để chỉ lấy
+        phần thay đổi ở lần hỏi sau.
+        """
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        with self._lock:
+            rows = [device.row(now_ms) for device in self._devices.values()
+                    if device.version > since]
+            return self.version, rows
+
+    def summary(self, now_ms=None):
+        """Số thiết bị, số đang alive, số đang bơm"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        with self._lock:
+            devices = list(self._devices.values())
+            alive = sum(1 for d in devices if d.online and d.last_seen_ms is not None
+                        and now_ms - d.last_seen_ms <= STALE_MS)
+            pumping = sum(1 for d in devices if d.pump == "ON")
+            return {"version": self.version, "devices": len(devices), "alive": alive, "pumping": pumping}
+
+    def __len__(self):
+        return len(self._devices)
+
+    # -------------------------------------------------------------------------
+    # Snapshot
+    # -------------------------------------------------------------------------
+
+    def save(self):
+        """Ghi snapshot (file tạm rồi đổi tên, không bao giờ để lại file dở)"""
+        if not self.snapshot_file:
+            return
+        with self._lock:
+            rows = [device.to_dict() for device in self._devices.values()]
+            version = self.version
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "saved_ms": int(time.time() * 1000), "devices": rows},
+                      f, separators=(",", ":"))
+        os.replace(tmp_file, self.snapshot_file)
+
+    def load(self):
+        """Nạp snapshot nếu có; trả về số thiết bị đã nạp"""
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return 0
+        try:
+            with open(self.snapshot_file, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Cannot read latest-state snapshot {self.snapshot_file}: {e}")
+            return 0
+        with self._lock:
+            for data in snapshot.get("devices", []):
+                device = DeviceState.from_dict(data)
+                self._devices[device.garden] = device
+            self.version = max(snapshot.get("version", 0),
+                               max((d.version for d in self._devices.values()), default=0))
+        return len(self._devices)
+
+    def start_snapshots(self, interval):
+        """Ghi snapshot mỗi `interval` giây trên thread nền"""
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        name="latest_snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Dừng thread snapshot và ghi snapshot cuối cùng"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.save()
+
+    def _run(self, interval):
+        saved_version = self.version
+        while not self._stop.wait(interval):
+            if self.version == saved_version:
+                continue
+            saved_version = self.version
+            try:
+                self.save()
+            except OSError as e:
+                print(f"❌ Latest-state snapshot failed: {e}")
@@ -4,12 +4,25 @@ Lắng nghe MQTT messages và lưu vào SQLite database
 ĐÃ ĐƯỢC CẬP NHẬT CHO "demo/garden" (Dùng "light" và "pump")
 """
 
-import sqlite3
-import json
+import os
+import subprocess
+import sys
 import time
+import threading
 from datetime import datetime
 import paho.mqtt.client as mqtt
 
+import history_api
+from batch_writer import BatchWriter
+from decoders import decode, sample_recv_ms, PayloadError, JSON_LIBRARY, BATCH_TABLE
+from ingest_queue import IngestQueue, write_record
+from archive import Archiver
+from tscompress import Compactor
+from latest_state import LatestState
+from retention import Pruner
+from schema import (open_database, migrate, current_version, shard_index, shard_files,
+                    worker_shards, garden_from_topic)
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
@@ -19,75 +32,114 @@ MQTT_BROKER = "192.168.1.7" # <<< SỬA: Dùng IP của bạn
 MQTT_PORT = 1883
 MQTT_USERNAME = ""
 MQTT_PASSWORD = ""
-TOPIC_NS = "demo/garden"
+# "+/+" nhận mọi node dạng <site>/<garden>/...; đặt "demo/garden" để chỉ nghe một node
+TOPIC_PREFIX = "+/+"
+TOPIC_KINDS = ("sensor/state", "sensor/batch", "device/state", "sys/online", "device/cmd")
+
+# In một dòng cho mỗi message; tắt khi tải cao (print chậm hơn cả việc ghi DB)
+LOG_MESSAGES = True
 
 # Database Configuration
 DB_FILE = "iot_garden_data.db" 
+DB_SHARDS = 1               # > 1: chia theo garden vào iot_garden_data.s<N>.db
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",        # WAL + NORMAL: không fsync mỗi commit
+    "cache_size": -16000,           # 16 MB page cache (số âm = KiB)
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,           # ms chờ khi view_database đang đọc
+    "journal_size_limit": 64 * 1024 * 1024,
+}
+
+# Retention Configuration (số ngày giữ lại, None = giữ mãi)
+RETENTION_DAYS = {
+    "sensor_data": 14,
+    "device_state": 14,
+    "device_online": 30,
+    "commands": 90,
+    "sensor_rollup:1m": None,
+    "sensor_rollup:1h": None,
+    "sensor_rollup:1d": None,
+}
+PRUNE_INTERVAL = 600        # Chạy pruner mỗi 10 phút
+PRUNE_BATCH = 1000          # Số dòng xóa trong một transaction
+
+# Archive Configuration (cần pyarrow): chuyển sensor_data cũ ra Parquet trước khi prune
+ARCHIVE_AFTER_DAYS = None   # vd 7 (phải nhỏ hơn RETENTION_DAYS["sensor_data"]); None = tắt
+ARCHIVE_FORMAT = "parquet"  # parquet | arrow
+
+# Compression Configuration: nén sensor_data cũ thành block delta/XOR trong bảng
+# sensor_blocks (~10x nhỏ hơn, vẫn đọc được qua view_database / history API).
+# Dùng thay cho archive: dòng đã nén không còn trong sensor_data để archive
+COMPRESS_AFTER_HOURS = None # vd 24; None = tắt
+
+# Batch Writer Configuration
+BATCH_MAX_ROWS = 500        # Flush khi đủ số dòng này
+BATCH_MAX_DELAY = 0.25      # ... hoặc khi dòng cũ nhất đã chờ quá 250 ms
+STATS_INTERVAL = 60         # In rows/s và độ trễ flush mỗi 60 giây
+
+# Heartbeat Dedup Configuration
+# Firmware gửi lại device/state và sys/online mỗi 15 giây dù không đổi gì;
+# True = chỉ ghi dòng mới khi trạng thái đổi, heartbeat chỉ cập nhật last_seen_ms
+DEDUP_HEARTBEATS = True
+# Garden im lặng lâu hơn mức này thì heartbeat kế tiếp ghi dòng mới thay vì touch:
+# dòng cũ có thể đã bị pruner xóa (phải ngắn hơn RETENTION_DAYS của device_state/device_online)
+DEDUP_MAX_SILENCE = 24 * 3600
+
+# History API Configuration: chạy history_api.py bên trong logger để query cache
+# được invalidate ngay sau mỗi lần ghi (thay vì chờ hết TTL)
+HISTORY_API_PORT = None     # vd 8090; None = tắt
+
+# Latest State Configuration: trạng thái mới nhất mỗi thiết bị trong RAM (/api/fleet)
+LATEST_SNAPSHOT_FILE = "latest_state.json"  # Nạp lại khi khởi động
+LATEST_SNAPSHOT_INTERVAL = 30               # Giây giữa hai lần ghi snapshot
+
+# Worker Configuration: WORKERS tiến trình logger, mỗi tiến trình sở hữu các shard
+# i % WORKERS == chỉ số worker và bỏ qua message của garden thuộc shard khác.
+# Chạy: python mqtt_logger.py --workers 4 (DB_SHARDS phải là bội số của WORKERS)
+WORKERS = 1
+WORKER_INDEX = 0
+
+# Ingest Queue Configuration
+INGEST_QUEUE_SIZE = 10000           # Số message tối đa chờ ghi trong bộ nhớ
+INGEST_POLICY = "block"             # block | drop_oldest | spill
+INGEST_SPILL_FILE = "ingest_spill.bin"
+
+# Capture Configuration: ghi mọi message nhận được ra file để replay.py nạp lại
+# (backfill sau sự cố, thử nghiệm); None = tắt
+CAPTURE_FILE = None         # vd "capture.bin"
+
+# =============================================================================
+# GLOBAL VARIABLES
+# =============================================================================
+
+writer = None
+ingest = None
+latest = LatestState(LATEST_SNAPSHOT_FILE)
+
+# Trạng thái cuối đã ghi của mỗi (bảng, garden): [các trường so sánh, recv_ms của dòng, lần thấy cuối]
+last_rows = {}
+dedup_skipped = 0
+
+# Shard do worker này ghi (None = mọi shard, chỉ có một worker)
+owned_shards = None
+foreign_skipped = 0
+invalid_messages = 0
+
+capture = None
 
 # =============================================================================
 # DATABASE SETUP
 # =============================================================================
 
 def init_database():
-    """Tạo database và các bảng nếu chưa có"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Bảng sensor_data (Giữ nguyên)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sensor_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_timestamp INTEGER,
-            temperature REAL,
-            humidity REAL,
-            rain_analog INTEGER, 
-            rain_digital INTEGER,
-            is_raining BOOLEAN, 
-            rssi INTEGER
-        )
-    """)
-    
-    # Bảng device_state
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS device_state (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_timestamp INTEGER,
-            light TEXT, 
-            pump TEXT, 
-            pumpSpeed INTEGER, 
-            rssi INTEGER
-        )
-    """) # <<< SỬA: Đổi lại thành 'light'
-    
-    # Bảng device_online (Giữ nguyên)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS device_online (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            device_timestamp INTEGER,
-            online BOOLEAN,
-            device_id TEXT,
-            firmware TEXT,
-            rssi INTEGER
-        )
-    """)
-    
-    # Bảng commands (Giữ nguyên)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS commands (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            command_type TEXT,
-            command_value TEXT,
-            source TEXT
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
-    print("✅ Database initialized: " + DB_FILE)
+    """Mở database (mọi shard) ở chế độ WAL và áp dụng các migration còn thiếu"""
+    for db_file in shard_files(DB_FILE, DB_SHARDS, owned_shards):
+        conn = open_database(db_file, **SQLITE_PRAGMAS)
+        version = current_version(conn)
+        for number, name in migrate(conn):
+            print(f"🔧 Migration {number}: {name}")
+        print(f"✅ Database initialized: {db_file} (schema v{version} → v{current_version(conn)})")
+        conn.close()
 
 # =============================================================================
 # MQTT CALLBACKS
@@ -96,32 +148,80 @@ def init_database():
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("✅ Connected to MQTT broker: " + MQTT_BROKER)
-        client.subscribe(f"{TOPIC_NS}/sensor/state")
-        client.subscribe(f"{TOPIC_NS}/device/state")
-        client.subscribe(f"{TOPIC_NS}/sys/online")
-        client.subscribe(f"{TOPIC_NS}/device/cmd")
-        print(f"📡 Subscribed to: {TOPIC_NS}/*")
+        for kind in TOPIC_KINDS:
+            client.subscribe(f"{TOPIC_PREFIX}/{kind}")
+            client.subscribe(f"{TOPIC_PREFIX}/{kind}/+")   # .../msgpack, .../cbor
+        print(f"📡 Subscribed to: {TOPIC_PREFIX}/* (json, msgpack, cbor)")
     else:
         print(f"❌ Connection failed with code: {rc}")
 
 def on_message(client, userdata, msg):
-    topic = msg.topic
-    payload = msg.payload.decode()
-    
+    """Chỉ đưa message vào hàng đợi; parse và ghi DB chạy trên ingest thread"""
+    global foreign_skipped
+    # Garden thuộc worker khác: bỏ ngay, chỉ tốn một lần hash topic
+    if owned_shards is not None and shard_index(garden_from_topic(msg.topic), DB_SHARDS) not in owned_shards:
+        foreign_skipped += 1
+        return
+    recv_time = time.time()
+    if capture is not None:
+        write_record(capture, msg.topic, msg.payload, recv_time)
+    ingest.put(msg.topic, msg.payload, recv_time)
+
+# =============================================================================
+# INGEST PIPELINE
+# =============================================================================
+
+def ingest_worker():
+    """Thread lấy message từ hàng đợi và xử lý, tách khỏi thread mạng của paho"""
+    last_report = time.monotonic()
+    while True:
+        item = ingest.get(timeout=1.0)
+        if item is not None:
+            topic, payload, recv_time = item
+            process_message(topic, payload, recv_time)
+        elif ingest.closed:
+            break
+        
+        if time.monotonic() - last_report >= STATS_INTERVAL:
+            s = ingest.stats()
+            print(f"📬 Ingest: depth={s['depth']} (spill {s['spill_depth']}, max {s['max_depth']}), "
+                  f"dropped={s['dropped']}, spilled={s['spilled']}, blocked={s['blocked']}, "
+                  f"heartbeats={dedup_skipped}, invalid={invalid_messages}, other workers={foreign_skipped}")
+            if HISTORY_API_PORT and WORKER_INDEX == 0:
+                c = history_api.cache.stats()
+                print(f"🗃️  Query cache: {c['entries']} entries, hit ratio {c['hit_ratio'] * 100:.1f}% "
+                      f"({c['hits']} hits, {c['misses']} misses, {c['invalidations']} invalidated)")
+            last_report = time.monotonic()
+
+def process_message(topic, payload, recv_time, content_type=None):
+    """Decode payload theo schema của topic và chuyển tới hàm lưu tương ứng"""
+    global invalid_messages
+    recv_ms = int(recv_time * 1000)
+    garden = garden_from_topic(topic)
     try:
-        data = json.loads(payload)
+        decoded = decode(topic, payload, content_type)
+        if decoded is None:
+            return
+        table, record = decoded
         
-        if topic.endswith("/sensor/state"):
-            save_sensor_data(data)
-        elif topic.endswith("/device/state"):
-            save_device_state(data)
-        elif topic.endswith("/sys/online"):
-            save_online_status(data)
-        elif topic.endswith("/device/cmd"):
-            save_command(data)
+        if table == "sensor_data":
+            latest.update_sensor(garden, record, recv_ms)
+            save_sensor_data(garden, record, recv_ms)
+        elif table == BATCH_TABLE:
+            latest.update_sensor(garden, record[-1], recv_ms)
+            save_sensor_batch(garden, record, recv_ms)
+        elif table == "device_state":
+            latest.update_state(garden, record, recv_ms)
+            save_device_state(garden, record, recv_ms)
+        elif table == "device_online":
+            latest.update_online(garden, record, recv_ms)
+            save_online_status(garden, record, recv_ms)
+        else:
+            save_command(garden, record, recv_ms)
             
-    except json.JSONDecodeError:
-        print(f"⚠️  Invalid JSON from {topic}: {payload}")
+    except PayloadError as e:
+        invalid_messages += 1
+        print(f"⚠️  Invalid payload from {topic} ({e}): {payload[:200].decode(errors='replace')}")
     except Exception as e:
         print(f"❌ Error processing message: {e}")
 
@@ -129,117 +229,174 @@ def on_message(client, userdata, msg):
 # DATABASE OPERATIONS
 # =============================================================================
 
-def save_sensor_data(data):
-    # (Hàm này giữ nguyên)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    temperature = data.get('temperature')
-    humidity = data.get('humidity')
-    rain_analog = data.get('rain_analog')
-    rain_digital = data.get('rain_digital')
-    is_raining = data.get('is_raining')
-    rssi = data.get('rssi')
-    device_timestamp = data.get('timestamp')
-    
-    cursor.execute("""
-        INSERT INTO sensor_data (device_timestamp, temperature, humidity, rain_analog, rain_digital, is_raining, rssi)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (device_timestamp, temperature, humidity, rain_analog, rain_digital, is_raining, rssi))
+def store(table, garden, row):
+    """Gắn garden vào dòng và gửi tới shard của garden đó"""
+    writer.add(table, (garden,) + row, shard_index(garden, DB_SHARDS))
+
+def store_changes(table, garden, fields, row, recv_ms):
+    """Ghi dòng khi `fields` khác lần trước; nếu trùng chỉ cập nhật last_seen_ms.
+
+    Trả về True nếu đã ghi dòng mới, False nếu chỉ là heartbeat.
+    """
+    global dedup_skipped
+    key = (table, garden)
+    last = last_rows.get(key)
+    if (DEDUP_HEARTBEATS and last is not None and last[0] == fields
+            and recv_ms - last[2] <= DEDUP_MAX_SILENCE * 1000):
+        writer.touch(table, garden, last[1], recv_ms, shard_index(garden, DB_SHARDS))
+        last[2] = max(last[2], recv_ms)
+        dedup_skipped += 1
+        return False
+    store(table, garden, row + (recv_ms,))
+    last_rows[key] = [fields, recv_ms, recv_ms]
+    return True
+
+def save_sensor_data(garden, record, recv_ms):
+    """Đưa dữ liệu cảm biến vào batch writer"""
+    # Thứ tự trường của SensorRecord trùng với cột INSERT sau recv_ms
+    store("sensor_data", garden, (recv_ms,) + record)
     
-    conn.commit()
-    conn.close()
+    if LOG_MESSAGES:
+        rain_status = "Raining" if record.is_raining else "Dry"
+        print(f"🌡️  [{garden}] Sensor: {record.temperature}°C, {record.humidity}%, {rain_status} "
+              f"(A:{record.rain_analog}) - Queued")
+
+def save_sensor_batch(garden, records, recv_ms):
+    """Bung sensor/batch thành các dòng sensor_data và đưa vào writer một lần"""
+    rows = [(garden, sample_ms) + record
+            for sample_ms, record in zip(sample_recv_ms(records, recv_ms), records)]
+    writer.add_many("sensor_data", rows, shard_index(garden, DB_SHARDS))
     
-    rain_status = "Raining" if is_raining else "Dry"
-    print(f"🌡️  Sensor: {temperature}°C, {humidity}%, {rain_status} (A:{rain_analog}) - Saved to DB")
+    if LOG_MESSAGES:
+        last = records[-1]
+        print(f"🌡️  [{garden}] Sensor batch: {len(records)} samples, last {last.temperature}°C, "
+              f"{last.humidity}% - Queued")
 
-def save_device_state(data):
+def save_device_state(garden, record, recv_ms):
     """Lưu trạng thái thiết bị vào database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    light = data.get('light')       # <<< SỬA: Đổi lại thành 'light'
-    pump = data.get('pump')
-    pumpSpeed = data.get('pumpSpeed')
-    rssi = data.get('rssi')
-    device_timestamp = data.get('timestamp')
+    # rssi và timestamp đổi liên tục nên không tính là thay đổi trạng thái
+    changed = store_changes("device_state", garden, (record.light, record.pump, record.pump_speed),
+                            (recv_ms,) + record, recv_ms)
     
-    cursor.execute("""
-        INSERT INTO device_state (device_timestamp, light, pump, pumpSpeed, rssi)
-        VALUES (?, ?, ?, ?, ?)
-    """, (device_timestamp, light, pump, pumpSpeed, rssi)) # <<< SỬA
-    
-    conn.commit()
-    conn.close()
-    
-    print(f"📊 State: Light={light}, Pump={pump} ({pumpSpeed}%) - Saved to DB") # <<< SỬA
+    if LOG_MESSAGES:
+        print(f"📊 [{garden}] State: Light={record.light}, Pump={record.pump} ({record.pump_speed}%) - "
+              f"{'Queued' if changed else 'Heartbeat'}")
 
-def save_online_status(data):
-    # (Hàm này giữ nguyên)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    online = data.get('online')
-    device_id = data.get('deviceId')
-    firmware = data.get('firmware')
-    rssi = data.get('rssi')
-    device_timestamp = data.get('timestamp')
-    
-    cursor.execute("""
-        INSERT INTO device_online (device_timestamp, online, device_id, firmware, rssi)
-        VALUES (?, ?, ?, ?, ?)
-    """, (device_timestamp, online, device_id, firmware, rssi))
+def save_online_status(garden, record, recv_ms):
+    """Lưu trạng thái online vào database"""
+    changed = store_changes("device_online", garden, (record.online, record.device_id, record.firmware),
+                            (recv_ms,) + record, recv_ms)
     
-    conn.commit()
-    conn.close()
-    
-    status = "🟢 Online" if online else "🔴 Offline"
-    print(f"{status}: {device_id} - Saved to DB")
+    if LOG_MESSAGES:
+        status = "🟢 Online" if record.online else "🔴 Offline"
+        print(f"{status} [{garden}]: {record.device_id} - {'Queued' if changed else 'Heartbeat'}")
 
-def save_command(data):
+def save_command(garden, record, recv_ms):
     """Lưu lệnh điều khiển vào database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    if 'light' in data:               # <<< SỬA: Đổi lại thành 'light'
-        cmd_type = 'light'
-        cmd_value = data['light']
-    elif 'pump' in data:
-        cmd_type = 'pump'
-        cmd_value = data['pump']
-    elif 'pumpSpeed' in data:
-        cmd_type = 'pumpSpeed'
-        cmd_value = str(data['pumpSpeed'])
-    else:
-        cmd_type = 'unknown'
-        cmd_value = json.dumps(data)
+    store("commands", garden, (recv_ms,) + record + ('mqtt',))
     
-    cursor.execute("""
-        INSERT INTO commands (command_type, command_value, source)
-        VALUES (?, ?, ?)
-    """, (cmd_type, cmd_value, 'mqtt'))
-    
-    conn.commit()
-    conn.close()
-    
-    print(f"📥 Command: {cmd_type}={cmd_value} - Saved to DB")
+    if LOG_MESSAGES:
+        print(f"📥 [{garden}] Command: {record.command_type}={record.command_value} - Queued")
+
+# =============================================================================
+# WORKERS
+# =============================================================================
+
+def worker_file(path):
+    """File riêng của worker: latest_state.json -> latest_state.w1.json"""
+    if WORKERS <= 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.w{WORKER_INDEX}{ext}"
+
+def run_workers(count):
+    """Chạy `count` tiến trình logger con (--worker k/count) và chờ chúng dừng"""
+    if DB_SHARDS % count:
+        print(f"❌ DB_SHARDS ({DB_SHARDS}) must be a multiple of the worker count ({count})")
+        return
+    print(f"🚀 Starting {count} logger workers over {DB_SHARDS} shards")
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", f"{k}/{count}"])
+             for k in range(count)]
+    try:
+        for proc in procs:
+            proc.wait()
+    except KeyboardInterrupt:
+        # Ctrl+C tới cả nhóm tiến trình; chờ các worker flush xong
+        for proc in procs:
+            proc.wait()
 
 # =============================================================================
 # MAIN
 # =============================================================================
 
 def main():
+    global writer, ingest, capture, owned_shards, WORKERS, WORKER_INDEX
+    
+    args = sys.argv[1:]
+    if args[:1] == ["--workers"]:
+        return run_workers(int(args[1]) if len(args) > 1 else WORKERS)
+    if args[:1] == ["--worker"]:
+        index, count = args[1].split("/")
+        WORKER_INDEX, WORKERS = int(index), int(count)
+    if WORKERS > 1:
+        if DB_SHARDS % WORKERS:
+            print(f"❌ DB_SHARDS ({DB_SHARDS}) must be a multiple of WORKERS ({WORKERS})")
+            return
+        owned_shards = worker_shards(DB_SHARDS, WORKERS, WORKER_INDEX)
+        latest.snapshot_file = worker_file(LATEST_SNAPSHOT_FILE)
+    
     print("╔════════════════════════════════════════════╗")
     print("║   MQTT to Database Logger (Garden Version) ║")
     print("╚════════════════════════════════════════════╝")
     print(f"📡 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
-    print(f"💾 Database: {DB_FILE}")
-    print(f"📊 Topic Namespace: {TOPIC_NS}")
+    print(f"💾 Database: {DB_FILE} ({DB_SHARDS} shard{'s' if DB_SHARDS > 1 else ''})")
+    print(f"📦 Batch: {BATCH_MAX_ROWS} rows / {BATCH_MAX_DELAY * 1000:.0f} ms")
+    print(f"📬 Ingest Queue: {INGEST_QUEUE_SIZE} messages, policy={INGEST_POLICY}")
+    if owned_shards is not None:
+        print(f"👷 Worker {WORKER_INDEX}/{WORKERS}: shards {owned_shards}")
+    print(f"📊 Topic Filter: {TOPIC_PREFIX}/*")
+    print(f"🧩 JSON decoder: {JSON_LIBRARY}")
     print("────────────────────────────────────────────")
     
     init_database()
+    print(f"🗂️  Latest state: {latest.load()} devices restored from {latest.snapshot_file}")
+    latest.start_snapshots(LATEST_SNAPSHOT_INTERVAL)
+    
+    writer = BatchWriter(DB_FILE, max_rows=BATCH_MAX_ROWS, max_delay=BATCH_MAX_DELAY,
+                         report_interval=STATS_INTERVAL, pragmas=SQLITE_PRAGMAS, shards=DB_SHARDS)
+    writer.start()
+    
+    api_server = None
+    if HISTORY_API_PORT and WORKER_INDEX == 0:
+        # Nhiều worker: API chạy ở worker 0; entry cache của shard khác chỉ hết hạn theo TTL
+        # và /api/latest đọc từ DB vì RAM của worker 0 chỉ có garden của nó
+        writer.add_flush_listener(history_api.cache.invalidate_changes)
+        if WORKERS == 1:
+            history_api.latest_store = latest
+        api_server = history_api.start_server(HISTORY_API_PORT, DB_FILE, DB_SHARDS)
+        print(f"🌐 History API: http://{history_api.HOST}:{HISTORY_API_PORT}/api/history")
+    
+    ingest = IngestQueue(INGEST_QUEUE_SIZE, INGEST_POLICY, worker_file(INGEST_SPILL_FILE))
+    if CAPTURE_FILE:
+        capture = open(worker_file(CAPTURE_FILE), "ab")
+        print(f"⏺️  Capturing messages to {capture.name} (python replay.py {capture.name})")
+    ingest_thread = threading.Thread(target=ingest_worker, name="ingest_worker", daemon=True)
+    ingest_thread.start()
+    
+    archiver = None
+    if ARCHIVE_AFTER_DAYS is not None:
+        archiver = Archiver(DB_FILE, ARCHIVE_AFTER_DAYS, ARCHIVE_FORMAT,
+                            shards=DB_SHARDS, pragmas=SQLITE_PRAGMAS, shard_ids=owned_shards)
+    compactor = None
+    if COMPRESS_AFTER_HOURS is not None:
+        compactor = Compactor(DB_FILE, COMPRESS_AFTER_HOURS, shards=DB_SHARDS,
+                              pragmas=SQLITE_PRAGMAS, shard_ids=owned_shards)
+    pruner = Pruner(DB_FILE, RETENTION_DAYS, shards=DB_SHARDS, interval=PRUNE_INTERVAL,
+                    batch_size=PRUNE_BATCH, pragmas=SQLITE_PRAGMAS, archiver=archiver,
+                    shard_ids=owned_shards, compactor=compactor)
+    pruner.start()
     
-    client = mqtt.Client(client_id="mqtt_logger_" + str(int(time.time())), protocol=mqtt.MQTTv311)
+    client = mqtt.Client(client_id=f"mqtt_logger_{WORKER_INDEX}_{int(time.time())}", protocol=mqtt.MQTTv311)
     # <<< SỬA: Thêm protocol=mqtt.MQTTv311 để hết lỗi DeprecationWarning
     
     client.on_connect = on_connect
@@ -261,6 +418,20 @@ def main():
         client.disconnect()
     except Exception as e:
         print(f"❌ Error: {e}")
+    finally:
+        # Xử lý hết message còn trong hàng đợi trước khi flush lần cuối
+        pruner.stop()
+        if api_server:
+            api_server.shutdown()
+        ingest.close()
+        ingest_thread.join()
+        if capture is not None:
+            capture.close()
+        latest.stop()
+        writer.close()
+        s = writer.stats()
+        print(f"💾 Flushed {s['rows_written']} rows + {s['rows_touched']} heartbeats in {s['flushes']} batches "
+              f"(avg {s['avg_flush_ms']:.1f} ms, {s['rows_per_sec']:.1f} rows/s)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
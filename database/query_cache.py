@@ -0,0 +1,129 @@
+"""
+Query Cache - Cache đọc qua (LRU + TTL) cho truy vấn trạng thái mới nhất và thống kê cửa sổ
+Mỗi entry khai báo phạm vi dữ liệu nó phụ thuộc: (các bảng, garden, khoảng
+recv_ms). Sau mỗi lần BatchWriter commit, invalidate_changes() chỉ xóa các
+entry có phạm vi chứa dòng vừa ghi, nên truy vấn cho ngày hôm qua vẫn nằm
+trong cache khi dữ liệu mới liên tục đổ về.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class _Entry:
+    __slots__ = ("value", "expires", "tables", "garden", "from_ms", "to_ms")
+
+    def __init__(self, value, expires, tables, garden, from_ms, to_ms):
+        self.value = value
+        self.expires = expires
+        self.tables = tables
+        self.garden = garden
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+
+    def overlaps(self, min_ms, max_ms):
+        return ((self.from_ms is None or self.from_ms <= max_ms) and
+                (self.to_ms is None or self.to_ms > min_ms))
+
+class QueryCache:
+    """LRU giới hạn `max_entries`, mỗi entry sống tối đa `ttl` giây.
+
+    TTL chỉ là giới hạn an toàn (cửa sổ trượt "24h qua", hoặc tiến trình
+    không nhận được invalidation); dữ liệu mới được xử lý bằng invalidation.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._index = {}            # (table, garden) -> set(key)
+        self._lock = threading.Lock()
+        self._generation = 0        # Tăng mỗi lần có dữ liệu mới được commit
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Giá trị đã cache hoặc None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, tables, garden=None, from_ms=None, to_ms=None):
+        """Lưu giá trị phụ thuộc vào `tables` của `garden` (None = mọi garden)
+        trong [from_ms, to_ms); None ở hai đầu = không giới hạn"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, tuple(tables),
+                                        garden, from_ms, to_ms)
+            for table in tables:
+                self._index.setdefault((table, garden), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def cached(self, key, loader, tables, garden=None, from_ms=None, to_ms=None):
+        """Đọc qua: trả về giá trị đã cache, nếu không có thì gọi loader() và lưu lại"""
+        value = self.get(key)
+        if value is None:
+            generation = self._generation
+            value = loader()
+            # Có commit trong lúc loader chạy: kết quả có thể đã cũ, không lưu
+            if generation == self._generation:
+                self.put(key, value, tables, garden, from_ms, to_ms)
+        return value
+
+    def invalidate_changes(self, changes):
+        """Listener của BatchWriter: changes = {(table, garden): (min_recv_ms, max_recv_ms)}"""
+        with self._lock:
+            self._generation += 1
+            for (table, garden), (min_ms, max_ms) in changes.items():
+                # Entry của riêng garden này và entry gộp mọi garden
+                for scope in ((table, garden), (table, None)):
+                    for key in list(self._index.get(scope, ())):
+                        entry = self._entries.get(key)
+                        if entry is not None and entry.overlaps(min_ms, max_ms):
+                            self._remove(key)
+                            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for table in entry.tables:
+            keys = self._index.get((table, entry.garden))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(table, entry.garden)]
@@ -0,0 +1,210 @@
+"""
+Replay / Backfill - Nạp lại traffic MQTT đã capture vào database
+Đọc file capture (CAPTURE_FILE của mqtt_logger, cùng định dạng với file spill
+của ingest_queue), parse JSON song song trên nhiều tiến trình theo chunk, rồi
+một writer duy nhất ghi từng lô bằng executemany (mỗi shard một transaction,
+rollup cập nhật cùng lúc).
+
+    reader ─► [chunk] ─► ProcessPool: parse_chunk() ─► lô dạng cột ─► dedup heartbeat ─► BatchWriter.write_batch()
+
+Replay là idempotent: (garden, recv_ms) là UNIQUE nên chạy lại cùng file, hay
+capture trùng với dữ liệu logger đã ghi live, không tạo dòng trùng và không
+cộng lại vào rollup; mẫu đã nén vào sensor_blocks cũng được bỏ qua. Dữ liệu
+đã chuyển ra archive (archive.py) thì không được kiểm tra.
+
+Chạy:
+    python replay.py capture.bin [capture2.bin ...] [--workers 4] [--chunk 5000]
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import rollups
+from batch_writer import BatchWriter
+from decoders import decode, sample_recv_ms, PayloadError, BATCH_TABLE
+from ingest_queue import read_records
+from schema import open_database, migrate, shard_index, shard_files, garden_from_topic
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+DB_FILE = "iot_garden_data.db"
+DB_SHARDS = 1               # Phải khớp với DB_SHARDS trong mqtt_logger.py
+WORKERS = os.cpu_count() or 1
+CHUNK_MESSAGES = 5000       # Số message mỗi lần gửi sang tiến trình parse
+DEDUP_HEARTBEATS = True     # Giống mqtt_logger: heartbeat không đổi chỉ cập nhật last_seen_ms
+
+# Các trường so sánh để nhận ra heartbeat (vị trí trong dòng INSERT, sau garden)
+STATE_FIELDS = slice(3, 6)  # device_state: light, pump, pumpSpeed / device_online: online, device_id, firmware
+DEDUP_TABLES = ("device_state", "device_online")
+
+# =============================================================================
+# PARSE (chạy trong tiến trình con)
+# =============================================================================
+
+def parse_chunk(records, shards=DB_SHARDS):
+    """Parse một chunk (topic, payload, recv_time) thành lô dạng cột.
+
+    Trả về ({(shard, table): [cột, ...]}, {shard: tham số UPSERT rollup},
+    số message lỗi). Mỗi cột là một list cùng độ dài, theo thứ tự cột của
+    batch_writer.INSERT_SQL; gửi cột thay vì từng tuple giúp pickle giữa các
+    tiến trình nhẹ hơn. Rollup cũng được gộp ở đây để writer chỉ còn ghi.
+    """
+    batch = {}
+    invalid = 0
+
+    for topic, payload, recv_time in records:
+        try:
+            decoded = decode(topic, payload)
+        except PayloadError:
+            invalid += 1
+            continue
+        if decoded is None:
+            continue
+        table, record = decoded
+        recv_ms = int(recv_time * 1000)
+        garden = garden_from_topic(topic)
+        if table == BATCH_TABLE:
+            # Một message sensor/batch -> nhiều dòng sensor_data
+            table = "sensor_data"
+            rows = [(garden, sample_ms) + sample
+                    for sample_ms, sample in zip(sample_recv_ms(record, recv_ms), record)]
+        else:
+            values = (garden, recv_ms) + record
+            if table in DEDUP_TABLES:
+                values += (recv_ms,)        # last_seen_ms
+            elif table == "commands":
+                values += ('mqtt',)
+            rows = (values,)
+        key = (shard_index(garden, shards), table)
+        cols = batch.get(key)
+        if cols is None:
+            cols = batch[key] = tuple([] for _ in rows[0])
+        for values in rows:
+            for col, value in zip(cols, values):
+                col.append(value)
+    rollup_params = {shard: rollups.aggregate(zip(*cols))
+                     for (shard, table), cols in batch.items() if table == "sensor_data"}
+    return batch, rollup_params, invalid
+
+def _parse(args):
+    return parse_chunk(*args)
+
+# =============================================================================
+# WRITE (tiến trình chính)
+# =============================================================================
+
+class Replayer:
+    """Nhận lô dạng cột theo đúng thứ tự capture, bỏ heartbeat trùng và ghi"""
+
+    def __init__(self, writer, dedup=DEDUP_HEARTBEATS):
+        self.writer = writer
+        self.dedup = dedup
+        self.last_rows = {}         # (table, garden) -> (các trường so sánh, recv_ms của dòng)
+        self.messages = 0
+        self.invalid = 0
+        self.heartbeats = 0
+
+    def apply(self, columnar, rollup_params=None, invalid=0):
+        batch = {}
+        touches = {}
+        for (shard, table), cols in columnar.items():
+            rows = list(zip(*cols))
+            self.messages += len(rows)
+            if self.dedup and table in DEDUP_TABLES:
+                rows = self._dedup(shard, table, rows, touches)
+            if rows:
+                batch[(shard, table)] = rows
+        self.invalid += invalid
+        if batch or touches:
+            self.writer.write_batch(batch, touches, rollup_params)
+
+    def _dedup(self, shard, table, rows, touches):
+        kept = []
+        for row in rows:
+            key = (table, row[0])
+            fields = row[STATE_FIELDS]
+            last = self.last_rows.get(key)
+            if last is not None and last[0] == fields:
+                touch_key = (shard, table, row[0], last[1])
+                touches[touch_key] = max(touches.get(touch_key, 0), row[1])
+                self.heartbeats += 1
+            else:
+                kept.append(row)
+                self.last_rows[key] = (fields, row[1])
+        return kept
+
+def read_chunks(paths, chunk_messages):
+    """Chunk các message từ một hoặc nhiều file capture, theo thứ tự"""
+    for path in paths:
+        with open(path, "rb") as f:
+            records = read_records(f)
+            while True:
+                chunk = list(islice(records, chunk_messages))
+                if not chunk:
+                    break
+                yield chunk
+
+def replay(paths, db_file=DB_FILE, shards=DB_SHARDS, workers=WORKERS,
+           chunk_messages=CHUNK_MESSAGES, dedup=DEDUP_HEARTBEATS, pragmas=None):
+    """Nạp các file capture vào database; trả về (Replayer, số giây)"""
+    for path in shard_files(db_file, shards):
+        conn = open_database(path, **(pragmas or {}))
+        migrate(conn)
+        conn.close()
+
+    writer = BatchWriter(db_file, pragmas=pragmas, shards=shards)
+    replayer = Replayer(writer, dedup)
+    jobs = ((chunk, shards) for chunk in read_chunks(paths, chunk_messages))
+    start = time.perf_counter()
+    try:
+        if workers <= 1:
+            for result in map(_parse, jobs):
+                replayer.apply(*result)
+        else:
+            # Executor.map() đọc hết file trước khi trả kết quả đầu tiên, nên tự giữ
+            # tối đa 2 chunk mỗi worker đang xử lý; lấy kết quả theo thứ tự submit
+            # để dedup heartbeat vẫn đúng thứ tự thời gian
+            with ProcessPoolExecutor(workers) as pool:
+                in_flight = deque()
+                for job in jobs:
+                    in_flight.append(pool.submit(_parse, job))
+                    if len(in_flight) >= workers * 2:
+                        replayer.apply(*in_flight.popleft().result())
+                while in_flight:
+                    replayer.apply(*in_flight.popleft().result())
+    finally:
+        writer.close()
+    return replayer, time.perf_counter() - start
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured MQTT traffic into the database")
+    parser.add_argument("files", nargs="+", help="capture file(s) written by mqtt_logger CAPTURE_FILE")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--shards", type=int, default=DB_SHARDS)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="parse processes (1 = in-process)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_MESSAGES, help="messages per parse chunk")
+    parser.add_argument("--no-dedup", action="store_true", help="write every heartbeat as a row")
+    args = parser.parse_args()
+
+    print(f"⏪ Replaying {len(args.files)} file(s) into {args.db} "
+          f"({args.workers} parse workers, {args.chunk} messages/chunk)")
+    replayer, elapsed = replay(args.files, args.db, args.shards, args.workers, args.chunk,
+                               not args.no_dedup)
+    s = replayer.writer.stats()
+    print(f"✅ {replayer.messages} messages in {elapsed:.2f}s "
+          f"({replayer.messages / elapsed if elapsed else 0:,.0f} msg/s): "
+          f"{s['rows_written']} rows, {s['rows_duplicate']} already stored, {replayer.heartbeats} heartbeats, "
+          f"{replayer.invalid} invalid, {s['flushes']} transactions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Retention & Compaction - Xóa dữ liệu cũ theo từng bảng và thu hồi dung lượng
+Pruner chạy nền: xóa theo lô nhỏ (mỗi lô một transaction ngắn, nghỉ giữa các
+lô để batch writer chen vào), sau đó chạy PRAGMA incremental_vacuum để trả
+trang trống về hệ điều hành.
+
+Chạy trực tiếp:
+    python retention.py                  # một lượt prune với DEFAULT_RETENTION_DAYS
+    python retention.py --enable-vacuum  # chuyển file cũ sang auto_vacuum=INCREMENTAL (cần dừng logger)
+"""
+
+import sys
+import threading
+import time
+
+import rollups
+from schema import open_database, shard_files
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+# Số ngày giữ lại; None = giữ mãi. Rollup ghi theo "sensor_rollup:<độ phân giải>".
+DEFAULT_RETENTION_DAYS = {
+    "sensor_data": 14,
+    "device_state": 14,
+    "device_online": 30,
+    "commands": 90,
+    "sensor_rollup:1m": None,
+    "sensor_rollup:1h": None,
+    "sensor_rollup:1d": None,
+}
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Bảng lưu theo thay đổi (có cột last_seen_ms)
+HEARTBEAT_TABLES = ("device_state", "device_online")
+
+# =============================================================================
+# PRUNING
+# =============================================================================
+
+def _delete_batch(conn, target, cutoff_ms, batch_size):
+    """Xóa tối đa batch_size dòng cũ hơn cutoff_ms; trả về số dòng đã xóa"""
+    if target.startswith("sensor_rollup:"):
+        resolution = rollups.RESOLUTIONS[target.split(":", 1)[1]]
+        sql = """
+            DELETE FROM sensor_rollup
+            WHERE (resolution, garden, bucket_ms) IN (
+                SELECT resolution, garden, bucket_ms FROM sensor_rollup
+                WHERE resolution = ? AND bucket_ms < ?
+                LIMIT ?
+            )
+        """
+        params = (resolution, cutoff_ms, batch_size)
+    elif target == "sensor_blocks":
+        # Block nén: xóa cả block khi mẫu mới nhất của nó đã quá hạn
+        sql = """
+            DELETE FROM sensor_blocks
+            WHERE (garden, start_ms) IN (
+                SELECT garden, start_ms FROM sensor_blocks
+                WHERE max_recv_ms < ?
+                LIMIT ?
+            )
+        """
+        params = (cutoff_ms, batch_size)
+    elif target in HEARTBEAT_TABLES:
+        # Dòng cũ nhưng vẫn được heartbeat gần đây là trạng thái hiện tại: giữ lại
+        sql = f"""
+            DELETE FROM {target}
+            WHERE id IN (
+                SELECT id FROM {target}
+                WHERE recv_ms < ? AND COALESCE(last_seen_ms, recv_ms) < ?
+                ORDER BY recv_ms
+                LIMIT ?
+            )
+        """
+        params = (cutoff_ms, cutoff_ms, batch_size)
+    else:
+        sql = f"""
+            DELETE FROM {target}
+            WHERE id IN (
+                SELECT id FROM {target}
+                WHERE recv_ms < ?
+                ORDER BY recv_ms
+                LIMIT ?
+            )
+        """
+        params = (cutoff_ms, batch_size)
+
+    with conn:
+        return conn.execute(sql, params).rowcount
+
+def prune(conn, retention_days, batch_size=1000, pause=0.05, vacuum_pages=1000,
+          now_ms=None, stop_event=None):
+    """Một lượt prune trên một file; trả về {bảng: số dòng đã xóa}"""
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    deleted = {}
+    # Block nén (tscompress.py) theo cùng hạn với sensor_data nếu không cấu hình riêng
+    retention_days = dict(retention_days)
+    retention_days.setdefault("sensor_blocks", retention_days.get("sensor_data"))
+    for target, days in retention_days.items():
+        if days is None:
+            continue
+        cutoff_ms = now_ms - int(days * DAY_MS)
+        total = 0
+        while not (stop_event and stop_event.is_set()):
+            count = _delete_batch(conn, target, cutoff_ms, batch_size)
+            total += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+        if total:
+            deleted[target] = total
+
+    if deleted and vacuum_pages:
+        # Chỉ có tác dụng khi file ở chế độ auto_vacuum=INCREMENTAL. Dùng
+        # executescript vì execute() chỉ step một lần (giải phóng một trang)
+        conn.executescript(f"PRAGMA incremental_vacuum({vacuum_pages});")
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return deleted
+
+# =============================================================================
+# BACKGROUND PRUNER
+# =============================================================================
+
+class Pruner:
+    """Thread nền chạy prune() mỗi `interval` giây trên mọi shard.
+
+    Nếu có `archiver` (archive.Archiver), dữ liệu cũ được chuyển ra file cột
+    trước khi prune xóa; nếu có `compactor` (tscompress.Compactor), sensor_data
+    cũ được nén thành block.
+    """
+
+    def __init__(self, db_file, retention_days=None, shards=1, interval=600,
+                 batch_size=1000, pause=0.05, vacuum_pages=1000, pragmas=None, archiver=None,
+                 shard_ids=None, compactor=None):
+        self.db_file = db_file
+        self.retention_days = retention_days or DEFAULT_RETENTION_DAYS
+        self.shards = shards
+        self.shard_ids = shard_ids      # None = mọi shard; worker chỉ prune shard của mình
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.pragmas = pragmas or {}
+        self.archiver = archiver
+        self.compactor = compactor
+
+        self.rows_deleted = 0
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._check_vacuum_mode()
+        self._thread = threading.Thread(target=self._run, name="pruner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """Prune mọi shard một lần; trả về tổng số dòng đã xóa"""
+        if self.archiver is not None:
+            self.archiver.run_once()
+        if self.compactor is not None:
+            self.compactor.run_once()
+        total = 0
+        for db_file in shard_files(self.db_file, self.shards, self.shard_ids):
+            conn = open_database(db_file, **self.pragmas)
+            try:
+                deleted = prune(conn, self.retention_days, self.batch_size, self.pause,
+                                self.vacuum_pages, stop_event=self._stop)
+            finally:
+                conn.close()
+            for target, count in deleted.items():
+                print(f"🧹 Pruned {count} rows from {target} ({db_file})")
+            total += sum(deleted.values())
+        self.rows_deleted += total
+        self.runs += 1
+        return total
+
+    def _check_vacuum_mode(self):
+        for db_file in shard_files(self.db_file, self.shards, self.shard_ids):
+            conn = open_database(db_file, **self.pragmas)
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            conn.close()
+            if mode != 2:
+                print(f"⚠️  {db_file} is not in auto_vacuum=INCREMENTAL mode; deleted pages are reused "
+                      f"but the file will not shrink. Run: python retention.py --enable-vacuum {db_file}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Pruner error: {e}")
+            self._stop.wait(self.interval)
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def enable_incremental_vacuum(db_file):
+    """Chuyển file cũ sang auto_vacuum=INCREMENTAL (VACUUM toàn bộ, cần khóa độc quyền)"""
+    conn = open_database(db_file)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    print(f"✅ {db_file}: auto_vacuum = {'INCREMENTAL' if mode == 2 else mode}")
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "--enable-vacuum":
+        for db_file in args[1:] or ["iot_garden_data.db"]:
+            enable_incremental_vacuum(db_file)
+        return
+
+    pruner = Pruner(args[0] if args else "iot_garden_data.db")
+    total = pruner.run_once()
+    print(f"✅ Prune finished: {total} rows deleted")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Sensor Rollups - Bảng tổng hợp 1 phút / 1 giờ / 1 ngày
+Mỗi batch sensor_data được gộp trước trong Python theo (độ phân giải, garden,
+bucket) rồi UPSERT vào sensor_rollup trong cùng transaction với các dòng thô,
+nên biểu đồ dài hạn chỉ đọc vài trăm dòng thay vì hàng triệu.
+"""
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+RESOLUTIONS = {
+    "1m": 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+
+# Vị trí cột trong một dòng sensor_data của batch_writer.INSERT_SQL
+COL_GARDEN, COL_RECV_MS, COL_TEMPERATURE, COL_HUMIDITY, COL_IS_RAINING, COL_RSSI = 0, 1, 3, 4, 7, 8
+
+# =============================================================================
+# SQL
+# =============================================================================
+# Bảng sensor_rollup được tạo (và backfill) trong migration 4 của schema.py
+
+UPSERT_SQL = """
+    INSERT INTO sensor_rollup (
+        resolution, garden, bucket_ms, samples, rain_count,
+        temp_count, temp_sum, temp_min, temp_max,
+        hum_count, hum_sum, hum_min, hum_max,
+        rssi_count, rssi_sum, rssi_min, rssi_max
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, garden, bucket_ms) DO UPDATE SET
+        samples = samples + excluded.samples,
+        rain_count = rain_count + excluded.rain_count,
+        temp_count = temp_count + excluded.temp_count,
+        temp_sum = temp_sum + excluded.temp_sum,
+        temp_min = min(coalesce(temp_min, excluded.temp_min), coalesce(excluded.temp_min, temp_min)),
+        temp_max = max(coalesce(temp_max, excluded.temp_max), coalesce(excluded.temp_max, temp_max)),
+        hum_count = hum_count + excluded.hum_count,
+        hum_sum = hum_sum + excluded.hum_sum,
+        hum_min = min(coalesce(hum_min, excluded.hum_min), coalesce(excluded.hum_min, hum_min)),
+        hum_max = max(coalesce(hum_max, excluded.hum_max), coalesce(excluded.hum_max, hum_max)),
+        rssi_count = rssi_count + excluded.rssi_count,
+        rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_min = min(coalesce(rssi_min, excluded.rssi_min), coalesce(excluded.rssi_min, rssi_min)),
+        rssi_max = max(coalesce(rssi_max, excluded.rssi_max), coalesce(excluded.rssi_max, rssi_max))
+"""
+
+# =============================================================================
+# INCREMENTAL AGGREGATION
+# =============================================================================
+
+def _add(acc, offset, value):
+    """Cộng một giá trị vào nhóm count/sum/min/max bắt đầu tại offset"""
+    if value is None:
+        return
+    acc[offset] += 1
+    acc[offset + 1] += value
+    if acc[offset + 2] is None or value < acc[offset + 2]:
+        acc[offset + 2] = value
+    if acc[offset + 3] is None or value > acc[offset + 3]:
+        acc[offset + 3] = value
+
+def aggregate(rows):
+    """Gộp các dòng sensor_data thành tham số cho UPSERT_SQL.
+
+    Mỗi (độ phân giải, garden, bucket) chỉ sinh một UPSERT dù batch có bao
+    nhiêu dòng.
+    """
+    buckets = {}
+    for row in rows:
+        garden = row[COL_GARDEN]
+        recv_ms = row[COL_RECV_MS]
+        if garden is None or recv_ms is None:
+            continue
+        for resolution in RESOLUTIONS.values():
+            key = (resolution, garden, recv_ms - recv_ms % resolution)
+            acc = buckets.get(key)
+            if acc is None:
+                # samples, rain_count, rồi count/sum/min/max cho temp, hum, rssi
+                acc = buckets[key] = [0, 0, 0, 0.0, None, None, 0, 0.0, None, None, 0, 0.0, None, None]
+            acc[0] += 1
+            if row[COL_IS_RAINING]:
+                acc[1] += 1
+            _add(acc, 2, row[COL_TEMPERATURE])
+            _add(acc, 6, row[COL_HUMIDITY])
+            _add(acc, 10, row[COL_RSSI])
+    return [key + tuple(acc) for key, acc in buckets.items()]
@@ -0,0 +1,349 @@
+"""
+Database Schema - Kết nối SQLite và migration có phiên bản
+Mở database ở chế độ WAL với các PRAGMA tinh chỉnh được, và áp dụng các
+migration theo thứ tự (ghi lại trong bảng schema_version) cho file cũ.
+
+Chạy trực tiếp để nâng cấp một file database:
+    python schema.py [iot_garden_data.db ...]
+"""
+
+import os
+import sqlite3
+import sys
+import zlib
+
+# =============================================================================
+# CONNECTION
+# =============================================================================
+
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",        # An toàn với WAL, chỉ fsync khi checkpoint
+    "cache_size": -16000,           # Số âm = KiB (16 MB page cache)
+    "mmap_size": 256 * 1024 * 1024, # Đọc qua mmap, giảm copy cho reader
+    "busy_timeout": 5000,           # ms chờ khóa thay vì lỗi "database is locked"
+    "journal_size_limit": 64 * 1024 * 1024,  # Cắt file -wal sau checkpoint
+}
+
+def open_database(db_file, journal_mode="WAL", **pragmas):
+    """Mở kết nối SQLite với journal_mode và PRAGMA đã chọn.
+
+    journal_mode=None bỏ qua việc đổi journal (dùng cho tiến trình chỉ đọc).
+    Các PRAGMA không truyền vào sẽ lấy từ DEFAULT_PRAGMAS.
+    """
+    options = dict(DEFAULT_PRAGMAS)
+    options.update(pragmas)
+
+    conn = sqlite3.connect(db_file, timeout=options["busy_timeout"] / 1000)
+    if journal_mode:
+        # auto_vacuum chỉ có tác dụng với file mới, nên phải đặt trước journal_mode;
+        # file cũ cần `python retention.py --enable-vacuum` một lần
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    for name, value in options.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+# =============================================================================
+# SHARDING
+# =============================================================================
+# Với DB_SHARDS > 1, mỗi garden (namespace topic, vd "demo/garden") luôn nằm
+# trong cùng một file: iot_garden_data.s0.db, iot_garden_data.s1.db, ...
+
+def shard_index(garden, shards):
+    """Shard chứa dữ liệu của garden (ổn định giữa các lần chạy)"""
+    if shards <= 1:
+        return 0
+    return zlib.crc32((garden or "").encode()) % shards
+
+def shard_file(db_file, index, shards):
+    """Tên file của shard; với 1 shard thì chính là db_file"""
+    if shards <= 1:
+        return db_file
+    base, ext = os.path.splitext(db_file)
+    return f"{base}.s{index}{ext}"
+
+def shard_files(db_file, shards, indices=None):
+    """File của mọi shard, hoặc chỉ các shard trong `indices`"""
+    if indices is None:
+        indices = range(max(shards, 1))
+    return [shard_file(db_file, i, shards) for i in indices]
+
+def worker_shards(shards, workers, worker):
+    """Các shard do worker `worker` (trong `workers` tiến trình logger) sở hữu.
+
+    Mỗi shard chỉ có đúng một worker ghi, nên các tiến trình không tranh khóa
+    ghi SQLite của nhau.
+    """
+    return [i for i in range(max(shards, 1)) if i % workers == worker]
+
+# Payload nhị phân gọn: thiết bị publish lên topic JSON + "/<encoding>",
+# vd demo/garden/sensor/state/msgpack (xem decoders.py)
+PAYLOAD_ENCODINGS = ("msgpack", "cbor")
+
+def split_encoding(topic):
+    """'demo/garden/sensor/state/msgpack' -> ('demo/garden/sensor/state', 'msgpack');
+    topic không có hậu tố encoding -> (topic, 'json')"""
+    head, _, last = topic.rpartition("/")
+    if last in PAYLOAD_ENCODINGS:
+        return head, last
+    return topic, "json"
+
+def garden_from_topic(topic):
+    """'demo/garden/sensor/state' (hoặc .../sensor/state/msgpack) -> 'demo/garden'"""
+    return split_encoding(topic)[0].rsplit("/", 2)[0]
+
+# =============================================================================
+# MIGRATIONS
+# =============================================================================
+# Mỗi migration là (version, mô tả, các bước). Một bước là câu SQL hoặc hàm
+# nhận `conn`. Chỉ THÊM migration mới vào cuối danh sách, không sửa cái cũ.
+
+def _spread_duplicate_recv_ms(conn, table):
+    """Dời recv_ms của các dòng trùng (garden, recv_ms) thêm 1 ms (giữ dòng id nhỏ nhất) tới khi hết trùng"""
+    while conn.execute(f"""
+        UPDATE {table} SET recv_ms = recv_ms + 1
+        WHERE id IN (SELECT b.id FROM {table} a JOIN {table} b
+                     ON a.garden = b.garden AND a.recv_ms = b.recv_ms AND a.id < b.id)
+    """).rowcount:
+        pass
+
+MIGRATIONS = [
+    (1, "initial tables", [
+        """
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_timestamp INTEGER,
+            temperature REAL,
+            humidity REAL,
+            rain_analog INTEGER,
+            rain_digital INTEGER,
+            is_raining BOOLEAN,
+            rssi INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS device_state (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_timestamp INTEGER,
+            light TEXT,
+            pump TEXT,
+            pumpSpeed INTEGER,
+            rssi INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS device_online (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_timestamp INTEGER,
+            online BOOLEAN,
+            device_id TEXT,
+            firmware TEXT,
+            rssi INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            command_type TEXT,
+            command_value TEXT,
+            source TEXT
+        )
+        """,
+    ]),
+    (2, "recv_ms epoch column and time indexes", [
+        # Thời điểm logger nhận message, epoch milliseconds (UTC)
+        "ALTER TABLE sensor_data ADD COLUMN recv_ms INTEGER",
+        "ALTER TABLE device_state ADD COLUMN recv_ms INTEGER",
+        "ALTER TABLE device_online ADD COLUMN recv_ms INTEGER",
+        "ALTER TABLE commands ADD COLUMN recv_ms INTEGER",
+        # Backfill từ cột TEXT timestamp (CURRENT_TIMESTAMP là UTC)
+        "UPDATE sensor_data SET recv_ms = CAST(strftime('%s', timestamp) AS INTEGER) * 1000 WHERE recv_ms IS NULL",
+        "UPDATE device_state SET recv_ms = CAST(strftime('%s', timestamp) AS INTEGER) * 1000 WHERE recv_ms IS NULL",
+        "UPDATE device_online SET recv_ms = CAST(strftime('%s', timestamp) AS INTEGER) * 1000 WHERE recv_ms IS NULL",
+        "UPDATE commands SET recv_ms = CAST(strftime('%s', timestamp) AS INTEGER) * 1000 WHERE recv_ms IS NULL",
+        # Covering index: truy vấn cửa sổ thời gian chỉ đọc index, không đọc bảng
+        "CREATE INDEX IF NOT EXISTS idx_sensor_data_recv ON sensor_data (recv_ms, temperature, humidity, is_raining)",
+        "CREATE INDEX IF NOT EXISTS idx_device_state_recv ON device_state (recv_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_device_online_recv ON device_online (recv_ms, online)",
+        "CREATE INDEX IF NOT EXISTS idx_device_online_device_recv ON device_online (device_id, recv_ms, online)",
+        "CREATE INDEX IF NOT EXISTS idx_commands_recv ON commands (recv_ms)",
+    ]),
+    (3, "garden column and per-device indexes", [
+        # garden = namespace topic của node; dữ liệu cũ đều đến từ demo/garden
+        "ALTER TABLE sensor_data ADD COLUMN garden TEXT",
+        "ALTER TABLE device_state ADD COLUMN garden TEXT",
+        "ALTER TABLE device_online ADD COLUMN garden TEXT",
+        "ALTER TABLE commands ADD COLUMN garden TEXT",
+        "UPDATE sensor_data SET garden = 'demo/garden' WHERE garden IS NULL",
+        "UPDATE device_state SET garden = 'demo/garden' WHERE garden IS NULL",
+        "UPDATE device_online SET garden = 'demo/garden' WHERE garden IS NULL",
+        "UPDATE commands SET garden = 'demo/garden' WHERE garden IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_sensor_data_garden_recv ON sensor_data (garden, recv_ms, temperature, humidity, is_raining)",
+        "CREATE INDEX IF NOT EXISTS idx_device_state_garden_recv ON device_state (garden, recv_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_device_online_garden_recv ON device_online (garden, recv_ms, online)",
+        "CREATE INDEX IF NOT EXISTS idx_commands_garden_recv ON commands (garden, recv_ms)",
+    ]),
+    (4, "sensor rollups (1m / 1h / 1d)", [
+        # SQL chép nguyên văn (không dùng rollups.py) để migration không đổi theo code
+        """
+        CREATE TABLE IF NOT EXISTS sensor_rollup (
+            resolution INTEGER NOT NULL,
+            garden TEXT NOT NULL,
+            bucket_ms INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            rain_count INTEGER NOT NULL,
+            temp_count INTEGER NOT NULL, temp_sum REAL NOT NULL, temp_min REAL, temp_max REAL,
+            hum_count INTEGER NOT NULL, hum_sum REAL NOT NULL, hum_min REAL, hum_max REAL,
+            rssi_count INTEGER NOT NULL, rssi_sum REAL NOT NULL, rssi_min REAL, rssi_max REAL,
+            PRIMARY KEY (resolution, garden, bucket_ms)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sensor_rollup_bucket ON sensor_rollup (resolution, bucket_ms)",
+        # Dựng rollup 1m / 1h / 1d từ sensor_data hiện có
+        """
+        INSERT OR REPLACE INTO sensor_rollup
+        SELECT 60000, garden, recv_ms / 60000 * 60000,
+               COUNT(*), SUM(CASE WHEN is_raining = 1 THEN 1 ELSE 0 END),
+               COUNT(temperature), TOTAL(temperature), MIN(temperature), MAX(temperature),
+               COUNT(humidity), TOTAL(humidity), MIN(humidity), MAX(humidity),
+               COUNT(rssi), TOTAL(rssi), MIN(rssi), MAX(rssi)
+        FROM sensor_data
+        WHERE recv_ms IS NOT NULL AND garden IS NOT NULL
+        GROUP BY garden, recv_ms / 60000
+        """,
+        """
+        INSERT OR REPLACE INTO sensor_rollup
+        SELECT 3600000, garden, recv_ms / 3600000 * 3600000,
+               COUNT(*), SUM(CASE WHEN is_raining = 1 THEN 1 ELSE 0 END),
+               COUNT(temperature), TOTAL(temperature), MIN(temperature), MAX(temperature),
+               COUNT(humidity), TOTAL(humidity), MIN(humidity), MAX(humidity),
+               COUNT(rssi), TOTAL(rssi), MIN(rssi), MAX(rssi)
+        FROM sensor_data
+        WHERE recv_ms IS NOT NULL AND garden IS NOT NULL
+        GROUP BY garden, recv_ms / 3600000
+        """,
+        """
+        INSERT OR REPLACE INTO sensor_rollup
+        SELECT 86400000, garden, recv_ms / 86400000 * 86400000,
+               COUNT(*), SUM(CASE WHEN is_raining = 1 THEN 1 ELSE 0 END),
+               COUNT(temperature), TOTAL(temperature), MIN(temperature), MAX(temperature),
+               COUNT(humidity), TOTAL(humidity), MIN(humidity), MAX(humidity),
+               COUNT(rssi), TOTAL(rssi), MIN(rssi), MAX(rssi)
+        FROM sensor_data
+        WHERE recv_ms IS NOT NULL AND garden IS NOT NULL
+        GROUP BY garden, recv_ms / 86400000
+        """,
+    ]),
+    (5, "last_seen_ms for change-only heartbeat tables", [
+        # Heartbeat trùng trạng thái không thêm dòng mới, chỉ kéo dài last_seen_ms
+        "ALTER TABLE device_state ADD COLUMN last_seen_ms INTEGER",
+        "ALTER TABLE device_online ADD COLUMN last_seen_ms INTEGER",
+        "UPDATE device_state SET last_seen_ms = recv_ms WHERE last_seen_ms IS NULL",
+        "UPDATE device_online SET last_seen_ms = recv_ms WHERE last_seen_ms IS NULL",
+    ]),
+    (6, "archive catalog", [
+        # Mỗi dòng là một file Parquet/Arrow do archive.py ghi ra (path tương đối thư mục archive)
+        """
+        CREATE TABLE IF NOT EXISTS archive_catalog (
+            table_name TEXT NOT NULL,
+            garden TEXT NOT NULL,
+            day_ms INTEGER NOT NULL,
+            part INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            format TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            min_recv_ms INTEGER NOT NULL,
+            max_recv_ms INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (table_name, garden, day_ms, part)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_archive_catalog_range ON archive_catalog (table_name, min_recv_ms, max_recv_ms)",
+    ]),
+    (7, "compressed sensor blocks", [
+        # Mỗi dòng là sensor_data của một garden trong một khung thời gian, nén bởi tscompress.py
+        """
+        CREATE TABLE IF NOT EXISTS sensor_blocks (
+            garden TEXT NOT NULL,
+            start_ms INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            min_recv_ms INTEGER NOT NULL,
+            max_recv_ms INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (garden, start_ms)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sensor_blocks_range ON sensor_blocks (min_recv_ms, max_recv_ms)",
+    ]),
+    (8, "unique (garden, recv_ms) for idempotent replay", [
+        # Dòng cũ trùng (garden, recv_ms) (recv_ms backfill theo giây ở migration 2, hai
+        # message trong cùng ms) được dời +1 ms thay vì xóa, rồi mới tạo UNIQUE index
+        lambda conn: _spread_duplicate_recv_ms(conn, "sensor_data"),
+        lambda conn: _spread_duplicate_recv_ms(conn, "device_state"),
+        lambda conn: _spread_duplicate_recv_ms(conn, "device_online"),
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sensor_data_unique ON sensor_data (garden, recv_ms)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_device_state_unique ON device_state (garden, recv_ms)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_device_online_unique ON device_online (garden, recv_ms)",
+    ]),
+]
+
+def current_version(conn):
+    """Phiên bản schema hiện tại của file (0 nếu chưa có bảng schema_version)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Áp dụng các migration còn thiếu, mỗi migration một transaction.
+
+    Trả về danh sách (version, mô tả) đã áp dụng. Với WAL, reader vẫn đọc
+    được trong lúc migration chạy; chỉ writer phải chờ transaction ngắn.
+    """
+    applied = []
+    version = current_version(conn)
+    for number, name, steps in migrations:
+        if number <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (number, name))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append((number, name))
+    return applied
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    db_files = sys.argv[1:] or ["iot_garden_data.db"]
+    for db_file in db_files:
+        conn = open_database(db_file)
+        before = current_version(conn)
+        applied = migrate(conn)
+        for number, name in applied:
+            print(f"✅ Applied migration {number}: {name}")
+        print(f"💾 {db_file}: schema version {before} → {current_version(conn)}")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+"""
+Time-Series Compression - Nén sensor_data thành block theo thời gian (kiểu Gorilla)
+Mỗi (garden, khung BLOCK_MS) được đóng gói thành một BLOB trong bảng
+sensor_blocks rồi xóa khỏi sensor_data trong cùng một transaction:
+
+    recv_ms, device_timestamp   delta-of-delta (mẫu đều 3 s -> hầu hết 1 bit)
+    số nguyên / số thập phân    delta của giá trị nhân 10^k (31.5 -> 315), không mất mát
+    float bất kỳ                XOR với giá trị trước (Gorilla)
+
+Mỗi giá trị delta dùng tiền tố độ dài (0 | 10+7 | 110+9 | 1110+12 | 11110+32
+| 11111+64 bit). Cột có NULL thêm một bit "có giá trị" mỗi mẫu. Cột
+timestamp (TEXT) không lưu: khi đọc được dựng lại từ recv_ms (UTC, giây).
+Rollup không đổi nên biểu đồ dài hạn không cần giải nén.
+
+Chạy trực tiếp:
+    python tscompress.py [iot_garden_data.db] [--hours 24]   # nén rồi in báo cáo byte/mẫu
+    python tscompress.py [iot_garden_data.db] --report       # chỉ in báo cáo
+"""
+
+import bisect
+import itertools
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+
+from schema import open_database, migrate, shard_files
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+COMPRESS_AFTER_HOURS = 24       # Chỉ nén block đã kết thúc trước mốc này
+BLOCK_MS = 60 * 60 * 1000       # Một block = một giờ của một garden (~1200 mẫu)
+MAX_DECIMALS = 4                # Số chữ số thập phân tối đa để nén kiểu delta
+MAX_EXACT = 1 << 60             # |giá trị| (sau khi nhân 10^k) lớn hơn: dùng XOR cho khỏi tràn 64 bit
+
+HOUR_MS = 60 * 60 * 1000
+FORMAT_VERSION = 1
+
+# Cột lưu trong block, theo thứ tự (garden nằm ở cột của bảng sensor_blocks)
+BLOCK_COLUMNS = ("recv_ms", "device_timestamp", "temperature", "humidity",
+                 "rain_analog", "rain_digital", "is_raining", "rssi")
+TIME_COLUMNS = ("recv_ms", "device_timestamp")
+
+KIND_NULL, KIND_DOD, KIND_DELTA, KIND_XOR = range(4)
+
+# (số bit, tiền tố) cho số nguyên có dấu; 0 mã hóa bằng một bit "0"
+BUCKETS = ((7, "10"), (9, "110"), (12, "1110"), (32, "11110"), (64, "11111"))
+
+_double = struct.Struct(">d")
+_header = struct.Struct("<BI")
+
+# =============================================================================
+# BIT STREAM
+# =============================================================================
+
+class _BitReader:
+    def __init__(self, data):
+        self.bits = format(int.from_bytes(data, "big"), f"0{len(data) * 8}b") if data else ""
+        self.pos = 0
+
+    def read(self, width):
+        value = int(self.bits[self.pos:self.pos + width], 2)
+        self.pos += width
+        return value
+
+    def read_signed(self, width):
+        value = self.read(width)
+        return value - (1 << width) if value >= 1 << (width - 1) else value
+
+    def flag(self):
+        self.pos += 1
+        return self.bits[self.pos - 1] == "1"
+
+def _put(bits, value, width):
+    """Ghi `value` (bù hai nếu âm) thành `width` bit"""
+    bits.append(format(value & ((1 << width) - 1), f"0{width}b"))
+
+def _put_varint(bits, value):
+    if value == 0:
+        bits.append("0")
+        return
+    for width, prefix in BUCKETS:
+        if -(1 << (width - 1)) <= value < 1 << (width - 1):
+            bits.append(prefix)
+            _put(bits, value, width)
+            return
+    raise ValueError(f"value out of range: {value}")
+
+_WIDTHS = (0,) + tuple(width for width, _ in BUCKETS)
+
+# =============================================================================
+# COLUMN CODECS
+# =============================================================================
+
+def _decimals(values):
+    """Số chữ số thập phân k nhỏ nhất để mọi giá trị = round(v * 10^k) / 10^k, hoặc None"""
+    largest = max(abs(v) for v in values)
+    for k in range(MAX_DECIMALS + 1):
+        scale = 10 ** k
+        if largest * scale >= MAX_EXACT:
+            return None
+        if all(round(v * scale) / scale == v for v in values):
+            return k
+    return None
+
+def _choose_kind(name, values):
+    if not values:
+        return KIND_NULL, 0, False
+    is_float = any(v.__class__ is float for v in values)
+    if any(v != v or abs(v) >= MAX_EXACT for v in values):
+        return KIND_XOR, 0, True            # NaN / vô cực / số quá lớn: giữ nguyên bit
+    if not is_float:
+        return (KIND_DOD if name in TIME_COLUMNS else KIND_DELTA), 0, False
+    k = _decimals(values)
+    return (KIND_XOR, 0, True) if k is None else (KIND_DELTA, k, True)
+
+def _encode_delta(bits, ints, dod):
+    _put(bits, ints[0], 64)
+    prev, prev_delta = ints[0], 0
+    for v in ints[1:]:
+        delta = v - prev
+        _put_varint(bits, delta - prev_delta if dod else delta)
+        prev, prev_delta = v, delta
+
+def _decode_delta(reader, count, dod):
+    # Vòng lặp nóng khi đọc: dùng biến cục bộ thay cho method của _BitReader;
+    # số bit 1 của tiền tố = vị trí bit 0 đầu tiên (str.find chạy trong C)
+    v = reader.read_signed(64)
+    bits, pos = reader.bits, reader.pos
+    out = [v]
+    append = out.append
+    delta = 0
+    while len(out) < count:
+        end = bits.find("0", pos, pos + 5)
+        if end == pos:
+            # Chuỗi bước 0 liên tiếp (giá trị / khoảng cách không đổi): thêm một lần
+            left = count - len(out)
+            run = bits.find("1", pos, pos + left)
+            run = (run if run >= 0 else pos + left) - pos
+            pos += run
+            if not dod:
+                delta = 0
+            if delta:
+                out.extend(range(v + delta, v + delta * run + (1 if delta > 0 else -1), delta))
+                v += delta * run
+            else:
+                out.extend([v] * run)
+            continue
+        if end < 0:
+            ones, pos = 5, pos + 5
+        else:
+            ones, pos = end - pos, end + 1
+        width = _WIDTHS[ones]
+        step = int(bits[pos:pos + width], 2)
+        pos += width
+        if step >= 1 << (width - 1):
+            step -= 1 << width
+        if dod:
+            delta += step
+        else:
+            delta = step
+        v += delta
+        append(v)
+    reader.pos = pos
+    return out
+
+def _encode_xor(bits, values):
+    prev_bits = int.from_bytes(_double.pack(float(values[0])), "big")
+    _put(bits, prev_bits, 64)
+    lead, tail = 65, 0                      # Chưa có cửa sổ bit nào
+    for v in values[1:]:
+        cur = int.from_bytes(_double.pack(float(v)), "big")
+        xor = cur ^ prev_bits
+        prev_bits = cur
+        if xor == 0:
+            bits.append("0")
+            continue
+        new_lead = min(64 - xor.bit_length(), 31)
+        new_tail = (xor & -xor).bit_length() - 1
+        if new_lead >= lead and new_tail >= tail:
+            # Bit có nghĩa nằm trong cửa sổ của giá trị trước
+            bits.append("10")
+            _put(bits, xor >> tail, 64 - lead - tail)
+        else:
+            lead, tail = new_lead, new_tail
+            size = 64 - lead - tail
+            bits.append("11")
+            _put(bits, lead, 5)
+            _put(bits, size - 1, 6)
+            _put(bits, xor >> tail, size)
+
+def _decode_xor(reader, count):
+    prev_bits = reader.read(64)
+    out = [_double.unpack(prev_bits.to_bytes(8, "big"))[0]]
+    lead = tail = 0
+    for _ in range(count - 1):
+        if reader.flag():
+            if reader.flag():
+                lead = reader.read(5)
+                tail = 64 - lead - (reader.read(6) + 1)
+            prev_bits ^= reader.read(64 - lead - tail) << tail
+        out.append(_double.unpack(prev_bits.to_bytes(8, "big"))[0])
+    return out
+
+# =============================================================================
+# BLOCKS
+# =============================================================================
+
+def encode_block(rows):
+    """Danh sách dòng (theo BLOCK_COLUMNS, sắp theo recv_ms) -> bytes"""
+    bits = []
+    for index, name in enumerate(BLOCK_COLUMNS):
+        column = [row[index] for row in rows]
+        values = [v for v in column if v is not None]
+        kind, decimals, is_float = _choose_kind(name, values)
+        _put(bits, kind, 2)
+        if kind == KIND_NULL:
+            continue
+        has_nulls = len(values) < len(column)
+        bits.append("1" if has_nulls else "0")
+        if has_nulls:
+            bits.append("".join("0" if v is None else "1" for v in column))
+        if kind == KIND_XOR:
+            _encode_xor(bits, values)
+            continue
+        if kind == KIND_DELTA:
+            bits.append("1" if is_float else "0")
+            _put(bits, decimals, 3)
+            scale = 10 ** decimals
+            values = [round(v * scale) for v in values] if is_float else [int(v) for v in values]
+        _encode_delta(bits, values, kind == KIND_DOD)
+    stream = "".join(bits)
+    padded = stream + "0" * (-len(stream) % 8)
+    body = int(padded, 2).to_bytes(len(padded) // 8, "big") if padded else b""
+    return _header.pack(FORMAT_VERSION, len(rows)) + body
+
+def decode_columns(data):
+    """bytes -> danh sách cột (mỗi cột một list) theo BLOCK_COLUMNS"""
+    version, count = _header.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unknown block format version: {version}")
+    reader = _BitReader(data[_header.size:])
+    columns = []
+    for _ in BLOCK_COLUMNS:
+        kind = reader.read(2)
+        if kind == KIND_NULL:
+            columns.append([None] * count)
+            continue
+        present = None
+        if reader.flag():
+            present = [reader.flag() for _ in range(count)]
+        size = count if present is None else sum(present)
+        if kind == KIND_XOR:
+            values = _decode_xor(reader, size)
+        else:
+            is_float = kind == KIND_DELTA and reader.flag()
+            decimals = reader.read(3) if kind == KIND_DELTA else 0
+            values = _decode_delta(reader, size, kind == KIND_DOD)
+            if is_float:
+                scale = 10 ** decimals
+                values = [v / scale for v in values]
+        if present is not None:
+            it = iter(values)
+            values = [next(it) if p else None for p in present]
+        columns.append(values)
+    return columns
+
+def decode_block(data):
+    """bytes -> danh sách dòng theo BLOCK_COLUMNS"""
+    return list(zip(*decode_columns(data)))
+
+def row_timestamp(recv_ms):
+    """Giá trị cột timestamp (CURRENT_TIMESTAMP, UTC) dựng lại từ recv_ms"""
+    return datetime.fromtimestamp(recv_ms // 1000, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+# =============================================================================
+# COMPACTION
+# =============================================================================
+
+def compact_block(conn, garden, start_ms, block_ms=BLOCK_MS):
+    """Nén sensor_data của garden trong [start_ms, start_ms + block_ms).
+
+    Dữ liệu đến trễ cho block đã nén được gộp vào block cũ. Trả về
+    (số dòng đã nén, số byte của block, số mẫu trong block).
+
+    Khóa ghi (BEGIN IMMEDIATE) được lấy trước SELECT: nếu không, dòng mà
+    logger commit giữa SELECT và DELETE theo khoảng recv_ms sẽ bị xóa mà
+    chưa được nén.
+    """
+    columns = ", ".join(BLOCK_COLUMNS)
+    with conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"""
+            SELECT {columns} FROM sensor_data
+            WHERE garden = ? AND recv_ms >= ? AND recv_ms < ?
+            ORDER BY recv_ms
+        """, (garden, start_ms, start_ms + block_ms)).fetchall()
+        if not rows:
+            return 0, 0, 0
+        existing = conn.execute("SELECT data FROM sensor_blocks WHERE garden = ? AND start_ms = ?",
+                                (garden, start_ms)).fetchone()
+        merged = rows
+        if existing is not None:
+            merged = sorted(decode_block(existing[0]) + rows, key=lambda row: row[0])
+        data = encode_block(merged)
+        conn.execute("""
+            INSERT OR REPLACE INTO sensor_blocks (garden, start_ms, samples, min_recv_ms, max_recv_ms, data)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (garden, start_ms, len(merged), merged[0][0], merged[-1][0], data))
+        conn.execute("DELETE FROM sensor_data WHERE garden = ? AND recv_ms >= ? AND recv_ms <= ?",
+                     (garden, start_ms, rows[-1][0]))
+    return len(rows), len(data), len(merged)
+
+def pending_blocks(conn, before_ms, block_ms=BLOCK_MS):
+    """Các (garden, start_ms) còn dữ liệu thô trong block kết thúc trước before_ms"""
+    return conn.execute(f"""
+        SELECT garden, recv_ms / {block_ms} * {block_ms} AS start_ms
+        FROM sensor_data
+        WHERE recv_ms < ? AND garden IS NOT NULL
+        GROUP BY garden, start_ms
+        ORDER BY start_ms
+    """, (before_ms - before_ms % block_ms,)).fetchall()
+
+class Compactor:
+    """Nén các block cũ hơn `after_hours` trên mọi shard (gọi từ retention.Pruner)"""
+
+    def __init__(self, db_file, after_hours=COMPRESS_AFTER_HOURS, block_ms=BLOCK_MS,
+                 shards=1, pragmas=None, shard_ids=None):
+        self.db_file = db_file
+        self.after_hours = after_hours
+        self.block_ms = block_ms
+        self.shards = shards
+        self.shard_ids = shard_ids      # None = mọi shard
+        self.pragmas = pragmas or {}
+        self.rows_compacted = 0
+        self.bytes_written = 0
+
+    def run_once(self, now_ms=None):
+        """Nén mọi shard một lần; trả về tổng số dòng đã nén"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        before_ms = now_ms - int(self.after_hours * HOUR_MS)
+        total = 0
+        for db_file in shard_files(self.db_file, self.shards, self.shard_ids):
+            conn = open_database(db_file, **self.pragmas)
+            try:
+                rows = size = samples = blocks = 0
+                for garden, start_ms in pending_blocks(conn, before_ms, self.block_ms):
+                    count, block_bytes, block_samples = compact_block(conn, garden, start_ms, self.block_ms)
+                    rows += count
+                    size += block_bytes
+                    samples += block_samples
+                    blocks += 1
+                if rows:
+                    print(f"🗜️  Compressed {rows} sensor rows into {blocks} blocks "
+                          f"({size / samples:.1f} B/sample, {db_file})")
+            finally:
+                conn.close()
+            total += rows
+            self.bytes_written += size
+        self.rows_compacted += total
+        return total
+
+# =============================================================================
+# READING
+# =============================================================================
+
+def iter_rows(conn, garden, from_ms, to_ms, columns=BLOCK_COLUMNS):
+    """Các dòng đã nén trong [from_ms, to_ms) dạng tuple theo `columns`, sắp theo recv_ms.
+
+    `columns` có thể gồm garden và timestamp (dựng lại từ recv_ms). Giải nén
+    từng khung thời gian một (mọi garden của khung đó) nên bộ nhớ cỡ một block.
+    """
+    sql = """
+        SELECT garden, start_ms, data FROM sensor_blocks
+        WHERE max_recv_ms >= ? AND min_recv_ms < ?
+    """
+    params = (from_ms, to_ms)
+    if garden:
+        sql += " AND garden = ?"
+        params += (garden,)
+    pending = []
+    current = None
+    for block_garden, start_ms, data in conn.execute(sql + " ORDER BY start_ms, garden", params):
+        if start_ms != current and pending:
+            pending.sort(key=lambda row: row[0])
+            yield from (row[1] for row in pending)
+            pending = []
+        current = start_ms
+        decoded = decode_columns(data)
+        recv = decoded[0]
+        lo = bisect.bisect_left(recv, from_ms)
+        hi = bisect.bisect_left(recv, to_ms)
+        if lo >= hi:
+            continue
+        selected = []
+        for name in columns:
+            if name == "garden":
+                selected.append(itertools.repeat(block_garden))
+            elif name == "timestamp":
+                selected.append(_timestamps(recv[lo:hi]))
+            else:
+                selected.append(decoded[BLOCK_COLUMNS.index(name)][lo:hi])
+        pending.extend(zip(recv[lo:hi], zip(*selected)))
+    pending.sort(key=lambda row: row[0])
+    yield from (row[1] for row in pending)
+
+def _timestamps(recv):
+    """row_timestamp cho cả cột: chỉ format ngày một lần, giờ:phút:giây tính bằng số học"""
+    days = {}
+    out = []
+    for recv_ms in recv:
+        day, second = divmod(recv_ms // 1000, 86400)
+        prefix = days.get(day)
+        if prefix is None:
+            prefix = days[day] = row_timestamp(day * 86400 * 1000)[:11]
+        minutes, second = divmod(second, 60)
+        out.append(f"{prefix}{minutes // 60:02d}:{minutes % 60:02d}:{second:02d}")
+    return out
+
+# =============================================================================
+# REPORT
+# =============================================================================
+
+def table_bytes(conn, table):
+    """Số byte trang của bảng và các index của nó (cần dbstat), hoặc None"""
+    names = [table] + [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,))]
+    try:
+        return conn.execute(f"""
+            SELECT SUM(pgsize) FROM dbstat WHERE name IN ({', '.join('?' * len(names))})
+        """, names).fetchone()[0] or 0
+    except Exception:       # SQLite build không có dbstat
+        return None
+
+def report(conn):
+    """Byte/mẫu của dòng sensor_data so với block nén (gồm cả index)"""
+    raw_rows = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+    blocks, samples, blob_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(samples), 0), COALESCE(SUM(length(data)), 0) FROM sensor_blocks").fetchone()
+    raw_bytes = table_bytes(conn, "sensor_data")
+    block_bytes = table_bytes(conn, "sensor_blocks")
+    return {
+        "raw_rows": raw_rows,
+        "raw_bytes": raw_bytes,
+        "raw_bytes_per_sample": raw_bytes / raw_rows if raw_rows and raw_bytes is not None else None,
+        "blocks": blocks,
+        "compressed_samples": samples,
+        "blob_bytes": blob_bytes,
+        "blob_bytes_per_sample": blob_bytes / samples if samples else None,
+        "block_bytes_per_sample": block_bytes / samples if samples and block_bytes is not None else None,
+    }
+
+def print_report(db_file, r):
+    fmt = lambda v: f"{v:.1f}" if v is not None else "N/A"
+    print(f"📏 {db_file}")
+    print(f"  • sensor_data rows:   {r['raw_rows']:>10}  {fmt(r['raw_bytes_per_sample']):>8} B/sample (table + indexes)")
+    print(f"  • compressed samples: {r['compressed_samples']:>10}  {fmt(r['block_bytes_per_sample']):>8} B/sample "
+          f"(table pages), {fmt(r['blob_bytes_per_sample'])} B/sample in {r['blocks']} blocks")
+    if r["raw_bytes_per_sample"] and r["block_bytes_per_sample"]:
+        print(f"  • ratio: {r['raw_bytes_per_sample'] / r['block_bytes_per_sample']:.1f}x smaller")
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def main():
+    args = sys.argv[1:]
+    hours = COMPRESS_AFTER_HOURS
+    only_report = "--report" in args
+    if only_report:
+        args.remove("--report")
+    if "--hours" in args:
+        i = args.index("--hours")
+        hours = float(args[i + 1])
+        del args[i:i + 2]
+    db_file = args[0] if args else "iot_garden_data.db"
+
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.close()
+
+    if not only_report:
+        total = Compactor(db_file, hours).run_once()
+        print(f"✅ Compression finished: {total} rows packed into sensor_blocks")
+    conn = open_database(db_file, journal_mode=None)
+    try:
+        print_report(db_file, report(conn))
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,202 +1,533 @@
 """
 Database Viewer - Xem dữ liệu từ SQLite database
 ĐÃ ĐƯỢC CẬP NHẬT CHO "demo/garden" (Dùng "light" và "pump")
+Hỗ trợ nhiều node: lọc theo garden và đọc qua các shard của mqtt_logger
 """
 
+import argparse
+import csv
+import heapq
+import io
+import json
+import os
 import sqlite3
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import sys
 
-DB_FILE = "iot_garden_data.db" 
+import archive
+import rollups
+import tscompress
+from schema import MIGRATIONS, open_database, migrate, shard_index, shard_file, shard_files
 
-def print_header(title):
+DB_FILE = "iot_garden_data.db"
+DB_SHARDS = 1   # Phải khớp với DB_SHARDS trong mqtt_logger.py
+QUERY_THREADS = 8  # Số shard được truy vấn song song (sqlite3 nhả GIL khi chạy câu lệnh)
+HEARTBEAT_GRACE_MS = 45 * 1000  # Mất 3 heartbeat (15 s) liên tiếp = coi như offline
+
+# Cột xuất ra của từng bảng (lệnh export)
+EXPORT_COLUMNS = {
+    "sensor_data": archive.COLUMNS,
+    "device_state": ("garden", "recv_ms", "timestamp", "device_timestamp", "light", "pump",
+                     "pumpSpeed", "rssi", "last_seen_ms"),
+    "device_online": ("garden", "recv_ms", "timestamp", "device_timestamp", "online", "device_id",
+                      "firmware", "rssi", "last_seen_ms"),
+    "commands": ("garden", "recv_ms", "timestamp", "command_type", "command_value", "source"),
+}
+EXPORT_CHUNK_ROWS = 5000        # Số dòng mỗi lần fetchmany
+EXPORT_WRITE_BYTES = 64 * 1024  # Gom output thành khối ~64 KB trước khi ghi
+
+def connect(db_file=DB_FILE):
+    """Kết nối chỉ đọc: dùng busy_timeout/mmap, không đổi journal_mode của logger"""
+    return open_database(db_file, journal_mode=None)
+
+def shards_for(garden=None):
+    """Các file cần đọc: chỉ shard chứa garden, hoặc tất cả các shard"""
+    if garden:
+        return [shard_file(DB_FILE, shard_index(garden, DB_SHARDS), DB_SHARDS)]
+    return shard_files(DB_FILE, DB_SHARDS)
+
+_query_pool = None
+
+def _query_file(db_file, sql, params):
+    conn = connect(db_file)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+def query_shards(sql, params=(), garden=None):
+    """Chạy cùng một truy vấn song song trên các shard liên quan, trả về kết quả của từng shard"""
+    global _query_pool
+    files = shards_for(garden)
+    if len(files) == 1:
+        return [_query_file(files[0], sql, params)]
+    if _query_pool is None:
+        _query_pool = ThreadPoolExecutor(QUERY_THREADS, thread_name_prefix="shard_query")
+    return list(_query_pool.map(lambda db_file: _query_file(db_file, sql, params), files))
+
+def garden_where(garden, prefix="WHERE"):
+    """Điều kiện lọc theo garden (dùng index (garden, recv_ms))"""
+    if garden:
+        return f"{prefix} garden = ?", (garden,)
+    return "", ()
+
+def latest_rows(table, columns, limit, garden=None):
+    """`limit` dòng mới nhất của bảng, gộp từ mọi shard theo recv_ms"""
+    where, params = garden_where(garden)
+    sql = f"""
+        SELECT recv_ms, {columns}
+        FROM {table}
+        {where}
+        ORDER BY recv_ms DESC
+        LIMIT ?
+    """
+    rows = [row for part in query_shards(sql, params + (limit,), garden) for row in part]
+    rows.sort(key=lambda row: row[0] or 0, reverse=True)
+    return [row[1:] for row in rows[:limit]]
+
+def _hot_rows(db_file, table, columns, from_ms, to_ms, garden, chunk_rows):
+    """Dòng còn trong SQLite, đọc theo chunk bằng fetchmany (bộ nhớ cố định)"""
+    where, params = garden_where(garden, prefix="AND")
+    conn = connect(db_file)
+    try:
+        cursor = conn.execute(f"""
+            SELECT {', '.join(columns)} FROM {table}
+            WHERE recv_ms >= ? AND recv_ms < ? {where}
+            ORDER BY recv_ms
+        """, (from_ms, to_ms) + params)
+        while True:
+            chunk = cursor.fetchmany(chunk_rows)
+            if not chunk:
+                break
+            yield from chunk
+    finally:
+        conn.close()
+
+def _archived_rows(db_file, columns, from_ms, to_ms, garden, chunk_rows):
+    conn = connect(db_file)
+    try:
+        yield from archive.iter_rows(conn, db_file, garden, from_ms, to_ms, columns, chunk_rows)
+    finally:
+        conn.close()
+
+def _compressed_rows(db_file, columns, from_ms, to_ms, garden):
+    conn = connect(db_file)
+    try:
+        yield from tscompress.iter_rows(conn, garden, from_ms, to_ms, columns)
+    finally:
+        conn.close()
+
+def range_rows(table, from_ms, to_ms, garden=None, columns=None, chunk_rows=5000):
+    """Generator các dòng trong [from_ms, to_ms) theo recv_ms, gộp mọi shard.
+
+    Với sensor_data, các ngày đã được archive.py chuyển ra Parquet/Arrow và
+    các block do tscompress.py nén cũng được đọc (giải nén khi đọc), người gọi
+    không cần phân biệt. `columns` phải chứa recv_ms.
+    """
+    columns = columns or EXPORT_COLUMNS[table]
+    key_index = list(columns).index("recv_ms")
+    sources = []
+    for db_file in shards_for(garden):
+        if table == "sensor_data":
+            sources.append(_archived_rows(db_file, columns, from_ms, to_ms, garden, chunk_rows))
+            sources.append(_compressed_rows(db_file, columns, from_ms, to_ms, garden))
+        sources.append(_hot_rows(db_file, table, columns, from_ms, to_ms, garden, chunk_rows))
+    return heapq.merge(*sources, key=lambda row: row[key_index])
+
+def since_ms(hours):
+    """Mốc epoch-ms của `hours` giờ trước, dùng với cột recv_ms có index"""
+    return int((time.time() - hours * 3600) * 1000)
+
+def online_ms(rows, start_ms, end_ms, grace_ms=HEARTBEAT_GRACE_MS):
+    """Thời gian online và thời gian quan sát (ms) của một garden trong [start_ms, end_ms).
+
+    `rows` là (recv_ms, last_seen_ms, online) theo thứ tự thời gian. Mỗi dòng giữ
+    trạng thái tới dòng kế tiếp; dòng online chỉ còn hiệu lực tới last_seen_ms +
+    grace_ms, sau đó (node im lặng) tính là offline.
+    """
+    online = observed = 0
+    for i, (recv_ms, last_seen_ms, is_online) in enumerate(rows):
+        begin = max(recv_ms, start_ms)
+        end = rows[i + 1][0] if i + 1 < len(rows) else end_ms
+        end = min(end, end_ms)
+        if end <= begin:
+            continue
+        observed += end - begin
+        if is_online:
+            online += max(0, min(end, (last_seen_ms or recv_ms) + grace_ms) - begin)
+    return online, observed
+
+def print_header(title, garden=None):
+    if garden:
+        title = f"{title} - {garden}"
     print("\n" + "="*80)
     print(f"  {title}")
     print("="*80)
 
-def view_sensor_data(limit=20):
-    # (Hàm này giữ nguyên)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT timestamp, temperature, humidity, rain_analog, is_raining, rssi
-        FROM sensor_data
-        ORDER BY id DESC
-        LIMIT ?
-    """, (limit,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    print_header(f"🌡️  SENSOR DATA (Latest {limit} records)")
-    print(f"{'Time':<20} {'Temp (°C)':<12} {'Humidity (%)':<15} {'Rain Analog':<15} {'Is Raining?':<15} {'RSSI (dBm)':<12}")
-    print("-"*90)
-    
+def view_sensor_data(limit=20, garden=None):
+    """Xem dữ liệu cảm biến mới nhất"""
+    rows = latest_rows("sensor_data",
+                       "timestamp, garden, temperature, humidity, rain_analog, is_raining, rssi",
+                       limit, garden)
+
+    print_header(f"🌡️  SENSOR DATA (Latest {limit} records)", garden)
+    print(f"{'Time':<20} {'Garden':<16} {'Temp (°C)':<12} {'Humidity (%)':<15} {'Rain Analog':<15} {'Is Raining?':<15} {'RSSI (dBm)':<12}")
+    print("-"*106)
+
     for row in rows:
-        timestamp, temp, hum, rain_a, is_rain, rssi = row
+        timestamp, row_garden, temp, hum, rain_a, is_rain, rssi = row
         rssi_str = str(rssi) if rssi is not None else "N/A"
         temp_str = f"{temp:.1f}" if temp is not None else "N/A"
         hum_str = f"{hum:.1f}" if hum is not None else "N/A"
         rain_a_str = str(rain_a) if rain_a is not None else "N/A"
         is_rain_str = "YES" if is_rain else "NO"
-        
-        print(f"{timestamp:<20} {temp_str:<12} {hum_str:<15} {rain_a_str:<15} {is_rain_str:<15} {rssi_str:<12}")
-    
+        garden_str = row_garden or "N/A"
+
+        print(f"{timestamp:<20} {garden_str:<16} {temp_str:<12} {hum_str:<15} {rain_a_str:<15} {is_rain_str:<15} {rssi_str:<12}")
+
     print(f"\nTotal records: {len(rows)}")
 
-def view_device_state(limit=20):
+def view_device_state(limit=20, garden=None):
     """Xem trạng thái thiết bị"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # <<< SỬA: Đổi lại thành 'light'
-    cursor.execute("""
-        SELECT timestamp, light, pump, pumpSpeed, rssi
-        FROM device_state
-        ORDER BY id DESC
-        LIMIT ?
-    """, (limit,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    print_header(f"💡 DEVICE STATE (Latest {limit} records)")
-    # <<< SỬA: Cập nhật tiêu đề
-    print(f"{'Time':<20} {'Light':<10} {'Pump':<10} {'Pump Speed (%)':<18} {'RSSI (dBm)':<12}")
-    print("-"*80)
-    
+    rows = latest_rows("device_state", "timestamp, garden, light, pump, pumpSpeed, rssi", limit, garden)
+
+    print_header(f"💡 DEVICE STATE (Latest {limit} records)", garden)
+    print(f"{'Time':<20} {'Garden':<16} {'Light':<10} {'Pump':<10} {'Pump Speed (%)':<18} {'RSSI (dBm)':<12}")
+    print("-"*96)
+
     for row in rows:
-        # <<< SỬA: Đổi lại thành 'light'
-        timestamp, light, pump, pumpSpeed, rssi = row
+        timestamp, row_garden, light, pump, pumpSpeed, rssi = row
         rssi_str = str(rssi) if rssi is not None else "N/A"
         pumpSpeed_str = str(pumpSpeed) if pumpSpeed is not None else "N/A"
         light_str = str(light) if light is not None else "N/A" # Xử lý lỗi None
         pump_str = str(pump) if pump is not None else "N/A"   # Xử lý lỗi None
+        garden_str = row_garden or "N/A"
+
+        print(f"{timestamp:<20} {garden_str:<16} {light_str:<10} {pump_str:<10} {pumpSpeed_str:<18} {rssi_str:<12}")
 
-        # <<< SỬA: Cập nhật in
-        print(f"{timestamp:<20} {light_str:<10} {pump_str:<10} {pumpSpeed_str:<18} {rssi_str:<12}")
-    
     print(f"\nTotal records: {len(rows)}")
 
-def view_online_status(limit=10):
-    # (Hàm này giữ nguyên)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT timestamp, online, device_id, firmware, rssi
-        FROM device_online
-        ORDER BY id DESC
-        LIMIT ?
-    """, (limit,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    print_header(f"🟢 ONLINE STATUS (Latest {limit} records)")
-    print(f"{'Time':<20} {'Status':<10} {'Device ID':<20} {'Firmware':<20} {'RSSI':<10}")
-    print("-"*80)
-    
+def view_online_status(limit=10, garden=None):
+    """Xem lịch sử online/offline"""
+    rows = latest_rows("device_online", "timestamp, garden, online, device_id, firmware, rssi", limit, garden)
+
+    print_header(f"🟢 ONLINE STATUS (Latest {limit} records)", garden)
+    print(f"{'Time':<20} {'Garden':<16} {'Status':<10} {'Device ID':<20} {'Firmware':<20} {'RSSI':<10}")
+    print("-"*96)
+
     for row in rows:
-        timestamp, online, device_id, firmware, rssi = row
+        timestamp, row_garden, online, device_id, firmware, rssi = row
         status = "🟢 Online" if online else "🔴 Offline"
         device_id = device_id or "N/A"
         firmware = firmware or "N/A"
         rssi_str = str(rssi) if rssi is not None else "N/A"
-        print(f"{timestamp:<20} {status:<10} {device_id:<20} {firmware:<20} {rssi_str:<10}")
-    
+        garden_str = row_garden or "N/A"
+        print(f"{timestamp:<20} {garden_str:<16} {status:<10} {device_id:<20} {firmware:<20} {rssi_str:<10}")
+
     print(f"\nTotal records: {len(rows)}")
 
-def view_commands(limit=20):
-    # (Hàm này giữ nguyên)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT timestamp, command_type, command_value, source
-        FROM commands
-        ORDER BY id DESC
-        LIMIT ?
-    """, (limit,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    print_header(f"📥 COMMAND HISTORY (Latest {limit} records)")
-    print(f"{'Time':<20} {'Type':<15} {'Value':<15} {'Source':<10}")
+def view_commands(limit=20, garden=None):
+    """Xem lịch sử lệnh điều khiển"""
+    rows = latest_rows("commands", "timestamp, garden, command_type, command_value, source", limit, garden)
+
+    print_header(f"📥 COMMAND HISTORY (Latest {limit} records)", garden)
+    print(f"{'Time':<20} {'Garden':<16} {'Type':<15} {'Value':<15} {'Source':<10}")
     print("-"*80)
-    
+
     for row in rows:
-        timestamp, cmd_type, cmd_value, source = row
-        print(f"{timestamp:<20} {cmd_type:<15} {cmd_value:<15} {source:<10}")
-    
+        timestamp, row_garden, cmd_type, cmd_value, source = row
+        garden_str = row_garden or "N/A"
+        print(f"{timestamp:<20} {garden_str:<16} {cmd_type:<15} {cmd_value:<15} {source:<10}")
+
     print(f"\nTotal records: {len(rows)}")
 
-def view_statistics():
-    # (Hàm này giữ nguyên)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    print_header("📊 DATABASE STATISTICS")
-    
-    cursor.execute("SELECT COUNT(*) FROM sensor_data")
-    sensor_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM device_state")
-    state_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM device_online")
-    online_count = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM commands")
-    cmd_count = cursor.fetchone()[0]
-    
-    print(f"📊 Total Records:")
-    print(f"  • Sensor Data:    {sensor_count:>8}")
-    print(f"  • Device State:   {state_count:>8}")
-    print(f"  • Online Status:  {online_count:>8}")
-    print(f"  • Commands:       {cmd_count:>8}")
-    
-    cursor.execute("""
-        SELECT AVG(temperature), AVG(humidity), MIN(temperature), MAX(temperature)
+def view_devices():
+    """Danh sách garden đã gửi dữ liệu, số mẫu và lần cuối nhận"""
+    parts = query_shards("""
+        SELECT garden, COUNT(*), MAX(recv_ms)
         FROM sensor_data
-        WHERE timestamp > datetime('now', '-24 hours')
+        GROUP BY garden
     """)
-    row = cursor.fetchone()
-    if row and row[0] is not None:
-        avg_temp, avg_hum, min_temp, max_temp = row
+    rows = sorted((row for part in parts for row in part), key=lambda row: row[0] or "")
+
+    print_header("🌿 DEVICES")
+    print(f"{'Garden':<24} {'Samples':>10}   {'Last Seen':<20}")
+    print("-"*60)
+
+    for row_garden, count, last_ms in rows:
+        last_seen = datetime.fromtimestamp(last_ms / 1000).strftime("%Y-%m-%d %H:%M:%S") if last_ms else "N/A"
+        print(f"{row_garden or 'N/A':<24} {count:>10}   {last_seen:<20}")
+
+    print(f"\nTotal devices: {len(rows)}")
+
+def view_statistics(garden=None):
+    """Thống kê tổng và 24 giờ qua (gộp từ mọi shard)"""
+    print_header("📊 DATABASE STATISTICS", garden)
+
+    where, params = garden_where(garden)
+    counts = {}
+    for table in ("sensor_data", "device_state", "device_online", "commands"):
+        parts = query_shards(f"SELECT COUNT(*) FROM {table} {where}", params, garden)
+        counts[table] = sum(part[0][0] for part in parts)
+    parts = query_shards(f"SELECT COALESCE(SUM(samples), 0) FROM sensor_blocks {where}", params, garden)
+    compressed = sum(part[0][0] for part in parts)
+
+    print(f"📊 Total Records:")
+    print(f"  • Sensor Data:    {counts['sensor_data']:>8}" + (f" (+{compressed} compressed)" if compressed else ""))
+    print(f"  • Device State:   {counts['device_state']:>8}")
+    print(f"  • Online Status:  {counts['device_online']:>8}")
+    print(f"  • Commands:       {counts['commands']:>8}")
+
+    where, params = garden_where(garden, prefix="AND")
+    cutoff = since_ms(24)
+    minute = rollups.RESOLUTIONS["1m"]
+
+    # Đọc rollup 1 phút (tối đa 1440 dòng mỗi garden) thay vì quét dữ liệu thô
+    parts = query_shards(f"""
+        SELECT SUM(temp_sum), SUM(temp_count), SUM(hum_sum), SUM(hum_count),
+               MIN(temp_min), MAX(temp_max), SUM(rain_count)
+        FROM sensor_rollup
+        WHERE resolution = ? AND bucket_ms >= ? {where}
+    """, (minute, cutoff - cutoff % minute) + params, garden)
+    rows = [part[0] for part in parts if part[0][1]]
+    if rows:
+        temp_count = sum(row[1] for row in rows)
+        hum_count = sum(row[3] for row in rows)
+        avg_temp = sum(row[0] for row in rows) / temp_count
+        avg_hum = sum(row[2] for row in rows) / hum_count if hum_count else 0.0
+        min_temp = min(row[4] for row in rows)
+        max_temp = max(row[5] for row in rows)
+        rain_events = sum(row[6] for row in rows)
         print(f"\n🌡️  Last 24 Hours:")
         print(f"  • Avg Temperature: {avg_temp:>6.1f}°C")
         print(f"  • Min Temperature: {min_temp:>6.1f}°C")
         print(f"  • Max Temperature: {max_temp:>6.1f}°C")
         print(f"  • Avg Humidity:    {avg_hum:>6.1f}%")
-        
-    cursor.execute("""
-        SELECT COUNT(*) 
-        FROM sensor_data
-        WHERE timestamp > datetime('now', '-24 hours') AND is_raining = 1
-    """)
-    row = cursor.fetchone()
-    if row and row[0] is not None:
-        rain_events = row[0]
         print(f"  • Rain Events:     {rain_events} records")
-    
-    cursor.execute("""
-        SELECT 
-            SUM(CASE WHEN online = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as uptime_pct
+
+    # device_online chỉ lưu khi trạng thái đổi, nên uptime tính theo thời gian chứ
+    # không theo số dòng: lấy dòng cuối trước cutoff (trạng thái đầu cửa sổ) + các dòng trong cửa sổ
+    now = int(time.time() * 1000)
+    parts = query_shards(f"""
+        SELECT garden, MAX(recv_ms), COALESCE(last_seen_ms, recv_ms), online
         FROM device_online
-        WHERE timestamp > datetime('now', '-24 hours')
-    """)
-    row = cursor.fetchone()
-    if row and row[0] is not None:
-        uptime = row[0]
+        WHERE recv_ms <= ? {where}
+        GROUP BY garden
+        UNION ALL
+        SELECT garden, recv_ms, COALESCE(last_seen_ms, recv_ms), online
+        FROM device_online
+        WHERE recv_ms > ? {where}
+    """, (cutoff,) + params + (cutoff,) + params, garden)
+    by_garden = {}
+    for part in parts:
+        for row_garden, recv_ms, last_seen_ms, is_online in part:
+            by_garden.setdefault(row_garden, []).append((recv_ms, last_seen_ms, is_online))
+    online_total = observed_total = 0
+    for rows in by_garden.values():
+        rows.sort()
+        online, observed = online_ms(rows, cutoff, now)
+        online_total += online
+        observed_total += observed
+    if observed_total:
+        uptime = online_total * 100.0 / observed_total
         print(f"\n🟢 Device Uptime (24h): {uptime:.1f}%")
-    
-    conn.close()
+
+def view_trend(garden=None, resolution="1h", hours=24):
+    """Xu hướng theo bucket từ bảng rollup (1m / 1h / 1d)"""
+    bucket = rollups.RESOLUTIONS[resolution]
+    cutoff = since_ms(hours)
+    where, params = garden_where(garden, prefix="AND")
+    parts = query_shards(f"""
+        SELECT bucket_ms, SUM(samples), SUM(temp_sum), SUM(temp_count), MIN(temp_min), MAX(temp_max),
+               SUM(hum_sum), SUM(hum_count), SUM(rain_count)
+        FROM sensor_rollup
+        WHERE resolution = ? AND bucket_ms >= ? {where}
+        GROUP BY bucket_ms
+    """, (bucket, cutoff - cutoff % bucket) + params, garden)
+
+    # Gộp cùng bucket từ nhiều shard
+    merged = {}
+    for part in parts:
+        for bucket_ms, samples, t_sum, t_count, t_min, t_max, h_sum, h_count, rain in part:
+            acc = merged.setdefault(bucket_ms, [0, 0.0, 0, None, None, 0.0, 0, 0])
+            acc[0] += samples
+            acc[1] += t_sum
+            acc[2] += t_count
+            acc[3] = t_min if acc[3] is None or (t_min is not None and t_min < acc[3]) else acc[3]
+            acc[4] = t_max if acc[4] is None or (t_max is not None and t_max > acc[4]) else acc[4]
+            acc[5] += h_sum
+            acc[6] += h_count
+            acc[7] += rain
+
+    print_header(f"📈 TREND ({resolution} buckets, last {hours}h)", garden)
+    print(f"{'Bucket':<20} {'Samples':>8} {'Avg °C':>8} {'Min °C':>8} {'Max °C':>8} {'Avg %':>8} {'Rain %':>8}")
+    print("-"*80)
+
+    for bucket_ms in sorted(merged):
+        samples, t_sum, t_count, t_min, t_max, h_sum, h_count, rain = merged[bucket_ms]
+        label = datetime.fromtimestamp(bucket_ms / 1000).strftime("%Y-%m-%d %H:%M")
+        avg_t = f"{t_sum / t_count:.1f}" if t_count else "N/A"
+        min_t = f"{t_min:.1f}" if t_min is not None else "N/A"
+        max_t = f"{t_max:.1f}" if t_max is not None else "N/A"
+        avg_h = f"{h_sum / h_count:.1f}" if h_count else "N/A"
+        print(f"{label:<20} {samples:>8} {avg_t:>8} {min_t:>8} {max_t:>8} {avg_h:>8} {rain * 100.0 / samples:>8.1f}")
+
+    print(f"\nTotal buckets: {len(merged)}")
+
+def view_history(garden=None, day=None):
+    """Tổng hợp theo giờ của một ngày (UTC) từ dữ liệu thô, kể cả phần đã archive"""
+    day = day or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    from_ms = int(start.timestamp() * 1000)
+    hour_ms = rollups.RESOLUTIONS["1h"]
+
+    hours = {}
+    for recv_ms, temp, hum, is_rain in range_rows("sensor_data", from_ms, from_ms + archive.DAY_MS, garden,
+                                                  ("recv_ms", "temperature", "humidity", "is_raining")):
+        acc = hours.setdefault(recv_ms - recv_ms % hour_ms, [0, 0.0, 0, None, None, 0.0, 0, 0])
+        acc[0] += 1
+        if temp is not None:
+            acc[1] += temp
+            acc[2] += 1
+            acc[3] = temp if acc[3] is None or temp < acc[3] else acc[3]
+            acc[4] = temp if acc[4] is None or temp > acc[4] else acc[4]
+        if hum is not None:
+            acc[5] += hum
+            acc[6] += 1
+        if is_rain:
+            acc[7] += 1
+
+    print_header(f"🗄️  HISTORY {day} UTC (raw rows, SQLite + archive)", garden)
+    print(f"{'Hour (UTC)':<20} {'Samples':>8} {'Avg °C':>8} {'Min °C':>8} {'Max °C':>8} {'Avg %':>8} {'Rain %':>8}")
+    print("-"*80)
+
+    for hour in sorted(hours):
+        samples, t_sum, t_count, t_min, t_max, h_sum, h_count, rain = hours[hour]
+        label = datetime.fromtimestamp(hour / 1000, timezone.utc).strftime("%Y-%m-%d %H:00")
+        avg_t = f"{t_sum / t_count:.1f}" if t_count else "N/A"
+        min_t = f"{t_min:.1f}" if t_min is not None else "N/A"
+        max_t = f"{t_max:.1f}" if t_max is not None else "N/A"
+        avg_h = f"{h_sum / h_count:.1f}" if h_count else "N/A"
+        print(f"{label:<20} {samples:>8} {avg_t:>8} {min_t:>8} {max_t:>8} {avg_h:>8} {rain * 100.0 / samples:>8.1f}")
+
+    print(f"\nTotal records: {sum(acc[0] for acc in hours.values())}")
+
+def view_compression():
+    """Byte/mẫu của sensor_data dạng dòng so với block nén, từng shard"""
+    print_header("🗜️  COMPRESSION (bytes per sensor sample)")
+    for db_file in shards_for():
+        conn = connect(db_file)
+        try:
+            tscompress.print_report(db_file, tscompress.report(conn))
+        finally:
+            conn.close()
+
+def view_all(garden=None):
+    view_statistics(garden)
+    view_sensor_data(10, garden)
+    view_device_state(10, garden)
+    view_online_status(5, garden)
+    view_commands(10, garden)
+
+def parse_time(value, now=None):
+    """'24h', '7d', '30m', '2026-10-01' hoặc '2026-10-01T12:00' (UTC) -> epoch ms"""
+    now = now if now is not None else time.time()
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if value[-1:] in units and value[:-1].replace(".", "", 1).isdigit():
+        return int((now - float(value[:-1]) * units[value[-1]]) * 1000)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def csv_chunks(columns, rows):
+    """Dòng -> các khối text CSV (~EXPORT_WRITE_BYTES), có dòng tiêu đề"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_WRITE_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def jsonl_chunks(columns, rows):
+    """Dòng -> các khối JSON Lines (~EXPORT_WRITE_BYTES)"""
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), ensure_ascii=False)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= EXPORT_WRITE_BYTES:
+            yield "\n".join(lines) + "\n"
+            lines = []
+            size = 0
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+EXPORT_FORMATS = {"csv": csv_chunks, "jsonl": jsonl_chunks}
+
+def export(table, from_ms, to_ms=None, garden=None, fmt="csv", out=None):
+    """Stream [from_ms, to_ms) của bảng ra `out` (mặc định stdout); trả về số dòng.
+
+    Pipeline generator: fetchmany -> gộp shard/archive -> định dạng -> ghi từng
+    khối, nên bộ nhớ không phụ thuộc độ dài khoảng thời gian.
+    """
+    out = out or sys.stdout
+    to_ms = to_ms if to_ms is not None else int(time.time() * 1000) + 1
+    columns = EXPORT_COLUMNS[table]
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    rows = range_rows(table, from_ms, to_ms, garden, columns, EXPORT_CHUNK_ROWS)
+    for chunk in EXPORT_FORMATS[fmt](columns, counted(rows)):
+        out.write(chunk)
+    out.flush()
+    return count
+
+def export_main(argv):
+    """view_database.py export --table sensor_data --since 24h [--until ...] [--format csv|jsonl]"""
+    parser = argparse.ArgumentParser(prog="view_database.py export",
+                                     description="Stream rows to CSV/JSON Lines with constant memory")
+    parser.add_argument("--table", choices=sorted(EXPORT_COLUMNS), default="sensor_data")
+    parser.add_argument("--since", default="24h", help="24h, 7d, 2026-10-01 or 2026-10-01T12:00 (UTC)")
+    parser.add_argument("--until", default=None, help="same formats as --since (default: now)")
+    parser.add_argument("--garden", default=None)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--output", "-o", default=None, help="file path (default: stdout)")
+    args = parser.parse_args(argv)
+
+    from_ms = parse_time(args.since)
+    to_ms = parse_time(args.until) if args.until else None
+    start = time.perf_counter()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            count = export(args.table, from_ms, to_ms, args.garden, args.format, out)
+    else:
+        count = export(args.table, from_ms, to_ms, args.garden, args.format)
+    elapsed = time.perf_counter() - start
+
+    # Thống kê ra stderr để stdout chỉ chứa dữ liệu
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Exported {count} rows from {args.table} in {elapsed:.2f}s ({rate:,.0f} rows/s)", file=sys.stderr)
 
 def interactive_menu():
-    # (Hàm này giữ nguyên)
+    """Menu tương tác; [8] chọn garden để lọc các màn hình còn lại"""
+    garden = None
     while True:
         print("\n" + "="*80)
         print("  📊 IoT DATABASE VIEWER (Garden Version)")
+        print(f"  🌿 Garden filter: {garden or 'all'}")
         print("="*80)
         print("\n[1] View Sensor Data")
         print("[2] View Device State")
@@ -204,68 +535,122 @@ def interactive_menu():
         print("[4] View Command History")
         print("[5] View Statistics")
         print("[6] View All")
+        print("[7] View Devices")
+        print("[8] Set Garden Filter")
+        print("[9] View Trend (rollups)")
+        print("[10] View Day History (SQLite + archive)")
         print("[0] Exit")
-        
-        choice = input("\nSelect option (0-6): ").strip()
-        
+
+        choice = input("\nSelect option (0-10): ").strip()
+
         if choice == '1':
             limit = input("How many records? (default 20): ").strip() or "20"
-            view_sensor_data(int(limit))
+            view_sensor_data(int(limit), garden)
         elif choice == '2':
             limit = input("How many records? (default 20): ").strip() or "20"
-            view_device_state(int(limit))
+            view_device_state(int(limit), garden)
         elif choice == '3':
             limit = input("How many records? (default 10): ").strip() or "10"
-            view_online_status(int(limit))
+            view_online_status(int(limit), garden)
         elif choice == '4':
             limit = input("How many records? (default 20): ").strip() or "20"
-            view_commands(int(limit))
+            view_commands(int(limit), garden)
         elif choice == '5':
-            view_statistics()
+            view_statistics(garden)
         elif choice == '6':
-            view_statistics()
-            view_sensor_data(10)
-            view_device_state(10)
-            view_online_status(5)
-            view_commands(10)
+            view_all(garden)
+        elif choice == '7':
+            view_devices()
+        elif choice == '8':
+            garden = input("Garden (e.g. demo/garden, Enter = all): ").strip() or None
+        elif choice == '9':
+            resolution = input("Resolution 1m/1h/1d? (default 1h): ").strip() or "1h"
+            hours = input("How many hours? (default 24): ").strip() or "24"
+            view_trend(garden, resolution, int(hours))
+        elif choice == '10':
+            day = input("Day YYYY-MM-DD (UTC, default today): ").strip() or None
+            view_history(garden, day)
         elif choice == '0':
             print("\n👋 Goodbye!")
             break
         else:
             print("❌ Invalid option!")
 
-def main():
-    # (Hàm này giữ nguyên)
+def schema_version(db_file):
+    """Phiên bản schema của file, đọc mà không tạo bảng (0 = chưa migrate)"""
+    conn = connect(db_file)
     try:
-        conn = sqlite3.connect(DB_FILE)
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0
+    finally:
         conn.close()
-    except Exception as e:
+
+def check_databases():
+    """Viewer chỉ đọc: không tạo file thiếu, không tự migrate (dùng --migrate)"""
+    files = shard_files(DB_FILE, DB_SHARDS)
+    missing = [db_file for db_file in files if not os.path.exists(db_file)]
+    if missing:
+        print(f"❌ Database not found: {', '.join(missing)}")
+        print(f"Make sure '{DB_FILE}' exists. Run mqtt_logger.py first!")
+        return False
+    latest = MIGRATIONS[-1][0]
+    outdated = [db_file for db_file in files if schema_version(db_file) < latest]
+    if outdated:
+        print(f"❌ Old schema in {', '.join(outdated)} (need version {latest})")
+        print("Run: python view_database.py --migrate  (or python schema.py <file>)")
+        return False
+    return True
+
+def main():
+    if "--migrate" in sys.argv:
+        sys.argv.remove("--migrate")
+        for db_file in shard_files(DB_FILE, DB_SHARDS):
+            if not os.path.exists(db_file):
+                continue
+            conn = open_database(db_file)
+            for number, name in migrate(conn):
+                print(f"✅ {db_file}: applied migration {number}: {name}")
+            conn.close()
+    try:
+        if not check_databases():
+            return
+    except sqlite3.Error as e:
         print(f"❌ Cannot open database: {e}")
         print(f"Make sure '{DB_FILE}' exists. Run mqtt_logger.py first!")
         return
-    
-    if len(sys.argv) > 1:
+
+    if len(sys.argv) > 1 and sys.argv[1].lower() == 'export':
+        export_main(sys.argv[2:])
+    elif len(sys.argv) > 1:
         cmd = sys.argv[1].lower()
+        garden = sys.argv[2] if len(sys.argv) > 2 else None
         if cmd == 'sensor':
-            view_sensor_data()
+            view_sensor_data(garden=garden)
         elif cmd == 'state':
-            view_device_state()
+            view_device_state(garden=garden)
         elif cmd == 'online':
-            view_online_status()
+            view_online_status(garden=garden)
         elif cmd == 'commands':
-            view_commands()
+            view_commands(garden=garden)
         elif cmd == 'stats':
-            view_statistics()
+            view_statistics(garden)
+        elif cmd == 'devices':
+            view_devices()
+        elif cmd == 'trend':
+            view_trend(garden)
+        elif cmd == 'compression':
+            view_compression()
+        elif cmd == 'history':
+            view_history(garden, sys.argv[3] if len(sys.argv) > 3 else None)
         elif cmd == 'all':
-            view_statistics()
-            view_sensor_data(10)
-            view_device_state(10)
-            view_online_status(5)
-            view_commands(10)
+            view_all(garden)
         else:
-            print("Usage: python view_database.py [sensor|state|online|commands|stats|all]")
+            print("Usage: python view_database.py [sensor|state|online|commands|stats|devices|trend|compression|all] [garden]")
+            print("       python view_database.py history [garden] [YYYY-MM-DD]")
+            print("       python view_database.py export --table sensor_data --since 24h --format csv|jsonl [-o file]")
     else:
         interactive_menu()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -11,12 +11,29 @@ import threading
 from datetime import datetime
 import paho.mqtt.client as mqtt
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
 # Configuration - Using local Mosquitto broker in Docker
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 TOPIC_NS = "demo/room1"
 DEVICE_ID = "esp32_simulator"
 FIRMWARE_VERSION = "sim-1.0.0"
+# Payload encoding: "json", or compact "msgpack" / "cbor" published to <topic>/<encoding>
+PAYLOAD_ENCODING = "json"
+# Batch mode: buffer BATCH_SAMPLES readings and publish them as one message on
+# <ns>/sensor/batch (1 = publish every reading on sensor/state as before).
+# BATCH_FORMAT: "samples" (list of readings) or "delta" (column deltas, smallest)
+BATCH_SAMPLES = 1
+BATCH_FORMAT = "samples"
+SENSOR_INTERVAL = 3  # seconds between readings
 
 # Device state
 device_state = {
@@ -25,6 +42,9 @@ device_state = {
     "online": True
 }
 
+# Readings waiting for the next batch publish
+sensor_buffer = []
+
 # MQTT client
 client = mqtt.Client(client_id=f"{DEVICE_ID}_{int(time.time())}")
 
@@ -104,6 +124,14 @@ def handle_device_command(payload):
     except json.JSONDecodeError as e:
         print(f"❌ Invalid JSON command: {e}")
 
+def encode_payload(topic, data):
+    """Return (topic, payload) for PAYLOAD_ENCODING"""
+    if PAYLOAD_ENCODING == "msgpack":
+        return f"{topic}/msgpack", msgpack.packb(data)
+    if PAYLOAD_ENCODING == "cbor":
+        return f"{topic}/cbor", cbor2.dumps(data)
+    return topic, json.dumps(data)
+
 def publish_sensor_data():
     """Publish simulated sensor data"""
     topic = f"{TOPIC_NS}/sensor/state"
@@ -120,7 +148,19 @@ def publish_sensor_data():
         "lux": lux
     }
     
-    payload = json.dumps(data)
+    if BATCH_SAMPLES > 1:
+        # Batch samples use the logger's sensor/state field names
+        sensor_buffer.append({
+            "timestamp": int(time.time() * 1000),
+            "temperature": temp_c,
+            "humidity": hum_pct,
+            "rssi": random.randint(-70, -40)
+        })
+        if len(sensor_buffer) >= BATCH_SAMPLES:
+            publish_sensor_batch()
+        return
+    
+    topic, payload = encode_payload(topic, data)
     result = client.publish(topic, payload, qos=0)
     
     if result.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -128,6 +168,32 @@ def publish_sensor_data():
     else:
         print(f"❌ Failed to publish sensor data")
 
+def delta_block(samples):
+    """Column delta block: first value then differences, 0.1 units for temperature/humidity"""
+    scale = {"temperature": 10, "humidity": 10}
+    block = {"delta": {}, "scale": scale}
+    for key in ("timestamp", "temperature", "humidity", "rssi"):
+        column = [round(sample[key] * scale.get(key, 1)) for sample in samples]
+        block["delta"][key] = [column[0]] + [b - a for a, b in zip(column, column[1:])]
+    return block
+
+def publish_sensor_batch():
+    """Publish buffered readings as one sensor/batch message"""
+    samples = sensor_buffer[:]
+    sensor_buffer.clear()
+    if not samples:
+        return
+    data = delta_block(samples) if BATCH_FORMAT == "delta" else {"samples": samples}
+    topic, payload = encode_payload(f"{TOPIC_NS}/sensor/batch", data)
+    result = client.publish(topic, payload, qos=1)
+    
+    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+        last = samples[-1]
+        print(f"📦 Sensor batch: {len(samples)} samples ({len(payload)} bytes), "
+              f"last {last['temperature']}°C, {last['humidity']}%")
+    else:
+        print(f"❌ Failed to publish sensor batch")
+
 def publish_device_state():
     """Publish device state (retained)"""
     topic = f"{TOPIC_NS}/device/state"
@@ -143,7 +209,7 @@ def publish_device_state():
         "fw": FIRMWARE_VERSION
     }
     
-    payload = json.dumps(data)
+    topic, payload = encode_payload(topic, data)
     result = client.publish(topic, payload, qos=1, retain=True)
     
     if result.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -156,7 +222,7 @@ def publish_online_status(online):
     topic = f"{TOPIC_NS}/sys/online"
     
     data = {"online": online}
-    payload = json.dumps(data)
+    topic, payload = encode_payload(topic, data)
     result = client.publish(topic, payload, qos=1, retain=True)
     
     if result.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -169,6 +235,7 @@ def publish_online_status_clear():
     topic = f"{TOPIC_NS}/sys/online"
     
     # Publish empty payload to clear retained message
+    topic, _ = encode_payload(topic, {})
     result = client.publish(topic, "", qos=1, retain=True)
     
     if result.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -177,11 +244,11 @@ def publish_online_status_clear():
         print("❌ Failed to clear retained online status")
 
 def sensor_publisher():
-    """Background thread to publish sensor data every 3 seconds"""
+    """Background thread to read sensors every SENSOR_INTERVAL seconds"""
     while True:
         if client.is_connected():
             publish_sensor_data()
-        time.sleep(3)
+        time.sleep(SENSOR_INTERVAL)
 
 def heartbeat_publisher():
     """Background thread to publish device state and online status every 15 seconds"""
@@ -196,6 +263,13 @@ def main():
     print(f"📡 MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
     print(f"🏠 Topic Namespace: {TOPIC_NS}")
     print(f"🆔 Device ID: {DEVICE_ID}")
+    print(f"📦 Payload encoding: {PAYLOAD_ENCODING}")
+    if BATCH_SAMPLES > 1:
+        print(f"🧺 Batch mode: {BATCH_SAMPLES} samples per message ({BATCH_FORMAT}), "
+              f"up to {BATCH_SAMPLES * SENSOR_INTERVAL}s latency")
+    if PAYLOAD_ENCODING == "msgpack" and msgpack is None or PAYLOAD_ENCODING == "cbor" and cbor2 is None:
+        print(f"❌ PAYLOAD_ENCODING={PAYLOAD_ENCODING} needs: pip install {'msgpack' if PAYLOAD_ENCODING == 'msgpack' else 'cbor2'}")
+        return
     print("─" * 50)
     
     # Setup MQTT callbacks
@@ -204,7 +278,7 @@ def main():
     
     # Set Last Will Testament
     lwt_topic = f"{TOPIC_NS}/sys/online"
-    lwt_payload = json.dumps({"online": False})
+    lwt_topic, lwt_payload = encode_payload(lwt_topic, {"online": False})
     client.will_set(lwt_topic, lwt_payload, qos=1, retain=True)
     
     try:
@@ -232,6 +306,9 @@ def main():
     except KeyboardInterrupt:
         print("\n🛑 Shutting down simulator...")
         
+        # Send readings still in the batch buffer
+        publish_sensor_batch()
+        
         # Publish offline status
         publish_online_status(False)
         time.sleep(1)  # Wait for message to be sent
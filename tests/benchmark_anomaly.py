@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Anomaly Detection Benchmark
+Sinh một đàn garden tổng hợp (nhiệt độ / độ ẩm theo chu kỳ ngày, rain_analog,
+RSSI) rồi cài lỗi vào một số garden: DHT đứng im, RSSI sụt, gai nhiệt độ
+(6 giờ cuối) và cảm biến mưa trôi dần (24 giờ cuối). Đo alerts/anomaly.py:
+
+    - thông lượng chấm điểm theo kích thước lô (lô 1 = chấm từng mẫu)
+    - tỉ lệ phát hiện đúng garden lỗi và số garden khỏe bị báo nhầm
+
+Cần numpy. Usage: python tests/benchmark_anomaly.py [gardens] [hours]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+import numpy as np
+
+from anomaly import AnomalyDetector, CHANNEL_INDEX, FIELDS
+
+INTERVAL = 30.0             # Giây giữa hai mẫu (thưa hơn firmware để chạy nhiều ngày nhanh)
+START = 1_700_000_000.0
+FAULT_HOURS = 6             # Lỗi bắt đầu 6 giờ trước khi kết thúc
+
+# Ngưỡng giống ANOMALY_RULES trong rules.py
+LIMITS = {
+    "spike": (("zscore", "temperature"), 5.0),
+    "stuck": (("flatline", "dht"), 30),
+    "drift": (("drift", "rain_analog"), 25),
+    "rssi": (("rssi_collapse", "rssi"), 15),
+}
+
+def build_fleet(gardens, hours, seed=3):
+    """(times [ticks], X [ticks, gardens, len(FIELDS)], {lỗi: mảng garden})"""
+    rng = np.random.default_rng(seed)
+    ticks = int(hours * 3600 / INTERVAL)
+    times = START + np.arange(ticks) * INTERVAL
+    day = np.sin(2 * np.pi * ((times + 7 * 3600) / 86400 - 0.375))[:, None]    # Đỉnh ~15h
+    X = np.empty((ticks, gardens, len(FIELDS)))
+    X[..., 0] = 27 + rng.uniform(-2, 2, gardens) + 4 * day + rng.normal(0, 0.3, (ticks, gardens))
+    X[..., 1] = 65 + rng.uniform(-5, 5, gardens) - 12 * day + rng.normal(0, 1.0, (ticks, gardens))
+    X[..., 2] = 3000 + rng.uniform(-300, 300, gardens) + rng.normal(0, 15, (ticks, gardens))
+    X[..., 3] = -60 + rng.uniform(-10, 10, gardens) + rng.normal(0, 2, (ticks, gardens))
+    X[..., 4] = 0
+    X[..., 0] = np.round(X[..., 0], 1)
+    X[..., 1] = np.round(X[..., 1], 1)
+    X[..., 3] = np.round(X[..., 3])
+
+    # Cài lỗi: mỗi loại 2% garden (khác nhau)
+    picked = rng.permutation(gardens)
+    share = max(gardens // 50, 1)
+    faults = {name: picked[i * share:(i + 1) * share] for i, name in enumerate(LIMITS)}
+    begin = ticks - int(FAULT_HOURS * 3600 / INTERVAL)
+    X[begin:, faults["stuck"], 0] = X[begin, faults["stuck"], 0]
+    X[begin:, faults["stuck"], 1] = X[begin, faults["stuck"], 1]
+    drift_begin = max(ticks - int(24 * 3600 / INTERVAL), 0)                  # Trôi chậm: +50% trong 24 h
+    X[drift_begin:, faults["drift"], 2] *= 1 + np.linspace(0, 0.5, ticks - drift_begin)[:, None]
+    X[begin:, faults["rssi"], 3] -= 25
+    X[begin + 60, faults["spike"], 0] += 12
+    return times, X, faults
+
+def run(detector, times, X, batch_size):
+    """Chấm cả chuỗi theo lô `batch_size` mẫu; trả về (giây, điểm lớn nhất [garden, kênh] trong giai đoạn lỗi)"""
+    ticks, gardens, _ = X.shape
+    slots = np.tile(np.array([detector.slot(f"site/g{g}") for g in range(gardens)]), ticks)
+    flat_t = np.repeat(times, gardens)
+    flat_X = X.reshape(-1, X.shape[2])
+    begin = (ticks - int(FAULT_HOURS * 3600 / INTERVAL)) * gardens
+    peak = np.full((gardens, len(CHANNEL_INDEX)), -np.inf)
+    start = time.perf_counter()
+    for i in range(0, len(slots), batch_size):
+        scores = detector.score_batch(slots[i:i + batch_size], flat_t[i:i + batch_size], flat_X[i:i + batch_size])
+        if i + batch_size > begin:
+            j = max(begin - i, 0)
+            np.fmax.at(peak, slots[i + j:i + batch_size], scores[j:])
+    return time.perf_counter() - start, peak
+
+def main():
+    gardens = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 72
+    times, X, faults = build_fleet(gardens, hours)
+    samples = X.shape[0] * gardens
+    print(f"\n🔎 {gardens} gardens x {hours:g} h ({samples:,} samples, every {INTERVAL:g}s), "
+          f"faults in last {FAULT_HOURS} h (drift 24 h)")
+
+    # Lô 1 (như chấm từng mẫu) chỉ chạy một phần dữ liệu cho nhanh
+    print(f"\n{'Batch size':<12} {'samples/s':>12} {'µs/sample':>10}")
+    print("-" * 36)
+    peak = None
+    for batch_size in (1, 64, 1024, 8192):
+        detector = AnomalyDetector()
+        if batch_size == 1:
+            part = max(2000 // gardens, 1)
+            seconds, _ = run(detector, times[:part], X[:part], batch_size)
+            count = part * gardens
+        else:
+            seconds, peak = run(detector, times, X, batch_size)
+            count = samples
+        print(f"{batch_size:<12} {count / seconds:>12,.0f} {seconds / count * 1e6:>10.2f}")
+
+    print(f"\n{'Fault':<8} {'Channel':<28} {'Limit':>6} {'Detected':>10} {'False +':>8}")
+    print("-" * 64)
+    faulty = np.concatenate(list(faults.values()))
+    healthy = np.setdiff1d(np.arange(gardens), faulty)
+    for name, (channel, limit) in LIMITS.items():
+        hits = peak[:, CHANNEL_INDEX[channel]] > limit
+        detected = hits[faults[name]].sum()
+        print(f"{name:<8} {'/'.join(channel):<28} {limit:>6g} "
+              f"{detected:>5}/{len(faults[name]):<4} {hits[healthy].sum():>8}")
+    seasonal = peak[healthy, CHANNEL_INDEX[("seasonal", "temperature")]]
+    print(f"\n🕒 seasonal/temperature on healthy gardens: median peak {np.median(seasonal):.2f}σ")
+
+if __name__ == "__main__":
+    main()
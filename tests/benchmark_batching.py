@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Sensor Batching Benchmark
+So sánh một mẫu mỗi message (sensor/state) với nhiều mẫu mỗi message
+(sensor/batch: danh sách mẫu hoặc khối delta): số message và byte trên dây
+cho mỗi mẫu, và thời gian logger xử lý (decode -> BatchWriter -> SQLite).
+
+Usage: python tests/benchmark_batching.py [samples] [batch_size]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import mqtt_logger
+from batch_writer import BatchWriter
+
+GARDENS = 50
+INTERVAL_MS = 3000
+START = 1_700_000_000.0
+
+def sample(tick, g):
+    return {"timestamp": tick * INTERVAL_MS, "temperature": round(25 + (tick + g) % 70 / 10, 1),
+            "humidity": round(60 + tick % 20 / 10, 1), "rain_analog": 3000 - tick % 500, "rain_digital": 1,
+            "is_raining": False, "rssi": -60 - g % 10}
+
+def delta_block(samples):
+    scale = {"temperature": 10, "humidity": 10}
+    columns = {}
+    for key in samples[0]:
+        column = [round(s[key] * scale.get(key, 1)) for s in samples]
+        columns[key] = [column[0]] + [b - a for a, b in zip(column, column[1:])]
+    return {"scale": scale, "delta": columns}
+
+def build_messages(samples, batch_size, mode):
+    """[(topic, payload, recv_time)] cho `samples` mẫu chia đều GARDENS garden"""
+    messages = []
+    ticks = samples // GARDENS
+    for start in range(0, ticks, batch_size):
+        block = range(start, min(start + batch_size, ticks))
+        for g in range(GARDENS):
+            readings = [sample(tick, g) for tick in block]
+            recv_time = START + block[-1] * INTERVAL_MS / 1000
+            if mode == "single":
+                messages.extend((f"site/g{g}/sensor/state", json.dumps(r).encode(),
+                                 START + tick * INTERVAL_MS / 1000) for tick, r in zip(block, readings))
+            elif mode == "samples":
+                messages.append((f"site/g{g}/sensor/batch", json.dumps({"samples": readings}).encode(), recv_time))
+            else:
+                messages.append((f"site/g{g}/sensor/batch", json.dumps(delta_block(readings)).encode(), recv_time))
+    return messages
+
+def run(messages, db_file):
+    """Chạy process_message của logger cho mọi message; trả về (giây, số dòng đã ghi)"""
+    mqtt_logger.DB_FILE = db_file
+    mqtt_logger.LOG_MESSAGES = False
+    mqtt_logger.init_database()
+    mqtt_logger.writer = BatchWriter(db_file)
+    mqtt_logger.writer.start()
+    start = time.perf_counter()
+    for topic, payload, recv_time in messages:
+        mqtt_logger.process_message(topic, payload, recv_time)
+    mqtt_logger.writer.close()
+    return time.perf_counter() - start, mqtt_logger.writer.stats()["rows_written"]
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print(f"🧺 {samples} samples, {GARDENS} gardens, batch of {batch_size} "
+          f"(+{(batch_size - 1) * INTERVAL_MS / 1000:.0f}s latency)")
+    print(f"{'Mode':<22} {'Messages':>9} {'B/sample':>9} {'Seconds':>8} {'samples/s':>10} {'Speedup':>8}")
+    print("-" * 72)
+    base = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("single", "samples", "delta"):
+            messages = build_messages(samples, 1 if mode == "single" else batch_size, mode)
+            elapsed, rows = run(messages, os.path.join(tmp, f"{mode}.db"))
+            rate = rows / elapsed
+            base = base or rate
+            # Gói PUBLISH QoS 0: ~4 byte header + độ dài topic + topic + payload
+            size = sum(4 + len(topic) + len(payload) for topic, payload, _ in messages) / rows
+            print(f"{mode:<22} {len(messages):>9} {size:>9.1f} {elapsed:>8.2f} {rate:>10,.0f} {rate / base:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
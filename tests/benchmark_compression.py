@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Sensor Compression Benchmark
+So sánh byte/mẫu của sensor_data dạng dòng (bảng + index, đo bằng dbstat)
+với block nén của tscompress.py (delta-of-delta thời gian, delta/XOR giá
+trị), cùng tốc độ nén và tốc độ đọc lại một ngày qua view_database.
+
+Usage: python tests/benchmark_compression.py [days] [gardens]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import tscompress
+import view_database
+from batch_writer import BatchWriter
+from schema import open_database, migrate
+
+INTERVAL_MS = 3000
+DAY_MS = 24 * 60 * 60 * 1000
+
+def build_rows(garden, start_ms, samples):
+    """Giống firmware: nhiệt độ/độ ẩm đổi chậm (1 chữ số thập phân), recv_ms lệch vài chục ms"""
+    rows = []
+    temp, hum, rain = 25.0, 70.0, 3000
+    for i in range(samples):
+        temp = round(min(max(temp + random.choice((-0.1, 0, 0, 0.1)), 15), 40), 1)
+        hum = round(min(max(hum + random.choice((-0.2, -0.1, 0, 0.1, 0.2)), 30), 99), 1)
+        rain = min(max(rain + random.randint(-8, 8), 0), 4095)
+        rows.append((garden, start_ms + i * INTERVAL_MS + random.randint(0, 60), i * INTERVAL_MS,
+                     temp, hum, rain, int(rain < 1500), rain < 1500, -60 - random.randint(0, 6)))
+    return rows
+
+def read_day(db_file, from_ms):
+    view_database.DB_FILE = db_file
+    start = time.perf_counter()
+    count = sum(1 for _ in view_database.range_rows("sensor_data", from_ms, from_ms + DAY_MS))
+    return count, time.perf_counter() - start
+
+def main():
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    gardens = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    random.seed(7)
+    samples = int(days * DAY_MS / INTERVAL_MS)
+    start_ms = int(time.time() * 1000) - int((days + 1) * DAY_MS)
+    start_ms -= start_ms % DAY_MS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.db")
+        conn = open_database(db_file)
+        migrate(conn)
+        conn.close()
+        writer = BatchWriter(db_file)
+        for g in range(gardens):
+            writer.write_batch({(0, "sensor_data"): build_rows(f"site/g{g}", start_ms, samples)})
+        writer.close()
+
+        conn = open_database(db_file)
+        before = tscompress.report(conn)
+        conn.close()
+        count, raw_read = read_day(db_file, start_ms)
+
+        compactor = tscompress.Compactor(db_file, after_hours=0)
+        t0 = time.perf_counter()
+        compacted = compactor.run_once()
+        compress_s = time.perf_counter() - t0
+        conn = open_database(db_file)
+        conn.execute("VACUUM")
+        after = tscompress.report(conn)
+        conn.close()
+        _, block_read = read_day(db_file, start_ms)
+
+    raw = before["raw_bytes_per_sample"]
+    print(f"\n🗜️  {gardens} gardens x {samples} samples ({days:g} days at {INTERVAL_MS // 1000}s)")
+    print(f"{'Format':<34} {'B/sample':>9} {'Ratio':>7}")
+    print("-" * 54)
+    print(f"{'sensor_data rows (table + indexes)':<34} {raw:>9.1f} {1.0:>6.1f}x")
+    print(f"{'sensor_blocks (table pages)':<34} {after['block_bytes_per_sample']:>9.1f} "
+          f"{raw / after['block_bytes_per_sample']:>6.1f}x")
+    print(f"{'  block payload only':<34} {after['blob_bytes_per_sample']:>9.1f} "
+          f"{raw / after['blob_bytes_per_sample']:>6.1f}x")
+    print(f"\n⏱️  Compress: {compacted / compress_s:,.0f} rows/s; read one day ({count} rows): "
+          f"rows {raw_read * 1000:.0f} ms, blocks {block_read * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
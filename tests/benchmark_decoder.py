@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Payload Decoder Micro-Benchmark
+Chi phí parse mỗi message (µs): đường cũ của mqtt_logger
+(payload.decode() + json.loads + 7 lần data.get) so với decoders.decode()
+dùng json chuẩn và orjson (nếu đã cài), cùng chi phí loại payload hỏng.
+
+Usage: python tests/benchmark_decoder.py [messages]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import decoders
+from decoders import decode, PayloadError
+
+RUNS = 5
+TOPIC = "demo/garden/sensor/state"
+PAYLOAD = json.dumps({"temperature": 31.5, "humidity": 80.2, "rain_analog": 2876, "rain_digital": 1,
+                      "is_raining": False, "rssi": -61, "timestamp": 123456789}).encode()
+BAD_PAYLOADS = [
+    b"garbage from a half-flashed node",             # không phải JSON object
+    b'{"temperature": 31.5, "humidity": ',           # JSON bị cắt
+    b'{"temperature": "hot", "humidity": 80}',       # sai kiểu
+    b"{" + b" " * 5000 + b"}",                       # quá dài
+]
+
+def old_path(topic, payload):
+    """Đường parse trước đây của process_message + save_sensor_data"""
+    data = json.loads(payload.decode())
+    return (data.get('timestamp'), data.get('temperature'), data.get('humidity'), data.get('rain_analog'),
+            data.get('rain_digital'), data.get('is_raining'), data.get('rssi'))
+
+def rejecting(topic, payload):
+    try:
+        decode(topic, payload)
+    except PayloadError:
+        pass
+
+def per_message_us(func, payloads, count):
+    """Thời gian trung vị (µs / message) của RUNS lần chạy"""
+    samples = []
+    n = len(payloads)
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for i in range(count):
+            func(TOPIC, payloads[i % n])
+        samples.append((time.perf_counter() - start) / count * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    assert decode(TOPIC, PAYLOAD)[1] == old_path(TOPIC, PAYLOAD)
+
+    cases = [("old: json.loads + dict.get", old_path, [PAYLOAD])]
+    decoders.loads = decoders.loads_json
+    cases.append(("decoders (json)", decode, [PAYLOAD]))
+    results = [(name, per_message_us(func, payloads, count)) for name, func, payloads in cases]
+    if decoders.orjson is not None:
+        decoders.loads = decoders.orjson.loads
+        results.append(("decoders (orjson)", per_message_us(decode, [PAYLOAD], count)))
+    else:
+        print("ℹ️  orjson not installed (pip install orjson): skipping orjson row")
+    results.append((f"reject malformed ({decoders.JSON_LIBRARY})",
+                    per_message_us(rejecting, BAD_PAYLOADS, count)))
+
+    base = results[0][1]
+    print(f"{'Decoder':<34} {'µs/msg':>8} {'msg/s':>12} {'Speedup':>8}")
+    print("-" * 66)
+    for name, us in results:
+        print(f"{name:<34} {us:>8.2f} {1e6 / us:>12,.0f} {base / us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
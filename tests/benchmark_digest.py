@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Alert Digest Benchmark
+Mô phỏng một đợt nắng nóng: mọi garden nóng dần vượt ngưỡng rồi mát lại.
+Cảnh báo của alerts/rules.py được đếm theo hai cách gửi: một request mỗi
+cảnh báo (như trước) và qua Digester (gom theo cửa sổ); in số request, số
+request tối đa trong một phút và thời gian Digester.add().
+
+Usage: python tests/benchmark_digest.py [gardens] [minutes]
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+from digest import Digester
+from rules import RuleEngine
+
+INTERVAL = 3.0
+START = 1_700_000_000.0
+
+def heatwave(gardens, minutes):
+    """(t, garden, values) mỗi INTERVAL giây: nhiệt độ tăng từ ~27 lên ~37°C ở giữa đợt rồi giảm"""
+    random.seed(5)
+    offsets = [random.uniform(-3, 3) for _ in range(gardens)]
+    ticks = int(minutes * 60 / INTERVAL)
+    for tick in range(ticks):
+        phase = 1 - abs(2 * tick / ticks - 1)       # 0 → 1 → 0
+        t = START + tick * INTERVAL
+        for g in range(gardens):
+            temp = round(27 + 10 * phase + offsets[g] + random.uniform(-0.3, 0.3), 1)
+            yield t, f"site{g % 4}/g{g}", {"temperature": temp, "humidity": 55.0, "rssi": -60,
+                                          "is_raining": g % 9 == 0}
+
+def main():
+    gardens = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 120
+
+    engine = RuleEngine()
+    messages = []           # (t, payload) mà Digester gửi
+    clock = [START]
+    digester = Digester(lambda payload, label: messages.append((clock[0], payload)))
+
+    per_alert = []          # Thời điểm từng cảnh báo = một request nếu không gom
+    add_s = 0.0
+    last_t = None
+    for t, garden, values in heatwave(gardens, minutes):
+        if t != last_t:
+            clock[0] = t
+            digester.flush(now=t)
+            last_t = t
+        for alert in engine.evaluate(garden, values, t):
+            per_alert.append(t)
+            t0 = time.perf_counter()
+            digester.add(alert, values, now=t)
+            add_s += time.perf_counter() - t0
+    clock[0] = last_t
+    digester.flush(force=True)
+
+    def peak_per_minute(times):
+        buckets = {}
+        for t in times:
+            buckets[int((t - START) // 60)] = buckets.get(int((t - START) // 60), 0) + 1
+        return max(buckets.values(), default=0)
+
+    stats = digester.stats()
+    embeds = sum(len(payload["embeds"]) for _, payload in messages)
+    largest = max((len(json.dumps(payload)) for _, payload in messages), default=0)
+    print(f"\n🌡️  Heat wave: {gardens} gardens, {minutes:g} min, {len(per_alert)} alerts "
+          f"({stats['duplicates']} repeats merged)")
+    print(f"{'Mode':<22} {'Requests':>9} {'Peak/min':>9}")
+    print("-" * 42)
+    print(f"{'one per alert':<22} {len(per_alert):>9} {peak_per_minute(per_alert):>9}")
+    print(f"{'digest':<22} {len(messages):>9} {peak_per_minute(t for t, _ in messages):>9}")
+    print(f"\n📨 {embeds} embeds in {len(messages)} messages, largest payload {largest / 1024:.1f} KB, "
+          f"Digester.add {add_s / max(len(per_alert), 1) * 1e6:.1f} µs/alert")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Alert Dispatcher Benchmark
+Chạy một webhook giả lập trên localhost (độ trễ cấu hình được, thỉnh thoảng
+trả 429 + Retry-After hoặc 500) và so sánh:
+  - thời gian luồng MQTT bị chặn mỗi cảnh báo: requests.post đồng bộ so với dispatcher.send()
+  - thông lượng gửi: kết nối mới mỗi request so với Session keep-alive của dispatcher
+  - mọi thông báo tới đúng một lần dù có 429/500, và còn nguyên qua lần khởi động lại
+
+Usage: python tests/benchmark_dispatcher.py [alerts] [latency_ms]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+import requests
+from dispatcher import Dispatcher
+
+# =============================================================================
+# STAND-IN WEBHOOK
+# =============================================================================
+
+class Webhook(BaseHTTPRequestHandler):
+    """Giống Discord: 204 khi thành công, 429 kèm Retry-After mỗi `rate_limit_every` request"""
+
+    protocol_version = "HTTP/1.1"       # Cho phép keep-alive
+    latency = 0.0
+    rate_limit_every = 0
+    error_every = 0
+    lock = threading.Lock()
+    requests_seen = 0
+    connections = set()
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cls = type(self)
+        with cls.lock:
+            cls.requests_seen += 1
+            n = cls.requests_seen
+            cls.connections.add(self.client_address)
+        time.sleep(cls.latency)
+        if cls.rate_limit_every and n % cls.rate_limit_every == 0:
+            self._reply(429, json.dumps({"retry_after": 0.2}).encode(), {"Retry-After": "0.2"})
+        elif cls.error_every and n % cls.error_every == 0:
+            self._reply(500, b"boom")
+        else:
+            with cls.lock:
+                cls.received.append(json.loads(body)["id"])
+            self._reply(204)
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(latency, rate_limit_every=0, error_every=0):
+    Webhook.latency = latency
+    Webhook.rate_limit_every = rate_limit_every
+    Webhook.error_every = error_every
+    Webhook.requests_seen = 0
+    Webhook.connections = set()
+    Webhook.received = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Webhook)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/webhook"
+
+def wait_for(count, timeout=60):
+    deadline = time.monotonic() + timeout
+    while len(Webhook.received) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+# =============================================================================
+# BENCHMARKS
+# =============================================================================
+
+def run_sync(url, alerts):
+    """Cách cũ: on_message gọi requests.post (kết nối mới mỗi lần) và chờ phản hồi"""
+    start = time.perf_counter()
+    for i in range(alerts):
+        requests.post(url, json={"id": i}, timeout=10)
+    elapsed = time.perf_counter() - start
+    return elapsed / alerts, elapsed
+
+def run_dispatcher(url, alerts, outbox_file, workers):
+    d = Dispatcher(url, workers=workers, outbox_file=outbox_file, backoff_base=0.05)
+    d.start()
+    start = time.perf_counter()
+    blocked = 0.0
+    for i in range(alerts):
+        t0 = time.perf_counter()
+        d.send({"id": i}, str(i))
+        blocked += time.perf_counter() - t0
+    wait_for(alerts)
+    elapsed = time.perf_counter() - start
+    stats = d.stats()
+    d.close()
+    return blocked / alerts, elapsed, stats
+
+def check_restart(url, outbox_file, alerts):
+    """Xếp hàng khi webhook không tới được, tắt, rồi khởi động lại khi webhook đã lên"""
+    d = Dispatcher(url, workers=1, outbox_file=outbox_file, backoff_base=30)
+    d.start()
+    for i in range(alerts):
+        d.send({"id": i}, str(i))
+    d.close()       # Webhook chưa chạy: mọi thông báo còn trong outbox
+    server, _ = serve(0.0)
+    server_url = f"http://127.0.0.1:{server.server_address[1]}/webhook"
+    # URL lưu trong outbox trỏ tới cổng cũ: ghi lại cho webhook mới
+    d = Dispatcher(server_url, workers=2, outbox_file=outbox_file)
+    d.outbox._conn.execute("UPDATE outbox SET url = ?", (server_url,))
+    d.start()
+    wait_for(alerts)
+    d.close()
+    server.shutdown()
+    return d.restored, len(Webhook.received), len(set(Webhook.received))
+
+def main():
+    alerts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    sys.stdout = open(os.devnull, "w")      # Bỏ log từng thông báo của dispatcher
+    out = sys.__stdout__
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, url = serve(latency)
+        sync_blocked, sync_total = run_sync(url, alerts)
+        sync_conns = len(Webhook.connections)
+        server.shutdown()
+
+        rows = []
+        for workers in (1, 4):
+            server, url = serve(latency)
+            blocked, total, _ = run_dispatcher(url, alerts, os.path.join(tmp, f"w{workers}.db"), workers)
+            rows.append((f"dispatcher, {workers} worker(s)", blocked, total, len(Webhook.connections)))
+            server.shutdown()
+
+        server, url = serve(latency, rate_limit_every=17, error_every=23)
+        _, faulty_total, faulty_stats = run_dispatcher(url, alerts, os.path.join(tmp, "faulty.db"), 4)
+        delivered, unique = len(Webhook.received), len(set(Webhook.received))
+        server.shutdown()
+
+        restored, restart_delivered, restart_unique = check_restart(url, os.path.join(tmp, "restart.db"), alerts)
+
+    print(f"\n🔔 {alerts} alerts, webhook latency {latency * 1000:.0f} ms", file=out)
+    print(f"{'Mode':<28} {'Blocked/alert':>14} {'Total s':>8} {'alerts/s':>9} {'Conns':>6}", file=out)
+    print("-" * 70, file=out)
+    print(f"{'requests.post (sync)':<28} {sync_blocked * 1e6:>11,.0f} µs {sync_total:>8.2f} "
+          f"{alerts / sync_total:>9.1f} {sync_conns:>6}", file=out)
+    for name, blocked, total, conns in rows:
+        print(f"{name:<28} {blocked * 1e6:>11,.0f} µs {total:>8.2f} {alerts / total:>9.1f} {conns:>6}", file=out)
+    print(f"\n🧪 With 429 every 17th and 500 every 23rd request: {unique}/{alerts} delivered "
+          f"({delivered - unique} duplicates) in {faulty_total:.2f}s, "
+          f"{faulty_stats['rate_limited']} rate limits, {faulty_stats['retried']} retries", file=out)
+    print(f"📮 Restart: {restored} restored from outbox, {restart_unique}/{alerts} delivered "
+          f"({restart_delivered - restart_unique} duplicates)", file=out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Payload Encoding Benchmark
+So sánh JSON (như firmware đang gửi) với MessagePack / CBOR (map cùng tên
+khóa, hoặc mảng theo thứ tự trường của decoders.SCHEMAS): số byte trên dây
+cho mỗi message sensor/state và thời gian decoders.decode() mỗi message.
+
+Cần: pip install msgpack cbor2 (định dạng nào thiếu thư viện sẽ bị bỏ qua)
+Usage: python tests/benchmark_payloads.py [messages]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import decoders
+from decoders import decode
+
+RUNS = 5
+TOPIC = "demo/garden/sensor/state"
+SENSOR_INTERVAL = 3                     # giây, giống SENSOR_PUBLISH_INTERVAL của firmware
+MESSAGES_PER_DAY = 24 * 3600 // SENSOR_INTERVAL
+SAMPLE = {"temperature": 31.5, "humidity": 80.2, "rain_analog": 2876, "rain_digital": 1,
+          "is_raining": False, "rssi": -61, "timestamp": 123456789}
+FIELDS = [key for key, _ in decoders.SCHEMAS["sensor/state"][2]]
+
+def publish_packet_size(topic, payload):
+    """Kích thước gói MQTT PUBLISH QoS 0: header cố định + độ dài topic + topic + payload"""
+    remaining = 2 + len(topic.encode()) + len(payload)
+    length_bytes = 1
+    while remaining >= 128 ** length_bytes:
+        length_bytes += 1
+    return 1 + length_bytes + remaining
+
+def formats():
+    """(tên, topic, payload) cho mỗi định dạng có thư viện"""
+    array = [SAMPLE[key] for key in FIELDS]
+    cases = [("json (firmware)", TOPIC, json.dumps(SAMPLE).encode()),
+             ("json (compact separators)", TOPIC, json.dumps(SAMPLE, separators=(",", ":")).encode())]
+    if decoders.msgpack is not None:
+        cases.append(("msgpack map", TOPIC + "/msgpack", decoders.msgpack.packb(SAMPLE)))
+        cases.append(("msgpack array", TOPIC + "/msgpack", decoders.msgpack.packb(array)))
+    else:
+        print("ℹ️  msgpack not installed: skipping msgpack rows")
+    if decoders.cbor2 is not None:
+        cases.append(("cbor map", TOPIC + "/cbor", decoders.cbor2.dumps(SAMPLE)))
+        cases.append(("cbor array", TOPIC + "/cbor", decoders.cbor2.dumps(array)))
+    else:
+        print("ℹ️  cbor2 not installed: skipping cbor rows")
+    return cases
+
+def decode_us(topic, payload, count):
+    """Thời gian trung vị (µs / message) của RUNS lần chạy"""
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for _ in range(count):
+            decode(topic, payload)
+        samples.append((time.perf_counter() - start) / count * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    expected = decode(TOPIC, json.dumps(SAMPLE).encode())
+
+    print(f"JSON decoder: {decoders.JSON_LIBRARY}")
+    print(f"{'Format':<28} {'Payload B':>9} {'Packet B':>9} {'KB/day':>8} {'µs/msg':>8}")
+    print("-" * 66)
+    base = None
+    for name, topic, payload in formats():
+        assert decode(topic, payload) == expected, name
+        packet = publish_packet_size(topic, payload)
+        base = base or packet
+        print(f"{name:<28} {len(payload):>9} {packet:>9} {packet * MESSAGES_PER_DAY / 1024:>8.0f} "
+              f"{decode_us(topic, payload, count):>8.2f}  ({packet * 100 / base:.0f}%)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Time-Window Query Benchmark
+So sánh truy vấn thống kê 24h: cột TEXT timestamp (quét toàn bảng)
+với cột recv_ms có covering index, theo kích thước bảng sensor_data.
+
+Usage: python tests/benchmark_queries.py [rows ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from schema import open_database, migrate, MIGRATIONS
+
+SAMPLE_INTERVAL = 3  # giây, giống SENSOR_PUBLISH_INTERVAL của firmware
+RUNS = 5
+
+OLD_QUERY = """
+    SELECT AVG(temperature), AVG(humidity), MIN(temperature), MAX(temperature)
+    FROM sensor_data
+    WHERE timestamp > datetime('now', '-24 hours')
+"""
+
+NEW_QUERY = """
+    SELECT AVG(temperature), AVG(humidity), MIN(temperature), MAX(temperature)
+    FROM sensor_data
+    WHERE recv_ms > ?
+"""
+
+def build_database(path, rows):
+    """Tạo DB schema v1 với `rows` mẫu cảm biến, mẫu mới nhất là hiện tại"""
+    conn = open_database(path)
+    migrate(conn, MIGRATIONS[:1])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def generate():
+        for i in range(rows):
+            ts = now - timedelta(seconds=(rows - i) * SAMPLE_INTERVAL)
+            yield (ts.strftime("%Y-%m-%d %H:%M:%S"), 25.0 + (i % 100) / 10, 60.0, i % 2)
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO sensor_data (timestamp, temperature, humidity, is_raining) VALUES (?, ?, ?, ?)",
+            generate())
+    return conn
+
+def time_query(conn, sql, params=()):
+    """Thời gian trung vị (ms) của RUNS lần chạy"""
+    samples = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchone()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+
+    print("📊 24h statistics query: TEXT timestamp scan vs recv_ms covering index")
+    print(f"{'Rows':>10} {'Scan (ms)':>12} {'Index (ms)':>12} {'Speedup':>10} {'Migrate (s)':>12}")
+    print("-" * 60)
+
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = build_database(os.path.join(tmp, "bench.db"), rows)
+            scan_ms = time_query(conn, OLD_QUERY)
+
+            start = time.perf_counter()
+            migrate(conn)
+            migrate_s = time.perf_counter() - start
+
+            cutoff = int((time.time() - 24 * 3600) * 1000)
+            index_ms = time_query(conn, NEW_QUERY, (cutoff,))
+            conn.close()
+
+        print(f"{rows:>10} {scan_ms:>12.2f} {index_ms:>12.2f} {scan_ms / index_ms:>9.1f}x {migrate_s:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Replay Benchmark
+So sánh messages/s khi nạp lại traffic đã capture: đường live của mqtt_logger
+(process_message từng message -> BatchWriter) với replay.py (parse theo chunk
+trên ProcessPool, lô dạng cột, một writer ghi hàng loạt).
+
+Usage: python tests/benchmark_replay.py [messages] [gardens]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import mqtt_logger
+import replay
+from batch_writer import BatchWriter
+from ingest_queue import read_records, write_record
+
+START = 1_700_000_000.0
+
+def build_capture(path, messages, gardens):
+    """Traffic giống firmware: sensor mỗi 3 s, device/state và sys/online mỗi 15 s"""
+    written = 0
+    with open(path, "wb") as f:
+        tick = 0
+        while written < messages:
+            now = START + tick * 3
+            for g in range(gardens):
+                topic = f"site/garden{g}"
+                sensor = {"temperature": 25 + (tick + g) % 70 / 10, "humidity": 60 + tick % 20,
+                          "rain_analog": 3000 - tick % 500, "rain_digital": 1, "is_raining": False,
+                          "rssi": -60 - g % 10, "timestamp": tick * 3000}
+                write_record(f, f"{topic}/sensor/state", json.dumps(sensor).encode(), now)
+                written += 1
+                if tick % 5 == 0:
+                    state = {"light": "ON" if tick % 200 < 100 else "OFF", "pump": "OFF", "pumpSpeed": 0,
+                             "rssi": -60, "timestamp": tick * 3000}
+                    online = {"online": True, "deviceId": f"esp32-{g}", "firmware": "1.0.0",
+                              "rssi": -60, "timestamp": tick * 3000}
+                    write_record(f, f"{topic}/device/state", json.dumps(state).encode(), now)
+                    write_record(f, f"{topic}/sys/online", json.dumps(online).encode(), now)
+                    written += 2
+            tick += 1
+    return written
+
+def bench_live(capture, db_file):
+    """Đường live: process_message cho từng message, BatchWriter flush nền"""
+    mqtt_logger.DB_FILE = db_file
+    mqtt_logger.LOG_MESSAGES = False
+    mqtt_logger.last_rows.clear()
+    mqtt_logger.init_database()
+    mqtt_logger.writer = BatchWriter(db_file)
+    mqtt_logger.writer.start()
+    count = 0
+    start = time.perf_counter()
+    with open(capture, "rb") as f:
+        for topic, payload, recv_time in read_records(f):
+            mqtt_logger.process_message(topic, payload, recv_time)
+            count += 1
+    mqtt_logger.writer.close()
+    return count, time.perf_counter() - start
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    gardens = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    cpus = os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        capture = os.path.join(tmp, "capture.bin")
+        total = build_capture(capture, messages, gardens)
+        print(f"📼 Capture: {total} messages, {gardens} gardens, {os.path.getsize(capture) / 1e6:.1f} MB "
+              f"({cpus} CPU)")
+        print(f"{'Path':<34} {'Seconds':>8} {'msg/s':>10} {'Speedup':>8}")
+        print("-" * 64)
+
+        count, elapsed = bench_live(capture, os.path.join(tmp, "live.db"))
+        base = count / elapsed
+        print(f"{'live (process_message)':<34} {elapsed:>8.2f} {base:>10,.0f} {1.0:>7.1f}x")
+
+        for workers in sorted({1, cpus}):
+            db_file = os.path.join(tmp, f"replay{workers}.db")
+            replayer, elapsed = replay.replay([capture], db_file, workers=workers)
+            rate = replayer.messages / elapsed
+            label = f"replay ({workers} worker{'s' if workers > 1 else ''})"
+            print(f"{label:<34} {elapsed:>8.2f} {rate:>10,.0f} {rate / base:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Alert Rule Engine Benchmark
+Đo số mẫu / số lần đánh giá luật mỗi giây của alerts/rules.py với hàng chục
+nghìn garden, bộ nhớ trạng thái mỗi garden, và chi phí mỗi mẫu khi tổng số
+luật tăng (luật riêng từng garden) so với cách duyệt mọi luật cho mỗi mẫu.
+
+Usage: python tests/benchmark_rules.py [devices] [samples]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from fnmatch import fnmatchcase
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+from rules import RuleEngine, RULES
+
+INTERVAL = 3.0
+START = 1_700_000_000.0
+
+def build_samples(devices, count):
+    """Mẫu xen kẽ theo garden như trên broker; nhiệt độ dao động quanh 29-36°C"""
+    random.seed(3)
+    temps = [random.uniform(24, 34) for _ in range(devices)]
+    samples = []
+    for i in range(count):
+        d = i % devices
+        temps[d] = min(max(temps[d] + random.uniform(-0.4, 0.45), 15), 42)
+        values = {"temperature": round(temps[d], 1), "humidity": 60.0, "rssi": -60,
+                  "is_raining": d % 7 == 0}
+        samples.append((f"site/g{d}", values, START + (i // devices) * INTERVAL))
+    return samples
+
+def run(engine, samples):
+    alerts = 0
+    start = time.perf_counter()
+    for device, values, t in samples:
+        alerts += len(engine.evaluate(device, values, t))
+    return time.perf_counter() - start, alerts
+
+def run_scan(engine, states, samples):
+    """Cách làm không có index: mỗi mẫu duyệt mọi luật và so khớp glob garden"""
+    rules = engine.rules
+    start = time.perf_counter()
+    for device, values, t in samples:
+        if engine.aggregates is not None:
+            engine.aggregates.update(device, values, t)
+        for rule in rules:
+            if fnmatchcase(device, rule.devices):
+                state = states.get((device, rule.id))
+                if state is None:
+                    state = states[(device, rule.id)] = rule.new_state()
+                rule.evaluate(state, device, values, t)
+    return time.perf_counter() - start
+
+def extra_rules(devices, count):
+    """`count` luật riêng cho từng garden (vd ngưỡng khác cho nhà kính)"""
+    return [{"id": f"custom_{i}", "type": "threshold", "field": "temperature", "above": 33.0 + i % 3,
+             "devices": f"site/g{i % devices}"} for i in range(count)]
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 400_000
+    samples = build_samples(devices, count)
+
+    # Bộ nhớ trạng thái: đo riêng vì tracemalloc làm chậm mọi phép cấp phát
+    engine = RuleEngine()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    run(engine, samples[:devices])
+    state_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    engine = RuleEngine()
+    elapsed, alerts = run(engine, samples)
+    evals = count * len(RULES)
+    print(f"\n📏 {devices} gardens, {count} samples, {len(RULES)} rules per garden")
+    print(f"   {count / elapsed:,.0f} samples/s, {evals / elapsed:,.0f} rule evaluations/s, "
+          f"{alerts} alerts, ~{state_bytes / devices:.0f} B state per garden")
+
+    print(f"\n{'Total rules':>12} {'Indexed µs/sample':>18} {'Scan-all µs/sample':>19}")
+    print("-" * 52)
+    subset = samples[:min(count, 100_000)]
+    for extra in (0, 1000, 10000):
+        specs = RULES + extra_rules(devices, extra)
+        engine = RuleEngine(specs)
+        run(engine, subset[:devices])       # Lần đầu mỗi garden: dựng index
+        indexed, _ = run(engine, subset)
+        scanned = subset[:max(200, 200_000 // len(specs))]
+        scan = run_scan(RuleEngine(specs), {}, scanned)
+        print(f"{len(specs):>12} {indexed / len(subset) * 1e6:>18.2f} {scan / len(scanned) * 1e6:>19.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Streaming Aggregates Benchmark
+Đo alerts/streaming.py: thời gian cập nhật mỗi mẫu, bộ nhớ mỗi chuỗi, sai số
+percentile của sketch so với giá trị chính xác, và so sánh câu hỏi "trung bình
+10 phút qua" trả lời từ RAM với một query SQLite (AVG trên sensor_data).
+
+Usage: python tests/benchmark_streaming.py [devices] [minutes]
+"""
+
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "alerts"))
+sys.path.insert(0, os.path.join(ROOT, "database"))
+
+from streaming import StreamAggregates, WINDOW_SECONDS
+from batch_writer import BatchWriter
+from schema import open_database, migrate
+
+INTERVAL = 3
+START = 1_700_000_000.0
+
+def build_samples(devices, minutes):
+    random.seed(11)
+    temps = [random.uniform(22, 32) for _ in range(devices)]
+    samples = []
+    for tick in range(int(minutes * 60 / INTERVAL)):
+        t = START + tick * INTERVAL
+        for d in range(devices):
+            temps[d] = round(min(max(temps[d] + random.uniform(-0.3, 0.3), 10), 45), 1)
+            samples.append((f"site/g{d}", t, {"temperature": temps[d], "humidity": 60.0 + d % 20}))
+    return samples
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    samples = build_samples(devices, minutes)
+
+    # Bộ nhớ: đo riêng vì tracemalloc làm chậm mọi phép cấp phát
+    tracemalloc.start()
+    probe = StreamAggregates()
+    for device, t, values in samples[:devices]:
+        probe.update(device, values, t)
+    per_series = tracemalloc.get_traced_memory()[0] / (devices * 2)
+    tracemalloc.stop()
+    del probe
+
+    aggregates = StreamAggregates()
+    start = time.perf_counter()
+    for device, t, values in samples:
+        aggregates.update(device, values, t)
+    update_s = time.perf_counter() - start
+    now = samples[-1][1]
+
+    # Sai số percentile so với giá trị chính xác trên cùng cửa sổ
+    exact_window = {}
+    for device, t, values in samples:
+        if t > now - WINDOW_SECONDS:
+            exact_window.setdefault(device, []).append(values["temperature"])
+    worst = 0.0
+    for device, values in list(exact_window.items())[:500]:
+        ordered = sorted(values)
+        series = aggregates.get(device, "temperature")
+        for q in (50, 90, 99):
+            exact = ordered[math.ceil(q / 100 * len(ordered)) - 1]
+            worst = max(worst, abs(series.percentile(q) - exact))
+
+    # Cùng câu hỏi qua SQLite: AVG 10 phút gần nhất cho một garden
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.db")
+        conn = open_database(db_file)
+        migrate(conn)
+        conn.close()
+        writer = BatchWriter(db_file, maintain_rollups=False)
+        writer.write_batch({(0, "sensor_data"): [
+            (device, int(t * 1000), 0, values["temperature"], values["humidity"], 3000, 1, False, -60)
+            for device, t, values in samples]})
+        writer.close()
+        conn = open_database(db_file)
+        queries = 2000
+        from_ms = int((now - WINDOW_SECONDS) * 1000)
+        start = time.perf_counter()
+        for i in range(queries):
+            conn.execute("SELECT AVG(temperature), MIN(temperature), MAX(temperature) FROM sensor_data "
+                         "WHERE garden = ? AND recv_ms > ?", (f"site/g{i % devices}", from_ms)).fetchone()
+        sql_s = (time.perf_counter() - start) / queries
+        conn.close()
+
+    start = time.perf_counter()
+    for i in range(queries):
+        series = aggregates.get(f"site/g{i % devices}", "temperature")
+        series.mean(), series.min(), series.max()
+    ram_s = (time.perf_counter() - start) / queries
+    start = time.perf_counter()
+    for i in range(queries):
+        aggregates.snapshot(f"site/g{i % devices}", now)
+    snapshot_s = (time.perf_counter() - start) / queries
+
+    print(f"\n📊 {devices} gardens x 2 fields, {len(samples)} samples over {minutes:g} min "
+          f"(window {WINDOW_SECONDS}s)")
+    print(f"   update: {update_s / len(samples) * 1e6:.2f} µs/sample ({len(samples) / update_s:,.0f} samples/s), "
+          f"{per_series / 1024:.1f} KB per series, percentile error ≤ {worst:.2f}°C")
+    print(f"\n{'Mean/min/max of last 10 min':<30} {'µs/query':>10}")
+    print("-" * 42)
+    print(f"{'SQLite (indexed)':<30} {sql_s * 1e6:>10.1f}")
+    print(f"{'StreamAggregates':<30} {ram_s * 1e6:>10.1f}")
+    print(f"{'  full snapshot (dashboard)':<30} {snapshot_s * 1e6:>10.1f}")
+
+if __name__ == "__main__":
+    main()
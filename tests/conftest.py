@@ -0,0 +1,6 @@
+"""
+pytest: chỉ chạy test tự động (test_*.py không cần broker)
+Các script thủ công gửi lệnh tới broker MQTT thật và benchmark_*.py chạy trực tiếp bằng python.
+"""
+
+collect_ignore = ["comprehensive_test.py", "test_commands.py", "test_mqtt_command.py"]
@@ -0,0 +1,65 @@
+"""
+Anomaly Detection Tests - alerts/anomaly.py: chấm theo lô cho cùng kết quả với chấm
+từng mẫu, phát hiện gai nhiệt độ và DHT đứng im (cần numpy, không có thì bỏ qua)
+Chạy: python -m pytest tests/test_anomaly.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+np = pytest.importorskip("numpy")
+
+from anomaly import AnomalyDetector, CHANNEL_INDEX, FIELDS
+
+INTERVAL = 30.0
+START = 1_700_000_000.0
+
+def fleet(hours=3, gardens=3, seed=1):
+    """(devices [n], times [n], X [n, len(FIELDS)]) xen kẽ các garden theo thời gian"""
+    rng = np.random.default_rng(seed)
+    ticks = int(hours * 3600 / INTERVAL)
+    X = np.empty((ticks, gardens, len(FIELDS)))
+    X[..., 0] = np.round(27 + rng.normal(0, 0.3, (ticks, gardens)), 1)
+    X[..., 1] = np.round(65 + rng.normal(0, 1.0, (ticks, gardens)), 1)
+    X[..., 2] = 3000 + rng.normal(0, 15, (ticks, gardens))
+    X[..., 3] = np.round(-60 + rng.normal(0, 2, (ticks, gardens)))
+    X[..., 4] = 0
+    X[-1, 0, 0] += 12                       # g0: gai nhiệt độ ở mẫu cuối
+    X[-90:, 1, :2] = X[-90, 1, :2]          # g1: DHT đứng im 45 phút cuối
+    devices = [f"site/g{g}" for g in range(gardens)] * ticks
+    times = np.repeat(START + np.arange(ticks) * INTERVAL, gardens)
+    return devices, times, X.reshape(-1, len(FIELDS))
+
+def test_batch_scores_match_per_sample_scores():
+    devices, times, X = fleet(hours=1)
+    whole = AnomalyDetector().score_batch(devices, times, X)
+    single = AnomalyDetector()
+    one_by_one = np.vstack([single.score_batch(devices[i:i + 1], times[i:i + 1], X[i:i + 1])
+                            for i in range(len(devices))])
+    np.testing.assert_allclose(whole, one_by_one, equal_nan=True)
+
+def test_spike_and_stuck_sensor_are_detected():
+    detector = AnomalyDetector()
+    detector.score_batch(*fleet())
+    spike = detector.score("site/g0", "zscore", "temperature")
+    assert spike > 5
+    assert detector.score("site/g2", "zscore", "temperature") < 5
+    assert detector.score("site/g1", "flatline", "dht") >= 30
+    assert detector.score("site/g2", "flatline", "dht") < 30
+
+def test_add_buffers_then_scores_and_reset_forgets():
+    detector = AnomalyDetector(batch_size=4, max_delay=1e9)
+    for i in range(3):
+        detector.add("site/g0", {"temperature": 27.0, "humidity": 65.0, "rssi": -60}, START + i)
+    assert detector.stats()["buffered"] == 3
+    assert detector.scores("site/g0") == {}
+    detector.add("site/g0", {"temperature": 27.0}, START + 3)
+    assert detector.stats()["buffered"] == 0
+    assert "flatline/dht" in detector.scores("site/g0")
+    detector.reset("site/g0")
+    assert detector.scores("site/g0") == {}
+    assert np.isnan(detector.latest[0, CHANNEL_INDEX[("flatline", "dht")]])
@@ -0,0 +1,55 @@
+"""
+Archive Tests - archive.py: garden lấy từ topic không được đưa file ra ngoài archive/
+Chạy: python -m pytest tests/test_archive.py (phần ghi file cần pyarrow)
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import archive
+from schema import open_database, migrate
+
+DAY_MS = archive.DAY_MS
+START_MS = 19_000 * DAY_MS
+
+@pytest.mark.parametrize("garden", ["../..", "../../etc", "a/./b", "x//y", "/abs", "..", "%2E%2E"])
+def test_partition_path_stays_inside_archive(tmp_path, garden):
+    rel_path = archive._partition_path(garden, START_MS, 0, "parquet")
+    root = str(tmp_path / "archive")
+    path = archive._archive_path(root, rel_path)
+    assert os.path.realpath(path).startswith(os.path.realpath(root) + os.sep)
+    assert ".." not in rel_path.split(os.sep)
+
+def test_distinct_gardens_get_distinct_paths():
+    gardens = ["site/g1", "site%2Fg1", "site/..", "site/%2E%2E", "site//g1", "site/%/g1"]
+    paths = {archive._partition_path(g, START_MS, 0, "parquet") for g in gardens}
+    assert len(paths) == len(gardens)
+    assert archive._partition_path("site/g1", START_MS, 0, "parquet") == os.path.join(
+        "sensor_data", "site", "g1", "2022-01-08.0.parquet")
+
+def test_escaping_rel_path_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        archive._archive_path(str(tmp_path / "archive"), os.path.join("sensor_data", "..", "..", "x.parquet"))
+
+def test_archive_partition_with_hostile_garden(tmp_path):
+    pytest.importorskip("pyarrow")
+    db_file = str(tmp_path / "db" / "garden.db")
+    os.makedirs(os.path.dirname(db_file))
+    conn = open_database(db_file)
+    migrate(conn)
+    garden = "../../outside"
+    with conn:
+        conn.executemany("INSERT INTO sensor_data (garden, recv_ms, temperature) VALUES (?, ?, ?)",
+                         [(garden, START_MS + i * 3000, 25.0 + i) for i in range(10)])
+    assert archive.archive_partition(conn, db_file, garden, START_MS) == 10
+
+    files = [os.path.join(d, f) for d, _, names in os.walk(tmp_path) for f in names if f.endswith(".parquet")]
+    root = archive.archive_root(db_file)
+    assert len(files) == 1 and files[0].startswith(root + os.sep)
+    table = archive.scan(conn, db_file, garden, START_MS, START_MS + DAY_MS, columns=("recv_ms", "temperature"))
+    assert table.num_rows == 10
+    conn.close()
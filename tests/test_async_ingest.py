@@ -0,0 +1,168 @@
+"""
+Async Ingest Tests - async_ingest: db_worker xử lý hết message trước sentinel, run_service
+ghi nốt hàng đợi khi reader dừng (lỗi hoặc bị hủy) rồi mới dừng dispatcher
+Chạy: python -m pytest tests/test_async_ingest.py (cần paho-mqtt; run_service cần requests)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+pytest.importorskip("paho.mqtt.client")
+
+import async_ingest
+import mqtt_logger
+from batch_writer import BatchWriter
+from latest_state import LatestState
+from schema import open_database, migrate, shard_index
+
+T0 = 1_700_000_000.0
+
+def sensor_payload(temperature=25.0, i=0):
+    return json.dumps({"temperature": temperature, "humidity": 60.0, "rain_analog": 3000, "rain_digital": 1,
+                       "is_raining": False, "rssi": -60, "timestamp": i}).encode()
+
+def message(i, garden="site/g1", temperature=25.0):
+    return (f"{garden}/sensor/state", sensor_payload(temperature, i), T0 + i, None)
+
+@pytest.fixture
+def processed(monkeypatch):
+    """Thay process_batch: ghi lại các lô (chạy trên thread của asyncio.to_thread)"""
+    batches = []
+    lock = threading.Lock()
+
+    def record(batch):
+        with lock:
+            batches.append(list(batch))
+
+    monkeypatch.setattr(async_ingest, "process_batch", record)
+    monkeypatch.setattr(async_ingest, "stats", async_ingest.Stats())
+    return batches
+
+def test_db_worker_drains_before_sentinel(processed, monkeypatch):
+    monkeypatch.setattr(async_ingest, "DB_CHUNK", 100)
+
+    async def scenario():
+        queue = asyncio.Queue()
+        for i in range(250):
+            queue.put_nowait(message(i))
+        queue.put_nowait(None)
+        # Message sau sentinel không được xử lý
+        queue.put_nowait(message(999))
+        await async_ingest.db_worker(queue)
+        return queue.qsize()
+
+    assert asyncio.run(scenario()) == 1
+    assert [len(batch) for batch in processed] == [100, 100, 50]
+    assert [item[2] for batch in processed for item in batch] == [T0 + i for i in range(250)]
+    assert async_ingest.stats.processed == 250
+
+def test_enqueue_skips_foreign_gardens_and_drops_old_alerts(processed, monkeypatch):
+    monkeypatch.setattr(mqtt_logger, "DB_SHARDS", 4)
+    gardens = [f"site/g{i}" for i in range(8)]
+    mine = [g for g in gardens if shard_index(g, 4) in (0, 2)]
+    monkeypatch.setattr(mqtt_logger, "owned_shards", [0, 2])
+
+    async def scenario():
+        db_queue = asyncio.Queue()
+        alert_queue = asyncio.Queue(2)
+        for i, garden in enumerate(gardens):
+            await async_ingest.enqueue(db_queue, alert_queue, *message(i, garden)[:3])
+        await async_ingest.enqueue(db_queue, alert_queue, f"{mine[0]}/device/state", b"{}", T0)
+        return ([db_queue.get_nowait()[0] for _ in range(db_queue.qsize())],
+                [alert_queue.get_nowait()[0] for _ in range(alert_queue.qsize())])
+
+    db_topics, alert_topics = asyncio.run(scenario())
+    assert db_topics == [f"{g}/sensor/state" for g in mine] + [f"{mine[0]}/device/state"]
+    # Hàng đợi cảnh báo đầy: giữ các mẫu mới nhất; device/state không sang nhánh cảnh báo
+    assert alert_topics == [f"{g}/sensor/state" for g in mine[-2:]]
+    assert async_ingest.stats.foreign_skipped == len(gardens) - len(mine)
+    assert async_ingest.stats.alert_dropped == len(mine) - 2
+
+@pytest.fixture
+def service(processed, monkeypatch):
+    """run_service với dispatcher/digester giả (không gửi webhook), trả về danh sách sự kiện"""
+    pytest.importorskip("requests")
+    import temperature_alert
+    from rules import RuleEngine
+
+    events = []
+    monkeypatch.setattr(temperature_alert, "engine", RuleEngine())
+    monkeypatch.setattr(temperature_alert, "start_dispatcher", lambda: events.append("start_dispatcher"))
+    monkeypatch.setattr(temperature_alert, "start_digester", lambda: events.append("start_digester"))
+    monkeypatch.setattr(temperature_alert, "notify", lambda alert, values: events.append(("alert", alert.kind)))
+
+    def stop_dispatcher():
+        # Phải chạy sau khi mọi message đã được ghi
+        events.append(("stop_dispatcher", sum(len(batch) for batch in processed)))
+
+    monkeypatch.setattr(temperature_alert, "stop_dispatcher", stop_dispatcher)
+    return events
+
+def test_run_service_drains_queue_when_reader_fails(service, processed, monkeypatch):
+    async def failing_reader(db_queue, alert_queue):
+        for i in range(300):
+            await async_ingest.enqueue(db_queue, alert_queue, *message(i, temperature=40.0 if i == 5 else 25.0)[:3])
+        raise RuntimeError("reader crashed")
+
+    monkeypatch.setattr(async_ingest, "mqtt_reader", failing_reader)
+    with pytest.raises(RuntimeError, match="reader crashed"):
+        asyncio.run(async_ingest.run_service())
+
+    assert sum(len(batch) for batch in processed) == 300
+    assert service[:2] == ["start_dispatcher", "start_digester"]
+    assert service[-1] == ("stop_dispatcher", 300)
+
+def test_run_service_drains_queue_when_cancelled(service, processed, monkeypatch):
+    monkeypatch.setattr(async_ingest, "ALERTS_ENABLED", False)
+    reader_done = []
+
+    async def blocking_reader(db_queue, alert_queue):
+        for i in range(500):
+            await async_ingest.enqueue(db_queue, alert_queue, *message(i)[:3])
+        reader_done[0].set()
+        await asyncio.Event().wait()        # Chờ message mới mãi mãi
+
+    async def scenario():
+        reader_done.append(asyncio.Event())
+        task = asyncio.create_task(async_ingest.run_service())
+        await reader_done[0].wait()
+        task.cancel()                       # Ctrl+C: asyncio.run hủy task chính
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    monkeypatch.setattr(async_ingest, "mqtt_reader", blocking_reader)
+    asyncio.run(scenario())
+
+    assert [item[2] for batch in processed for item in batch] == [T0 + i for i in range(500)]
+    # Không bật cảnh báo: không đụng tới dispatcher
+    assert service == []
+
+def test_benchmark_pipeline_writes_every_message(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "garden.db")
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.close()
+
+    writer = BatchWriter(db_file, max_delay=0.01, report_interval=3600)
+    writer.start()
+    monkeypatch.setattr(mqtt_logger, "writer", writer)
+    monkeypatch.setattr(mqtt_logger, "DB_SHARDS", 1)
+    monkeypatch.setattr(mqtt_logger, "LOG_MESSAGES", False)
+    monkeypatch.setattr(mqtt_logger, "latest", LatestState())
+    monkeypatch.setattr(async_ingest, "stats", async_ingest.Stats())
+
+    elapsed, alerts = asyncio.run(async_ingest.run_benchmark(2000, gardens=10))
+    writer.close()
+
+    conn = open_database(db_file)
+    assert conn.execute("SELECT COUNT(*), COUNT(DISTINCT garden) FROM sensor_data").fetchone() == (2000, 10)
+    conn.close()
+    assert async_ingest.stats.processed == 2000
+    assert alerts > 0
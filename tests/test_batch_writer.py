@@ -0,0 +1,59 @@
+"""
+Batch Writer Tests - batch_writer.py: một dòng lỗi không làm mất cả lô của shard
+Chạy: python -m pytest tests/test_batch_writer.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from batch_writer import BatchWriter
+from schema import open_database, migrate
+
+START_MS = 1_700_000_000_000
+
+def sensor_row(i, garden="site/g1"):
+    return (garden, START_MS + i * 3000, i * 3000, 25.0, 60.0, 3000, 1, False, -60)
+
+def open_writer(tmp_path, **kwargs):
+    db_file = str(tmp_path / "garden.db")
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.close()
+    return db_file, BatchWriter(db_file, **kwargs)
+
+def count(db_file, table):
+    conn = open_database(db_file)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_bad_row_only_fails_itself(tmp_path):
+    db_file, writer = open_writer(tmp_path)
+    bad_command = ("site/g1", START_MS, "light", {"x": 1}, "mqtt")       # dict không bind được
+    good_commands = [("site/g1", START_MS + i, "pump", "ON", "mqtt") for i in (1, 2)]
+    sensors = [sensor_row(i) for i in range(5)] + [sensor_row(6)[:3] + (1 << 70,) + sensor_row(6)[4:]]
+    writer.write_batch({(0, "commands"): [good_commands[0], bad_command, good_commands[1]],
+                        (0, "sensor_data"): sensors})
+    writer.close()
+
+    s = writer.stats()
+    assert (s["rows_written"], s["rows_failed"], s["rows_duplicate"]) == (7, 2, 0)
+    assert count(db_file, "commands") == 2
+    assert count(db_file, "sensor_data") == 5
+    assert count(db_file, "sensor_rollup") > 0
+
+def test_flush_thread_keeps_good_rows_and_counts_duplicates(tmp_path):
+    db_file, writer = open_writer(tmp_path, max_delay=0.01)
+    writer.start()
+    for i in range(3):
+        writer.add("sensor_data", sensor_row(i))
+    writer.add("sensor_data", sensor_row(0))                            # Trùng (garden, recv_ms)
+    writer.add("commands", ("site/g1", START_MS, "light", ["ON"], "mqtt"))
+    writer.close()
+
+    s = writer.stats()
+    assert (s["rows_written"], s["rows_failed"], s["rows_duplicate"]) == (3, 1, 1)
+    assert count(db_file, "sensor_data") == 3
@@ -0,0 +1,143 @@
+"""
+Decoder Tests - decoders.py: payload theo schema của topic, loại payload hỏng
+Chạy: python -m pytest tests/test_decoders.py
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import decoders
+from decoders import decode, PayloadError, SensorRecord, StateRecord, OnlineRecord, CommandRecord
+
+SENSOR = {"timestamp": 3000, "temperature": 31.5, "humidity": 80.2, "rain_analog": 2900,
+          "rain_digital": 1, "is_raining": False, "rssi": -61}
+
+def payload(data):
+    return json.dumps(data).encode()
+
+def test_sensor_state_fields_in_insert_order():
+    table, record = decode("demo/g1/sensor/state", payload(SENSOR))
+    assert table == "sensor_data"
+    assert record == SensorRecord(3000, 31.5, 80.2, 2900, 1, False, -61)
+
+def test_missing_fields_are_none():
+    table, record = decode("demo/g1/device/state", payload({"light": "ON", "pump": "OFF"}))
+    assert (table, record) == ("device_state", StateRecord(None, "ON", "OFF", None, None))
+
+def test_online_and_commands():
+    online = {"online": True, "deviceId": "esp32-01", "firmware": "1.2.0", "rssi": -70, "timestamp": 5}
+    assert decode("demo/g1/sys/online", payload(online)) == (
+        "device_online", OnlineRecord(5, True, "esp32-01", "1.2.0", -70))
+    assert decode("demo/g1/device/cmd", payload({"pumpSpeed": 80})) == ("commands", CommandRecord("pumpSpeed", "80"))
+    assert decode("demo/g1/device/cmd", payload({"reboot": 1}))[1].command_type == "unknown"
+
+def test_unknown_topic_is_not_stored():
+    assert decode("demo/g1/sensor/config", payload(SENSOR)) is None
+
+@pytest.mark.parametrize("raw", [
+    b"",
+    b"not json",
+    b"[1, 2, 3]",
+    b'{"temperature": 31.5',
+    b" " * (decoders.MAX_PAYLOAD_BYTES + 1),
+])
+def test_malformed_payloads_are_rejected(raw):
+    with pytest.raises(PayloadError):
+        decode("demo/g1/sensor/state", raw)
+
+def test_wrong_type_is_rejected_every_time():
+    bad = payload(dict(SENSOR, temperature="hot"))
+    for _ in range(2):      # Chữ ký kiểu sai không được nhớ như chữ ký hợp lệ
+        with pytest.raises(PayloadError, match="temperature"):
+            decode("demo/g1/sensor/state", bad)
+    decode("demo/g1/sensor/state", payload(SENSOR))
+
+def test_content_type_overrides_topic_suffix():
+    assert decode("demo/g1/sensor/state", payload(SENSOR), "application/json; charset=utf-8")[0] == "sensor_data"
+    with pytest.raises(PayloadError, match="content type"):
+        decode("demo/g1/sensor/state", payload(SENSOR), "text/plain")
+
+# =============================================================================
+# MESSAGEPACK / CBOR
+# =============================================================================
+
+def test_encoding_suffix_is_not_part_of_garden():
+    from schema import garden_from_topic
+    assert garden_from_topic("demo/g1/sensor/state/msgpack") == "demo/g1"
+    assert garden_from_topic("demo/g1/sensor/state") == "demo/g1"
+
+def test_msgpack_map_and_array():
+    msgpack = pytest.importorskip("msgpack")
+    expected = ("sensor_data", SensorRecord(3000, 31.5, 80.2, 2900, 1, False, -61))
+    assert decode("demo/g1/sensor/state/msgpack", msgpack.packb(SENSOR)) == expected
+    assert decode("demo/g1/sensor/state/msgpack", msgpack.packb([3000, 31.5, 80.2, 2900, 1, False, -61])) == expected
+    assert decode("demo/g1/sensor/state", msgpack.packb(SENSOR), "application/msgpack") == expected
+    with pytest.raises(PayloadError, match="fields"):
+        decode("demo/g1/sensor/state/msgpack", msgpack.packb([0] * 8))
+    with pytest.raises(PayloadError):
+        decode("demo/g1/sensor/state/msgpack", b"\xc1")
+
+def test_cbor_array():
+    cbor2 = pytest.importorskip("cbor2")
+    assert decode("demo/g1/device/state/cbor", cbor2.dumps([7, "ON", "OFF", 50])) == (
+        "device_state", StateRecord(7, "ON", "OFF", 50, None))
+
+@pytest.mark.skipif(decoders.msgpack is not None, reason="msgpack is installed")
+def test_binary_payload_without_library_is_rejected():
+    with pytest.raises(PayloadError, match="not installed"):
+        decode("demo/g1/sensor/state/msgpack", b"\x81")
+
+# =============================================================================
+# SENSOR/BATCH
+# =============================================================================
+
+def test_batch_sample_list():
+    samples = [dict(SENSOR, timestamp=t) for t in (0, 3000, 6000)]
+    for body in (samples, {"samples": samples}):
+        table, records = decode("demo/g1/sensor/batch", payload(body))
+        assert table == decoders.BATCH_TABLE
+        assert [r.device_timestamp for r in records] == [0, 3000, 6000]
+
+def test_batch_delta_block():
+    block = {"t0": 1000, "dt": 3000, "scale": {"temperature": 10},
+             "delta": {"temperature": [315, 1, -2], "humidity": [80, 0, 5]}}
+    _, records = decode("demo/g1/sensor/batch", payload(block))
+    assert [(r.device_timestamp, r.temperature, r.humidity, r.rssi) for r in records] == [
+        (1000, 31.5, 80, None), (4000, 31.6, 80, None), (7000, 31.4, 85, None)]
+
+@pytest.mark.parametrize("body", [
+    [],
+    {"samples": "x"},
+    [1, 2],
+    {"delta": {"temperature": [1, 2], "humidity": [1]}, "t0": 0},
+    {"delta": {"temperature": [1, 2]}},                         # Không có t0 và cột timestamp
+    {"delta": {"temperature": [1]}, "t0": 0, "scale": {"temperature": 0}},
+    [SENSOR] * (decoders.MAX_BATCH_SAMPLES + 1),
+])
+def test_malformed_batches_are_rejected(body):
+    with pytest.raises(PayloadError):
+        decode("demo/g1/sensor/batch", payload(body))
+
+def test_sample_times_count_back_from_receive_time():
+    _, records = decode("demo/g1/sensor/batch", payload([dict(SENSOR, timestamp=t) for t in (0, 2500, 6000)]))
+    assert decoders.sample_recv_ms(records, 100_000) == [94_000, 96_500, 100_000]
+    assert [ms for _, ms in decoders.sensor_samples(decoders.BATCH_TABLE, records, 100_000)] == [94_000, 96_500, 100_000]
+    state = decode("demo/g1/device/state", payload({"light": "ON"}))
+    assert decoders.sensor_samples(*state, 100_000) == []
+
+@pytest.mark.parametrize("body", [{"light": {"x": 1}}, {"pump": ["ON"]}, {"pumpSpeed": None}])
+def test_command_values_must_be_scalar(body):
+    with pytest.raises(PayloadError):
+        decode("demo/g1/device/cmd", payload(body))
+
+def test_sample_times_are_strictly_increasing():
+    stamps = (0, 3000, 3000, 1000, 6000, 6000)             # Trùng và sai thứ tự
+    _, records = decode("demo/g1/sensor/batch", payload([dict(SENSOR, timestamp=t) for t in stamps]))
+    times = decoders.sample_recv_ms(records, 100_000)
+    # Giữ thứ tự trong message, mỗi mẫu sớm hơn mẫu sau ít nhất 1 ms
+    assert times == [94_000, 94_998, 94_999, 95_000, 99_999, 100_000]
@@ -0,0 +1,55 @@
+"""
+Digest Tests - alerts/digest.py: nhiều garden cùng luật trong một cửa sổ -> một embed,
+cảnh báo lặp lại được gộp, tối đa MAX_EMBEDS embed mỗi message
+Chạy: python -m pytest tests/test_digest.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+from digest import Digester
+from rules import Alert, FIRE, REPEAT, CLEAR, make_rule
+
+HOT = make_rule({"id": "hot", "type": "threshold", "field": "temperature", "above": 30.0,
+                 "severity": "warning"})
+
+def collect():
+    sent = []
+    return sent, lambda payload, label: sent.append(payload)
+
+def test_storm_becomes_one_message_per_window():
+    sent, send = collect()
+    digester = Digester(send, windows={"warning": 60})
+    for i in range(100):
+        digester.add(Alert(f"site/g{i}", HOT, FIRE, 31 + i % 3, 1000.0), now=1000.0)
+    digester.add(Alert("site/g0", HOT, REPEAT, 33, 1030.0), now=1030.0)
+
+    assert digester.flush(now=1059.0) == 0                  # Cửa sổ chưa hết
+    assert digester.flush(now=1060.0) == 1
+    (embed,) = sent[0]["embeds"]
+    assert "100 vườn" in embed["title"]
+    assert "… và 75 vườn khác" in embed["description"]     # Liệt kê tối đa MAX_DEVICES_LISTED
+    assert {"name": "🔁 Lặp lại đã gộp", "value": "1", "inline": True} in embed["fields"]
+    assert digester.stats()["duplicates"] == 1
+
+def test_fire_and_clear_are_separate_groups():
+    sent, send = collect()
+    digester = Digester(send, windows={"warning": 60})
+    digester.add(Alert("site/g1", HOT, FIRE, 31, 0.0), now=0.0)
+    digester.add(Alert("site/g2", HOT, CLEAR, 29, 0.0), now=0.0)
+    digester.flush(force=True)
+    assert len(sent[0]["embeds"]) == 2
+
+def test_single_garden_uses_detailed_embed_and_chunks_embeds():
+    sent, send = collect()
+    digester = Digester(send, single=lambda alert, values: {"title": alert.device}, max_embeds=10,
+                        windows={"warning": 60})
+    rules = [make_rule({"id": f"r{i}", "type": "threshold", "field": "temperature", "above": 30.0,
+                        "severity": "warning"}) for i in range(12)]
+    for rule in rules:
+        digester.add(Alert("site/g1", rule, FIRE, 31, 0.0), now=0.0)
+    assert digester.flush(force=True) == 2
+    assert [len(payload["embeds"]) for payload in sent] == [10, 2]
+    assert sent[0]["embeds"][0] == {"title": "site/g1"}
@@ -0,0 +1,146 @@
+"""
+Dispatcher Tests - alerts/dispatcher.py với một webhook giả lập trên localhost:
+2xx xóa khỏi outbox, 5xx thử lại có backoff, 429 tạm dừng mọi worker, 4xx thành
+dead, thông báo còn trong outbox được gửi lại sau khi mở lại (cần requests)
+Chạy: python -m pytest tests/test_dispatcher.py
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+pytest.importorskip("requests")
+
+from dispatcher import Dispatcher
+
+class Webhook(BaseHTTPRequestHandler):
+    """Trả lần lượt các (status, headers) trong `script`, hết thì 204; ghi lại (thời điểm, id)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with server.lock:
+            server.seen.append((time.time(), body["id"]))
+            status, headers = server.script.popleft() if server.script else (204, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def webhook():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Webhook)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.seen = []
+    server.script = deque()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/webhook"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def outbox_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT id, attempts, dead FROM outbox ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_success_removes_from_outbox(webhook, tmp_path):
+    outbox = str(tmp_path / "outbox.db")
+    dispatcher = Dispatcher(webhook.url, outbox_file=outbox)
+    dispatcher.start()
+    for i in range(5):
+        dispatcher.send({"id": i})
+    dispatcher.close(drain=True, timeout=5)
+
+    assert sorted(i for _, i in webhook.seen) == list(range(5))
+    assert dispatcher.stats()["sent"] == 5
+    assert outbox_rows(outbox) == []
+
+def test_server_error_retries_with_backoff(webhook, tmp_path):
+    webhook.script.extend([(500, {}), (503, {})])
+    dispatcher = Dispatcher(webhook.url, workers=1, outbox_file=str(tmp_path / "outbox.db"), backoff_base=0.1)
+    dispatcher.start()
+    dispatcher.send({"id": 1})
+    dispatcher.close(drain=True, timeout=5)
+
+    times = [t for t, _ in webhook.seen]
+    assert len(times) == 3
+    # Backoff nhân đôi, jitter 0.5-1.0: lần 1 chờ 0.05-0.1 s, lần 2 chờ 0.1-0.2 s
+    assert times[1] - times[0] >= 0.05 - 0.01
+    assert times[2] - times[1] >= 0.1 - 0.01
+    s = dispatcher.stats()
+    assert (s["sent"], s["retried"], s["dead"]) == (1, 2, 0)
+
+def test_rate_limit_pauses_every_worker(webhook, tmp_path):
+    webhook.script.append((429, {"Retry-After": "0.5"}))
+    dispatcher = Dispatcher(webhook.url, workers=3, outbox_file=str(tmp_path / "outbox.db"))
+    dispatcher.start()
+    dispatcher.send({"id": 0})
+    wait_for(lambda: dispatcher.stats()["rate_limited"] == 1)
+    limited_at = webhook.seen[0][0]
+    for i in range(1, 4):
+        dispatcher.send({"id": i})                      # Worker rảnh cũng phải chờ
+    dispatcher.close(drain=True, timeout=5)
+
+    later = webhook.seen[1:]
+    assert sorted(i for _, i in later) == [0, 1, 2, 3]  # 429 không làm mất thông báo
+    assert min(t for t, _ in later) >= limited_at + 0.5 - 0.05
+    assert dispatcher.stats()["retried"] == 0           # 429 không tính là một lần thử
+
+def test_client_error_is_dead_lettered(webhook, tmp_path):
+    outbox = str(tmp_path / "outbox.db")
+    webhook.script.append((400, {}))
+    dispatcher = Dispatcher(webhook.url, outbox_file=outbox)
+    dispatcher.start()
+    job_id = dispatcher.send({"id": 1})
+    dispatcher.close(drain=True, timeout=5)
+
+    assert len(webhook.seen) == 1
+    assert dispatcher.stats()["dead"] == 1
+    assert outbox_rows(outbox) == [(job_id, 1, 1)]
+
+def test_pending_notifications_survive_restart(webhook, tmp_path):
+    outbox = str(tmp_path / "outbox.db")
+    webhook.script.append((500, {}))
+    first = Dispatcher(webhook.url, workers=1, outbox_file=outbox, backoff_base=60)
+    first.start()
+    first.send({"id": 1})
+    wait_for(lambda: first.stats()["retried"] == 1)
+    first.close()                                       # Còn chờ backoff: nằm lại trong outbox
+    stopped = Dispatcher(webhook.url, outbox_file=outbox)
+    stopped.send({"id": 2})                             # Chưa start: chỉ ghi outbox
+    stopped.close()
+    assert [dead for _, _, dead in outbox_rows(outbox)] == [0, 0]
+
+    second = Dispatcher(webhook.url, outbox_file=outbox)
+    second.start()
+    second.close(drain=True, timeout=5)
+
+    assert second.restored == 2
+    assert sorted(i for _, i in webhook.seen[1:]) == [1, 2]
+    assert outbox_rows(outbox) == []
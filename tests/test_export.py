@@ -0,0 +1,150 @@
+"""
+Export Tests - view_database.range_rows/export: gộp shard (và block nén) theo recv_ms,
+đọc bằng fetchmany từng chunk, khoảng [from_ms, to_ms)
+Chạy: python -m pytest tests/test_export.py
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import tscompress
+import view_database
+from schema import open_database, migrate, shard_index, shard_file, shard_files
+
+START_MS = 1_700_000_000_000 - 1_700_000_000_000 % tscompress.BLOCK_MS
+GARDENS = ("site/a", "site/b", "site/c", "site/d")
+SHARDS = 2
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """Hai shard; garden i có mẫu ở START_MS + 1000 * k với k % 4 == i (xen kẽ giữa các shard)"""
+    db_file = str(tmp_path / "garden.db")
+    monkeypatch.setattr(view_database, "DB_FILE", db_file)
+    monkeypatch.setattr(view_database, "DB_SHARDS", SHARDS)
+    for shard in shard_files(db_file, SHARDS):
+        conn = open_database(shard)
+        migrate(conn)
+        conn.close()
+    assert {shard_index(g, SHARDS) for g in GARDENS} == {0, 1}
+
+    for i, garden in enumerate(GARDENS):
+        conn = open_database(shard_file(db_file, shard_index(garden, SHARDS), SHARDS))
+        with conn:
+            conn.executemany(
+                "INSERT INTO sensor_data (garden, recv_ms, temperature, humidity) VALUES (?, ?, ?, ?)",
+                [(garden, START_MS + 1000 * k, 20.0 + k, 50.0) for k in range(i, 200, 4)])
+            conn.execute("INSERT INTO commands (garden, recv_ms, command_type, command_value, source) "
+                         "VALUES (?, ?, 'pump', 'ON', 'mqtt')", (garden, START_MS + i))
+        conn.close()
+    return db_file
+
+class CursorSpy:
+    """Ghi lại cách _hot_rows đọc cursor (phải là fetchmany, không fetchall)"""
+
+    calls = []
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def fetchmany(self, size):
+        rows = self._cursor.fetchmany(size)
+        CursorSpy.calls.append(("fetchmany", size, len(rows)))
+        return rows
+
+    def fetchall(self):
+        CursorSpy.calls.append(("fetchall",))
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        CursorSpy.calls.append(("iter",))
+        return iter(self._cursor)
+
+class ConnectionSpy:
+    """Chỉ theo dõi truy vấn dòng "nóng" (không phải catalog archive / sensor_blocks)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql, *args):
+        cursor = self._conn.execute(sql, *args)
+        if "FROM sensor_data" in sql or "FROM commands" in sql:
+            return CursorSpy(cursor)
+        return cursor
+
+    def close(self):
+        self._conn.close()
+
+def test_range_rows_merges_shards_in_order(db_file):
+    rows = list(view_database.range_rows("sensor_data", START_MS + 10_000, START_MS + 50_000,
+                                         columns=("garden", "recv_ms", "temperature"), chunk_rows=7))
+    # [from_ms, to_ms): 40 mẫu, đủ mọi garden, đúng thứ tự thời gian
+    assert [recv_ms for _, recv_ms, _ in rows] == [START_MS + 1000 * k for k in range(10, 50)]
+    assert [garden for garden, _, _ in rows[:4]] == ["site/c", "site/d", "site/a", "site/b"]
+
+def test_range_rows_filters_garden(db_file):
+    rows = list(view_database.range_rows("sensor_data", START_MS, START_MS + 100_000, garden="site/b",
+                                         columns=("garden", "recv_ms"), chunk_rows=3))
+    assert rows == [("site/b", START_MS + 1000 * k) for k in range(1, 100, 4)]
+
+def test_hot_rows_read_with_fetchmany(db_file, monkeypatch):
+    monkeypatch.setattr(view_database, "connect", lambda path: ConnectionSpy(open_database(path, journal_mode=None)))
+    CursorSpy.calls = []
+
+    rows = view_database.range_rows("commands", START_MS, START_MS + 10, columns=("garden", "recv_ms"),
+                                    chunk_rows=5)
+    # Lazy: chưa lấy dòng nào thì chưa đọc cursor
+    assert CursorSpy.calls == []
+    assert next(rows) == ("site/a", START_MS)
+    assert list(rows) == [(g, START_MS + i) for i, g in enumerate(GARDENS)][1:]
+
+    assert CursorSpy.calls and all(call[0] == "fetchmany" and call[1] == 5 for call in CursorSpy.calls)
+
+    CursorSpy.calls = []
+    assert len(list(view_database.range_rows("sensor_data", START_MS, START_MS + 200_000,
+                                             columns=("garden", "recv_ms"), chunk_rows=16))) == 200
+    sizes = [call[2] for call in CursorSpy.calls if call[0] == "fetchmany"]
+    assert len(sizes) == len(CursorSpy.calls)
+    assert max(sizes) == 16 and sum(sizes) == 200
+
+def test_compressed_rows_merged_with_hot_rows(db_file):
+    garden = "site/a"
+    path = shard_file(db_file, shard_index(garden, SHARDS), SHARDS)
+    conn = open_database(path)
+    assert tscompress.compact_block(conn, garden, START_MS)[0] == 50
+    # Dòng đến sau khi nén vẫn nằm trong sensor_data
+    with conn:
+        conn.execute("INSERT INTO sensor_data (garden, recv_ms, temperature) VALUES (?, ?, 99.0)",
+                     (garden, START_MS + 2))
+    conn.close()
+
+    rows = list(view_database.range_rows("sensor_data", START_MS, START_MS + 20_000, garden=garden,
+                                         columns=("recv_ms", "temperature")))
+    assert rows == [(START_MS, 20.0), (START_MS + 2, 99.0)] + \
+        [(START_MS + 1000 * k, 20.0 + k) for k in range(4, 20, 4)]
+
+def test_export_csv_and_jsonl(db_file, monkeypatch):
+    monkeypatch.setattr(view_database, "EXPORT_CHUNK_ROWS", 3)
+    monkeypatch.setattr(view_database, "EXPORT_WRITE_BYTES", 100)
+
+    out = io.StringIO()
+    assert view_database.export("sensor_data", START_MS, START_MS + 20_000, fmt="csv", out=out) == 20
+    reader = csv.reader(io.StringIO(out.getvalue()))
+    assert next(reader) == list(view_database.EXPORT_COLUMNS["sensor_data"])
+    recv_index = view_database.EXPORT_COLUMNS["sensor_data"].index("recv_ms")
+    assert [int(row[recv_index]) for row in reader] == [START_MS + 1000 * k for k in range(20)]
+
+    out = io.StringIO()
+    assert view_database.export("commands", START_MS, START_MS + 3, fmt="jsonl", out=out) == 3
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(r["garden"], r["recv_ms"], r["command_value"]) for r in records] == [
+        ("site/a", START_MS, "ON"), ("site/b", START_MS + 1, "ON"), ("site/c", START_MS + 2, "ON")]
@@ -0,0 +1,91 @@
+"""
+Ingest Queue Tests - ingest_queue.py: block / drop_oldest / spill khi hàng đợi đầy,
+và spill khởi động lại không nhận lại message đã đọc ra
+Chạy: python -m pytest tests/test_ingest_queue.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from ingest_queue import IngestQueue
+
+def put_many(queue, ids):
+    for i in ids:
+        assert queue.put("site/g1/device/cmd", str(i).encode(), 1000.0 + i)
+
+def drain(queue, limit=None):
+    ids = []
+    while limit is None or len(ids) < limit:
+        item = queue.get(timeout=0)
+        if item is None:
+            break
+        ids.append(int(item[1]))
+    return ids
+
+def test_block_waits_for_room():
+    queue = IngestQueue(maxsize=2, policy="block")
+    put_many(queue, range(2))
+    done = threading.Event()
+    producer = threading.Thread(target=lambda: (put_many(queue, [2]), done.set()))
+    producer.start()
+    time.sleep(0.05)
+    assert not done.is_set()                # Đầy: put() bị chặn
+    assert int(queue.get()[1]) == 0
+    producer.join(1)
+    assert done.is_set()
+    assert drain(queue) == [1, 2]
+    assert queue.stats()["blocked"] == 1
+
+def test_block_put_returns_false_after_close():
+    queue = IngestQueue(maxsize=1, policy="block")
+    put_many(queue, [0])
+    result = []
+    producer = threading.Thread(target=lambda: result.append(queue.put("t", b"1")))
+    producer.start()
+    time.sleep(0.05)
+    queue.close()
+    producer.join(1)
+    assert result == [False]
+    assert drain(queue) == [0]
+
+def test_drop_oldest_keeps_newest():
+    queue = IngestQueue(maxsize=3, policy="drop_oldest")
+    put_many(queue, range(5))
+    assert drain(queue) == [2, 3, 4]
+    s = queue.stats()
+    assert (s["dropped"], s["enqueued"]) == (2, 5)
+
+def test_spill_keeps_fifo_order_and_cleans_up(tmp_path):
+    spill = str(tmp_path / "spill.bin")
+    queue = IngestQueue(maxsize=2, policy="spill", spill_file=spill)
+    put_many(queue, range(5))
+    assert queue.depth == 5 and queue.stats()["spilled"] == 3
+    assert drain(queue, 3) == [0, 1, 2]
+    put_many(queue, range(5, 8))            # Sau dữ liệu trên đĩa, message mới vẫn vào file
+    assert drain(queue) == [3, 4, 5, 6, 7]
+    assert not os.path.exists(spill) and not os.path.exists(spill + ".offset")
+
+def test_spill_restart_skips_messages_already_read(tmp_path):
+    spill = str(tmp_path / "spill.bin")
+    queue = IngestQueue(maxsize=2, policy="spill", spill_file=spill)
+    put_many(queue, range(10))
+    assert drain(queue, 5) == [0, 1, 2, 3, 4]
+    # Dừng đột ngột (không close): 5 đã được đọc ra bộ nhớ, 6..9 còn trong file
+    with open(spill, "ab") as f:
+        f.write(b"\x00" * 7)                # Bản ghi dở dang cuối file
+
+    restarted = IngestQueue(maxsize=2, policy="spill", spill_file=spill)
+    assert restarted.depth == 4
+    assert drain(restarted) == [6, 7, 8, 9]
+    assert not os.path.exists(spill)
+
+def test_spill_restart_with_nothing_read(tmp_path):
+    spill = str(tmp_path / "spill.bin")
+    queue = IngestQueue(maxsize=1, policy="spill", spill_file=spill)
+    put_many(queue, range(4))
+    restarted = IngestQueue(maxsize=1, policy="spill", spill_file=spill)
+    assert drain(restarted) == [1, 2, 3]
@@ -0,0 +1,107 @@
+"""
+Latest State Tests - LatestState.fleet(since): client gửi lại version đã nhận để chỉ lấy
+thiết bị thay đổi; version vẫn tăng tiếp sau khi nạp lại snapshot
+Chạy: python -m pytest tests/test_latest_state.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from decoders import SensorRecord, StateRecord, OnlineRecord
+from latest_state import FLEET_COLUMNS, STALE_MS, LatestState
+
+T0 = 1_700_000_000_000
+GARDEN = FLEET_COLUMNS.index("garden")
+VERSION = FLEET_COLUMNS.index("version")
+ALIVE = FLEET_COLUMNS.index("alive")
+
+def sensor(temperature, rssi=-60):
+    return SensorRecord(1, temperature, 60.0, 3000, 1, False, rssi)
+
+def state(pump):
+    return StateRecord(1, "ON", pump, 80 if pump == "ON" else 0, None)
+
+def online(is_online, firmware="1.0"):
+    return OnlineRecord(1, is_online, "esp32", firmware, -55)
+
+def gardens(rows):
+    return sorted(row[GARDEN] for row in rows)
+
+def test_fleet_since_returns_only_changed_devices():
+    latest = LatestState()
+    assert latest.fleet() == (0, [])
+
+    for i, garden in enumerate(("g1", "g2", "g3")):
+        latest.update_sensor(garden, sensor(20.0 + i), T0)
+    version, rows = latest.fleet(0, now_ms=T0)
+    assert version == 3 and gardens(rows) == ["g1", "g2", "g3"]
+
+    # Không có gì mới: version giữ nguyên, không có dòng
+    assert latest.fleet(version, now_ms=T0) == (3, [])
+
+    latest.update_state("g2", state("ON"), T0 + 1000)
+    latest.update_online("g3", online(True), T0 + 1000)
+    latest.update_sensor("g2", sensor(25.0), T0 + 2000)
+    version2, rows = latest.fleet(version, now_ms=T0 + 2000)
+    assert version2 == 6 and gardens(rows) == ["g2", "g3"]
+    # Mỗi dòng mang version lần đổi cuối của thiết bị đó
+    assert {row[GARDEN]: row[VERSION] for row in rows} == {"g2": 6, "g3": 5}
+
+    # Client đã lỡ vài lần hỏi vẫn nhận đủ phần thay đổi
+    assert gardens(latest.fleet(4, now_ms=T0)[1]) == ["g2", "g3"]
+    assert gardens(latest.fleet(5, now_ms=T0)[1]) == ["g2"]
+
+def test_row_follows_fleet_columns():
+    latest = LatestState()
+    latest.update_online("g", online(True, "1.2"), T0)
+    latest.update_state("g", state("ON"), T0 + 1000)
+    latest.update_sensor("g", sensor(31.5, rssi=-70), T0 + 2000)
+
+    _, [row] = latest.fleet(now_ms=T0 + 2000)
+    data = dict(zip(FLEET_COLUMNS, row))
+    assert data["temperature"] == 31.5 and data["pump"] == "ON" and data["firmware"] == "1.2"
+    # rssi None trong device/state không xóa giá trị cũ
+    assert data["rssi"] == -70
+    assert (data["online_ms"], data["state_ms"], data["sensor_ms"], data["last_seen_ms"]) == \
+        (T0, T0 + 1000, T0 + 2000, T0 + 2000)
+    assert data == dict(latest.get("g", now_ms=T0 + 2000), alive=True)
+
+def test_alive_depends_on_online_and_staleness():
+    latest = LatestState()
+    latest.update_online("up", online(True), T0)
+    latest.update_online("down", online(False), T0)
+    latest.update_sensor("silent", sensor(20.0), T0)
+
+    def alive(now_ms):
+        return {row[GARDEN]: row[ALIVE] for row in latest.fleet(now_ms=now_ms)[1]}
+
+    assert alive(T0 + STALE_MS) == {"up": True, "down": False, "silent": False}
+    assert alive(T0 + STALE_MS + 1) == {"up": False, "down": False, "silent": False}
+    assert latest.summary(T0) == {"version": 3, "devices": 3, "alive": 1, "pumping": 0}
+
+def test_version_continues_after_snapshot_reload(tmp_path):
+    snapshot = str(tmp_path / "latest_state.json")
+    latest = LatestState(snapshot)
+    latest.update_sensor("g1", sensor(20.0), T0)
+    latest.update_sensor("g2", sensor(21.0), T0)
+    latest.save()
+    client_version, _ = latest.fleet(now_ms=T0)
+
+    reloaded = LatestState(snapshot)
+    assert reloaded.load() == 2
+    assert reloaded.fleet(client_version, now_ms=T0) == (client_version, [])
+    assert reloaded.get("g2")["temperature"] == 21.0
+
+    # Thay đổi sau khi khởi động lại có version lớn hơn version client đang giữ
+    reloaded.update_state("g1", state("ON"), T0 + 1000)
+    version, rows = reloaded.fleet(client_version, now_ms=T0 + 1000)
+    assert version == client_version + 1 and gardens(rows) == ["g1"]
+
+def test_missing_or_broken_snapshot(tmp_path):
+    assert LatestState(str(tmp_path / "missing.json")).load() == 0
+    broken = tmp_path / "broken.json"
+    broken.write_text("{not json")
+    latest = LatestState(str(broken))
+    assert latest.load() == 0 and latest.fleet() == (0, [])
@@ -0,0 +1,112 @@
+"""
+Query Cache Tests - QueryCache.invalidate_changes chỉ xóa entry có (bảng, garden, khoảng recv_ms)
+chứa dòng vừa ghi; kết quả nạp trong lúc có commit không được lưu lại
+Chạy: python -m pytest tests/test_query_cache.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from batch_writer import BatchWriter
+from query_cache import QueryCache
+from schema import open_database, migrate
+
+HOUR_MS = 3600 * 1000
+T0 = 1_700_000_000_000
+
+def keys(cache):
+    return set(cache._entries)
+
+def test_range_overlap():
+    cache = QueryCache()
+    cache.put("yesterday", 1, ["sensor_data"], "g", T0 - 24 * HOUR_MS, T0)
+    cache.put("today", 2, ["sensor_data"], "g", T0, T0 + 24 * HOUR_MS)
+    cache.put("since", 3, ["sensor_data"], "g", T0 + HOUR_MS, None)
+    cache.put("until", 4, ["sensor_data"], "g", None, T0 - HOUR_MS)
+    cache.put("all", 5, ["sensor_data"], "g")
+
+    # to_ms là cận mở: dòng tại đúng T0 thuộc "today", không thuộc "yesterday"
+    cache.invalidate_changes({("sensor_data", "g"): (T0, T0 + 1000)})
+    assert keys(cache) == {"yesterday", "since", "until"}
+
+    cache.invalidate_changes({("sensor_data", "g"): (T0 - 2 * HOUR_MS, T0 - 2 * HOUR_MS)})
+    assert keys(cache) == {"since"}
+
+    # min..max của lô trùm cả khoảng mở của entry
+    cache.invalidate_changes({("sensor_data", "g"): (T0, T0 + 5 * HOUR_MS)})
+    assert keys(cache) == set()
+    assert cache.stats()["invalidations"] == 5
+
+def test_scope_by_table_and_garden():
+    cache = QueryCache()
+    cache.put("g1", 1, ["sensor_data"], "g1")
+    cache.put("g2", 2, ["sensor_data"], "g2")
+    cache.put("fleet", 3, ["sensor_data"])                  # Gộp mọi garden
+    cache.put("state", 4, ["device_state"], "g1")
+    cache.put("status", 5, ["device_state", "device_online"], "g2")
+
+    cache.invalidate_changes({("sensor_data", "g1"): (T0, T0)})
+    assert keys(cache) == {"g2", "state", "status"}
+
+    cache.invalidate_changes({("device_online", "g2"): (T0, T0)})
+    assert keys(cache) == {"g2", "state"}
+    # Entry đã xóa không còn trong index của bảng khác
+    assert ("device_state", "g2") not in cache._index
+
+    cache.invalidate_changes({("commands", "g1"): (T0, T0)})
+    assert keys(cache) == {"g2", "state"}
+
+def test_cached_skips_store_when_commit_races_loader():
+    cache = QueryCache()
+    loads = []
+
+    def racing_loader():
+        loads.append(1)
+        # Batch writer commit trong lúc truy vấn đang chạy (khác garden, khác khoảng)
+        cache.invalidate_changes({("sensor_data", "other"): (T0, T0)})
+        return "stale?"
+
+    assert cache.cached("k", racing_loader, ["sensor_data"], "g", T0, T0 + HOUR_MS) == "stale?"
+    assert cache.get("k") is None
+
+    assert cache.cached("k", lambda: "fresh", ["sensor_data"], "g", T0, T0 + HOUR_MS) == "fresh"
+    assert cache.cached("k", lambda: "unused", ["sensor_data"], "g", T0, T0 + HOUR_MS) == "fresh"
+    assert len(loads) == 1
+
+def test_lru_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("query_cache.time.monotonic", lambda: now[0])
+    cache = QueryCache(max_entries=2, ttl=30)
+    cache.put("a", 1, ["sensor_data"])
+    cache.put("b", 2, ["sensor_data"])
+    assert cache.get("a") == 1                              # a mới dùng: b bị đẩy ra
+    cache.put("c", 3, ["sensor_data"])
+    assert keys(cache) == {"a", "c"} and cache.evictions == 1
+
+    now[0] += 30
+    assert cache.get("a") is None and cache.expired == 1
+    assert keys(cache) == {"c"}
+
+def test_flush_listener_invalidates_written_range(tmp_path):
+    db_file = str(tmp_path / "garden.db")
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.close()
+
+    cache = QueryCache()
+    cache.put("old", 1, ["sensor_data"], "g", T0 - 24 * HOUR_MS, T0 - HOUR_MS)
+    cache.put("recent", 2, ["sensor_data"], "g", T0 - HOUR_MS, None)
+    cache.put("state", 3, ["device_state"], "g", T0 - HOUR_MS, None)
+
+    writer = BatchWriter(db_file)
+    writer.add_flush_listener(cache.invalidate_changes)
+    writer.write_batch({(0, "sensor_data"): [("g", T0, None, 25.0, 60.0, 0, 1, False, -60)]})
+    assert writer.rows_written == 1
+    assert keys(cache) == {"old", "state"}
+
+    # Heartbeat (touch) cũng làm cũ entry của bảng đó
+    writer.write_batch({}, touches={(0, "device_state", "g", T0 - 2 * HOUR_MS): T0})
+    assert keys(cache) == {"old"}
+    writer.close()
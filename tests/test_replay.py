@@ -0,0 +1,93 @@
+"""
+Replay Tests - replay.py nạp lại capture phải idempotent
+Chạy: python -m pytest tests/test_replay.py
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import replay
+import tscompress
+from ingest_queue import write_record
+from schema import open_database
+
+START = 1_700_000_000.0         # 2023-11-14 22:13:20 UTC
+
+def write_capture(path, ticks=5, garden="site/g1"):
+    """`ticks` mẫu sensor mỗi 3 s + heartbeat device/state không đổi"""
+    with open(path, "wb") as f:
+        for tick in range(ticks):
+            now = START + tick * 3
+            sensor = {"temperature": 25 + tick / 10, "humidity": 60.0, "rain_analog": 3000,
+                      "rain_digital": 1, "is_raining": False, "rssi": -60, "timestamp": tick * 3000}
+            state = {"light": "ON", "pump": "OFF", "pumpSpeed": 0, "rssi": -60, "timestamp": tick * 3000}
+            write_record(f, f"{garden}/sensor/state", json.dumps(sensor).encode(), now)
+            write_record(f, f"{garden}/device/state", json.dumps(state).encode(), now)
+
+def query(db_file, sql):
+    conn = open_database(db_file, journal_mode=None)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+def test_replay_twice_is_idempotent(tmp_path):
+    capture = str(tmp_path / "capture.bin")
+    db_file = str(tmp_path / "garden.db")
+    write_capture(capture)
+
+    replay.replay([capture], db_file, workers=1)
+    replayer, _ = replay.replay([capture], db_file, workers=1)
+
+    assert query(db_file, "SELECT COUNT(*), COUNT(DISTINCT recv_ms) FROM sensor_data") == [(5, 5)]
+    assert query(db_file, "SELECT COUNT(*) FROM device_state") == [(1,)]
+    assert query(db_file, "SELECT samples, temp_count FROM sensor_rollup WHERE resolution = 60000") == [(5, 5)]
+    assert replayer.writer.stats()["rows_duplicate"] == 6       # 5 sensor + 1 state
+
+def test_replay_keeps_capture_time_in_timestamp(tmp_path):
+    capture = str(tmp_path / "capture.bin")
+    db_file = str(tmp_path / "garden.db")
+    write_capture(capture, ticks=1)
+    replay.replay([capture], db_file, workers=1)
+
+    assert query(db_file, "SELECT timestamp FROM sensor_data") == [("2023-11-14 22:13:20",)]
+    assert query(db_file, "SELECT timestamp FROM device_state") == [("2023-11-14 22:13:20",)]
+
+def test_replay_skips_samples_already_compressed(tmp_path):
+    capture = str(tmp_path / "capture.bin")
+    db_file = str(tmp_path / "garden.db")
+    write_capture(capture)
+    replay.replay([capture], db_file, workers=1)
+    tscompress.Compactor(db_file, after_hours=0).run_once(now_ms=int(START * 1000) + 10 * tscompress.HOUR_MS)
+    assert query(db_file, "SELECT COUNT(*) FROM sensor_data") == [(0,)]
+
+    replay.replay([capture], db_file, workers=1)
+
+    assert query(db_file, "SELECT COUNT(*) FROM sensor_data") == [(0,)]
+    assert query(db_file, "SELECT SUM(samples) FROM sensor_blocks") == [(5,)]
+    assert query(db_file, "SELECT samples FROM sensor_rollup WHERE resolution = 60000") == [(5,)]
+
+def test_batch_samples_keep_their_own_timestamp(tmp_path):
+    capture = str(tmp_path / "capture.bin")
+    db_file = str(tmp_path / "garden.db")
+    batch = {"t0": 0, "dt": 3000, "delta": {"temperature": [25, 1, 1], "humidity": [60, 0, 0]}}
+    with open(capture, "wb") as f:
+        write_record(f, "site/g1/sensor/batch", json.dumps(batch).encode(), START)
+    replay.replay([capture], db_file, workers=1)
+
+    assert query(db_file, "SELECT timestamp, temperature FROM sensor_data ORDER BY recv_ms") == [
+        ("2023-11-14 22:13:14", 25), ("2023-11-14 22:13:17", 26), ("2023-11-14 22:13:20", 27)]
+
+def test_batch_samples_with_equal_timestamps_are_all_stored(tmp_path):
+    capture = str(tmp_path / "capture.bin")
+    db_file = str(tmp_path / "garden.db")
+    batch = [{"timestamp": 3000, "temperature": 25 + i} for i in range(3)]
+    with open(capture, "wb") as f:
+        write_record(f, "site/g1/sensor/batch", json.dumps(batch).encode(), START)
+    replayer, _ = replay.replay([capture], db_file, workers=1)
+
+    assert query(db_file, "SELECT COUNT(*) FROM sensor_data") == [(3,)]
+    assert replayer.writer.stats()["rows_duplicate"] == 0
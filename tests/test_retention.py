@@ -0,0 +1,119 @@
+"""
+Retention Tests - prune/Pruner: xóa dòng quá hạn theo từng bảng, giữ dòng heartbeat còn được last_seen_ms
+Chạy: python -m pytest tests/test_retention.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from retention import DAY_MS, Pruner, prune
+from schema import open_database, migrate, shard_files
+
+NOW_MS = 1_700_000_000_000
+RETENTION = {"sensor_data": 14, "device_state": 14, "device_online": 30, "commands": None}
+
+def make_db(path):
+    conn = open_database(str(path))
+    migrate(conn)
+    return conn
+
+def days_ago(days, now_ms=NOW_MS):
+    return now_ms - int(days * DAY_MS)
+
+def add_sensor(conn, recv_ms, garden="g"):
+    conn.execute("INSERT INTO sensor_data (garden, recv_ms, temperature) VALUES (?, ?, 20.0)", (garden, recv_ms))
+
+def add_online(conn, recv_ms, last_seen_ms, garden="g"):
+    conn.execute("INSERT INTO device_online (garden, recv_ms, last_seen_ms, online, device_id) VALUES (?, ?, ?, 1, 'esp32')",
+                 (garden, recv_ms, last_seen_ms))
+
+def test_prune_deletes_only_expired_rows(tmp_path):
+    conn = make_db(tmp_path / "garden.db")
+    for days in (20, 15, 13, 1):
+        add_sensor(conn, days_ago(days))
+    conn.execute("INSERT INTO commands (garden, recv_ms, command_type) VALUES ('g', ?, 'pump')", (days_ago(400),))
+    conn.commit()
+
+    deleted = prune(conn, RETENTION, batch_size=1, pause=0, now_ms=NOW_MS)
+
+    assert deleted == {"sensor_data": 2}
+    remaining = [row[0] for row in conn.execute("SELECT recv_ms FROM sensor_data ORDER BY recv_ms")]
+    assert remaining == [days_ago(13), days_ago(1)]
+    # None = giữ mãi
+    assert conn.execute("SELECT COUNT(*) FROM commands").fetchone()[0] == 1
+    conn.close()
+
+def test_heartbeat_rows_kept_by_last_seen(tmp_path):
+    conn = make_db(tmp_path / "garden.db")
+    # Trạng thái cũ đã bị thay thế: quá hạn
+    add_online(conn, days_ago(60), days_ago(45))
+    # Trạng thái ghi từ 60 ngày trước nhưng vẫn được heartbeat hôm qua: là trạng thái hiện tại
+    add_online(conn, days_ago(59), days_ago(1))
+    # Dòng trước migration 5 (last_seen_ms NULL) rơi về recv_ms
+    add_online(conn, days_ago(50), None, garden="other")
+    conn.execute("INSERT INTO device_state (garden, recv_ms, last_seen_ms, light) VALUES ('g', ?, ?, 'ON')",
+                 (days_ago(20), days_ago(0.5)))
+    conn.commit()
+
+    deleted = prune(conn, RETENTION, pause=0, now_ms=NOW_MS)
+
+    assert deleted == {"device_online": 2}
+    assert conn.execute("SELECT recv_ms FROM device_online").fetchall() == [(days_ago(59),)]
+    assert conn.execute("SELECT COUNT(*) FROM device_state").fetchone()[0] == 1
+    conn.close()
+
+def test_expired_blocks_follow_sensor_retention(tmp_path):
+    conn = make_db(tmp_path / "garden.db")
+    conn.executemany("INSERT INTO sensor_blocks VALUES ('g', ?, 1, ?, ?, x'00')",
+                     [(days_ago(30), days_ago(30), days_ago(29)),
+                      (days_ago(15), days_ago(15), days_ago(13))])
+    conn.commit()
+
+    assert prune(conn, RETENTION, pause=0, now_ms=NOW_MS) == {"sensor_blocks": 1}
+    assert conn.execute("SELECT start_ms FROM sensor_blocks").fetchall() == [(days_ago(15),)]
+    conn.close()
+
+def test_stop_event_interrupts_batches(tmp_path):
+    conn = make_db(tmp_path / "garden.db")
+    for i in range(10):
+        add_sensor(conn, days_ago(20) + i)
+    conn.commit()
+
+    class StopAfterFirstBatch:
+        calls = 0
+        def is_set(self):
+            self.calls += 1
+            return self.calls > 1
+
+    deleted = prune(conn, {"sensor_data": 14}, batch_size=3, pause=0, now_ms=NOW_MS,
+                    stop_event=StopAfterFirstBatch())
+    assert deleted == {"sensor_data": 3}
+    conn.close()
+
+def test_pruner_run_once_covers_every_shard(tmp_path):
+    db_file = str(tmp_path / "garden.db")
+    now_ms = int(time.time() * 1000)
+    for i, shard in enumerate(shard_files(db_file, 2)):
+        conn = make_db(shard)
+        add_sensor(conn, days_ago(20, now_ms), garden=f"g{i}")
+        add_sensor(conn, days_ago(1, now_ms), garden=f"g{i}")
+        add_online(conn, days_ago(40, now_ms), days_ago(40, now_ms), garden=f"g{i}")
+        add_online(conn, days_ago(40, now_ms) + 1, now_ms, garden=f"g{i}")
+        conn.commit()
+        conn.close()
+
+    pruner = Pruner(db_file, RETENTION, shards=2, pause=0)
+    assert pruner.run_once() == 4
+    assert pruner.rows_deleted == 4 and pruner.runs == 1
+
+    for shard in shard_files(db_file, 2):
+        conn = open_database(shard)
+        assert conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0] == 1
+        assert conn.execute("SELECT last_seen_ms FROM device_online").fetchall() == [(now_ms,)]
+        conn.close()
+
+    # Lượt sau không còn gì để xóa
+    assert pruner.run_once() == 0
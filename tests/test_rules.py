@@ -0,0 +1,93 @@
+"""
+Rule Engine Tests - alerts/rules.py: trạng thái riêng mỗi (garden, luật),
+hysteresis, kéo dài N phút, nhắc lại và lọc garden theo glob
+Chạy: python -m pytest tests/test_rules.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+from rules import Rule, RuleEngine, FIRE, REPEAT, CLEAR
+
+HOT = {"id": "hot", "type": "threshold", "field": "temperature", "above": 30.0, "hysteresis": 0.5}
+
+def kinds(engine, device, temps, start=0.0, step=60.0, **extra):
+    """Chạy một chuỗi nhiệt độ, trả về [(phút, rule_id, kind)]"""
+    events = []
+    for i, temp in enumerate(temps):
+        t = start + i * step
+        for alert in engine.evaluate(device, dict(extra, temperature=temp), t):
+            events.append((int(t // 60), alert.rule.id, alert.kind))
+    return events
+
+def test_threshold_fires_once_and_clears_below_hysteresis():
+    engine = RuleEngine([HOT])
+    events = kinds(engine, "g1", [29, 31, 32, 29.8, 31, 29.4, 29])
+    # 29.8 nằm trong vùng trễ (> 30 - 0.5): vẫn đang vượt, không báo lại khi lên 31
+    assert events == [(1, "hot", FIRE), (5, "hot", CLEAR)]
+
+def test_gardens_have_separate_state():
+    engine = RuleEngine([HOT])
+    assert kinds(engine, "g1", [31]) == [(0, "hot", FIRE)]
+    assert kinds(engine, "g2", [29]) == []                  # g2 bình thường không xóa cảnh báo của g1
+    assert kinds(engine, "g2", [31]) == [(0, "hot", FIRE)]
+    assert sorted(d for d, _, _ in engine.active()) == ["g1", "g2"]
+    assert kinds(engine, "g1", [29]) == [(0, "hot", CLEAR)]
+    assert [d for d, _, _ in engine.active()] == ["g2"]
+
+def test_sustained_minutes_and_repeat():
+    engine = RuleEngine([dict(HOT, id="heat", minutes=10, repeat=300)])
+    events = kinds(engine, "g1", [31] * 21)
+    assert events == [(10, "heat", FIRE), (15, "heat", REPEAT), (20, "heat", REPEAT)]
+    # Một mẫu không vượt trước khi đủ giờ giữ: đếm lại từ đầu
+    engine = RuleEngine([dict(HOT, id="heat", minutes=10)])
+    assert kinds(engine, "g1", [31] * 8 + [29] + [31] * 11) == [(19, "heat", FIRE)]
+
+def test_rate_and_combo():
+    engine = RuleEngine([
+        {"id": "rising", "type": "rate", "field": "temperature", "per_minute": 0.5, "window": 600},
+        {"id": "hot_dry", "type": "combo", "when": [("temperature", ">", 32.0), ("is_raining", "==", False)]},
+    ])
+    assert kinds(engine, "g1", [25, 26, 27], is_raining=True) == [(1, "rising", FIRE)]
+    assert kinds(engine, "g2", [33], is_raining=False) == [(0, "hot_dry", FIRE)]
+    assert kinds(engine, "g2", [33], is_raining=True) == [(0, "hot_dry", CLEAR)]
+
+def test_devices_glob_selects_rules():
+    engine = RuleEngine([HOT, dict(HOT, id="demo_only", above=20.0, devices="demo/*"),
+                         dict(HOT, id="g7_only", above=25.0, devices="site/g7")])
+    assert [r.id for r in engine.rules_for("demo/a")] == ["hot", "demo_only"]
+    assert [r.id for r in engine.rules_for("site/g7")] == ["hot", "g7_only"]
+    assert [r.id for r in engine.rules_for("site/g8")] == ["hot"]
+    assert kinds(engine, "site/g8", [26]) == []
+
+def test_rule_added_later_keeps_existing_state():
+    engine = RuleEngine([HOT])
+    kinds(engine, "g1", [31])
+    engine.add_rule(dict(HOT, id="warm", above=25.0))
+    assert kinds(engine, "g1", [31]) == [(0, "warm", FIRE)]     # "hot" vẫn nhớ là đang vượt
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError, match="Unknown rule type"):
+        RuleEngine([{"id": "x", "type": "magic"}])
+    with pytest.raises(ValueError, match="Duplicate"):
+        RuleEngine([HOT, HOT])
+
+def test_rule_without_condition_fails_at_construction():
+    class Incomplete(Rule):
+        __slots__ = ()
+
+    class Always(Rule):
+        __slots__ = ()
+
+        def condition(self, state, device, values, t):
+            return True, values["temperature"]
+
+    with pytest.raises(TypeError, match="condition"):
+        Incomplete({"id": "incomplete"})
+    # Luật tự viết (subclass có condition) dùng được trực tiếp trong engine
+    engine = RuleEngine([Always({"id": "always"})])
+    assert kinds(engine, "g1", [10]) == [(0, "always", FIRE)]
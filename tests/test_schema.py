@@ -0,0 +1,116 @@
+"""
+Schema Tests - schema.migrate: file mới, nâng cấp file cũ (schema gốc), chạy lại không đổi gì
+Chạy: python -m pytest tests/test_schema.py
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+from schema import MIGRATIONS, open_database, migrate, current_version
+
+LATEST = MIGRATIONS[-1][0]
+
+# Schema của mqtt_logger.py trước khi có migration (file database cũ đang chạy thật)
+BASELINE_SQL = [
+    """CREATE TABLE sensor_data (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, device_timestamp INTEGER,
+       temperature REAL, humidity REAL, rain_analog INTEGER, rain_digital INTEGER,
+       is_raining BOOLEAN, rssi INTEGER)""",
+    """CREATE TABLE device_state (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, device_timestamp INTEGER,
+       light TEXT, pump TEXT, pumpSpeed INTEGER, rssi INTEGER)""",
+    """CREATE TABLE device_online (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, device_timestamp INTEGER,
+       online BOOLEAN, device_id TEXT, firmware TEXT, rssi INTEGER)""",
+    """CREATE TABLE commands (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, command_type TEXT,
+       command_value TEXT, source TEXT)""",
+]
+
+def columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def indexes(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA index_list({table})")}
+
+def test_fresh_database(tmp_path):
+    conn = open_database(str(tmp_path / "fresh.db"))
+    applied = migrate(conn)
+
+    assert [number for number, _ in applied] == [number for number, _, _ in MIGRATIONS]
+    assert current_version(conn) == LATEST
+    assert {"recv_ms", "garden"} <= columns(conn, "sensor_data")
+    assert {"recv_ms", "garden", "last_seen_ms"} <= columns(conn, "device_online")
+    assert "idx_sensor_data_unique" in indexes(conn, "sensor_data")
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"sensor_rollup", "archive_catalog", "sensor_blocks"} <= tables
+    conn.close()
+
+def test_upgrade_from_baseline_schema(tmp_path):
+    db_file = str(tmp_path / "old.db")
+    conn = open_database(db_file)
+    for sql in BASELINE_SQL:
+        conn.execute(sql)
+    # Hai message trong cùng một giây: sau backfill recv_ms trùng nhau
+    conn.executemany(
+        "INSERT INTO sensor_data (timestamp, temperature, humidity, is_raining, rssi) VALUES (?, ?, ?, ?, ?)",
+        [("2024-01-01 10:00:00", 25.0, 60.0, 0, -50),
+         ("2024-01-01 10:00:00", 26.0, 61.0, 1, -51),
+         ("2024-01-01 10:05:00", 27.0, 62.0, 0, -52)])
+    conn.execute("INSERT INTO device_online (timestamp, online, device_id) VALUES ('2024-01-01 10:00:00', 1, 'esp32')")
+    conn.execute("INSERT INTO commands (timestamp, command_type, command_value) VALUES ('2024-01-01 10:01:00', 'pump', 'ON')")
+    conn.commit()
+
+    migrate(conn)
+    assert current_version(conn) == LATEST
+
+    base_ms = 1704103200000     # 2024-01-01 10:00:00 UTC
+    rows = conn.execute("SELECT garden, recv_ms, temperature FROM sensor_data ORDER BY id").fetchall()
+    assert rows == [("demo/garden", base_ms, 25.0),
+                    ("demo/garden", base_ms + 1, 26.0),
+                    ("demo/garden", base_ms + 300000, 27.0)]
+    assert conn.execute("SELECT garden, recv_ms, last_seen_ms FROM device_online").fetchone() == \
+        ("demo/garden", base_ms, base_ms)
+    assert conn.execute("SELECT garden, recv_ms FROM commands").fetchone() == ("demo/garden", base_ms + 60000)
+
+    # Rollup được dựng lại từ dữ liệu cũ
+    minute = conn.execute("""
+        SELECT samples, rain_count, temp_min, temp_max FROM sensor_rollup
+        WHERE resolution = 60000 AND bucket_ms = ?
+    """, (base_ms,)).fetchone()
+    assert minute == (2, 1, 25.0, 26.0)
+    conn.close()
+
+def test_migrate_is_idempotent(tmp_path):
+    db_file = str(tmp_path / "garden.db")
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.execute("INSERT INTO sensor_data (garden, recv_ms, temperature) VALUES ('g', 1, 20.0)")
+    conn.commit()
+    conn.close()
+
+    conn = open_database(db_file)
+    assert migrate(conn) == []
+    assert current_version(conn) == LATEST
+    versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [number for number, _, _ in MIGRATIONS]
+    assert conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0] == 1
+    conn.close()
+
+def test_failed_migration_rolls_back(tmp_path):
+    conn = open_database(str(tmp_path / "garden.db"))
+    migrate(conn)
+    broken = MIGRATIONS + [(LATEST + 1, "broken", [
+        "ALTER TABLE commands ADD COLUMN extra TEXT",
+        "SELECT * FROM missing_table",
+    ])]
+    with pytest.raises(sqlite3.OperationalError):
+        migrate(conn, broken)
+    assert current_version(conn) == LATEST
+    assert "extra" not in columns(conn, "commands")
+    conn.close()
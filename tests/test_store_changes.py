@@ -0,0 +1,123 @@
+"""
+Heartbeat Dedup Tests - mqtt_logger.store_changes: heartbeat trùng trạng thái chỉ cập nhật
+last_seen_ms, trạng thái đổi (hoặc im lặng quá DEDUP_MAX_SILENCE) thì ghi dòng mới
+Chạy: python -m pytest tests/test_store_changes.py (cần paho-mqtt)
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+pytest.importorskip("paho.mqtt.client")
+
+import mqtt_logger
+from batch_writer import BatchWriter
+from latest_state import LatestState
+from schema import open_database, migrate
+
+GARDEN = "demo/garden"
+T0 = 1_700_000_000.0
+
+@pytest.fixture
+def logger(tmp_path, monkeypatch):
+    """mqtt_logger với writer ghi vào file tạm; trả về hàm đọc lại database sau khi flush"""
+    db_file = str(tmp_path / "garden.db")
+    conn = open_database(db_file)
+    migrate(conn)
+    conn.close()
+
+    writer = BatchWriter(db_file, max_delay=0.01, report_interval=3600)
+    writer.start()
+    monkeypatch.setattr(mqtt_logger, "writer", writer)
+    monkeypatch.setattr(mqtt_logger, "DB_SHARDS", 1)
+    monkeypatch.setattr(mqtt_logger, "LOG_MESSAGES", False)
+    monkeypatch.setattr(mqtt_logger, "DEDUP_HEARTBEATS", True)
+    monkeypatch.setattr(mqtt_logger, "last_rows", {})
+    monkeypatch.setattr(mqtt_logger, "dedup_skipped", 0)
+    monkeypatch.setattr(mqtt_logger, "latest", LatestState())
+
+    def rows(sql):
+        # close() flush hết dòng và touch còn chờ
+        writer.close()
+        conn = open_database(db_file, journal_mode=None)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    yield rows
+    writer.close()
+
+def state(recv_time, light="ON", pump="OFF", speed=0, rssi=-60, garden=GARDEN):
+    payload = {"timestamp": 1, "light": light, "pump": pump, "pumpSpeed": speed, "rssi": rssi}
+    mqtt_logger.process_message(f"{garden}/device/state", json.dumps(payload).encode(), recv_time)
+
+def online(recv_time, is_online=True, device_id="esp32", firmware="1.0", garden=GARDEN):
+    payload = {"timestamp": 1, "online": is_online, "deviceId": device_id, "firmware": firmware, "rssi": -60}
+    mqtt_logger.process_message(f"{garden}/sys/online", json.dumps(payload).encode(), recv_time)
+
+def ms(t):
+    return int(t * 1000)
+
+def test_heartbeats_touch_last_seen(logger):
+    # rssi đổi liên tục nhưng không tính là đổi trạng thái
+    for i in range(4):
+        state(T0 + 15 * i, rssi=-60 - i)
+
+    assert logger("SELECT recv_ms, last_seen_ms, light FROM device_state") == [(ms(T0), ms(T0 + 45), "ON")]
+    assert mqtt_logger.dedup_skipped == 3
+
+def test_changed_state_writes_new_row(logger):
+    state(T0)
+    state(T0 + 15)
+    state(T0 + 30, pump="ON", speed=80)
+    state(T0 + 45, pump="ON", speed=80)
+    state(T0 + 60)
+
+    assert logger("SELECT recv_ms, last_seen_ms, pump FROM device_state ORDER BY recv_ms") == [
+        (ms(T0), ms(T0 + 15), "OFF"),
+        (ms(T0 + 30), ms(T0 + 45), "ON"),
+        (ms(T0 + 60), ms(T0 + 60), "OFF"),
+    ]
+
+def test_gardens_and_tables_dedup_separately(logger):
+    state(T0)
+    state(T0, garden="other/garden")
+    online(T0)
+    state(T0 + 15)
+    state(T0 + 15, garden="other/garden")
+    online(T0 + 15)
+    online(T0 + 30, firmware="1.1")
+
+    assert logger("SELECT garden, last_seen_ms FROM device_state ORDER BY garden") == [
+        (GARDEN, ms(T0 + 15)), ("other/garden", ms(T0 + 15))]
+    assert logger("SELECT recv_ms, last_seen_ms, firmware FROM device_online ORDER BY recv_ms") == [
+        (ms(T0), ms(T0 + 15), "1.0"), (ms(T0 + 30), ms(T0 + 30), "1.1")]
+
+def test_long_silence_rewrites_row(logger, monkeypatch):
+    monkeypatch.setattr(mqtt_logger, "DEDUP_MAX_SILENCE", 3600)
+    state(T0)
+    state(T0 + 3600)            # Đúng giới hạn: vẫn là heartbeat
+    state(T0 + 2 * 3600 + 1)    # Im lặng quá giới hạn: dòng cũ có thể đã bị prune
+
+    assert logger("SELECT recv_ms, last_seen_ms FROM device_state ORDER BY recv_ms") == [
+        (ms(T0), ms(T0 + 3600)), (ms(T0 + 2 * 3600 + 1), ms(T0 + 2 * 3600 + 1))]
+
+def test_out_of_order_heartbeat_keeps_latest_seen(logger):
+    state(T0)
+    state(T0 + 30)
+    state(T0 + 15)
+
+    assert logger("SELECT last_seen_ms FROM device_state") == [(ms(T0 + 30),)]
+
+def test_dedup_disabled_writes_every_message(logger, monkeypatch):
+    monkeypatch.setattr(mqtt_logger, "DEDUP_HEARTBEATS", False)
+    for i in range(3):
+        online(T0 + 15 * i)
+
+    assert logger("SELECT COUNT(*) FROM device_online") == [(3,)]
+    assert mqtt_logger.dedup_skipped == 0
@@ -0,0 +1,67 @@
+"""
+Streaming Aggregates Tests - alerts/streaming.py so với tính lại trực tiếp trên cửa sổ,
+và luật "window" của rules.py
+Chạy: python -m pytest tests/test_streaming.py
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "alerts"))
+
+from rules import RuleEngine, FIRE, CLEAR
+from streaming import SeriesWindow, StreamAggregates, SKETCH_BINS
+
+def test_window_matches_brute_force():
+    rng = random.Random(7)
+    step = SKETCH_BINS["temperature"][2]
+    series = SeriesWindow(600, bins=SKETCH_BINS["temperature"])
+    samples = []
+    t = 0.0
+    for _ in range(2000):
+        t += rng.choice((1, 3, 3, 3, 10))
+        value = round(rng.gauss(28, 4), 1)
+        series.add(t, value)
+        samples.append((t, value))
+        if rng.random() < 0.05:
+            inside = sorted(v for ts, v in samples if ts > t - 600)
+            assert series.size == len(inside)
+            assert series.mean() == pytest.approx(sum(inside) / len(inside))
+            assert (series.min(), series.max()) == pytest.approx((inside[0], inside[-1]), abs=1e-4)    # ring lưu float32
+            exact = inside[min(int(0.9 * len(inside)), len(inside) - 1)]
+            assert abs(series.percentile(90) - exact) <= step * 2
+
+def test_expire_on_read_and_forget():
+    aggregates = StreamAggregates()
+    for i in range(10):
+        aggregates.update("g1", {"temperature": 20 + i, "humidity": None}, i * 60.0)
+    assert aggregates.get("g1", "temperature").size == 10
+    assert aggregates.get("g1", "humidity").size == 0
+    assert aggregates.fleet(now=9 * 60.0 + 300) == {"g1": pytest.approx(27.0)}    # Còn 5 mẫu cuối
+    aggregates.forget("g1")
+    assert aggregates.devices() == []
+
+def test_window_rule_uses_the_sliding_mean():
+    engine = RuleEngine([{"id": "avg_hot", "type": "window", "field": "temperature", "stat": "mean",
+                          "window": 600, "above": 30.0, "hysteresis": 0.5, "min_count": 3}])
+    events = []
+    # Một mẫu 40°C không đủ kéo trung bình; nóng kéo dài thì mới báo
+    temps = [25, 25, 40, 25, 25] + [34] * 15 + [25] * 20
+    for i, temp in enumerate(temps):
+        for alert in engine.evaluate("g1", {"temperature": temp}, i * 60.0):
+            events.append((i, alert.kind))
+    assert [kind for _, kind in events] == [FIRE, CLEAR]
+    assert events[0][0] > 5
+
+def test_forget_drops_the_garden_windows():
+    engine = RuleEngine([{"id": "avg_hot", "type": "window", "field": "temperature", "window": 600,
+                          "above": 30.0}])
+    for device in ("g1", "g2"):
+        engine.evaluate(device, {"temperature": 25.0}, 0.0)
+    engine.forget("g1")
+    assert sorted(engine.aggregates.devices()) == ["g2"]
+    assert list(engine.aggregates.fleet(now=0.0)) == ["g2"]
+    assert engine.stats()["devices"] == 1
@@ -0,0 +1,108 @@
+"""
+Time-Series Compression Tests - tscompress.py: block giải nén ra đúng dữ liệu gốc,
+dữ liệu đến trễ và ghi đồng thời khi đang nén không bị mất
+Chạy: python -m pytest tests/test_tscompress.py
+"""
+
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+
+import tscompress
+from schema import open_database, migrate
+
+START_MS = 1_700_000_000_000 - 1_700_000_000_000 % tscompress.BLOCK_MS
+GARDEN = "site/g1"
+
+INSERT_SQL = """
+    INSERT INTO sensor_data (garden, recv_ms, device_timestamp, temperature, humidity,
+                             rain_analog, rain_digital, is_raining, rssi)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def make_rows(count, start_ms=START_MS, step_ms=3000):
+    """Mẫu theo thứ tự BLOCK_COLUMNS: nhịp đều, số thập phân, có NULL và một nhịp lệch"""
+    rows = []
+    for i in range(count):
+        recv_ms = start_ms + i * step_ms + (7 if i == count // 2 else 0)
+        rows.append((recv_ms, i * step_ms, round(25 + i * 0.1, 1), 60.5 if i % 3 else None,
+                     3000 - i, 1, i % 2 == 0, -60 - i % 5))
+    return rows
+
+def open_db(tmp_path):
+    conn = open_database(str(tmp_path / "garden.db"))
+    migrate(conn)
+    return conn
+
+def insert(conn, rows, garden=GARDEN):
+    with conn:
+        conn.executemany(INSERT_SQL, [(garden,) + row for row in rows])
+
+def test_block_roundtrip():
+    rows = make_rows(50)
+    rows.append((START_MS + 200_000, None, 1e300, 1 / 3, 0, 0, False, -90))    # XOR, số rất lớn
+    decoded = tscompress.decode_block(tscompress.encode_block(rows))
+    assert [tuple(row) for row in decoded] == [tuple(int(v) if isinstance(v, bool) else v for v in row)
+                                               for row in rows]
+
+def test_compact_then_late_rows_are_merged(tmp_path):
+    conn = open_db(tmp_path)
+    rows = make_rows(20)
+    insert(conn, rows[:15])
+    assert tscompress.compact_block(conn, GARDEN, START_MS)[0] == 15
+    insert(conn, rows[15:])
+    compacted, _, samples = tscompress.compact_block(conn, GARDEN, START_MS)
+
+    assert (compacted, samples) == (5, 20)
+    assert conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone() == (0,)
+    restored = list(tscompress.iter_rows(conn, GARDEN, START_MS, START_MS + tscompress.BLOCK_MS,
+                                         columns=("recv_ms", "temperature")))
+    assert restored == [(row[0], row[2]) for row in rows]
+
+class RacingConnection:
+    """Bọc connection: ngay sau SELECT sensor_data của compact_block, chạy `on_select`
+    (một writer khác chen vào giữa SELECT và DELETE)"""
+
+    def __init__(self, conn, on_select):
+        self.conn = conn
+        self.on_select = on_select
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self.conn.__exit__(*exc)
+
+    def execute(self, sql, *args):
+        cursor = self.conn.execute(sql, *args)
+        if "FROM sensor_data" in sql and sql.lstrip().startswith("SELECT"):
+            self.on_select()
+        return cursor
+
+def test_row_committed_during_compaction_is_not_lost(tmp_path):
+    conn = open_db(tmp_path)
+    rows = make_rows(10)
+    late = rows.pop(4)
+    insert(conn, rows)
+    writer = sqlite3.connect(str(tmp_path / "garden.db"), timeout=0)
+    blocked = []
+
+    def write_late_row():
+        try:
+            insert(writer, [late])
+        except sqlite3.OperationalError:    # Compactor đang giữ khóa ghi: thử lại sau
+            blocked.append(late)
+
+    tscompress.compact_block(RacingConnection(conn, write_late_row), GARDEN, START_MS)
+    insert(writer, blocked)
+    tscompress.compact_block(conn, GARDEN, START_MS)
+    writer.close()
+
+    restored = list(tscompress.iter_rows(conn, GARDEN, START_MS, START_MS + tscompress.BLOCK_MS,
+                                         columns=("recv_ms",)))
+    assert restored == sorted((row[0],) for row in rows + [late])